@@ -46,20 +46,68 @@ def create_app(config_class=Config):
         db.create_all()
 
         # Initialize background monitoring
-        from services.background_tasks import init_background_monitor
+        from services.background_tasks import (
+            init_background_monitor, init_capture_service, init_packet_writer, init_flow_exporter,
+            init_capture_jobs, init_stats_sketches, init_partition_manager,
+            init_retention_job, init_packet_purger, init_device_index, init_dns_resolver,
+            init_system_sampler, init_rate_engine
+        )
+        init_system_sampler(config_class)
+        init_rate_engine(config_class)
         init_background_monitor(app, config_class)
+        init_stats_sketches(app, config_class)
+        init_device_index(app, config_class)
+        init_packet_writer(app, config_class)
+        init_flow_exporter(app, config_class)
+        init_capture_service(config_class)
+        init_capture_jobs(app, config_class)
+        init_partition_manager(app, config_class)
+        init_retention_job(app, config_class)
+        init_packet_purger(app, config_class)
+        init_dns_resolver(config_class)
 
     return app
 
 
-app = create_app()
+def __getattr__(name):
+    """
+    Build the module-level app on first use (`gunicorn app:app`, `from app import app`)
+
+    Importing this module starts nothing: spawned capture pipeline workers
+    import the main script again as __mp_main__, and must not start a
+    second sniffer, monitor, writer and database pool of their own.
+    """
+    global app
+    if name == 'app':
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 if __name__ == '__main__':
     import os
 
+    app = create_app()
+
     # Register cleanup handler
-    from services.background_tasks import stop_background_monitor
+    from services.background_tasks import (
+        stop_background_monitor, stop_capture_service, stop_packet_writer, stop_flow_exporter,
+        stop_capture_jobs, stop_stats_sketches, stop_partition_manager,
+        stop_retention_job, stop_packet_purger, stop_dns_resolver, stop_system_sampler,
+        stop_rate_engine
+    )
     atexit.register(stop_background_monitor)
+    atexit.register(stop_stats_sketches)
+    atexit.register(stop_packet_writer)
+    atexit.register(stop_flow_exporter)
+    atexit.register(stop_capture_service)
+    atexit.register(stop_capture_jobs)
+    atexit.register(stop_partition_manager)
+    atexit.register(stop_retention_job)
+    atexit.register(stop_packet_purger)
+    atexit.register(stop_dns_resolver)
+    atexit.register(stop_system_sampler)
+    atexit.register(stop_rate_engine)
 
     print("Starting Flask server on http://localhost:5000")
     # Debug mode should only be enabled in development
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark: psutil vs the direct /proc collector (services.collectors)
+
+Times each metric and one full sample (CPU, memory, per-interface network
+counters and disk I/O, as the system sampler and the rate engine take
+every second), and the peak memory allocated while sampling.
+
+Usage:
+    python benchmarks/bench_collectors.py [iterations]
+"""
+
+import sys
+import os
+import time
+import tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.collectors import PsutilCollector, ProcCollector, proc_available
+
+METRICS = ('cpu_percent', 'memory', 'net_counters', 'disk_io')
+
+
+def full_sample(collector):
+    collector.cpu_percent()
+    collector.memory()
+    collector.net_counters()
+    collector.disk_io()
+
+
+def bench(collector, n):
+    """{metric: microseconds per call}, plus the full sample and its peak allocated memory"""
+    results = {}
+    for metric in METRICS:
+        fn = getattr(collector, metric)
+        fn()
+        started = time.perf_counter()
+        for _ in range(n):
+            fn()
+        results[metric] = (time.perf_counter() - started) / n * 1e6
+    started = time.perf_counter()
+    for _ in range(n):
+        full_sample(collector)
+    results['full sample'] = (time.perf_counter() - started) / n * 1e6
+
+    tracemalloc.start()
+    for _ in range(100):
+        full_sample(collector)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results['peak KiB'] = peak / 1024
+    return results
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    if not proc_available():
+        print("No readable Linux /proc: only psutil is available here")
+        return
+    psutil_collector, proc_collector = PsutilCollector(), ProcCollector()
+    try:
+        slow = bench(psutil_collector, n)
+        fast = bench(proc_collector, n)
+    finally:
+        proc_collector.close()
+
+    print(f"{n} calls each")
+    print("-" * 64)
+    print(f"{'':<16} {'psutil':>12} {'/proc':>12} {'speedup':>10}")
+    for metric in METRICS + ('full sample',):
+        print(f"{metric:<16} {slow[metric]:10.1f}us {fast[metric]:10.1f}us {slow[metric] / fast[metric]:9.1f}x")
+    print(f"{'peak memory':<16} {slow['peak KiB']:9.1f}KiB {fast['peak KiB']:9.1f}KiB")
+    print("-" * 64)
+    print(f"At one full sample per second: psutil {slow['full sample'] / 1e4:.3f}% of a core, "
+          f"/proc {fast['full sample'] / 1e4:.3f}%")
+
+
+if __name__ == '__main__':
+    main()
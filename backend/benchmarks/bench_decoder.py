@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Benchmark: scapy dissection + parse_packet vs the struct fast-path decoder
+
+Usage:
+    python benchmarks/bench_decoder.py [frames]
+"""
+
+import sys
+import os
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scapy.all import Ether, IP, IPv6, TCP, UDP, ICMP, Raw
+from services.capture import parse_packet
+from services.decoder import decode_with_fallback
+
+
+def build_frames(n):
+    """A traffic mix of TCP, UDP, ICMP and IPv6 frames as raw bytes"""
+    templates = [
+        bytes(Ether() / IP(src='192.168.1.10', dst='93.184.216.34') / TCP(sport=51515, dport=443, flags='PA') / Raw(b'x' * 1200)),
+        bytes(Ether() / IP(src='93.184.216.34', dst='192.168.1.10') / TCP(sport=443, dport=51515, flags='A')),
+        bytes(Ether() / IP(src='192.168.1.10', dst='8.8.8.8') / UDP(sport=53000, dport=53) / Raw(b'q' * 40)),
+        bytes(Ether() / IP(src='192.168.1.10', dst='192.168.1.1') / ICMP(type=8)),
+        bytes(Ether() / IPv6(src='2001:db8::10', dst='2001:db8::1') / TCP(sport=40000, dport=22, flags='PA') / Raw(b'y' * 200)),
+    ]
+    return [templates[i % len(templates)] for i in range(n)]
+
+
+def bench(name, fn, frames):
+    now = time.time()
+    started = time.perf_counter()
+    for frame in frames:
+        fn(frame, now)
+    elapsed = time.perf_counter() - started
+    pps = len(frames) / elapsed
+    print(f"{name:<32} {elapsed:8.3f} s  {pps:12,.0f} packets/sec")
+    return pps
+
+
+def scapy_path(frame, timestamp):
+    """What sniff() + packet_callback did per packet (minus the database)"""
+    packet = Ether(frame)
+    packet.time = timestamp
+    return parse_packet(packet)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    frames = build_frames(n)
+    print(f"Decoding {n} frames")
+    print("-" * 64)
+    slow = bench("scapy dissection + parse_packet", scapy_path, frames)
+    fast = bench("struct fast path", decode_with_fallback, frames)
+    print("-" * 64)
+    print(f"Speedup: {fast / slow:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
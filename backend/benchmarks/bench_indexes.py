@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Benchmark: query plans and latencies of the hot queries with and without indexes
+
+Seeds packets, flows, alerts and traffic logs for a number of users and
+devices, drops the model indexes, then prints the EXPLAIN plan and best-of
+latency of every query the analysis and monitoring routes run. The indexes
+are then built with the migration (timed too) and everything is measured
+again.
+
+Usage:
+    python benchmarks/bench_indexes.py [packets] [database_url]
+
+The database defaults to a temporary sqlite file; pass a MySQL URL to
+measure the production setup (use an empty database, tables are created).
+"""
+
+import sys
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import func, desc
+from models import db, User, Device, TrafficLog, Alert, PacketCapture, Flow
+from migrations import create_missing_indexes, drop_model_indexes
+from services.packet_writer import PACKET_COLUMNS
+
+USERS = 20
+DEVICES_PER_USER = 5
+INDEXED_TABLES = ('devices', 'traffic_logs', 'alerts', 'packet_captures', 'flows')
+
+
+def insert(model, rows):
+    db.session.execute(model.__table__.insert(), rows)
+
+
+def seed(n):
+    """n packets, n / 4 flows, n / 20 alerts and n / 10 traffic logs spread over users and the last week"""
+    rng = random.Random(7)
+    now = datetime.utcnow()
+    week = 7 * 86400
+    insert(User, [{'id': u, 'username': f'user{u}', 'email': f'user{u}@example.com', 'password_hash': 'x'}
+                  for u in range(1, USERS + 1)])
+    insert(Device, [{'id': d, 'name': f'device{d}', 'ip_address': f'10.0.0.{d}', 'user_id': (d - 1) // DEVICES_PER_USER + 1}
+                    for d in range(1, USERS * DEVICES_PER_USER + 1)])
+
+    protocols = ['TCP'] * 7 + ['UDP'] * 2 + ['ICMP']
+    ports = [443, 443, 443, 80, 53, 22, 3306, 8080]
+    batch = []
+    for i in range(n):
+        batch.append(dict(zip(PACKET_COLUMNS, (
+            now - timedelta(seconds=rng.random() * week), rng.choice(protocols),
+            f'192.168.{rng.randint(0, 7)}.{rng.randint(1, 254)}', f'10.{rng.randint(0, 3)}.{rng.randint(0, 255)}.1',
+            rng.randint(1024, 65535), rng.choice(ports), rng.randint(60, 1500), None, 1.0, rng.randint(1, USERS)))))
+        if len(batch) == 10000 or i == n - 1:
+            insert(PacketCapture, batch)
+            batch = []
+
+    flows = []
+    for i in range(n // 4):
+        last_seen = now - timedelta(seconds=rng.random() * week)
+        flows.append({'protocol': rng.choice(protocols), 'src_ip': f'192.168.0.{rng.randint(1, 254)}',
+                      'dst_ip': f'10.0.{rng.randint(0, 255)}.1', 'src_port': rng.randint(1024, 65535),
+                      'dst_port': rng.choice(ports), 'packets': rng.randint(1, 100), 'bytes': rng.randint(60, 150000),
+                      'tcp_flags': 0, 'sample_rate': 1.0, 'first_seen': last_seen - timedelta(seconds=30),
+                      'last_seen': last_seen, 'user_id': rng.randint(1, USERS)})
+        if len(flows) == 10000:
+            insert(Flow, flows)
+            flows = []
+    if flows:
+        insert(Flow, flows)
+
+    alert_types = ['high_cpu', 'high_memory', 'high_disk', 'high_traffic']
+    insert(Alert, [{'alert_type': rng.choice(alert_types), 'message': 'threshold exceeded',
+                    'severity': rng.choice(['warning', 'critical']), 'status': 'active' if rng.random() < 0.05 else 'resolved',
+                    'created_at': now - timedelta(seconds=rng.random() * week), 'user_id': rng.randint(1, USERS)}
+                   for _ in range(n // 20)])
+
+    logs = []
+    for i in range(n // 10):
+        logs.append({'timestamp': now - timedelta(seconds=rng.random() * week), 'bytes_sent': rng.randint(0, 10 ** 6),
+                     'bytes_recv': rng.randint(0, 10 ** 6), 'packets_sent': rng.randint(0, 1000),
+                     'packets_recv': rng.randint(0, 1000), 'device_id': rng.randint(1, USERS * DEVICES_PER_USER)})
+        if len(logs) == 10000:
+            insert(TrafficLog, logs)
+            logs = []
+    if logs:
+        insert(TrafficLog, logs)
+    db.session.commit()
+
+
+def hot_queries(user_id=3, device_id=12):
+    """The queries of routes/analysis.py, routes/monitoring.py and the alert checks, as they are issued"""
+    hour = datetime.utcnow() - timedelta(hours=1)
+    day = datetime.utcnow() - timedelta(hours=24)
+    week = datetime.utcnow() - timedelta(days=7)
+    rate = func.coalesce(PacketCapture.sample_rate, 1.0)
+    return [
+        ('packets (1h, newest 500)', PacketCapture.query.filter(
+            PacketCapture.user_id == user_id, PacketCapture.timestamp >= hour
+        ).order_by(PacketCapture.timestamp.desc()).limit(500)),
+        ('packets by protocol (24h)', PacketCapture.query.filter(
+            PacketCapture.user_id == user_id, PacketCapture.timestamp >= day, PacketCapture.protocol == 'UDP'
+        ).order_by(PacketCapture.timestamp.desc()).limit(500)),
+        ('protocol stats (24h)', db.session.query(
+            PacketCapture.protocol, func.sum(rate), func.sum(PacketCapture.length * rate)
+        ).filter(
+            PacketCapture.user_id == user_id, PacketCapture.timestamp >= day
+        ).group_by(PacketCapture.protocol)),
+        ('top sources (24h)', db.session.query(
+            PacketCapture.src_ip, func.sum(rate).label('count'), func.sum(PacketCapture.length * rate)
+        ).filter(
+            PacketCapture.user_id == user_id, PacketCapture.timestamp >= day, PacketCapture.src_ip.isnot(None)
+        ).group_by(PacketCapture.src_ip).order_by(desc('count')).limit(10)),
+        ('combined stats scan (24h)', db.session.query(
+            PacketCapture.protocol, PacketCapture.src_ip, PacketCapture.dst_ip, PacketCapture.dst_port,
+            func.sum(rate), func.sum(PacketCapture.length * rate)
+        ).filter(
+            PacketCapture.user_id == user_id, PacketCapture.timestamp >= day
+        ).group_by(PacketCapture.protocol, PacketCapture.src_ip, PacketCapture.dst_ip, PacketCapture.dst_port)),
+        ('flows (1h, newest 500)', Flow.query.filter(
+            Flow.user_id == user_id, Flow.last_seen >= hour
+        ).order_by(Flow.last_seen.desc()).limit(500)),
+        ('active alerts', Alert.query.filter_by(
+            user_id=user_id, status='active'
+        ).order_by(Alert.created_at.desc()).limit(100)),
+        ('existing alert check', Alert.query.filter_by(
+            user_id=user_id, alert_type='high_cpu', status='active'
+        ).limit(1)),
+        ('alert stats by type (7d)', db.session.query(
+            Alert.alert_type, func.count(Alert.id)
+        ).filter(
+            Alert.user_id == user_id, Alert.created_at >= week
+        ).group_by(Alert.alert_type)),
+        ('device history (24h)', TrafficLog.query.filter(
+            TrafficLog.timestamp >= day, TrafficLog.device_id == device_id
+        ).order_by(TrafficLog.timestamp.desc()).limit(1000)),
+        ('user devices', Device.query.filter_by(user_id=user_id)),
+    ]
+
+
+def explain(query):
+    """The database's plan for a query, one line per step"""
+    engine = db.session.get_bind()
+    compiled = query.statement.compile(dialect=engine.dialect)
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    prefix = 'EXPLAIN QUERY PLAN ' if engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(prefix + str(compiled), params).fetchall()
+    if engine.dialect.name == 'sqlite':
+        return [row[-1] for row in rows]
+    # MySQL: table, access type, chosen key and the Extra notes ("Using index" = covering)
+    return [' '.join(str(value) for value in (row.table, row.type, row.key, row.rows, row.Extra) if value is not None)
+            for row in rows]
+
+
+def timed(query, runs=5):
+    """Best of several runs, in seconds"""
+    best = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        query.all()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure(label):
+    print(f"\n--- {label} ---")
+    results = {}
+    for name, query in hot_queries():
+        results[name] = timed(query)
+        print(f"{name:<28}{results[name] * 1000:>10.2f} ms")
+        for step in explain(query):
+            print(f"    {step}")
+    db.session.rollback()
+    return results
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    url = sys.argv[2] if len(sys.argv) > 2 else f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_indexes.db')}"
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        drop_model_indexes(db.engine, INDEXED_TABLES)
+        print(f"Seeding {n} packets, {n // 4} flows, {n // 20} alerts, {n // 10} traffic logs...")
+        started = time.perf_counter()
+        seed(n)
+        print(f"Seeded in {time.perf_counter() - started:.1f} s")
+
+        before = measure("without indexes")
+        started = time.perf_counter()
+        created = create_missing_indexes(db.engine)
+        print(f"\nMigration created {len(created)} indexes in {time.perf_counter() - started:.1f} s")
+        after = measure("with indexes")
+
+    print(f"\n{'query':<28}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+    for name in before:
+        print(f"{name:<28}{before[name] * 1000:>12.2f}{after[name] * 1000:>12.2f}{before[name] / after[name]:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
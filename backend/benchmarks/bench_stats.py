@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Benchmark: /api/analysis/stats as four GROUP BY queries vs one combined scan
+
+Seeds a database with synthetic packets for one user (plus other users'
+noise) and times get_protocol_stats() + get_packet_analysis() against one
+scan grouped on (protocol, src_ip, dst_ip, dst_port) and rolled up in
+memory, checking both produce the same statistics. A third run lets
+get_capture_stats() take the top talkers from the statistics sketches, as
+the server does once it has been up for the whole window.
+
+Usage:
+    python benchmarks/bench_stats.py [packets] [database_url]
+
+The database defaults to a temporary sqlite file; pass a MySQL URL to
+measure the production setup.
+"""
+
+import sys
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import heapq
+from collections import defaultdict
+from flask import Flask
+from models import db, PacketCapture
+from services import background_tasks
+from services.capture import get_protocol_stats, get_packet_analysis, get_capture_stats, _stats_source
+from services.purge import visible_rows
+from services.stats_sketches import StatsSketches
+from services.packet_writer import PACKET_COLUMNS
+
+
+class SketchConfig:
+    STATS_SKETCH_RETENTION_HOURS = 25
+
+
+def seed(n, sketches, user_id=1):
+    """Skewed synthetic traffic over the last 24 hours, a quarter of it from other users"""
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    sources = [f'192.168.{i // 256}.{i % 256}' for i in range(2000)]
+    destinations = [f'10.{i // 65536}.{i // 256 % 256}.{i % 256}' for i in range(20000)]
+    ports = [443] * 40 + [80] * 20 + [53] * 15 + [22, 3306, 8080, 5432] + list(range(1024, 1124))
+    protocols = ['TCP'] * 7 + ['UDP'] * 2 + ['ICMP']
+    batch = []
+    for i in range(n):
+        batch.append((
+            now - timedelta(seconds=rng.random() * 86400),
+            rng.choice(protocols),
+            sources[int(rng.paretovariate(1.2)) % len(sources)],
+            destinations[int(rng.paretovariate(1.0)) % len(destinations)],
+            rng.randint(1024, 65535),
+            rng.choice(ports),
+            rng.randint(60, 1500),
+            None,
+            1.0,
+            user_id if i % 4 else user_id + 1
+        ))
+        if len(batch) == 10000 or i == n - 1:
+            db.session.execute(PacketCapture.__table__.insert(), [dict(zip(PACKET_COLUMNS, row)) for row in batch])
+            sketches.add_rows(batch)
+            batch = []
+    db.session.commit()
+
+
+def single_pass(user_id, start_time, limit=10):
+    """All four statistics from one grouped scan, rolled up in memory"""
+    model, time_column, packet_count, byte_sum = _stats_source()
+    groups = db.session.query(
+        model.protocol, model.src_ip, model.dst_ip, model.dst_port, packet_count, byte_sum
+    ).filter(
+        visible_rows(model, user_id), time_column >= start_time
+    ).group_by(model.protocol, model.src_ip, model.dst_ip, model.dst_port)
+
+    protocols = defaultdict(lambda: [0.0, 0.0])
+    src_ips = defaultdict(lambda: [0.0, 0.0])
+    dst_ips = defaultdict(lambda: [0.0, 0.0])
+    dst_ports = defaultdict(float)
+    for proto, src_ip, dst_ip, dst_port, count, total_bytes in groups.yield_per(10000):
+        for counters, key in ((protocols, proto), (src_ips, src_ip), (dst_ips, dst_ip)):
+            if key is not None:
+                counters[key][0] += count or 0
+                counters[key][1] += total_bytes or 0
+        if dst_port is not None:
+            dst_ports[dst_port] += count or 0
+
+    def top(counters):
+        return [{'packet_count': int(round(values[0]))}
+                for _, values in heapq.nlargest(limit, counters.items(), key=lambda item: item[1][0])]
+
+    stats = {
+        'protocols': [{'protocol': proto, 'count': int(round(count)), 'bytes': int(round(total_bytes))}
+                      for proto, (count, total_bytes) in protocols.items()],
+        'total_packets': sum(int(round(count)) for count, _ in protocols.values())
+    }
+    analysis = {
+        'top_source_ips': top(src_ips),
+        'top_destination_ips': top(dst_ips),
+        'top_destination_ports': [{'packet_count': int(round(count))} for _, count in
+                                  heapq.nlargest(limit, dst_ports.items(), key=lambda item: item[1])]
+    }
+    return stats, analysis
+
+
+def timed(function, runs=3):
+    """Best of several runs, in seconds"""
+    best, result = None, None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def counts(rows):
+    return [row['packet_count'] for row in rows]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    url = sys.argv[2] if len(sys.argv) > 2 else f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_stats.db')}"
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    db.init_app(app)
+    # As if the server had been up for the whole window
+    sketches = StatsSketches(None, SketchConfig)
+    sketches.started = datetime.utcnow() - timedelta(hours=24, minutes=1)
+
+    with app.app_context():
+        db.create_all()
+        print(f"Seeding {n} packets...")
+        seed(n, sketches)
+        start_time = datetime.utcnow() - timedelta(hours=24)
+
+        # Database paths first, without the sketches
+        background_tasks.stats_sketches = None
+        four_query, (stats, analysis) = timed(
+            lambda: (get_protocol_stats(1, start_time), get_packet_analysis(1, start_time)))
+        one_scan, (combined_stats, combined_analysis) = timed(lambda: single_pass(1, start_time))
+        background_tasks.stats_sketches = sketches
+        with_sketches, (_, sketch_analysis) = timed(lambda: get_capture_stats(1, start_time))
+        background_tasks.stats_sketches = None
+
+    assert stats['total_packets'] == combined_stats['total_packets']
+    assert sorted(map(str, stats['protocols'])) == sorted(map(str, combined_stats['protocols']))
+    for key in ('top_source_ips', 'top_destination_ips', 'top_destination_ports'):
+        assert counts(analysis[key]) == counts(combined_analysis[key]), key
+    assert sketch_analysis['source'] == 'sketch'
+
+    print(f"\n{'path':<22}{'seconds':>10}")
+    print(f"{'four queries':<22}{four_query:>10.3f}")
+    print(f"{'single pass':<22}{one_scan:>10.3f}")
+    print(f"{'scan + sketches':<22}{with_sketches:>10.3f}")
+    print(f"\nspeedup over {stats['total_packets']} packets in the window: single pass "
+          f"{four_query / one_scan:.2f}x, with sketches {four_query / with_sketches:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Benchmark: size and scan speed of packet rows stored as text vs compact
+
+Seeds packets into the previous packet_captures layout (addresses and
+protocols as strings, a free text info column) and measures the table and
+index size on disk and the statistics GROUP BYs. The table is then
+converted with the compact_packet_columns migration (timed too) and
+measured again.
+
+Usage:
+    python benchmarks/bench_storage.py [packets] [database_url]
+
+The database defaults to a temporary sqlite file; pass a MySQL URL to
+measure the production setup (use an empty database, tables are created).
+"""
+
+import sys
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import MetaData, Table, Column, Integer, String, Text, Float, DateTime, Index, func, desc, inspect, text
+from models import db, User, PacketCapture
+from migrations import compact_packet_columns
+
+USERS = 20
+
+
+def legacy_table():
+    """packet_captures as stored before the compact column types, with the same indexes"""
+    return Table(
+        'packet_captures', MetaData(),
+        Column('id', Integer, primary_key=True),
+        Column('timestamp', DateTime, index=True),
+        Column('protocol', String(10)),
+        Column('src_ip', String(45)),
+        Column('dst_ip', String(45)),
+        Column('src_port', Integer),
+        Column('dst_port', Integer),
+        Column('length', Integer),
+        Column('info', Text),
+        Column('sample_rate', Float),
+        Column('user_id', Integer, nullable=False),
+        Index('ix_packet_captures_user_time', 'user_id', 'timestamp', 'protocol', 'src_ip', 'dst_ip',
+              'dst_port', 'length', 'sample_rate'),
+    )
+
+
+def seed(table, n):
+    """n packets over users and the last day; a tenth of the addresses are IPv6"""
+    rng = random.Random(7)
+    now = datetime.utcnow()
+    protocols = ['TCP'] * 7 + ['UDP'] * 2 + ['ICMP']
+    ports = [443, 443, 443, 80, 53, 22, 3306, 8080]
+    db.session.execute(User.__table__.insert(), [
+        {'id': u, 'username': f'user{u}', 'email': f'user{u}@example.com', 'password_hash': 'x'}
+        for u in range(1, USERS + 1)
+    ])
+    batch = []
+    for i in range(n):
+        protocol = rng.choice(protocols)
+        if rng.random() < 0.1:
+            src_ip, dst_ip = f'2001:db8:{rng.randint(0, 7):x}::{rng.randint(1, 254):x}', f'2001:db8:ff::{rng.randint(1, 64):x}'
+        else:
+            src_ip, dst_ip = f'192.168.{rng.randint(0, 7)}.{rng.randint(1, 254)}', f'10.{rng.randint(0, 3)}.{rng.randint(0, 255)}.1'
+        batch.append({
+            'timestamp': now - timedelta(seconds=rng.random() * 86400), 'protocol': protocol,
+            'src_ip': src_ip, 'dst_ip': dst_ip, 'src_port': rng.randint(1024, 65535), 'dst_port': rng.choice(ports),
+            'length': rng.randint(60, 1500),
+            'info': {'TCP': rng.choice(['Flags: A', 'Flags: PA', 'Flags: S', 'Flags: FA']), 'ICMP': 'Type: 8'}.get(protocol, ''),
+            'sample_rate': 1.0, 'user_id': rng.randint(1, USERS)
+        })
+        if len(batch) == 10000 or i == n - 1:
+            db.session.execute(table.insert(), batch)
+            batch = []
+    db.session.commit()
+
+
+def storage_size():
+    """(table bytes, index bytes) of packet_captures"""
+    engine = db.engine
+    with engine.connect() as connection:
+        if engine.dialect.name == 'sqlite':
+            indexes = {index['name'] for index in inspect(connection).get_indexes('packet_captures')}
+            sizes = dict(connection.execute(text("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name")).all())
+            return sizes.get('packet_captures', 0), sum(sizes.get(name, 0) for name in indexes)
+        connection.execute(text("ANALYZE TABLE packet_captures"))
+        return tuple(connection.execute(text(
+            "SELECT data_length, index_length FROM information_schema.TABLES "
+            "WHERE table_schema = DATABASE() AND table_name = 'packet_captures'"
+        )).one())
+
+
+def stats_queries(user_id=3):
+    """The statistics queries of services/capture.py over the last day"""
+    day = datetime.utcnow() - timedelta(hours=24)
+    rate = func.coalesce(PacketCapture.sample_rate, 1.0)
+    return [
+        ('protocol stats', db.session.query(
+            PacketCapture.protocol, func.sum(rate), func.sum(PacketCapture.length * rate)
+        ).filter(
+            PacketCapture.user_id == user_id, PacketCapture.timestamp >= day
+        ).group_by(PacketCapture.protocol)),
+        ('top sources', db.session.query(
+            PacketCapture.src_ip, func.sum(rate).label('count'), func.sum(PacketCapture.length * rate)
+        ).filter(
+            PacketCapture.user_id == user_id, PacketCapture.timestamp >= day, PacketCapture.src_ip.isnot(None)
+        ).group_by(PacketCapture.src_ip).order_by(desc('count')).limit(10)),
+        ('combined stats scan', db.session.query(
+            PacketCapture.protocol, PacketCapture.src_ip, PacketCapture.dst_ip, PacketCapture.dst_port,
+            func.sum(rate), func.sum(PacketCapture.length * rate)
+        ).filter(
+            PacketCapture.user_id == user_id, PacketCapture.timestamp >= day
+        ).group_by(PacketCapture.protocol, PacketCapture.src_ip, PacketCapture.dst_ip, PacketCapture.dst_port)),
+        ('all users by source', db.session.query(
+            PacketCapture.src_ip, func.count(PacketCapture.id)
+        ).group_by(PacketCapture.src_ip)),
+    ]
+
+
+def timed(query, runs=5):
+    """Best of several runs, in seconds"""
+    best = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        query.all()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure(label):
+    print(f"\n--- {label} ---")
+    table_bytes, index_bytes = storage_size()
+    print(f"{'table':<24}{table_bytes / 2 ** 20:>10.1f} MiB")
+    print(f"{'indexes':<24}{index_bytes / 2 ** 20:>10.1f} MiB")
+    results = {'table MiB': table_bytes / 2 ** 20, 'indexes MiB': index_bytes / 2 ** 20}
+    # The legacy rows are read through the compact column types, which pass text through
+    for name, query in stats_queries():
+        results[name + ' ms'] = timed(query) * 1000
+        print(f"{name:<24}{results[name + ' ms']:>10.2f} ms")
+    db.session.rollback()
+    return results
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    url = sys.argv[2] if len(sys.argv) > 2 else f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_storage.db')}"
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        PacketCapture.__table__.drop(bind=db.engine)
+        table = legacy_table()
+        table.create(bind=db.engine)
+        print(f"Seeding {n} packets...")
+        started = time.perf_counter()
+        seed(table, n)
+        print(f"Seeded in {time.perf_counter() - started:.1f} s")
+
+        before = measure("text columns")
+        db.session.remove()
+        started = time.perf_counter()
+        converted = compact_packet_columns(db.engine)
+        print(f"\nMigration converted {', '.join(converted)} in {time.perf_counter() - started:.1f} s")
+        if db.engine.dialect.name == 'sqlite':
+            with db.engine.connect() as connection:
+                connection.execute(text("VACUUM"))
+        after = measure("compact columns")
+
+    print(f"\n{'':<24}{'text':>12}{'compact':>12}{'ratio':>10}")
+    for name in before:
+        print(f"{name:<24}{before[name]:>12.2f}{after[name]:>12.2f}{before[name] / after[name]:>9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Compact column types for captured packets and flows
+
+Addresses are stored as 4 (IPv4) or 16 (IPv6) packed bytes instead of up to
+45 characters, protocols as their IP protocol number, and the packet info
+text as the TCP flags / ICMP type it is generated from. Conversion happens
+in the column types, so the API and the capture code keep using strings.
+"""
+import socket
+from sqlalchemy import types
+from sqlalchemy.dialects import mysql
+
+# Protocol labels used by the capture code and their IP protocol numbers;
+# 'IP' (IP with another transport) gets a number outside the 8-bit range
+PROTOCOL_NUMBERS = {'ICMP': 1, 'TCP': 6, 'UDP': 17, 'ICMPv6': 58, 'IP': 256}
+PROTOCOL_NAMES = {number: name for name, number in PROTOCOL_NUMBERS.items()}
+_PROTOCOL_LOOKUP = {name.lower(): number for name, number in PROTOCOL_NUMBERS.items()}
+
+# Same letters and order scapy uses when printing TCP flags
+_TCP_FLAG_LETTERS = 'FSRPAUECN'
+
+
+def pack_ip(address):
+    """Packed bytes of an IPv4 or IPv6 address string"""
+    if ':' in address:
+        return socket.inet_pton(socket.AF_INET6, address)
+    return socket.inet_aton(address) if address.count('.') == 3 else socket.inet_pton(socket.AF_INET, address)
+
+
+def unpack_ip(packed):
+    return socket.inet_ntop(socket.AF_INET6 if len(packed) == 16 else socket.AF_INET, packed)
+
+
+class IPAddress(types.TypeDecorator):
+    """IP address string stored as VARBINARY(16) (BLOB elsewhere)"""
+    impl = types.LargeBinary
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'mysql':
+            return dialect.type_descriptor(mysql.VARBINARY(16))
+        return dialect.type_descriptor(types.LargeBinary())
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, (bytes, bytearray)):
+            return value
+        return pack_ip(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, str):
+            # Rows written before the migration are still text
+            return value
+        return unpack_ip(bytes(value))
+
+
+class ProtocolNumber(types.TypeDecorator):
+    """Protocol label ('TCP', 'UDP', ...) stored as a small integer"""
+    impl = types.SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, int):
+            return value
+        # Unknown labels compare as NULL (match nothing) rather than failing the query
+        return _PROTOCOL_LOOKUP.get(str(value).lower())
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            return value
+        return PROTOCOL_NAMES.get(value, str(value))
+
+
+def format_info(tcp_flags, icmp_type):
+    """The packet info text shown by the API"""
+    if tcp_flags is not None:
+        return "Flags: " + ''.join(letter for bit, letter in enumerate(_TCP_FLAG_LETTERS) if tcp_flags & (1 << bit))
+    if icmp_type is not None:
+        return f"Type: {icmp_type}"
+    return ""
+
+
+def parse_info(info):
+    """(tcp_flags, icmp_type) of a packet info text; other text is not kept"""
+    if info and info.startswith('Flags: '):
+        letters = info[7:]
+        if all(letter in _TCP_FLAG_LETTERS for letter in letters):
+            return sum(1 << _TCP_FLAG_LETTERS.index(letter) for letter in letters), None
+    elif info and info.startswith('Type: ') and info[6:].isdigit():
+        return None, int(info[6:])
+    return None, None
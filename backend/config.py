@@ -1,4 +1,5 @@
 import os
+import tempfile
 from datetime import timedelta
 
 class Config:
@@ -32,11 +33,164 @@ class Config:
     MEMORY_THRESHOLD = 80  # percentage
     DISK_THRESHOLD = 90  # percentage
     NETWORK_THRESHOLD = 90  # percentage
+    TCP_ESTABLISHED_THRESHOLD = 10000  # connections
+    TCP_TIME_WAIT_THRESHOLD = 20000  # connections
+    TCP_SYN_RECV_THRESHOLD = 256  # half-open connections; many suggest a SYN flood
 
     # Packet Capture
-    CAPTURE_TIMEOUT = 60  # seconds
-    MAX_PACKETS = 1000
+    CAPTURE_TIMEOUT = 60  # seconds (upper bound on a capture job's timeout)
+    MAX_PACKETS = 1000  # upper bound on a capture job's packet count
     # Network interface for packet capture (None = default interface)
     # Example: 'Intel(R) Wi-Fi 6E AX211 160MHz' on Windows, 'eth0' on Linux
     # Set to None or empty string to let scapy choose the default interface automatically
     CAPTURE_INTERFACE = os.environ.get('CAPTURE_INTERFACE') or 'Intel(R) Wi-Fi 6E AX211 160MHz'
+
+    # Continuous capture service: one background sniffer feeding a bounded ring buffer
+    # that capture requests read from instead of sniffing in the request thread
+    CAPTURE_DAEMON_ENABLED = (os.environ.get('CAPTURE_DAEMON_ENABLED') or 'true').lower() == 'true'
+    CAPTURE_DAEMON_FILTER = os.environ.get('CAPTURE_DAEMON_FILTER') or None  # BPF filter, e.g. 'ip'
+    CAPTURE_RING_SIZE = int(os.environ.get('CAPTURE_RING_SIZE') or 10000)  # packets kept in memory
+    CAPTURE_SUBSCRIBER_QUEUE_SIZE = 1000  # per-subscriber backlog before drops
+    CAPTURE_RETRY_INTERVAL = 30  # seconds between restarts after a sniffer error
+    # Sampling for the background sniffer on high-rate links: keep 1 in N frames,
+    # or each frame with probability p (set one of them). Stats are scaled back up.
+    CAPTURE_DAEMON_SAMPLE_EVERY = int(os.environ.get('CAPTURE_DAEMON_SAMPLE_EVERY') or 1)
+    CAPTURE_DAEMON_SAMPLE_PROBABILITY = float(os.environ['CAPTURE_DAEMON_SAMPLE_PROBABILITY']) \
+        if os.environ.get('CAPTURE_DAEMON_SAMPLE_PROBABILITY') else None
+
+    # Write-behind packet storage: rows are bulk inserted in size/time bounded batches
+    PACKET_WRITER_ENABLED = (os.environ.get('PACKET_WRITER_ENABLED') or 'true').lower() == 'true'
+    PACKET_WRITER_BATCH_SIZE = int(os.environ.get('PACKET_WRITER_BATCH_SIZE') or 500)  # rows per INSERT
+    PACKET_WRITER_FLUSH_INTERVAL = float(os.environ.get('PACKET_WRITER_FLUSH_INTERVAL') or 1.0)  # seconds
+    PACKET_WRITER_MAX_BACKLOG = 100000  # queued rows before new rows are dropped
+    # Batches failing on a database outage are retried with exponential backoff; failed batches are
+    # bisected to isolate rejected rows;
+    # rows that cannot be written are appended to <dir>/packet_writer.jsonl (or flow_writer.jsonl)
+    PACKET_WRITER_RETRIES = int(os.environ.get('PACKET_WRITER_RETRIES') or 3)
+    PACKET_WRITER_RETRY_BACKOFF = float(os.environ.get('PACKET_WRITER_RETRY_BACKOFF') or 0.5)  # seconds, doubled per retry
+    PACKET_WRITER_DEAD_LETTER_DIR = os.environ.get('PACKET_WRITER_DEAD_LETTER_DIR') or \
+        os.path.join(tempfile.gettempdir(), 'network_monitor_dead_letters')
+
+    # Capture backend: 'afpacket' (Linux TPACKET_V3 mmap ring), 'scapy', or 'auto'
+    # ('auto' uses AF_PACKET on Linux and falls back to scapy if the ring cannot be set up)
+    CAPTURE_BACKEND = os.environ.get('CAPTURE_BACKEND') or 'auto'
+    AFPACKET_BLOCK_SIZE = 1 << 20  # bytes per ring block (multiple of the page size)
+    AFPACKET_BLOCK_COUNT = 64  # blocks in the ring (64 MiB total)
+    AFPACKET_BLOCK_TIMEOUT_MS = 100  # kernel hands over partially filled blocks after this
+
+    # Captured packet storage: 'packets' (one row per packet), 'flows' (5-tuple flow
+    # records only, far fewer writes) or 'both' (every packet written twice). Statistics are read
+    # from flows in 'flows' mode.
+    CAPTURE_STORAGE = os.environ.get('CAPTURE_STORAGE') or 'packets'
+    FLOW_ACTIVE_TIMEOUT = int(os.environ.get('FLOW_ACTIVE_TIMEOUT') or 300)  # export long-lived flows every N seconds
+    FLOW_IDLE_TIMEOUT = int(os.environ.get('FLOW_IDLE_TIMEOUT') or 30)  # export flows idle for N seconds
+    FLOW_TABLE_MAX_FLOWS = 100000  # active flows kept in memory before early export
+
+    # Multi-process capture pipeline (POST /api/analysis/capture/parallel): frames are
+    # partitioned by flow hash over N decoding/aggregating worker processes. Mode 'fanout'
+    # lets the kernel distribute frames over per-worker AF_PACKET rings (PACKET_FANOUT),
+    # 'reader' reads in one process and hashes frames to the workers, 'auto' picks fanout on Linux
+    CAPTURE_PIPELINE_WORKERS = int(os.environ.get('CAPTURE_PIPELINE_WORKERS') or os.cpu_count() or 1)
+    CAPTURE_PIPELINE_MODE = os.environ.get('CAPTURE_PIPELINE_MODE') or 'auto'
+    CAPTURE_PIPELINE_BATCH_SIZE = 256  # frames per batch sent to a worker in reader mode
+
+    # Offline capture ingestion (POST /api/analysis/ingest and ingest_pcap.py):
+    # uploads are stored here until they have been ingested
+    PCAP_UPLOAD_DIR = os.environ.get('PCAP_UPLOAD_DIR') or os.path.join(tempfile.gettempdir(), 'network_monitor_uploads')
+
+    # Live packet streaming (GET /api/analysis/stream, Server-Sent Events)
+    CAPTURE_STREAM_MAX_RATE = int(os.environ.get('CAPTURE_STREAM_MAX_RATE') or 500)  # packets/sec per client (upper bound)
+    CAPTURE_STREAM_MAX_CLIENTS = 20  # concurrent streams
+
+    # Capture jobs (POST /api/analysis/jobs): jobs beyond the global limit wait in a queue,
+    # running jobs with compatible filters share one sniffer. Limits count the jobs of all app
+    # processes (job state is kept in the capture_jobs table)
+    CAPTURE_JOBS_MAX_CONCURRENT = int(os.environ.get('CAPTURE_JOBS_MAX_CONCURRENT') or 4)
+    CAPTURE_JOBS_MAX_PER_USER = int(os.environ.get('CAPTURE_JOBS_MAX_PER_USER') or 2)  # queued or running
+    CAPTURE_JOBS_MAX_QUEUED = 20
+    CAPTURE_JOBS_RETAINED = 50  # finished jobs kept for status and result requests
+
+    # Top IPs/ports for /api/analysis/stats from in-memory sketches (Space-Saving + Count-Min)
+    # updated as packets are stored, per user and time bucket; windows starting before the
+    # process started, or beyond the retention, are answered from the database
+    STATS_SKETCHES_ENABLED = (os.environ.get('STATS_SKETCHES_ENABLED') or 'true').lower() == 'true'
+    STATS_SKETCH_BUCKET_SECONDS = 900  # windows start at a bucket boundary
+    STATS_SKETCH_RETENTION_HOURS = 24
+    STATS_SKETCH_CAPACITY = 100  # counters per bucket and key type (count error <= bucket total / capacity)
+    STATS_SKETCH_WIDTH = 256  # Count-Min width and depth
+    STATS_SKETCH_DEPTH = 4
+    # Distinct source IPs / destination ports / flows per bucket (HyperLogLog, 2^precision
+    # one-byte registers, ~1.6% error at 12), flushed to the distinct_counts table
+    STATS_HLL_PRECISION = 12
+    STATS_SKETCH_FLUSH_INTERVAL = 60  # seconds
+
+    # Daily range partitions (MySQL only) for packet_captures, traffic_logs and
+    # system_resource_logs: time-window queries read only the days they cover and
+    # retention drops whole days. Existing tables are converted by `python init_db.py migrate`
+    PARTITIONING_ENABLED = (os.environ.get('PARTITIONING_ENABLED') or 'false').lower() == 'true'
+    PARTITION_PRECREATE_DAYS = 7  # partitions kept ready ahead of today
+    PARTITION_MAINTENANCE_INTERVAL = 3600  # seconds between partition maintenance runs
+
+    # Days of data kept per table (0 keeps everything). Nothing expires unless set, so an
+    # upgrade never starts deleting existing data
+    PACKET_RETENTION_DAYS = int(os.environ.get('PACKET_RETENTION_DAYS') or 0)
+    FLOW_RETENTION_DAYS = int(os.environ.get('FLOW_RETENTION_DAYS') or 0)
+    TRAFFIC_LOG_RETENTION_DAYS = int(os.environ.get('TRAFFIC_LOG_RETENTION_DAYS') or 0)
+    RESOURCE_LOG_RETENTION_DAYS = int(os.environ.get('RESOURCE_LOG_RETENTION_DAYS') or 0)
+    ALERT_RETENTION_DAYS = int(os.environ.get('ALERT_RETENTION_DAYS') or 0)  # resolved alerts only
+    ROLLUP_RETENTION_DAYS = int(os.environ.get('ROLLUP_RETENTION_DAYS') or 365)  # hourly traffic/resource rollups
+
+    # Retention job: expired rows are deleted in short chunked transactions (tables with daily
+    # partitions drop partitions instead); traffic and resource logs are first rolled up hourly.
+    # Every app process starts the job, but only the holder of a lease row in job_leases runs it
+    RETENTION_ENABLED = (os.environ.get('RETENTION_ENABLED') or 'true').lower() == 'true'
+    RETENTION_DOWNSAMPLE = (os.environ.get('RETENTION_DOWNSAMPLE') or 'true').lower() == 'true'
+    RETENTION_INTERVAL = 3600  # seconds between runs
+    RETENTION_CHUNK_SIZE = 1000  # rows per DELETE transaction
+    RETENTION_CHUNK_PAUSE = 0.05  # seconds between chunks, to let other writers in
+
+    # Clearing captured packets (clear-packets, clear_previous) hides them at once and
+    # deletes them in the background, one chunk per transaction
+    PURGE_CHUNK_SIZE = 5000
+    PURGE_CHUNK_PAUSE = 0.02  # seconds between chunks
+    PURGE_RETRY_INTERVAL = 60  # seconds before a failed purge runs again (its rows stay hidden)
+
+    # Tag captured packets and flows with the device (Device.ip_address, a host or CIDR)
+    # and configured subnet of their local end, and log per-device traffic to traffic_logs.
+    # Subnets are comma-separated name=cidr pairs, e.g. 'lan=192.168.0.0/16,dmz=10.1.0.0/24'
+    ENRICHMENT_ENABLED = (os.environ.get('ENRICHMENT_ENABLED') or 'true').lower() == 'true'
+    ENRICHMENT_SUBNETS = os.environ.get('ENRICHMENT_SUBNETS') or ''
+
+    # Hostnames of the top talkers in /api/analysis/stats: resolved by background threads
+    # and served from an LRU cache; failed lookups are cached for the negative TTL
+    REVERSE_DNS_ENABLED = (os.environ.get('REVERSE_DNS_ENABLED') or 'true').lower() == 'true'
+    REVERSE_DNS_CACHE_SIZE = 4096  # addresses
+    REVERSE_DNS_TTL = int(os.environ.get('REVERSE_DNS_TTL') or 3600)  # seconds
+    REVERSE_DNS_NEGATIVE_TTL = int(os.environ.get('REVERSE_DNS_NEGATIVE_TTL') or 300)  # seconds
+    REVERSE_DNS_WORKERS = 4  # concurrent lookups
+    REVERSE_DNS_QUEUE_SIZE = 1024  # addresses waiting; more are dropped and retried on a later request
+
+    # CPU, memory, disk and interface stats are sampled by one background thread on a fixed
+    # cadence; /api/monitoring/system and the background monitor read the latest snapshot
+    SYSTEM_SAMPLER_ENABLED = (os.environ.get('SYSTEM_SAMPLER_ENABLED') or 'true').lower() == 'true'
+    SYSTEM_SAMPLE_INTERVAL = float(os.environ.get('SYSTEM_SAMPLE_INTERVAL') or 1.0)  # seconds
+    SYSTEM_SAMPLE_SLOW_EVERY = 10  # disk usage and interface addresses are refreshed every N samples
+    # Where the system sampler and the rate engine read CPU, memory, network and disk counters:
+    # 'psutil', 'proc' (Linux /proc files read directly, lower overhead) or 'auto' (proc when available)
+    METRICS_BACKEND = os.environ.get('METRICS_BACKEND') or 'psutil'
+
+    # Network rates (/api/monitoring/network-load) are computed from counters read once per
+    # interval into a ring buffer of per-second rates shared by all readers
+    RATE_SAMPLE_INTERVAL = float(os.environ.get('RATE_SAMPLE_INTERVAL') or 1.0)  # seconds
+    RATE_HISTORY_SECONDS = int(os.environ.get('RATE_HISTORY_SECONDS') or 3600)  # kept in memory
+    RATE_EWMA_SECONDS = 10  # time constant of the smoothed rates
+    # Interfaces with their own rates and interface_traffic_logs, comma-separated (empty: all)
+    RATE_INTERFACES = os.environ.get('RATE_INTERFACES') or ''
+    # Interface capacities, e.g. 'eth0=1000,wwan0=50'; others use the reported link speed,
+    # or NETWORK_CAPACITY_MBPS when the driver reports none
+    INTERFACE_CAPACITY_MBPS = os.environ.get('INTERFACE_CAPACITY_MBPS') or ''
+
+    # TCP connection counts by state (/api/monitoring/connections) are read from /proc/net/tcp{,6}
+    # at most once per interval, shared by all callers, and logged with the resource logs
+    CONNECTION_SAMPLE_INTERVAL = int(os.environ.get('CONNECTION_SAMPLE_INTERVAL') or 5)  # seconds
+    CONNECTION_TOP_REMOTES = 10  # remote addresses listed, by connection count
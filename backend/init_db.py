@@ -76,6 +76,23 @@ def reset_database():
             print("Operation cancelled.")
             print("操作已取消。")
 
+def migrate_database():
+    """
+    Bring an existing database up to the current models (tables, columns and indexes).
+    将现有数据库升级到当前模型（表和索引）。
+    """
+    from migrations import upgrade
+    app = create_app()
+    with app.app_context():
+        print("Migrating database...")
+        print("正在迁移数据库...")
+        for name, changes in upgrade(db.engine):
+            for change in changes:
+                print(f"  + {change}")
+            print(f"✓ {name}: {len(changes)} change(s)")
+        print("✓ Database is up to date!")
+        print("✓ 数据库已是最新！")
+
 def show_info():
     """
     Display database information.
@@ -93,13 +110,14 @@ def show_info():
         
         # Try to get table information
         try:
-            from models import User, Device, TrafficLog, Alert, PacketCapture
+            from models import User, Device, TrafficLog, Alert, PacketCapture, Flow
             tables = [
                 ("users", "用户表", User),
                 ("devices", "设备表", Device),
                 ("traffic_logs", "流量日志表", TrafficLog),
                 ("alerts", "警报表", Alert),
-                ("packet_captures", "数据包捕获表", PacketCapture)
+                ("packet_captures", "数据包捕获表", PacketCapture),
+                ("flows", "流记录表", Flow)
             ]
             
             for table_name, chinese_name, model in tables:
@@ -132,6 +150,8 @@ def print_usage():
     print("           - 删除所有表（警告：删除所有数据）")
     print("  reset    - Reset database (drop and recreate tables)")
     print("           - 重置数据库（删除并重新创建表）")
+    print("  migrate  - Add new tables, columns and indexes to an existing database")
+    print("           - 为现有数据库添加新表和索引")
     print("  info     - Show database information")
     print("           - 显示数据库信息")
     print("  help     - Show this help message")
@@ -155,6 +175,8 @@ if __name__ == '__main__':
         drop_database()
     elif command == 'reset':
         reset_database()
+    elif command == 'migrate':
+        migrate_database()
     elif command == 'info':
         show_info()
     elif command == 'help':
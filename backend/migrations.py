@@ -0,0 +1,189 @@
+"""
+Schema migrations for existing databases
+
+db.create_all() creates missing tables but never alters existing ones, so
+databases created by an older version lack columns and indexes added to the models
+since. Every migration here is idempotent and safe to run repeatedly:
+
+    python init_db.py migrate
+"""
+from sqlalchemy import inspect, types, MetaData, Table, select, func, text
+
+from column_types import pack_ip, parse_info
+from models import db, PacketCapture, Flow
+
+
+def add_missing_columns(engine):
+    """
+    Add nullable model columns an existing table does not have yet
+
+    Returns:
+        list of 'table.column' names that were added
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+    added = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable or column.primary_key:
+                continue
+            with engine.begin() as connection:
+                connection.execute(text(
+                    f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} "
+                    f"{column.type.compile(dialect=engine.dialect)}"
+                ))
+            added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def create_missing_indexes(engine):
+    """
+    Create the model indexes an existing table does not have yet
+
+    Returns:
+        list of 'table.index' names that were created
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing:
+                # Builds the whole index in one statement; on MySQL (InnoDB)
+                # this is an online operation and inserts continue meanwhile
+                index.create(bind=engine)
+                created.append(f"{table.name}.{index.name}")
+    return created
+
+
+def drop_model_indexes(engine, tables=None):
+    """Drop the model indexes of the given tables (used to measure without them)"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    dropped = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables or (tables is not None and table.name not in tables):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                index.drop(bind=engine)
+                dropped.append(f"{table.name}.{index.name}")
+    return dropped
+
+
+def _compact_ip(address):
+    try:
+        return pack_ip(address) if address else None
+    except (OSError, ValueError):
+        return None
+
+
+def _compact_rows(rows, legacy_columns):
+    """Legacy text rows as values for the compact table"""
+    values = []
+    for row in rows:
+        row = dict(row._mapping)
+        row['src_ip'] = _compact_ip(row['src_ip'])
+        row['dst_ip'] = _compact_ip(row['dst_ip'])
+        if 'info' in legacy_columns:
+            row['tcp_flags'], row['icmp_type'] = parse_info(row.pop('info'))
+        values.append(row)
+    return values
+
+
+def compact_packet_columns(engine, chunk_size=10000):
+    """
+    Rebuild packet_captures and flows with binary addresses and numeric protocols
+
+    Tables whose src_ip is still text are renamed to <table>_legacy, recreated
+    from the model and copied over in id order, one transaction per chunk; an
+    interrupted copy resumes from the highest id already copied. Stop the
+    capture while it runs: copied rows keep their ids.
+
+    Returns:
+        list of 'table: N rows' for the tables converted
+    """
+    converted = []
+    for model in (PacketCapture, Flow):
+        table = model.__table__
+        legacy_name = f"{table.name}_legacy"
+        inspector = inspect(engine)
+        existing_tables = set(inspector.get_table_names())
+        if legacy_name not in existing_tables:
+            if table.name not in existing_tables:
+                continue
+            src_ip = next(column for column in inspector.get_columns(table.name) if column['name'] == 'src_ip')
+            if not isinstance(src_ip['type'], types.String):
+                continue
+            preparer = engine.dialect.identifier_preparer
+            with engine.begin() as connection:
+                if engine.dialect.name == 'sqlite':
+                    # SQLite index names are per database, not per table
+                    for index in inspector.get_indexes(table.name):
+                        connection.execute(text(f"DROP INDEX {preparer.quote(index['name'])}"))
+                connection.execute(text(
+                    f"ALTER TABLE {preparer.quote(table.name)} RENAME TO {preparer.quote(legacy_name)}"
+                ))
+            table.create(bind=engine)
+
+        legacy = Table(legacy_name, MetaData(), autoload_with=engine)
+        legacy_columns = [column.name for column in legacy.columns if column.name in table.columns or
+                          column.name == 'info']
+        copied = 0
+        with engine.connect() as connection:
+            last_id = connection.execute(select(func.max(table.c.id))).scalar() or 0
+        while True:
+            with engine.begin() as connection:
+                rows = connection.execute(
+                    select(*[legacy.c[name] for name in legacy_columns])
+                    .where(legacy.c.id > last_id).order_by(legacy.c.id).limit(chunk_size)
+                ).all()
+                if not rows:
+                    break
+                connection.execute(table.insert(), _compact_rows(rows, legacy_columns))
+            last_id = rows[-1].id
+            copied += len(rows)
+        legacy.drop(bind=engine)
+        converted.append(f"{table.name}: {copied} rows")
+    return converted
+
+
+def partition_time_series_tables(engine):
+    """
+    Convert the time-series tables to daily partitions (MySQL, PARTITIONING_ENABLED)
+
+    Rebuilds each table once; run it in a maintenance window on large tables.
+    """
+    from config import Config
+    from services.partitions import partition_tables
+
+    if engine.dialect.name != 'mysql' or not getattr(Config, 'PARTITIONING_ENABLED', False):
+        return []
+    with engine.begin() as connection:
+        return partition_tables(connection, inspect(connection), Config)
+
+
+MIGRATIONS = [
+    # Before the indexes: the rebuilt tables get them from the model
+    ('compact_packet_columns', compact_packet_columns),
+    ('new_columns', add_missing_columns),
+    ('composite_indexes', create_missing_indexes),
+    ('daily_partitions', partition_time_series_tables),
+]
+
+
+def upgrade(engine):
+    """Create missing tables, then run every migration in order"""
+    db.metadata.create_all(bind=engine)
+    results = []
+    for name, migration in MIGRATIONS:
+        results.append((name, migration(engine)))
+    return results
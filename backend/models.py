@@ -1,6 +1,8 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
+from sqlalchemy.dialects import mysql
+from column_types import IPAddress, ProtocolNumber, format_info, parse_info
 
 db = SQLAlchemy()
 bcrypt = Bcrypt()
@@ -36,6 +38,7 @@ class User(db.Model):
 class Device(db.Model):
     """Network device model"""
     __tablename__ = 'devices'
+    __table_args__ = (db.Index('ix_devices_user_id', 'user_id'),)
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -62,6 +65,8 @@ class Device(db.Model):
 class TrafficLog(db.Model):
     """Network traffic log model"""
     __tablename__ = 'traffic_logs'
+    # History filtered by device over a time range
+    __table_args__ = (db.Index('ix_traffic_logs_device_time', 'device_id', 'timestamp'),)
     
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
@@ -87,6 +92,14 @@ class TrafficLog(db.Model):
 class Alert(db.Model):
     """Alert model for threshold violations"""
     __tablename__ = 'alerts'
+    __table_args__ = (
+        # Alert list: user and status, newest first
+        db.Index('ix_alerts_user_status_time', 'user_id', 'status', 'created_at'),
+        # Threshold check for an existing active alert of a type
+        db.Index('ix_alerts_user_type_status', 'user_id', 'alert_type', 'status'),
+        # Alert statistics by type and severity, answered from the index alone
+        db.Index('ix_alerts_user_time_type', 'user_id', 'created_at', 'alert_type', 'severity'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     alert_type = db.Column(db.String(50), nullable=False)
@@ -115,17 +128,40 @@ class Alert(db.Model):
 class PacketCapture(db.Model):
     """Packet capture records"""
     __tablename__ = 'packet_captures'
+    # Every query is one user's time window; the trailing columns cover the
+    # statistics GROUP BYs so they never read the rows themselves
+    __table_args__ = (
+        db.Index('ix_packet_captures_user_time', 'user_id', 'timestamp', 'protocol', 'src_ip', 'dst_ip',
+                 'dst_port', 'length', 'sample_rate'),
+        db.Index('ix_packet_captures_user_device_time', 'user_id', 'device_id', 'timestamp', 'protocol',
+                 'length', 'sample_rate'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    protocol = db.Column(db.String(10))
-    src_ip = db.Column(db.String(45))
-    dst_ip = db.Column(db.String(45))
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # retention walks expired rows
+    protocol = db.Column(ProtocolNumber)
+    src_ip = db.Column(IPAddress)
+    dst_ip = db.Column(IPAddress)
     src_port = db.Column(db.Integer)
     dst_port = db.Column(db.Integer)
     length = db.Column(db.Integer)
-    info = db.Column(db.Text)
+    tcp_flags = db.Column(db.SmallInteger)  # TCP packets
+    icmp_type = db.Column(db.SmallInteger)  # ICMP packets
+    sample_rate = db.Column(db.Float, default=1.0)  # Packets this row stands for when sampling
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # Device and configured subnet of the local end (services.enrichment); no foreign key,
+    # partitioned tables cannot have one
+    device_id = db.Column(db.Integer)
+    subnet = db.Column(db.String(32))
+    
+    @property
+    def info(self):
+        """Summary text, built from tcp_flags or icmp_type"""
+        return format_info(self.tcp_flags, self.icmp_type)
+    
+    @info.setter
+    def info(self, value):
+        self.tcp_flags, self.icmp_type = parse_info(value)
     
     def to_dict(self):
         """Convert to dictionary"""
@@ -138,7 +174,98 @@ class PacketCapture(db.Model):
             'src_port': self.src_port,
             'dst_port': self.dst_port,
             'length': self.length,
-            'info': self.info
+            'info': self.info,
+            'tcp_flags': self.tcp_flags,
+            'sample_rate': self.sample_rate,
+            'device_id': self.device_id,
+            'subnet': self.subnet
+        }
+
+
+class Flow(db.Model):
+    """Aggregated 5-tuple flow record exported from the in-memory flow table"""
+    __tablename__ = 'flows'
+    __table_args__ = (
+        db.Index('ix_flows_user_last_seen', 'user_id', 'last_seen', 'protocol', 'src_ip', 'dst_ip',
+                 'dst_port', 'packets', 'bytes', 'sample_rate'),
+        db.Index('ix_flows_user_device_last_seen', 'user_id', 'device_id', 'last_seen', 'protocol',
+                 'packets', 'bytes', 'sample_rate'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    protocol = db.Column(ProtocolNumber)
+    src_ip = db.Column(IPAddress)
+    dst_ip = db.Column(IPAddress)
+    src_port = db.Column(db.Integer)
+    dst_port = db.Column(db.Integer)
+    packets = db.Column(db.BigInteger, default=0)
+    bytes = db.Column(db.BigInteger, default=0)
+    tcp_flags = db.Column(db.Integer, default=0)  # Union of TCP flags seen in the flow
+    sample_rate = db.Column(db.Float, default=1.0)  # Packets each counted packet stands for
+    first_seen = db.Column(db.DateTime, default=datetime.utcnow)
+    last_seen = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    device_id = db.Column(db.Integer)  # Device of the local end, as for packets
+    subnet = db.Column(db.String(32))
+    
+    def to_dict(self):
+        """Convert to dictionary"""
+        return {
+            'id': self.id,
+            'protocol': self.protocol,
+            'src_ip': self.src_ip,
+            'dst_ip': self.dst_ip,
+            'src_port': self.src_port,
+            'dst_port': self.dst_port,
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'tcp_flags': self.tcp_flags,
+            'sample_rate': self.sample_rate,
+            'first_seen': self.first_seen.isoformat(),
+            'last_seen': self.last_seen.isoformat(),
+            'device_id': self.device_id,
+            'subnet': self.subnet
+        }
+
+
+class DistinctCount(db.Model):
+    """HyperLogLog registers of one distinct-count metric for one user and time bucket"""
+    __tablename__ = 'distinct_counts'
+    __table_args__ = (db.UniqueConstraint('user_id', 'metric', 'bucket_start'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    metric = db.Column(db.String(20), nullable=False)  # source_ips, destination_ports or flows
+    bucket_start = db.Column(db.DateTime, nullable=False, index=True)
+    registers = db.Column(db.LargeBinary, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+
+
+class PacketPurge(db.Model):
+    """Background deletion of one user's packets and flows up to the newest ids at request time"""
+    __tablename__ = 'packet_purges'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    packets_up_to = db.Column(db.Integer, default=0)  # rows with ids up to these are deleted
+    flows_up_to = db.Column(db.Integer, default=0)
+    status = db.Column(db.String(20), default='pending')  # pending, running, completed or failed
+    packets_deleted = db.Column(db.Integer, default=0)
+    flows_deleted = db.Column(db.Integer, default=0)
+    error = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    
+    def to_dict(self):
+        """Convert to dictionary"""
+        return {
+            'id': self.id,
+            'status': self.status,
+            'packets_deleted': self.packets_deleted,
+            'flows_deleted': self.flows_deleted,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
         }
 
 
@@ -169,3 +296,191 @@ class SystemResourceLog(db.Model):
             'disk_used': self.disk_used,
             'disk_total': self.disk_total
         }
+
+
+class InterfaceTrafficLog(db.Model):
+    """Traffic of one network interface over one background monitor interval"""
+    __tablename__ = 'interface_traffic_logs'
+    # History filtered by interface over a time range
+    __table_args__ = (db.Index('ix_interface_traffic_logs_interface_time', 'interface', 'timestamp'),)
+    
+    # Counts over the interval rather than the raw 64-bit counters; intervals
+    # without traffic on an interface are not stored
+    id = db.Column(db.Integer, primary_key=True)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    interface = db.Column(db.String(32), nullable=False)
+    seconds = db.Column(db.Float, nullable=False)  # length of the interval
+    bytes_sent = db.Column(db.BigInteger, default=0)
+    bytes_recv = db.Column(db.BigInteger, default=0)
+    packets_sent = db.Column(db.Integer, default=0)
+    packets_recv = db.Column(db.Integer, default=0)
+    errin = db.Column(db.Integer, default=0)
+    errout = db.Column(db.Integer, default=0)
+    dropin = db.Column(db.Integer, default=0)
+    dropout = db.Column(db.Integer, default=0)
+    capacity_mbps = db.Column(db.Integer)  # interface capacity at the time
+    
+    def to_dict(self):
+        """Convert to dictionary, with per-second rates and utilization"""
+        seconds = self.seconds or 1
+        bytes_sent_per_sec = self.bytes_sent / seconds
+        bytes_recv_per_sec = self.bytes_recv / seconds
+        capacity = (self.capacity_mbps or 0) * 1000 * 1000 / 8
+        return {
+            'id': self.id,
+            'timestamp': self.timestamp.isoformat(),
+            'interface': self.interface,
+            'seconds': self.seconds,
+            'bytes_sent': self.bytes_sent,
+            'bytes_recv': self.bytes_recv,
+            'packets_sent': self.packets_sent,
+            'packets_recv': self.packets_recv,
+            'errin': self.errin,
+            'errout': self.errout,
+            'dropin': self.dropin,
+            'dropout': self.dropout,
+            'bytes_sent_per_sec': round(bytes_sent_per_sec, 2),
+            'bytes_recv_per_sec': round(bytes_recv_per_sec, 2),
+            'capacity_mbps': self.capacity_mbps,
+            'upload_utilization_percent': round(min(100, bytes_sent_per_sec / capacity * 100), 2) if capacity else None,
+            'download_utilization_percent': round(min(100, bytes_recv_per_sec / capacity * 100), 2) if capacity else None
+        }
+
+
+class ConnectionStateLog(db.Model):
+    """TCP connection counts by state, logged by the background monitor"""
+    __tablename__ = 'connection_state_logs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    total = db.Column(db.Integer, default=0)
+    established = db.Column(db.Integer, default=0)
+    syn_sent = db.Column(db.Integer, default=0)
+    syn_recv = db.Column(db.Integer, default=0)
+    fin_wait = db.Column(db.Integer, default=0)  # FIN_WAIT1 and FIN_WAIT2
+    time_wait = db.Column(db.Integer, default=0)
+    close_wait = db.Column(db.Integer, default=0)
+    listen = db.Column(db.Integer, default=0)
+    other = db.Column(db.Integer, default=0)  # CLOSE, LAST_ACK and CLOSING
+    
+    def to_dict(self):
+        """Convert to dictionary"""
+        return {
+            'id': self.id,
+            'timestamp': self.timestamp.isoformat(),
+            'total': self.total,
+            'established': self.established,
+            'syn_sent': self.syn_sent,
+            'syn_recv': self.syn_recv,
+            'fin_wait': self.fin_wait,
+            'time_wait': self.time_wait,
+            'close_wait': self.close_wait,
+            'listen': self.listen,
+            'other': self.other
+        }
+
+
+class JobLease(db.Model):
+    """Which process runs a background job that must run once per deployment"""
+    __tablename__ = 'job_leases'
+    
+    name = db.Column(db.String(64), primary_key=True)
+    owner = db.Column(db.String(128), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+
+class DataVersion(db.Model):
+    """Change counter of data every app process keeps a copy of (e.g. the device index)"""
+    __tablename__ = 'data_versions'
+    
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class CaptureJobRecord(db.Model):
+    """State of an asynchronous capture job, readable by every app process"""
+    __tablename__ = 'capture_jobs'
+    __table_args__ = (
+        # Per-user and global limit checks over queued and running jobs
+        db.Index('ix_capture_jobs_status_user', 'status', 'user_id'),
+    )
+    
+    id = db.Column(db.String(32), primary_key=True)
+    owner = db.Column(db.String(128), nullable=False)  # process running the job
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    cancel_requested = db.Column(db.Boolean, default=False)  # set by other processes, applied by the owner
+    state = db.Column(db.Text)  # to_dict() of the job without packets, as JSON
+    packets = db.Column(db.LargeBinary().with_variant(mysql.LONGBLOB(), 'mysql'))  # zlib-compressed JSON once finished
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+
+
+class IngestJobRecord(db.Model):
+    """Progress of an uploaded capture file ingestion, readable by every app process"""
+    __tablename__ = 'ingest_jobs'
+    
+    id = db.Column(db.String(32), primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    progress = db.Column(db.Text)  # IngestProgress.to_dict() as JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)  # written at least every second while running
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+
+
+class TrafficLogRollup(db.Model):
+    """Hourly downsample of traffic_logs, kept after the raw rows expire"""
+    __tablename__ = 'traffic_log_rollups'
+    __table_args__ = (db.UniqueConstraint('device_id', 'hour'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    hour = db.Column(db.DateTime, nullable=False, index=True)
+    # Host counters (device_id NULL) are cumulative, so the hour is represented by its
+    # last (largest) values; device rows count an interval each and are summed
+    bytes_sent = db.Column(db.BigInteger, default=0)
+    bytes_recv = db.Column(db.BigInteger, default=0)
+    packets_sent = db.Column(db.BigInteger, default=0)
+    packets_recv = db.Column(db.BigInteger, default=0)
+    samples = db.Column(db.Integer, default=0)
+    device_id = db.Column(db.Integer)
+    
+    def to_dict(self):
+        """Convert to dictionary"""
+        return {
+            'timestamp': self.hour.isoformat(),
+            'bytes_sent': self.bytes_sent,
+            'bytes_recv': self.bytes_recv,
+            'packets_sent': self.packets_sent,
+            'packets_recv': self.packets_recv,
+            'samples': self.samples,
+            'device_id': self.device_id
+        }
+
+
+class SystemResourceRollup(db.Model):
+    """Hourly averages and peaks of system_resource_logs, kept after the raw rows expire"""
+    __tablename__ = 'system_resource_rollups'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    hour = db.Column(db.DateTime, nullable=False, unique=True)
+    cpu_percent = db.Column(db.Float, default=0)
+    cpu_percent_max = db.Column(db.Float, default=0)
+    memory_percent = db.Column(db.Float, default=0)
+    memory_percent_max = db.Column(db.Float, default=0)
+    disk_percent = db.Column(db.Float, default=0)
+    disk_percent_max = db.Column(db.Float, default=0)
+    samples = db.Column(db.Integer, default=0)
+    
+    def to_dict(self):
+        """Convert to dictionary"""
+        return {
+            'timestamp': self.hour.isoformat(),
+            'cpu_percent': self.cpu_percent,
+            'cpu_percent_max': self.cpu_percent_max,
+            'memory_percent': self.memory_percent,
+            'memory_percent_max': self.memory_percent_max,
+            'disk_percent': self.disk_percent,
+            'disk_percent_max': self.disk_percent_max,
+            'samples': self.samples
+        }
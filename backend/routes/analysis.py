@@ -1,8 +1,17 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, PacketCapture
-from services.capture import start_packet_capture, get_protocol_stats, check_capture_permissions, get_packet_analysis
+from models import db, PacketCapture, Flow, DistinctCount
+from services.capture import start_packet_capture, check_capture_permissions, get_capture_stats, save_packets
+from services.sampling import sampler_from_request
+from services.capture_pipeline import ParallelCapture
+from services.pcap_ingest import start_ingest_job, get_ingest_job
+from services.packet_stream import PacketFilter, PacketStream
+from services.capture_jobs import CaptureLimitError, JOB_FAILED
+from services.background_tasks import get_capture_service, get_packet_writer, get_flow_exporter, get_capture_jobs, get_stats_sketches, get_packet_purger, get_dns_resolver
+from services.purge import visible_rows
 from datetime import datetime, timedelta
+import os
+import uuid
 
 analysis_bp = Blueprint('analysis', __name__)
 
@@ -32,22 +41,85 @@ def capture_packets():
     protocol = data.get('protocol', 'all')  # tcp, udp, ip, or all
     count = data.get('count', 100)
     timeout = data.get('timeout', 10)
+    since = data.get('since')  # Ring buffer cursor returned by a previous call (default: newest packets)
     clear_previous = data.get('clear_previous', False)  # Whether to clear previous captures
     
+    # Optional sampling: sample_every (keep 1 in N) or sample_probability (keep with probability p)
     try:
-        # Clear previous captures if requested
+        sampler = sampler_from_request(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': 'Invalid sampling parameters', 'message': str(e)}), 400
+    
+    try:
+        # Clear previous captures if requested (hidden now, deleted in the background)
         if clear_previous:
-            deleted_count = PacketCapture.query.filter_by(user_id=user_id).delete()
-            db.session.commit()
+            clear_user_captures(user_id)
         
-        packets = start_packet_capture(protocol=protocol, count=count, timeout=timeout, user_id=user_id)
+        service = get_capture_service()
+        if service is not None and service.is_available():
+            # Return what the background sniffer's ring buffer holds right away instead of
+            # sniffing here; packets already returned to this user are never saved again
+            packets, cursor = service.collect(
+                user_id, protocol=protocol, count=int(count), since=since,
+                packet_filter=lambda packet: sampler.accept()
+            )
+            packets = [dict(packet, sample_rate=packet.get('sample_rate', 1.0) * sampler.rate) for packet in packets]
+            save_packets(packets, user_id)
+            db.session.commit()
+            
+            return jsonify({
+                'message': 'Packet capture completed',
+                'packets': packets,
+                'count': len(packets),
+                'cursor': cursor,
+                'source': 'capture_service',
+                'sampling': sampler.stats(),
+                'cleared_previous': clear_previous
+            }), 200
         
+        jobs = get_capture_jobs()
+        if jobs is None:
+            packets = start_packet_capture(protocol=protocol, count=count, timeout=timeout, user_id=user_id, sampler=sampler)
+
+            return jsonify({
+                'message': 'Packet capture completed',
+                'packets': packets,
+                'count': len(packets),
+                'source': 'sniff',
+                'sampling': sampler.stats(),
+                'cleared_previous': clear_previous
+            }), 200
+
+        # Run as a capture job so synchronous captures count against the same limits
+        # and share sniffers with concurrent jobs
+        job = jobs.submit(user_id, protocol=protocol, count=count, timeout=timeout, sampler=sampler)
+        if not job.wait(timeout=float(timeout) + jobs.max_timeout):
+            jobs.cancel(job.id, user_id)
+            job.wait(timeout=5)
+        if job.status == JOB_FAILED:
+            if job.permission_denied:
+                raise PermissionError(job.error)
+            raise RuntimeError(job.error)
+
         return jsonify({
             'message': 'Packet capture completed',
-            'packets': packets,
-            'count': len(packets),
+            'packets': job.packets,
+            'count': len(job.packets),
+            'job_id': job.id,
+            'source': 'sniff',
+            'sampling': sampler.stats(),
             'cleared_previous': clear_previous
         }), 200
+    except CaptureLimitError as e:
+        return jsonify({
+            'error': 'Too many captures',
+            'message': str(e)
+        }), 429
+    except ValueError as e:
+        return jsonify({
+            'error': 'Invalid capture parameters',
+            'message': str(e)
+        }), 400
     except PermissionError as e:
         return jsonify({
             'error': 'Permission denied',
@@ -66,6 +138,251 @@ def capture_packets():
         }), 500
 
 
+@analysis_bp.route('/capture/status', methods=['GET'])
+@jwt_required()
+def capture_status():
+    """Get the state and drop counters of the background capture service and packet writer"""
+    service = get_capture_service()
+    status = service.status() if service is not None else {}
+    status['enabled'] = service is not None
+    
+    writer = get_packet_writer()
+    status['writer'] = writer.metrics() if writer is not None else None
+    
+    flow_exporter = get_flow_exporter()
+    status['flows'] = flow_exporter.stats() if flow_exporter is not None else None
+    
+    resolver = get_dns_resolver()
+    status['reverse_dns'] = resolver.stats() if resolver is not None else None
+    return jsonify(status), 200
+
+
+@analysis_bp.route('/stream', methods=['GET'])
+@jwt_required()
+def stream_packets():
+    """Stream live packets from the capture service as Server-Sent Events"""
+    from config import Config
+    service = get_capture_service()
+    if service is None or not service.is_available():
+        return jsonify({'error': 'Capture service is not running'}), 503
+    if service.ring.stats()['subscribers'] >= Config.CAPTURE_STREAM_MAX_CLIENTS:
+        return jsonify({'error': 'Too many live streams'}), 429
+    
+    # Server-side filter plus client-controlled coalescing window and rate limit
+    try:
+        packet_filter = PacketFilter.from_args(request.args)
+        interval = min(max(float(request.args.get('interval', 0.5)), 0.05), 10.0)
+        max_rate = min(max(int(request.args.get('max_rate', Config.CAPTURE_STREAM_MAX_RATE)), 1),
+                       Config.CAPTURE_STREAM_MAX_RATE)
+        duration = float(request.args.get('duration', 0)) or None
+    except ValueError as e:
+        return jsonify({'error': 'Invalid stream parameters', 'message': str(e)}), 400
+    
+    subscription = service.subscribe(packet_filter=packet_filter)
+    stream = PacketStream(subscription, interval=interval, max_rate=max_rate, duration=duration)
+    response = Response(
+        stream.events(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Also unsubscribe when the client leaves before the first event
+    response.call_on_close(subscription.close)
+    return response
+
+
+@analysis_bp.route('/capture/parallel', methods=['POST'])
+@jwt_required()
+def capture_parallel():
+    """Submit a multi-process pipeline capture as a job; its flows are stored when it finishes"""
+    from config import Config
+    user_id = int(get_jwt_identity())
+    data = request.get_json() or {}
+    jobs = get_capture_jobs()
+    if jobs is None:
+        return jsonify({'error': 'Capture jobs are not available'}), 503
+    
+    try:
+        # Validated before any worker is spawned; the workers start when the job does
+        pipeline = ParallelCapture(Config, workers=data.get('workers'), mode=data.get('mode'), user_id=user_id)
+        job = jobs.submit_pipeline(
+            user_id,
+            pipeline,
+            protocol=data.get('protocol', 'all'),  # tcp, udp, ip, icmp, or all
+            timeout=data.get('timeout', 10)
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': 'Invalid pipeline parameters', 'message': str(e)}), 400
+    except CaptureLimitError as e:
+        return jsonify({'error': 'Too many captures', 'message': str(e)}), 429
+    
+    return jsonify({
+        'message': 'Capture job submitted',
+        'job': job.to_dict()
+    }), 202
+
+
+@analysis_bp.route('/ingest', methods=['POST'])
+@jwt_required()
+def ingest_pcap():
+    """Upload a .pcap/.pcapng file and ingest it in the background"""
+    from config import Config
+    user_id = int(get_jwt_identity())
+    
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify({'error': 'No capture file uploaded'}), 400
+    if not upload.filename.lower().endswith(('.pcap', '.pcapng', '.cap', '.pcap.gz', '.pcapng.gz')):
+        return jsonify({'error': 'Unsupported file type', 'message': 'Expected a .pcap or .pcapng file'}), 400
+    
+    try:
+        sampler = sampler_from_request(request.form)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': 'Invalid sampling parameters', 'message': str(e)}), 400
+    
+    upload_dir = Config.PCAP_UPLOAD_DIR
+    os.makedirs(upload_dir, exist_ok=True)
+    path = os.path.join(upload_dir, f'{uuid.uuid4().hex}.upload')
+    upload.save(path)
+    
+    job = start_ingest_job(
+        current_app._get_current_object(), path, user_id, upload.filename,
+        protocol=request.form.get('protocol', 'all'), sampler=sampler
+    )
+    return jsonify({
+        'message': 'Capture file ingestion started',
+        'job': job.to_dict()
+    }), 202
+
+
+@analysis_bp.route('/ingest/<job_id>', methods=['GET'])
+@jwt_required()
+def ingest_status(job_id):
+    """Get progress and throughput of a capture file ingestion"""
+    user_id = int(get_jwt_identity())
+    job = get_ingest_job(job_id, user_id)
+    if job is None:
+        return jsonify({'error': 'Ingestion job not found'}), 404
+    return jsonify(job.to_dict()), 200
+
+
+@analysis_bp.route('/jobs', methods=['POST'])
+@jwt_required()
+def submit_capture_job():
+    """Submit an asynchronous capture job"""
+    user_id = int(get_jwt_identity())
+    data = request.get_json() or {}
+    jobs = get_capture_jobs()
+    if jobs is None:
+        return jsonify({'error': 'Capture jobs are not available'}), 503
+    
+    try:
+        sampler = sampler_from_request(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': 'Invalid sampling parameters', 'message': str(e)}), 400
+    
+    try:
+        job = jobs.submit(
+            user_id,
+            protocol=data.get('protocol', 'all'),
+            count=data.get('count', 100),
+            timeout=data.get('timeout', 10),
+            sampler=sampler
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': 'Invalid capture parameters', 'message': str(e)}), 400
+    except CaptureLimitError as e:
+        return jsonify({'error': 'Too many captures', 'message': str(e)}), 429
+    
+    return jsonify({
+        'message': 'Capture job submitted',
+        'job': job.to_dict()
+    }), 202
+
+
+@analysis_bp.route('/jobs', methods=['GET'])
+@jwt_required()
+def list_capture_jobs():
+    """List the user's capture jobs and the job manager's load"""
+    user_id = int(get_jwt_identity())
+    jobs = get_capture_jobs()
+    if jobs is None:
+        return jsonify({'error': 'Capture jobs are not available'}), 503
+    return jsonify({
+        'jobs': [job.to_dict() for job in jobs.list(user_id)],
+        'manager': jobs.stats()
+    }), 200
+
+
+@analysis_bp.route('/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def capture_job_status(job_id):
+    """Get the status and progress of a capture job"""
+    user_id = int(get_jwt_identity())
+    jobs = get_capture_jobs()
+    job = jobs.get(job_id, user_id) if jobs is not None else None
+    if job is None:
+        return jsonify({'error': 'Capture job not found'}), 404
+    return jsonify(job.to_dict()), 200
+
+
+@analysis_bp.route('/jobs/<job_id>/results', methods=['GET'])
+@jwt_required()
+def capture_job_results(job_id):
+    """Get the packets captured by a finished capture job"""
+    user_id = int(get_jwt_identity())
+    jobs = get_capture_jobs()
+    job = jobs.get(job_id, user_id) if jobs is not None else None
+    if job is None:
+        return jsonify({'error': 'Capture job not found'}), 404
+    if job.status in ('queued', 'running'):
+        return jsonify({'error': 'Capture job has not finished', 'job': job.to_dict()}), 409
+    return jsonify(job.to_dict(include_packets=True)), 200
+
+
+@analysis_bp.route('/jobs/<job_id>', methods=['DELETE'])
+@jwt_required()
+def cancel_capture_job(job_id):
+    """Cancel a queued or running capture job"""
+    user_id = int(get_jwt_identity())
+    jobs = get_capture_jobs()
+    job = jobs.cancel(job_id, user_id) if jobs is not None else None
+    if job is None:
+        return jsonify({'error': 'Capture job not found'}), 404
+    return jsonify({
+        'message': 'Capture job cancelled',
+        'job': job.to_dict()
+    }), 200
+
+
+def clear_user_captures(user_id):
+    """
+    Clear a user's packets, flows and statistics
+
+    With the purge worker running the packets and flows are hidden at once and
+    deleted in the background; otherwise they are deleted here.
+
+    Returns:
+        tuple of (PacketPurge or None, deleted packets, deleted flows)
+    """
+    DistinctCount.query.filter_by(user_id=user_id).delete()
+    sketches = get_stats_sketches()
+    
+    purger = get_packet_purger()
+    if purger is not None:
+        purge = purger.submit(user_id)
+        # The other processes' sketches find the clear through the purge row
+        if sketches is not None:
+            sketches.reset(user_id, purge.created_at)
+        return purge, 0, 0
+    
+    if sketches is not None:
+        sketches.reset(user_id)
+    deleted_count = PacketCapture.query.filter_by(user_id=user_id).delete()
+    deleted_flows = Flow.query.filter_by(user_id=user_id).delete()
+    db.session.commit()
+    return None, deleted_count, deleted_flows
+
+
 @analysis_bp.route('/clear-packets', methods=['DELETE'])
 @jwt_required()
 def clear_packets():
@@ -73,12 +390,18 @@ def clear_packets():
     user_id = int(get_jwt_identity())
     
     try:
-        deleted_count = PacketCapture.query.filter_by(user_id=user_id).delete()
-        db.session.commit()
+        purge, deleted_count, deleted_flows = clear_user_captures(user_id)
+        
+        if purge is not None:
+            return jsonify({
+                'message': 'Packets cleared; deleting in the background',
+                'purge': purge.to_dict()
+            }), 202
         
         return jsonify({
             'message': 'Packets cleared successfully',
-            'deleted_count': deleted_count
+            'deleted_count': deleted_count,
+            'deleted_flows': deleted_flows
         }), 200
     except Exception as e:
         db.session.rollback()
@@ -88,6 +411,18 @@ def clear_packets():
         }), 500
 
 
+@analysis_bp.route('/purges/<int:purge_id>', methods=['GET'])
+@jwt_required()
+def get_purge(purge_id):
+    """Get the progress of a background packet purge"""
+    user_id = int(get_jwt_identity())
+    purger = get_packet_purger()
+    purge = purger.get(purge_id, user_id) if purger is not None else None
+    if purge is None:
+        return jsonify({'error': 'Purge not found'}), 404
+    return jsonify({'purge': purge.to_dict()}), 200
+
+
 @analysis_bp.route('/packets', methods=['GET'])
 @jwt_required()
 def get_packets():
@@ -102,13 +437,18 @@ def get_packets():
     protocol = request.args.get('protocol')
     
     query = PacketCapture.query.filter(
-        PacketCapture.user_id == user_id,
+        visible_rows(PacketCapture, user_id),
         PacketCapture.timestamp >= start_time
     )
     
     if protocol:
         query = query.filter(PacketCapture.protocol == protocol)
     
+    # Get device filter
+    device_id = request.args.get('device_id', type=int)
+    if device_id:
+        query = query.filter(PacketCapture.device_id == device_id)
+    
     packets = query.order_by(PacketCapture.timestamp.desc()).limit(500).all()
     
     return jsonify({
@@ -117,6 +457,40 @@ def get_packets():
     }), 200
 
 
+@analysis_bp.route('/flows', methods=['GET'])
+@jwt_required()
+def get_flows():
+    """Get exported flow records"""
+    user_id = int(get_jwt_identity())
+    
+    # Get time range
+    hours = request.args.get('hours', 1, type=int)
+    start_time = datetime.utcnow() - timedelta(hours=hours)
+    
+    # Get protocol filter
+    protocol = request.args.get('protocol')
+    
+    query = Flow.query.filter(
+        visible_rows(Flow, user_id),
+        Flow.last_seen >= start_time
+    )
+    
+    if protocol:
+        query = query.filter(Flow.protocol == protocol)
+    
+    # Get device filter
+    device_id = request.args.get('device_id', type=int)
+    if device_id:
+        query = query.filter(Flow.device_id == device_id)
+    
+    flows = query.order_by(Flow.last_seen.desc()).limit(500).all()
+    
+    return jsonify({
+        'flows': [flow.to_dict() for flow in flows],
+        'count': len(flows)
+    }), 200
+
+
 @analysis_bp.route('/stats', methods=['GET'])
 @jwt_required()
 def get_stats():
@@ -126,15 +500,25 @@ def get_stats():
     # Get time range
     hours = request.args.get('hours', 24, type=int)
     start_time = datetime.utcnow() - timedelta(hours=hours)
+    sketches = get_stats_sketches()
+    if sketches is not None:
+        # The sketches count whole buckets; every statistic uses the same widened window
+        start_time = sketches.window_start(start_time)
     
     # Get protocol statistics
     try:
-        protocol_stats = get_protocol_stats(user_id, start_time)
-        packet_analysis = get_packet_analysis(user_id, start_time)
+        protocol_stats, packet_analysis = get_capture_stats(user_id, start_time)
+        
+        # Names come from the cache only; unknown addresses are resolved for later requests
+        resolver = get_dns_resolver()
+        if resolver is not None:
+            packet_analysis = resolver.annotate(packet_analysis)
         
         return jsonify({
             'stats': protocol_stats,
             'analysis': packet_analysis,
+            'distinct': sketches.get_distinct_counts(user_id, start_time) if sketches is not None else None,
+            'window_start': start_time.isoformat(),
             'timestamp': datetime.utcnow().isoformat()
         }), 200
     except Exception as e:
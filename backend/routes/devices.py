@@ -1,7 +1,10 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, Device
-from datetime import datetime
+from models import db, Device, TrafficLog, TrafficLogRollup
+from services.background_tasks import get_device_index
+from services.enrichment import touch_devices
+from services.capture import get_protocol_stats
+from datetime import datetime, timedelta
 
 devices_bp = Blueprint('devices', __name__)
 
@@ -48,8 +51,13 @@ def add_device():
     )
     
     db.session.add(device)
+    touch_devices()
     db.session.commit()
     
+    device_index = get_device_index()
+    if device_index is not None:
+        device_index.add_device(device)
+    
     return jsonify({
         'message': 'Device added successfully',
         'device': device.to_dict()
@@ -78,8 +86,14 @@ def update_device(device_id):
         device.status = data['status']
     
     device.last_seen = datetime.utcnow()
+    if 'ip_address' in data:
+        touch_devices()
     db.session.commit()
     
+    device_index = get_device_index()
+    if device_index is not None:
+        device_index.update_device(device)
+    
     return jsonify({
         'message': 'Device updated successfully',
         'device': device.to_dict()
@@ -96,7 +110,36 @@ def delete_device(device_id):
     if not device:
         return jsonify({'error': 'Device not found'}), 404
     
+    # The device's traffic history goes with it
+    TrafficLog.query.filter_by(device_id=device_id).delete(synchronize_session=False)
+    TrafficLogRollup.query.filter_by(device_id=device_id).delete(synchronize_session=False)
     db.session.delete(device)
+    touch_devices()
     db.session.commit()
     
+    device_index = get_device_index()
+    if device_index is not None:
+        device_index.remove_device(device_id)
+    
     return jsonify({'message': 'Device deleted successfully'}), 200
+
+
+@devices_bp.route('/<int:device_id>/traffic', methods=['GET'])
+@jwt_required()
+def get_device_traffic(device_id):
+    """Captured traffic of a device by protocol"""
+    user_id = int(get_jwt_identity())
+    device = Device.query.filter_by(id=device_id, user_id=user_id).first()
+    
+    if not device:
+        return jsonify({'error': 'Device not found'}), 404
+    
+    hours = request.args.get('hours', 24, type=int)
+    start_time = datetime.utcnow() - timedelta(hours=hours)
+    stats = get_protocol_stats(user_id, start_time, device_id=device_id)
+    
+    return jsonify({
+        'device': device.to_dict(),
+        'hours': hours,
+        'stats': stats
+    }), 200
@@ -1,7 +1,12 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, TrafficLog, Alert
-from services.monitor import get_network_traffic, get_system_stats, run_speed_test, get_network_load
+from models import (
+    db, TrafficLog, Alert, TrafficLogRollup, SystemResourceRollup, InterfaceTrafficLog, ConnectionStateLog
+)
+from services.monitor import (
+    get_network_traffic, get_system_stats, run_speed_test, get_network_load, get_interface_load,
+    get_interface_rate_history, get_connection_stats
+)
 from datetime import datetime, timedelta
 
 monitoring_bp = Blueprint('monitoring', __name__)
@@ -10,8 +15,9 @@ monitoring_bp = Blueprint('monitoring', __name__)
 @jwt_required()
 def get_traffic():
     """Get current network traffic data"""
+    pernic = request.args.get('pernic', 'false').lower() == 'true'
     try:
-        traffic_data = get_network_traffic()
+        traffic_data = get_network_traffic(pernic)
         return jsonify({
             'traffic': traffic_data,
             'timestamp': datetime.utcnow().isoformat()
@@ -52,8 +58,11 @@ def speed_test():
 @jwt_required()
 def network_load():
     """Get current network load metrics"""
+    from config import Config
+    window = request.args.get('window', 60, type=int)
+    window = max(1, min(window, Config.RATE_HISTORY_SECONDS))
     try:
-        load_data = get_network_load()
+        load_data = get_network_load(window)
         return jsonify({
             'load': load_data,
             'timestamp': datetime.utcnow().isoformat()
@@ -62,6 +71,101 @@ def network_load():
         return jsonify({'error': str(e)}), 500
 
 
+def _interface_filter():
+    """Interfaces named in the comma-separated interface query parameter, or None for all"""
+    names = [name.strip() for name in request.args.get('interface', '').split(',') if name.strip()]
+    return set(names) or None
+
+
+@monitoring_bp.route('/interfaces', methods=['GET'])
+@jwt_required()
+def interface_load():
+    """Get the current load of each network interface, busiest first"""
+    from config import Config
+    window = request.args.get('window', 60, type=int)
+    window = max(1, min(window, Config.RATE_HISTORY_SECONDS))
+    try:
+        loads = get_interface_load(_interface_filter(), window)
+        return jsonify({
+            'interfaces': loads,
+            'count': len(loads),
+            'timestamp': datetime.utcnow().isoformat()
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@monitoring_bp.route('/interfaces/history', methods=['GET'])
+@jwt_required()
+def interface_history():
+    """
+    Get per-interface traffic history
+
+    With seconds, the per-second rates kept in memory; otherwise the
+    stored per-interval logs of the last hours.
+    """
+    from config import Config
+    interfaces = _interface_filter()
+    
+    seconds = request.args.get('seconds', type=int)
+    if seconds:
+        seconds = max(1, min(seconds, Config.RATE_HISTORY_SECONDS))
+        history = get_interface_rate_history(interfaces, seconds)
+        return jsonify({
+            'history': history,
+            'resolution': 'second',
+            'count': sum(len(points) for points in history.values())
+        }), 200
+    
+    hours = request.args.get('hours', 24, type=int)
+    start_time = datetime.utcnow() - timedelta(hours=hours)
+    limit = getattr(Config, 'MAX_HISTORY_RECORDS', 1000)
+    
+    query = InterfaceTrafficLog.query.filter(InterfaceTrafficLog.timestamp >= start_time)
+    if interfaces:
+        query = query.filter(InterfaceTrafficLog.interface.in_(interfaces))
+    logs = query.order_by(InterfaceTrafficLog.timestamp.desc()).limit(limit).all()
+    
+    return jsonify({
+        'history': [log.to_dict() for log in logs],
+        'resolution': 'interval',
+        'count': len(logs)
+    }), 200
+
+
+@monitoring_bp.route('/connections', methods=['GET'])
+@jwt_required()
+def connections():
+    """Get TCP connection counts by state and the top remote addresses"""
+    try:
+        stats = get_connection_stats()
+        return jsonify({
+            'connections': stats,
+            'timestamp': datetime.utcnow().isoformat()
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@monitoring_bp.route('/connections/history', methods=['GET'])
+@jwt_required()
+def connection_history():
+    """Get historical TCP connection counts by state"""
+    from config import Config
+    hours = request.args.get('hours', 24, type=int)
+    start_time = datetime.utcnow() - timedelta(hours=hours)
+    limit = getattr(Config, 'MAX_HISTORY_RECORDS', 1000)
+    
+    logs = ConnectionStateLog.query.filter(
+        ConnectionStateLog.timestamp >= start_time
+    ).order_by(ConnectionStateLog.timestamp.desc()).limit(limit).all()
+    
+    return jsonify({
+        'history': [log.to_dict() for log in logs],
+        'count': len(logs)
+    }), 200
+
+
 @monitoring_bp.route('/history', methods=['GET'])
 @jwt_required()
 def get_history():
@@ -79,12 +183,21 @@ def get_history():
     # Get limit from config
     limit = getattr(Config, 'MAX_HISTORY_RECORDS', 1000)
     
-    query = TrafficLog.query.filter(TrafficLog.timestamp >= start_time)
+    # Hourly rollups reach back past the raw log retention
+    if request.args.get('resolution') == 'hour':
+        model, time_column = TrafficLogRollup, TrafficLogRollup.hour
+    else:
+        model, time_column = TrafficLog, TrafficLog.timestamp
+    
+    query = model.query.filter(time_column >= start_time)
     
     if device_id:
-        query = query.filter(TrafficLog.device_id == device_id)
+        query = query.filter(model.device_id == device_id)
+    else:
+        # Host rows only; device rows are per-device breakdowns of the same traffic
+        query = query.filter(model.device_id.is_(None))
     
-    logs = query.order_by(TrafficLog.timestamp.desc()).limit(limit).all()
+    logs = query.order_by(time_column.desc()).limit(limit).all()
     
     return jsonify({
         'history': [log.to_dict() for log in logs],
@@ -141,11 +254,39 @@ def get_system_history():
     from config import Config
     limit = getattr(Config, 'MAX_HISTORY_RECORDS', 1000)
     
-    logs = SystemResourceLog.query.filter(
-        SystemResourceLog.timestamp >= start_time
-    ).order_by(SystemResourceLog.timestamp.desc()).limit(limit).all()
+    # Hourly averages and peaks reach back past the raw log retention
+    if request.args.get('resolution') == 'hour':
+        logs = SystemResourceRollup.query.filter(
+            SystemResourceRollup.hour >= start_time
+        ).order_by(SystemResourceRollup.hour.desc()).limit(limit).all()
+    else:
+        logs = SystemResourceLog.query.filter(
+            SystemResourceLog.timestamp >= start_time
+        ).order_by(SystemResourceLog.timestamp.desc()).limit(limit).all()
     
     return jsonify({
         'history': [log.to_dict() for log in logs],
         'count': len(logs)
     }), 200
+
+
+@monitoring_bp.route('/retention', methods=['GET'])
+@jwt_required()
+def get_retention():
+    """Get the retention settings and the last retention run"""
+    from services.background_tasks import get_retention_job
+    job = get_retention_job()
+    
+    if job is None:
+        return jsonify({'enabled': False}), 200
+    
+    return jsonify({
+        'enabled': True,
+        'retention_days': {table: days for table, (_, _, _, days) in job.tables.items()},
+        'downsample': job.downsample,
+        'runs': job.runs,
+        'skipped_runs': job.skipped,
+        'errors': job.errors,
+        'rows_deleted': dict(job.totals),
+        'last_run': job.last_report
+    }), 200
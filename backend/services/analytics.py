@@ -11,6 +11,8 @@ def get_traffic_analytics(device_id=None, hours=24):
     query = TrafficLog.query.filter(TrafficLog.timestamp >= start_time)
     if device_id:
         query = query.filter(TrafficLog.device_id == device_id)
+    else:
+        query = query.filter(TrafficLog.device_id.is_(None))
     
     logs = query.order_by(TrafficLog.timestamp).all()
     
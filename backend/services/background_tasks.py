@@ -4,9 +4,21 @@ Background tasks for automatic monitoring and alert generation
 import threading
 import time
 from datetime import datetime
-from services.monitor import get_network_traffic, get_system_stats
+from services.monitor import get_network_traffic, get_system_stats, get_connection_stats, connection_alerts
 from services.analytics import create_alert
-from models import db, TrafficLog, SystemResourceLog, User, Alert
+from services.capture_service import CaptureService
+from services.packet_writer import PacketWriter
+from services.flows import FlowExporter
+from services.capture_jobs import CaptureJobManager
+from services.stats_sketches import StatsSketches
+from services.partitions import PartitionManager
+from services.retention import RetentionJob
+from services.purge import PacketPurger
+from services.enrichment import DeviceIndex
+from services.reverse_dns import ReverseDNSResolver
+from services.system_sampler import SystemSampler
+from services.rates import RateEngine, TOTAL, interface_capacities
+from models import db, TrafficLog, SystemResourceLog, User, Alert, InterfaceTrafficLog, ConnectionStateLog
 
 
 class BackgroundMonitor:
@@ -78,6 +90,36 @@ class BackgroundMonitor:
                 
                 db.session.add(log_entry)
                 
+                # Per-device captured traffic since the previous log (services.enrichment);
+                # these rows hold interval counts, the host row above cumulative counters
+                device_index = get_device_index()
+                if device_index is not None:
+                    for device_id, counters in device_index.drain_traffic().items():
+                        bytes_sent, bytes_recv, packets_sent, packets_recv = counters
+                        db.session.add(TrafficLog(
+                            timestamp=log_entry.timestamp,
+                            bytes_sent=bytes_sent,
+                            bytes_recv=bytes_recv,
+                            packets_sent=packets_sent,
+                            packets_recv=packets_recv,
+                            device_id=device_id
+                        ))
+                
+                # Per-interface traffic since the previous log (services.rates)
+                rate_engine = get_rate_engine()
+                if rate_engine is not None:
+                    capacities = interface_capacities(self.config)
+                    for interface, (seconds, counts) in rate_engine.drain().items():
+                        if interface == TOTAL or not seconds or not any(counts.values()):
+                            continue
+                        db.session.add(InterfaceTrafficLog(
+                            timestamp=log_entry.timestamp,
+                            interface=interface[:32],
+                            seconds=round(seconds, 3),
+                            capacity_mbps=capacities.get(interface, {}).get('capacity_mbps'),
+                            **counts
+                        ))
+                
                 # Also log system resource data
                 system_stats = get_system_stats()
                 
@@ -93,6 +135,25 @@ class BackgroundMonitor:
                 )
                 
                 db.session.add(resource_entry)
+                
+                # TCP connection counts by state
+                connection_stats = get_connection_stats()
+                states = connection_stats['states']
+                counts = {
+                    'established': states['ESTABLISHED'],
+                    'syn_sent': states['SYN_SENT'],
+                    'syn_recv': states['SYN_RECV'],
+                    'fin_wait': states['FIN_WAIT1'] + states['FIN_WAIT2'],
+                    'time_wait': states['TIME_WAIT'],
+                    'close_wait': states['CLOSE_WAIT'],
+                    'listen': states['LISTEN']
+                }
+                db.session.add(ConnectionStateLog(
+                    timestamp=resource_entry.timestamp,
+                    total=connection_stats['total'],
+                    other=connection_stats['total'] - sum(counts.values()),
+                    **counts
+                ))
                 db.session.commit()
                 
         except Exception as e:
@@ -103,6 +164,7 @@ class BackgroundMonitor:
         try:
             with self.app.app_context():
                 system_stats = get_system_stats()
+                connection_stats = get_connection_stats()
                 
                 # Get all users to create alerts for
                 users = User.query.all()
@@ -134,6 +196,10 @@ class BackgroundMonitor:
                             f"Disk usage is at {system_stats['disk']['percent']}%",
                             'warning'
                         )
+                    
+                    # Check TCP connection state counts
+                    for alert_type, message in connection_alerts(connection_stats, self.config):
+                        self._create_threshold_alert(user.id, alert_type, message, 'warning')
                 
         except Exception as e:
             print(f"Error checking thresholds: {e}")
@@ -156,6 +222,43 @@ class BackgroundMonitor:
 # Global background monitor instance
 background_monitor = None
 
+# Global packet capture service instance
+capture_service = None
+
+# Global write-behind packet writer instance
+packet_writer = None
+
+# Global flow table exporter instance
+flow_exporter = None
+
+# Global capture job manager instance
+capture_jobs = None
+
+# Global statistics sketches instance
+stats_sketches = None
+
+# Global partition maintenance instance
+partition_manager = None
+
+# Global retention job instance
+retention_job = None
+
+# Global packet purge worker instance
+packet_purger = None
+
+# Global device and subnet enrichment index
+device_index = None
+
+# Global reverse DNS resolver instance
+dns_resolver = None
+
+# Global system metrics sampler instance
+system_sampler = None
+
+# Global network rate engine instance (also started on first use outside the app)
+rate_engine = None
+_rate_engine_lock = threading.Lock()
+
 
 def init_background_monitor(app, config):
     """Initialize and start the background monitor"""
@@ -175,3 +278,304 @@ def stop_background_monitor():
     if background_monitor:
         background_monitor.stop()
         background_monitor = None
+
+
+def init_capture_service(config):
+    """Initialize and start the continuous packet capture service"""
+    global capture_service
+
+    if capture_service is None and getattr(config, 'CAPTURE_DAEMON_ENABLED', False):
+        capture_service = CaptureService(config)
+        capture_service.start()
+
+    return capture_service
+
+
+def get_capture_service():
+    """Return the running capture service, or None if it is disabled"""
+    return capture_service
+
+
+def stop_capture_service():
+    """Stop the packet capture service"""
+    global capture_service
+
+    if capture_service:
+        capture_service.stop()
+        capture_service = None
+
+
+def init_packet_writer(app, config):
+    """Initialize and start the write-behind packet writer"""
+    global packet_writer
+
+    if packet_writer is None and getattr(config, 'PACKET_WRITER_ENABLED', False):
+        packet_writer = PacketWriter(
+            app,
+            batch_size=getattr(config, 'PACKET_WRITER_BATCH_SIZE', 500),
+            flush_interval=getattr(config, 'PACKET_WRITER_FLUSH_INTERVAL', 1.0),
+            max_backlog=getattr(config, 'PACKET_WRITER_MAX_BACKLOG', 100000),
+            retries=getattr(config, 'PACKET_WRITER_RETRIES', 3),
+            retry_backoff=getattr(config, 'PACKET_WRITER_RETRY_BACKOFF', 0.5),
+            dead_letter_dir=getattr(config, 'PACKET_WRITER_DEAD_LETTER_DIR', None)
+        )
+        packet_writer.start()
+
+    return packet_writer
+
+
+def get_packet_writer():
+    """Return the running packet writer, or None if it is disabled"""
+    return packet_writer
+
+
+def stop_packet_writer():
+    """Flush and stop the packet writer"""
+    global packet_writer
+
+    if packet_writer:
+        packet_writer.stop()
+        packet_writer = None
+
+
+def init_flow_exporter(app, config):
+    """Initialize and start flow aggregation when flows are being stored"""
+    global flow_exporter
+
+    if flow_exporter is None and getattr(config, 'CAPTURE_STORAGE', 'packets') in ('flows', 'both'):
+        flow_exporter = FlowExporter(app, config)
+        flow_exporter.start()
+
+    return flow_exporter
+
+
+def get_flow_exporter():
+    """Return the running flow exporter, or None if flows are not stored"""
+    return flow_exporter
+
+
+def stop_flow_exporter():
+    """Export remaining flows and stop the flow exporter"""
+    global flow_exporter
+
+    if flow_exporter:
+        flow_exporter.stop()
+        flow_exporter = None
+
+
+def init_capture_jobs(app, config):
+    """Initialize the capture job manager"""
+    global capture_jobs
+
+    if capture_jobs is None:
+        capture_jobs = CaptureJobManager(app, config)
+        capture_jobs.start()
+
+    return capture_jobs
+
+
+def get_capture_jobs():
+    """Return the capture job manager, or None if it is not initialized"""
+    return capture_jobs
+
+
+def stop_capture_jobs():
+    """Cancel queued and running capture jobs"""
+    global capture_jobs
+
+    if capture_jobs:
+        capture_jobs.stop()
+        capture_jobs = None
+
+
+def init_stats_sketches(app, config):
+    """Initialize the statistics sketches and start flushing their distinct counters"""
+    global stats_sketches
+
+    if stats_sketches is None and getattr(config, 'STATS_SKETCHES_ENABLED', False):
+        stats_sketches = StatsSketches(app, config)
+        stats_sketches.start()
+
+    return stats_sketches
+
+
+def get_stats_sketches():
+    """Return the statistics sketches, or None if they are disabled"""
+    return stats_sketches
+
+
+def stop_stats_sketches():
+    """Flush distinct counters and stop the statistics sketches"""
+    global stats_sketches
+
+    if stats_sketches:
+        stats_sketches.stop()
+        stats_sketches = None
+
+
+def init_partition_manager(app, config):
+    """Initialize and start partition maintenance on partitioned MySQL databases"""
+    global partition_manager
+
+    if partition_manager is None and getattr(config, 'PARTITIONING_ENABLED', False) \
+            and db.engine.dialect.name == 'mysql':
+        partition_manager = PartitionManager(app, config)
+        partition_manager.start()
+
+    return partition_manager
+
+
+def get_partition_manager():
+    """Return the partition manager, or None if partitioning is disabled"""
+    return partition_manager
+
+
+def stop_partition_manager():
+    """Stop partition maintenance"""
+    global partition_manager
+
+    if partition_manager:
+        partition_manager.stop()
+        partition_manager = None
+
+
+def init_retention_job(app, config):
+    """Initialize and start the retention and downsampling job"""
+    global retention_job
+
+    if retention_job is None and getattr(config, 'RETENTION_ENABLED', False):
+        retention_job = RetentionJob(app, config)
+        retention_job.start()
+
+    return retention_job
+
+
+def get_retention_job():
+    """Return the retention job, or None if it is disabled"""
+    return retention_job
+
+
+def stop_retention_job():
+    """Stop the retention job"""
+    global retention_job
+
+    if retention_job:
+        retention_job.stop()
+        retention_job = None
+
+
+def init_packet_purger(app, config):
+    """Initialize the packet purge worker and resume unfinished purges"""
+    global packet_purger
+
+    if packet_purger is None:
+        packet_purger = PacketPurger(app, config)
+        packet_purger.start()
+
+    return packet_purger
+
+
+def get_packet_purger():
+    """Return the packet purge worker, or None if it is not initialized"""
+    return packet_purger
+
+
+def stop_packet_purger():
+    """Stop the packet purge worker"""
+    global packet_purger
+
+    if packet_purger:
+        packet_purger.stop()
+        packet_purger = None
+
+
+def init_device_index(app, config):
+    """Initialize the device and subnet index and load the registered devices"""
+    global device_index
+
+    if device_index is None and getattr(config, 'ENRICHMENT_ENABLED', False):
+        device_index = DeviceIndex(app, config)
+        device_index.load()
+
+    return device_index
+
+
+def get_device_index():
+    """Return the device index, or None if enrichment is disabled"""
+    return device_index
+
+
+def init_dns_resolver(config):
+    """Initialize and start the background reverse DNS resolver"""
+    global dns_resolver
+
+    if dns_resolver is None and getattr(config, 'REVERSE_DNS_ENABLED', False):
+        dns_resolver = ReverseDNSResolver(config)
+        dns_resolver.start()
+
+    return dns_resolver
+
+
+def get_dns_resolver():
+    """Return the reverse DNS resolver, or None if it is disabled"""
+    return dns_resolver
+
+
+def stop_dns_resolver():
+    """Stop the reverse DNS resolver"""
+    global dns_resolver
+
+    if dns_resolver:
+        dns_resolver.stop()
+        dns_resolver = None
+
+
+def init_system_sampler(config):
+    """Initialize and start the background system metrics sampler"""
+    global system_sampler
+
+    if system_sampler is None and getattr(config, 'SYSTEM_SAMPLER_ENABLED', False):
+        system_sampler = SystemSampler(config)
+        system_sampler.start()
+
+    return system_sampler
+
+
+def get_system_sampler():
+    """Return the system sampler, or None if it is disabled"""
+    return system_sampler
+
+
+def stop_system_sampler():
+    """Stop the system sampler"""
+    global system_sampler
+
+    if system_sampler:
+        system_sampler.stop()
+        system_sampler = None
+
+
+def init_rate_engine(config):
+    """Initialize and start the network rate engine"""
+    global rate_engine
+
+    with _rate_engine_lock:
+        if rate_engine is None:
+            rate_engine = RateEngine(config)
+            rate_engine.start()
+
+    return rate_engine
+
+
+def get_rate_engine():
+    """Return the network rate engine, or None if it is not started"""
+    return rate_engine
+
+
+def stop_rate_engine():
+    """Stop the network rate engine"""
+    global rate_engine
+
+    if rate_engine:
+        rate_engine.stop()
+        rate_engine = None
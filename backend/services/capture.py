@@ -1,11 +1,25 @@
 from scapy.all import sniff, IP, TCP, UDP, ICMP
-from models import db, PacketCapture
+from models import db, PacketCapture, Flow
+from column_types import parse_info
+from services.packet_writer import PACKET_COLUMNS
+from services.decoder import decode_with_fallback
+from services.capture_backends import capture_frames
+from services.sampling import PacketSampler
+from services.purge import visible_rows
 from datetime import datetime
 import os
 import platform
 import sys
 import logging
 
+# Common port names for reference
+COMMON_PORTS = {
+    20: 'FTP-Data', 21: 'FTP', 22: 'SSH', 23: 'Telnet',
+    25: 'SMTP', 53: 'DNS', 80: 'HTTP', 110: 'POP3',
+    143: 'IMAP', 443: 'HTTPS', 3306: 'MySQL', 5432: 'PostgreSQL',
+    3389: 'RDP', 8080: 'HTTP-Alt', 8443: 'HTTPS-Alt'
+}
+
 
 def check_capture_permissions():
     """
@@ -128,69 +142,186 @@ def format_permission_instructions():
     return '\n'.join(lines)
 
 
+def parse_packet(packet):
+    """
+    Extract the fields we store and display from a scapy packet
+
+    Returns:
+        dict with packet data, or None for non-IP packets
+    """
+    if IP not in packet:
+        return None
+
+    protocol = None
+    src_port = None
+    dst_port = None
+    tcp_flags = None
+    icmp_type = None
+    info = ""
+
+    if TCP in packet:
+        protocol = 'TCP'
+        src_port = packet[TCP].sport
+        dst_port = packet[TCP].dport
+        tcp_flags = int(packet[TCP].flags)
+        info = f"Flags: {packet[TCP].flags}"
+    elif UDP in packet:
+        protocol = 'UDP'
+        src_port = packet[UDP].sport
+        dst_port = packet[UDP].dport
+    elif ICMP in packet:
+        protocol = 'ICMP'
+        icmp_type = packet[ICMP].type
+        info = f"Type: {icmp_type}"
+    else:
+        protocol = 'IP'
+
+    return {
+        'timestamp': datetime.utcfromtimestamp(float(packet.time)).isoformat(),
+        'protocol': protocol,
+        'src_ip': packet[IP].src,
+        'dst_ip': packet[IP].dst,
+        'src_port': src_port,
+        'dst_port': dst_port,
+        'length': len(packet),
+        'info': info,
+        'tcp_flags': tcp_flags,
+        'icmp_type': icmp_type
+    }
+
+
+def matches_protocol(packet_data, protocol):
+    """Check a parsed packet against the protocol filter used by the capture API"""
+    protocol = (protocol or 'all').lower()
+    if protocol in ('all', 'ip'):
+        return True
+    return (packet_data.get('protocol') or '').lower() == protocol
+
+
+def save_packets(packets, user_id):
+    """
+    Store already parsed packets for a user
+
+    Depending on CAPTURE_STORAGE, packets are folded into the flow table,
+    stored as packet rows, or both. Packet rows go to the write-behind packet
+    writer when it is running; otherwise they are added to the current
+    session (the caller commits). The statistics sketches see every packet.
+    """
+    from config import Config
+    from services.background_tasks import get_packet_writer, get_flow_exporter, get_stats_sketches, get_device_index
+    storage = getattr(Config, 'CAPTURE_STORAGE', 'packets')
+
+    rows = []
+    for packet_data in packets:
+        timestamp = packet_data.get('timestamp')
+        if 'tcp_flags' in packet_data or 'icmp_type' in packet_data:
+            tcp_flags, icmp_type = packet_data.get('tcp_flags'), packet_data.get('icmp_type')
+        else:
+            tcp_flags, icmp_type = parse_info(packet_data.get('info'))
+        rows.append((
+            datetime.fromisoformat(timestamp) if timestamp else datetime.utcnow(),
+            packet_data['protocol'],
+            packet_data['src_ip'],
+            packet_data['dst_ip'],
+            packet_data['src_port'],
+            packet_data['dst_port'],
+            packet_data['length'],
+            tcp_flags,
+            packet_data.get('sample_rate', 1.0),
+            user_id,
+            icmp_type
+        ))
+
+    index = get_device_index()
+    if index is not None:
+        rows = index.tag_packet_rows(rows)
+
+    sketches = get_stats_sketches()
+    if sketches is not None:
+        sketches.add_rows(rows)
+
+    if storage in ('flows', 'both'):
+        flow_exporter = get_flow_exporter()
+        if flow_exporter is not None:
+            flow_exporter.add_packets(packets, user_id)
+            if storage == 'flows':
+                return
+
+    writer = get_packet_writer()
+    if writer is not None:
+        writer.submit_many(rows)
+        return
+
+    for row in rows:
+        db.session.add(PacketCapture(**dict(zip(PACKET_COLUMNS, row))))
+
+
+def save_flows(rows):
+    """
+    Store flow rows aggregated outside the flow table (FLOW_COLUMNS order, e.g. by the capture pipeline)
+
+    Rows go to the flow exporter's writer when it is running; otherwise they
+    are added to the current session (the caller commits). They never went
+    through save_packets(), so they count for the devices here.
+    """
+    from config import Config
+    from services.flows import FLOW_COLUMNS
+    from services.background_tasks import get_flow_exporter, get_stats_sketches, get_device_index
+    flow_exporter = get_flow_exporter()
+    if flow_exporter is not None:
+        flow_exporter.export(rows, count=True)
+    elif rows:
+        index = get_device_index()
+        tagged = index.tag_flow_rows(rows, count=True) if index is not None else rows
+        db.session.execute(Flow.__table__.insert(), [dict(zip(FLOW_COLUMNS, row)) for row in tagged])
+
+    # Flow rows only feed the statistics when they are what the statistics read
+    sketches = get_stats_sketches()
+    if sketches is not None and getattr(Config, 'CAPTURE_STORAGE', 'packets') == 'flows':
+        sketches.add_flow_rows(rows)
+
+
 def packet_callback(packet, user_id, captured_packets):
     """Callback function to process captured packets"""
     try:
-        if IP in packet:
-            protocol = None
-            src_port = None
-            dst_port = None
-            info = ""
-
-            if TCP in packet:
-                protocol = 'TCP'
-                src_port = packet[TCP].sport
-                dst_port = packet[TCP].dport
-                info = f"Flags: {packet[TCP].flags}"
-            elif UDP in packet:
-                protocol = 'UDP'
-                src_port = packet[UDP].sport
-                dst_port = packet[UDP].dport
-            elif ICMP in packet:
-                protocol = 'ICMP'
-                info = f"Type: {packet[ICMP].type}"
-            else:
-                protocol = 'IP'
-
-            packet_data = {
-                'timestamp': datetime.utcnow().isoformat(),
-                'protocol': protocol,
-                'src_ip': packet[IP].src,
-                'dst_ip': packet[IP].dst,
-                'src_port': src_port,
-                'dst_port': dst_port,
-                'length': len(packet),
-                'info': info
-            }
+        packet_data = parse_packet(packet)
+        if packet_data is not None:
+            save_packets([packet_data], user_id)
+            captured_packets.append(packet_data)
+
+    except Exception as e:
+        print(f"Error processing packet: {e}")
 
-            # Save to database
-            capture = PacketCapture(
-                protocol=protocol,
-                src_ip=packet[IP].src,
-                dst_ip=packet[IP].dst,
-                src_port=src_port,
-                dst_port=dst_port,
-                length=len(packet),
-                info=info,
-                user_id=user_id
-            )
-            db.session.add(capture)
 
+def frame_callback(frame, timestamp, link_layer, user_id, captured_packets, sample_rate=1.0):
+    """Callback for raw frames: fast header decode, scapy only for exotic frames"""
+    try:
+        packet_data = decode_with_fallback(frame, timestamp, link_layer)
+        if packet_data is not None:
+            packet_data['sample_rate'] = sample_rate
+            save_packets([packet_data], user_id)
             captured_packets.append(packet_data)
 
     except Exception as e:
         print(f"Error processing packet: {e}")
 
 
-def start_packet_capture(protocol='all', count=100, timeout=10, user_id=None):
+def capture_filter(protocol):
+    """BPF filter string for a capture API protocol (None captures everything)"""
+    protocol = (protocol or 'all').lower()
+    return protocol if protocol in ('tcp', 'udp', 'icmp', 'ip') else None
+
+
+def start_packet_capture(protocol='all', count=100, timeout=10, user_id=None, sampler=None):
     """
     Start capturing network packets
 
     Args:
         protocol: Protocol filter (tcp, udp, ip, icmp, or all)
-        count: Number of packets to capture
+        count: Number of (sampled) packets to capture
         timeout: Capture timeout in seconds
         user_id: User ID for database storage
+        sampler: Optional PacketSampler; rejected frames are skipped before decoding
 
     Returns:
         List of captured packet data
@@ -201,28 +332,25 @@ def start_packet_capture(protocol='all', count=100, timeout=10, user_id=None):
     """
     from config import Config
     captured_packets = []
+    sampler = sampler or PacketSampler()
+
+    def on_frame(frame, timestamp, link_layer):
+        if len(captured_packets) >= count or not sampler.accept():
+            return
+        frame_callback(frame, timestamp, link_layer, user_id, captured_packets, sampler.rate)
 
-    # Build filter string
-    filter_str = None
-    if protocol.lower() == 'tcp':
-        filter_str = 'tcp'
-    elif protocol.lower() == 'udp':
-        filter_str = 'udp'
-    elif protocol.lower() == 'icmp':
-        filter_str = 'icmp'
-    elif protocol.lower() == 'ip':
-        filter_str = 'ip'
+    filter_str = capture_filter(protocol)
 
     try:
         # Capture packets
         # Note: This requires root/admin privileges
-        sniff(
-            filter=filter_str,
-            prn=lambda pkt: packet_callback(pkt, user_id, captured_packets),
-            count=count,
+        capture_frames(
+            on_frame,
+            Config,
+            iface=getattr(Config, 'CAPTURE_INTERFACE', None) or None,
+            filter_str=filter_str,
             timeout=timeout,
-            store=False,
-            iface="Intel(R) Wi-Fi 6E AX211 160MHz"
+            stop=lambda: len(captured_packets) >= count
         )
 
         # Commit all captured packets to database
@@ -248,19 +376,44 @@ def start_packet_capture(protocol='all', count=100, timeout=10, user_id=None):
 
 
 
-def get_protocol_stats(user_id, start_time):
-    """Get statistics about captured packets by protocol"""
+def _stats_source():
+    """
+    Columns the statistics queries aggregate over
+
+    Per-packet rows by default; exported flow records when CAPTURE_STORAGE is
+    'flows' (packet rows are not written in that mode). Counts and bytes are
+    scaled by each record's sample_rate, so sampled captures yield estimates.
+
+    Returns:
+        tuple of (model, time column, packet count expression, byte sum expression)
+    """
+    from config import Config
     from sqlalchemy import func
 
+    if getattr(Config, 'CAPTURE_STORAGE', 'packets') == 'flows':
+        rate = func.coalesce(Flow.sample_rate, 1.0)
+        return Flow, Flow.last_seen, func.sum(Flow.packets * rate), func.sum(Flow.bytes * rate)
+    rate = func.coalesce(PacketCapture.sample_rate, 1.0)
+    return PacketCapture, PacketCapture.timestamp, func.sum(rate), func.sum(PacketCapture.length * rate)
+
+
+def get_protocol_stats(user_id, start_time, device_id=None):
+    """Get statistics about captured packets by protocol, optionally of one device"""
+    model, time_column, packet_count, byte_sum = _stats_source()
+
     # Query packet counts by protocol
     protocol_counts = db.session.query(
-        PacketCapture.protocol,
-        func.count(PacketCapture.id).label('count'),
-        func.sum(PacketCapture.length).label('total_bytes')
+        model.protocol,
+        packet_count.label('count'),
+        byte_sum.label('total_bytes')
     ).filter(
-        PacketCapture.user_id == user_id,
-        PacketCapture.timestamp >= start_time
-    ).group_by(PacketCapture.protocol).all()
+        visible_rows(model, user_id),
+        time_column >= start_time
+    )
+    if device_id is not None:
+        # Served from the (user_id, device_id, time) covering index
+        protocol_counts = protocol_counts.filter(model.device_id == device_id)
+    protocol_counts = protocol_counts.group_by(model.protocol).all()
 
     stats = {
         'protocols': [],
@@ -271,15 +424,32 @@ def get_protocol_stats(user_id, start_time):
     for proto, count, total_bytes in protocol_counts:
         stats['protocols'].append({
             'protocol': proto,
-            'count': count,
-            'bytes': total_bytes or 0
+            'count': int(round(count or 0)),
+            'bytes': int(round(total_bytes or 0))
         })
-        stats['total_packets'] += count
-        stats['total_bytes'] += total_bytes or 0
+        stats['total_packets'] += int(round(count or 0))
+        stats['total_bytes'] += int(round(total_bytes or 0))
 
     return stats
 
 
+def get_capture_stats(user_id, start_time):
+    """
+    Protocol distribution, totals and top talkers of a window
+
+    The top talkers come from the statistics sketches when they cover the
+    window, which leaves the protocol GROUP BY as the only scan. Otherwise
+    each statistic is its own GROUP BY: neither SQLite nor MySQL has
+    GROUPING SETS, and one scan grouped on (protocol, src_ip, dst_ip,
+    dst_port) and rolled up in memory measured slower than the separate
+    scans (benchmarks/bench_stats.py).
+
+    Returns:
+        tuple of (stats, analysis) in get_protocol_stats() and get_packet_analysis() format
+    """
+    return get_protocol_stats(user_id, start_time), get_packet_analysis(user_id, start_time)
+
+
 def get_packet_analysis(user_id, start_time):
     """
     Get detailed packet analysis including:
@@ -288,72 +458,75 @@ def get_packet_analysis(user_id, start_time):
     - Top ports
     - Protocol distribution
     - Traffic patterns
+
+    Served from the in-memory sketches when they cover the window.
     """
-    from sqlalchemy import func, desc
+    from sqlalchemy import desc
+    from services.background_tasks import get_stats_sketches
+    sketches = get_stats_sketches()
+    if sketches is not None:
+        analysis = sketches.get_packet_analysis(user_id, start_time)
+        if analysis is not None:
+            return analysis
+
+    model, time_column, packet_count, byte_sum = _stats_source()
     
     # Get top source IPs
     top_src_ips = db.session.query(
-        PacketCapture.src_ip,
-        func.count(PacketCapture.id).label('count'),
-        func.sum(PacketCapture.length).label('bytes')
+        model.src_ip,
+        packet_count.label('count'),
+        byte_sum.label('bytes')
     ).filter(
-        PacketCapture.user_id == user_id,
-        PacketCapture.timestamp >= start_time,
-        PacketCapture.src_ip.isnot(None)
-    ).group_by(PacketCapture.src_ip).order_by(desc('count')).limit(10).all()
+        visible_rows(model, user_id),
+        time_column >= start_time,
+        model.src_ip.isnot(None)
+    ).group_by(model.src_ip).order_by(desc('count')).limit(10).all()
     
     # Get top destination IPs
     top_dst_ips = db.session.query(
-        PacketCapture.dst_ip,
-        func.count(PacketCapture.id).label('count'),
-        func.sum(PacketCapture.length).label('bytes')
+        model.dst_ip,
+        packet_count.label('count'),
+        byte_sum.label('bytes')
     ).filter(
-        PacketCapture.user_id == user_id,
-        PacketCapture.timestamp >= start_time,
-        PacketCapture.dst_ip.isnot(None)
-    ).group_by(PacketCapture.dst_ip).order_by(desc('count')).limit(10).all()
+        visible_rows(model, user_id),
+        time_column >= start_time,
+        model.dst_ip.isnot(None)
+    ).group_by(model.dst_ip).order_by(desc('count')).limit(10).all()
     
     # Get top destination ports
     top_dst_ports = db.session.query(
-        PacketCapture.dst_port,
-        func.count(PacketCapture.id).label('count')
+        model.dst_port,
+        packet_count.label('count')
     ).filter(
-        PacketCapture.user_id == user_id,
-        PacketCapture.timestamp >= start_time,
-        PacketCapture.dst_port.isnot(None)
-    ).group_by(PacketCapture.dst_port).order_by(desc('count')).limit(10).all()
-    
-    # Common port names for reference
-    common_ports = {
-        20: 'FTP-Data', 21: 'FTP', 22: 'SSH', 23: 'Telnet',
-        25: 'SMTP', 53: 'DNS', 80: 'HTTP', 110: 'POP3',
-        143: 'IMAP', 443: 'HTTPS', 3306: 'MySQL', 5432: 'PostgreSQL',
-        3389: 'RDP', 8080: 'HTTP-Alt', 8443: 'HTTPS-Alt'
-    }
+        visible_rows(model, user_id),
+        time_column >= start_time,
+        model.dst_port.isnot(None)
+    ).group_by(model.dst_port).order_by(desc('count')).limit(10).all()
     
     return {
         'top_source_ips': [
             {
                 'ip': ip,
-                'packet_count': count,
-                'total_bytes': bytes or 0
+                'packet_count': int(round(count or 0)),
+                'total_bytes': int(round(bytes or 0))
             }
             for ip, count, bytes in top_src_ips
         ],
         'top_destination_ips': [
             {
                 'ip': ip,
-                'packet_count': count,
-                'total_bytes': bytes or 0
+                'packet_count': int(round(count or 0)),
+                'total_bytes': int(round(bytes or 0))
             }
             for ip, count, bytes in top_dst_ips
         ],
         'top_destination_ports': [
             {
                 'port': port,
-                'service': common_ports.get(port, 'Unknown'),
-                'packet_count': count
+                'service': COMMON_PORTS.get(port, 'Unknown'),
+                'packet_count': int(round(count or 0))
             }
             for port, count in top_dst_ports
-        ]
+        ],
+        'source': 'database'
     }
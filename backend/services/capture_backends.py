@@ -0,0 +1,303 @@
+"""
+Pluggable raw-frame capture backends
+
+Every backend delivers frames as on_frame(frame, timestamp, link_layer) and
+honours the same count/timeout/stop arguments:
+
+- ScapyBackend: scapy's L2 listen socket (one recv syscall per frame), works everywhere
+- AfPacketBackend: Linux AF_PACKET socket with a TPACKET_V3 memory-mapped ring;
+  the kernel fills whole blocks of frames that are walked in place (zero-copy)
+
+CAPTURE_BACKEND selects 'scapy', 'afpacket' or 'auto' (AF_PACKET on Linux,
+scapy elsewhere or when the ring cannot be set up).
+"""
+import mmap
+import select
+import socket
+import struct
+import sys
+import time
+import logging
+from scapy.all import conf
+
+# Linux <linux/if_packet.h> / <linux/if_ether.h> constants
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+PACKET_FANOUT = 18
+PACKET_FANOUT_HASH = 0
+PACKET_FANOUT_FLAG_DEFRAG = 0x8000
+TPACKET_V3 = 2
+ETH_P_ALL = 0x0003
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+ARPHRD_ETHER = 1
+ARPHRD_LOOPBACK = 772
+
+_tpacket_req3 = struct.Struct('=IIIIIII')
+_tpacket_stats_v3 = struct.Struct('=III')
+_u32 = struct.Struct('=I')
+# tpacket_hdr_v1 fields after the block descriptor's version/offset_to_priv
+_block_header = struct.Struct('=III')  # block_status, num_pkts, offset_to_first_pkt
+# tpacket3_hdr: tp_next_offset, tp_sec, tp_nsec, tp_snaplen, tp_len, tp_status, tp_mac
+_packet_header = struct.Struct('=IIIIIIH')
+
+
+class ScapyBackend:
+    """Raw frames from scapy's L2 listen socket without scapy dissection"""
+    name = 'scapy'
+
+    def __init__(self, config=None):
+        self.received = 0
+
+    def run(self, on_frame, iface=None, filter_str=None, count=0, timeout=None, stop=None, on_open=None):
+        """
+        Capture frames until count, timeout or stop() is reached
+
+        Args:
+            on_frame: called as on_frame(frame, timestamp, link_layer_class)
+            iface: Interface to listen on (None = scapy default)
+            filter_str: BPF filter
+            count: Stop after this many frames (0 = unlimited)
+            timeout: Stop after this many seconds (None = no limit)
+            stop: Optional callable; capture ends once it returns True
+            on_open: Optional callable invoked once the socket is open
+
+        Returns:
+            Number of frames read
+        """
+        sock = conf.L2listen(iface=iface, filter=filter_str)
+        if on_open:
+            on_open()
+
+        received = 0
+        deadline = time.time() + timeout if timeout else None
+        try:
+            while not (stop and stop()):
+                poll = 0.5
+                if deadline is not None:
+                    remain = deadline - time.time()
+                    if remain <= 0:
+                        break
+                    poll = min(remain, poll)
+
+                if not type(sock).select([sock], poll):
+                    continue
+                link_layer, frame, timestamp = sock.recv_raw()
+                if frame is None:
+                    continue
+
+                on_frame(frame, timestamp or time.time(), link_layer)
+                received += 1
+                self.received += 1
+                if count and received >= count:
+                    break
+        finally:
+            sock.close()
+
+        return received
+
+    def stats(self):
+        return {'backend': self.name, 'received': self.received}
+
+
+class AfPacketBackend:
+    """AF_PACKET + TPACKET_V3 memory-mapped ring capture (Linux only)"""
+    name = 'afpacket'
+
+    def __init__(self, config=None, fanout_group=None):
+        self.fanout_group = fanout_group
+        self.block_size = getattr(config, 'AFPACKET_BLOCK_SIZE', 1 << 20)
+        self.block_count = getattr(config, 'AFPACKET_BLOCK_COUNT', 64)
+        self.block_timeout_ms = getattr(config, 'AFPACKET_BLOCK_TIMEOUT_MS', 100)
+        self.frame_size = 2048
+        self.received = 0
+        self.blocks = 0
+        self.kernel_packets = 0
+        self.kernel_drops = 0
+
+    @staticmethod
+    def is_supported():
+        return sys.platform.startswith('linux') and hasattr(socket, 'AF_PACKET')
+
+    def _open(self, iface, filter_str):
+        if not self.is_supported():
+            raise OSError('AF_PACKET capture is only available on Linux')
+
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        try:
+            sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+            sock.setsockopt(SOL_PACKET, PACKET_RX_RING, _tpacket_req3.pack(
+                self.block_size,
+                self.block_count,
+                self.frame_size,
+                self.block_size * self.block_count // self.frame_size,
+                self.block_timeout_ms,
+                0,  # sizeof_priv
+                0   # feature_req_word
+            ))
+            ring = mmap.mmap(
+                sock.fileno(), self.block_size * self.block_count,
+                mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE
+            )
+            if filter_str:
+                from scapy.arch.linux import attach_filter
+                attach_filter(sock, filter_str, iface)
+            if iface:
+                sock.bind((iface, ETH_P_ALL))
+            if self.fanout_group is not None:
+                # Sockets of one fanout group share the traffic; the kernel picks
+                # the member by flow hash (fragments are reassembled first)
+                fanout_type = PACKET_FANOUT_HASH | PACKET_FANOUT_FLAG_DEFRAG
+                sock.setsockopt(SOL_PACKET, PACKET_FANOUT, _u32.pack((self.fanout_group & 0xFFFF) | (fanout_type << 16)))
+        except Exception:
+            sock.close()
+            raise
+        return sock, ring
+
+    @staticmethod
+    def _link_layer(iface):
+        """scapy class for non-Ethernet interfaces (None means Ethernet framing)"""
+        if not iface:
+            return None
+        try:
+            with open(f'/sys/class/net/{iface}/type') as f:
+                hatype = int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+        if hatype in (ARPHRD_ETHER, ARPHRD_LOOPBACK):
+            return None
+        return conf.l2types.get(hatype)
+
+    def run(self, on_frame, iface=None, filter_str=None, count=0, timeout=None, stop=None, on_open=None):
+        """Capture frames block by block; same arguments as ScapyBackend.run"""
+        sock, ring = self._open(iface, filter_str)
+        if on_open:
+            on_open()
+
+        link_layer = self._link_layer(iface)
+        poller = select.poll()
+        poller.register(sock.fileno(), select.POLLIN | select.POLLERR)
+        view = memoryview(ring)
+        block_size = self.block_size
+        block_index = 0
+        received = 0
+        deadline = time.time() + timeout if timeout else None
+        try:
+            while not (stop and stop()):
+                poll_ms = 500
+                if deadline is not None:
+                    remain = deadline - time.time()
+                    if remain <= 0:
+                        break
+                    poll_ms = max(1, min(poll_ms, int(remain * 1000)))
+
+                base = block_index * block_size
+                block_status, num_pkts, offset = _block_header.unpack_from(ring, base + 8)
+                if not block_status & TP_STATUS_USER:
+                    poller.poll(poll_ms)
+                    continue
+
+                # Walk the block in place; frames are memoryview slices of the ring
+                position = base + offset
+                for _ in range(num_pkts):
+                    next_offset, sec, nsec, snaplen, _wire_len, _status, mac = _packet_header.unpack_from(ring, position)
+                    start = position + mac
+                    on_frame(view[start:start + snaplen], sec + nsec / 1e9, link_layer)
+                    received += 1
+                    self.received += 1
+                    position += next_offset
+                    if count and received >= count:
+                        break
+
+                # Hand the block back to the kernel
+                _u32.pack_into(ring, base + 8, TP_STATUS_KERNEL)
+                self.blocks += 1
+                block_index = (block_index + 1) % self.block_count
+                if count and received >= count:
+                    break
+        finally:
+            self._read_kernel_stats(sock)
+            view.release()
+            try:
+                ring.close()
+            except BufferError:
+                # A consumer still holds a frame view; the mapping is freed with it
+                pass
+            sock.close()
+
+        return received
+
+    def _read_kernel_stats(self, sock):
+        try:
+            packets, drops, _freeze = _tpacket_stats_v3.unpack(
+                sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, _tpacket_stats_v3.size)
+            )
+            self.kernel_packets += packets
+            self.kernel_drops += drops
+        except OSError:
+            pass
+
+    def stats(self):
+        return {
+            'backend': self.name,
+            'received': self.received,
+            'blocks': self.blocks,
+            'kernel_packets': self.kernel_packets,
+            'kernel_drops': self.kernel_drops
+        }
+
+
+BACKENDS = {
+    ScapyBackend.name: ScapyBackend,
+    AfPacketBackend.name: AfPacketBackend
+}
+
+
+def get_capture_backend(config):
+    """Create the backend selected by CAPTURE_BACKEND ('scapy', 'afpacket' or 'auto')"""
+    name = (getattr(config, 'CAPTURE_BACKEND', None) or 'auto').lower()
+    if name == 'auto':
+        name = AfPacketBackend.name if AfPacketBackend.is_supported() else ScapyBackend.name
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown capture backend: {name}")
+    return BACKENDS[name](config)
+
+
+def capture_frames(on_frame, config, **kwargs):
+    """
+    Capture with the configured backend, falling back to scapy if it cannot start
+
+    Permission errors are not retried with scapy since it needs the same privileges.
+    on_backend, if given, is called with each backend before it starts capturing.
+
+    Returns:
+        tuple of (backend used, number of frames read)
+    """
+    on_backend = kwargs.pop('on_backend', None) or (lambda backend: None)
+    backend = get_capture_backend(config)
+    on_backend(backend)
+    if isinstance(backend, ScapyBackend):
+        return backend, backend.run(on_frame, **kwargs)
+
+    opened = []
+    on_open = kwargs.pop('on_open', None)
+
+    def mark_open():
+        opened.append(True)
+        if on_open:
+            on_open()
+
+    try:
+        return backend, backend.run(on_frame, on_open=mark_open, **kwargs)
+    except OSError as e:
+        # Only a backend that failed to start is replaced; permission problems
+        # are raised since scapy needs the same privileges
+        if opened or isinstance(e, PermissionError) or e.errno == 1:
+            raise
+        logging.warning(f"{backend.name} capture backend unavailable ({e}), falling back to scapy")
+
+    backend = ScapyBackend(config)
+    on_backend(backend)
+    return backend, backend.run(on_frame, on_open=on_open, **kwargs)
@@ -0,0 +1,642 @@
+"""
+Asynchronous capture jobs
+
+Capture requests become jobs (submit -> id, then poll status/progress, fetch
+results or cancel) instead of holding a request thread for the whole
+capture. A global limit bounds how many jobs capture at once (the rest
+wait in a FIFO queue) and a per-user limit bounds how many jobs one user
+can have queued or running.
+
+Running jobs share their packet source: while the background capture
+service is up every job reads from its ring buffer through one subscription;
+otherwise jobs with compatible filters attach to one shared sniffer that
+decodes each frame once and hands the packet to every attached job.
+
+Every app process (one per gunicorn worker) has its own manager, so job
+state lives in the capture_jobs table: the process that accepted a job runs
+it and writes its status, progress and packets there, and any process can
+answer status, list, result and cancel requests from it. The limits are
+checked against the table while holding the 'capture-job-slots' lease, so
+they hold for the deployment rather than per process. Multi-process pipeline
+captures run as jobs too (one slot each) and store flows instead of packets. Each manager renews a
+'capture-jobs:' lease; queued and running jobs of a process whose lease
+lapsed (it stopped without finishing them) are marked failed.
+"""
+import json
+import threading
+import time
+import uuid
+import zlib
+import logging
+from collections import deque
+from datetime import datetime
+from sqlalchemy.orm import defer
+from models import db, CaptureJobRecord
+from services.capture import save_packets, save_flows, matches_protocol, capture_filter, format_permission_instructions
+from services.capture_backends import capture_frames
+from services.decoder import decode_with_fallback
+from services.sampling import PacketSampler
+from services.leases import acquire_lease, release_lease, other_holders, process_owner
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_CANCELLED = 'cancelled'
+JOB_FAILED = 'failed'
+ACTIVE_STATES = (JOB_QUEUED, JOB_RUNNING)
+FINISHED_STATES = (JOB_COMPLETED, JOB_CANCELLED, JOB_FAILED)
+
+# Prefix of the leases held by processes running capture jobs
+JOBS_LEASE = 'capture-jobs:'
+# Held while checking limits and starting jobs, so the checks see every process's jobs
+SLOTS_LEASE = 'capture-job-slots'
+
+
+class CaptureLimitError(Exception):
+    """A concurrency or queue limit prevents accepting the job"""
+
+
+class CaptureJob:
+    """One capture request: parameters, progress and captured packets"""
+
+    def __init__(self, user_id, protocol='all', count=100, timeout=10, sampler=None):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.protocol = (protocol or 'all').lower()
+        self.filter = capture_filter(self.protocol)
+        self.count = count
+        self.timeout = timeout
+        self.sampler = sampler or PacketSampler()
+        self.status = JOB_QUEUED
+        self.source = None
+        self.error = None
+        self.permission_denied = False
+        self.packets = []
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_requested = False
+        self.stored_captured = None  # packet count last written to the capture_jobs row
+        self._done = threading.Event()
+
+    def offer(self, packet_data):
+        """
+        Consider one decoded packet; called from the shared source thread
+
+        Returns:
+            True once the job has captured `count` packets
+        """
+        if not matches_protocol(packet_data, self.protocol) or not self.sampler.accept():
+            return False
+        self.packets.append(dict(packet_data, sample_rate=packet_data.get('sample_rate', 1.0) * self.sampler.rate))
+        return len(self.packets) >= self.count
+
+    def is_due(self, now):
+        """True when the job was cancelled or its timeout has passed"""
+        return self.cancel_requested or (self.started is not None and now >= self.started + self.timeout)
+
+    def wait(self, timeout=None):
+        """Block until the job has finished"""
+        return self._done.wait(timeout)
+
+    def progress(self):
+        now = self.finished or time.time()
+        elapsed = now - self.started if self.started else 0.0
+        return {
+            'captured': len(self.packets),
+            'count': self.count,
+            'percent': round(100.0 * min(1.0, max(len(self.packets) / self.count, elapsed / self.timeout)), 1)
+            if self.status != JOB_QUEUED else 0.0,
+            'elapsed': round(elapsed, 3)
+        }
+
+    def to_dict(self, include_packets=False):
+        data = {
+            'job_id': self.id,
+            'status': self.status,
+            'protocol': self.protocol,
+            'count': self.count,
+            'timeout': self.timeout,
+            'source': self.source,
+            'error': self.error,
+            'sampling': self.sampler.stats(),
+            'progress': self.progress(),
+            'created_at': self.created,
+            'started_at': self.started,
+            'finished_at': self.finished
+        }
+        if include_packets:
+            data['packets'] = self.packets
+        return data
+
+
+class PipelineJob(CaptureJob):
+    """A multi-process pipeline capture; stores the aggregated flows instead of packets"""
+
+    def __init__(self, user_id, pipeline, protocol='all', timeout=10):
+        super().__init__(user_id, protocol, count=0, timeout=timeout)
+        self.pipeline = pipeline
+        self.result = None
+
+    def progress(self):
+        now = self.finished or time.time()
+        elapsed = now - self.started if self.started else 0.0
+        return {
+            'captured': self.result['stats']['total_packets'] if self.result else None,
+            'count': None,
+            'percent': 100.0 if self.finished else round(100.0 * min(1.0, elapsed / self.timeout), 1)
+            if self.status != JOB_QUEUED else 0.0,
+            'elapsed': round(elapsed, 3)
+        }
+
+    def to_dict(self, include_packets=False):
+        data = super().to_dict(include_packets)
+        data.update(kind='pipeline', workers=self.pipeline.workers, mode=self.pipeline.mode, count=None)
+        if self.result is not None:
+            data.update(self.result)
+        return data
+
+
+class StoredCaptureJob:
+    """A job as last written to the capture_jobs table, e.g. by another process"""
+
+    def __init__(self, record, with_packets=False):
+        self.id = record.id
+        self.user_id = record.user_id
+        self.status = record.status
+        self._state = json.loads(record.state) if record.state else {'job_id': record.id, 'status': record.status}
+        self._packets = record.packets if with_packets else None
+
+    def to_dict(self, include_packets=False):
+        data = dict(self._state)
+        if include_packets:
+            data['packets'] = json.loads(zlib.decompress(self._packets)) if self._packets else []
+        return data
+
+
+def _covers(source_filter, job_filter):
+    """True if packets captured with source_filter include everything job_filter wants"""
+    if source_filter is None or source_filter == job_filter:
+        return True
+    return source_filter == 'ip' and job_filter in ('tcp', 'udp', 'icmp')
+
+
+class SharedCapture:
+    """One packet source feeding every attached job"""
+
+    def __init__(self, manager, filter_str=None, service=None):
+        self.manager = manager
+        self.filter = filter_str
+        self.service = service
+        self.name = 'capture_service' if service is not None else 'sniffer'
+        self.jobs = []
+        self.stopping = False
+        self.packets = 0
+        self.thread = None
+
+    def covers(self, job):
+        return not self.stopping and (self.service is not None or _covers(self.filter, job.filter))
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            if self.service is not None:
+                self._read_ring()
+            else:
+                config = self.manager.config
+                capture_frames(
+                    self._on_frame,
+                    config,
+                    iface=getattr(config, 'CAPTURE_INTERFACE', None) or None,
+                    filter_str=self.filter,
+                    stop=self._poll
+                )
+        except Exception as e:
+            permission_denied = isinstance(e, PermissionError) or getattr(e, 'errno', None) == 1
+            logging.error(f"Shared capture error: {e}")
+            self.manager._source_failed(self, format_permission_instructions() if permission_denied else str(e),
+                                        permission_denied)
+        finally:
+            self.manager._source_stopped(self)
+
+    def _read_ring(self):
+        subscription = self.service.subscribe()
+        try:
+            while not self._poll():
+                for _, packet_data in subscription.get(timeout=0.5, max_items=1000):
+                    self._dispatch(packet_data)
+        finally:
+            subscription.close()
+
+    def _on_frame(self, frame, timestamp, link_layer):
+        try:
+            packet_data = decode_with_fallback(frame, timestamp, link_layer)
+        except Exception as e:
+            logging.debug(f"Error parsing packet: {e}")
+            return
+        if packet_data is not None:
+            self._dispatch(packet_data)
+
+    def _dispatch(self, packet_data):
+        # Decoded once, offered to every job attached to this source
+        self.packets += 1
+        for job in list(self.jobs):
+            if job.offer(packet_data):
+                self.manager._finish(job, JOB_COMPLETED)
+
+    def _poll(self):
+        """Finish due jobs; returns True (stop capturing) once no job is attached"""
+        now = time.time()
+        for job in list(self.jobs):
+            if job.is_due(now):
+                self.manager._finish(job, JOB_CANCELLED if job.cancel_requested else JOB_COMPLETED)
+        return self.manager._release_if_idle(self)
+
+
+class CaptureJobManager:
+    """Queues capture jobs, enforces concurrency limits and shares packet sources"""
+
+    def __init__(self, app, config):
+        self.app = app
+        self.config = config
+        self.max_concurrent = getattr(config, 'CAPTURE_JOBS_MAX_CONCURRENT', 4)
+        self.max_per_user = getattr(config, 'CAPTURE_JOBS_MAX_PER_USER', 2)
+        self.max_queued = getattr(config, 'CAPTURE_JOBS_MAX_QUEUED', 20)
+        self.retained = getattr(config, 'CAPTURE_JOBS_RETAINED', 50)
+        self.max_count = getattr(config, 'MAX_PACKETS', 1000)
+        self.max_timeout = getattr(config, 'CAPTURE_TIMEOUT', 60)
+        self.owner = process_owner()
+        self.lease_seconds = 30
+        self.sync_interval = 0.5  # how often cancellations, progress and free slots are picked up
+        self._lease_renew_at = 0.0
+        self._jobs = {}  # unfinished jobs of this process
+        self._queue = deque()
+        self._sources = []
+        self._lock = threading.RLock()
+        self.sources_started = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """Take this process's jobs lease and start the sync thread"""
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._sync_loop, daemon=True)
+            self.thread.start()
+            print("Capture job manager started")
+
+    def submit(self, user_id, protocol='all', count=100, timeout=10, sampler=None):
+        """
+        Queue a capture job and start it as soon as a slot is free
+
+        Raises:
+            ValueError: for invalid count/timeout
+            CaptureLimitError: if the user or the queue is at its limit
+        """
+        count, timeout = int(count), float(timeout)
+        if not 1 <= count <= self.max_count:
+            raise ValueError(f"count must be between 1 and {self.max_count}")
+        if not 0 < timeout <= self.max_timeout:
+            raise ValueError(f"timeout must be between 0 and {self.max_timeout} seconds")
+        return self._admit(CaptureJob(user_id, protocol, count, timeout, sampler))
+
+    def submit_pipeline(self, user_id, pipeline, protocol='all', timeout=10):
+        """
+        Queue a multi-process pipeline capture (a ParallelCapture) under the same limits
+
+        Raises:
+            ValueError: for an invalid timeout
+            CaptureLimitError: if the user or the queue is at its limit
+        """
+        timeout = float(timeout)
+        if not 0 < timeout <= self.max_timeout:
+            raise ValueError(f"timeout must be between 0 and {self.max_timeout} seconds")
+        return self._admit(PipelineJob(user_id, pipeline, protocol, timeout))
+
+    def _admit(self, job):
+        """Check the limits, record the job and queue it"""
+        user_id = job.user_id
+        with self._lock, self.app.app_context():
+            self._renew_lease()
+            if not self._take_slots():
+                raise CaptureLimitError("Capture jobs are busy, try again later")
+            try:
+                active = self._active_jobs()
+                if active.filter(CaptureJobRecord.user_id == user_id).count() >= self.max_per_user:
+                    raise CaptureLimitError(f"At most {self.max_per_user} concurrent captures per user")
+                if (active.filter(CaptureJobRecord.status == JOB_RUNNING).count() >= self.max_concurrent
+                        and active.filter(CaptureJobRecord.status == JOB_QUEUED).count() >= self.max_queued):
+                    raise CaptureLimitError("Too many capture jobs are queued, try again later")
+                self._store(job)
+                db.session.commit()
+            finally:
+                release_lease(SLOTS_LEASE, self.owner)
+            self._jobs[job.id] = job
+            self._queue.append(job)
+            self._schedule()
+        return job
+
+    def get(self, job_id, user_id):
+        """Return a user's job, or None; jobs of other processes are read from the capture_jobs table"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            with self.app.app_context():
+                record = db.session.get(CaptureJobRecord, job_id)
+                job = StoredCaptureJob(record, with_packets=True) if record is not None else None
+        return job if job is not None and job.user_id == user_id else None
+
+    def list(self, user_id):
+        """A user's jobs in every process, newest first"""
+        with self.app.app_context():
+            records = CaptureJobRecord.query.options(defer(CaptureJobRecord.packets)).filter_by(
+                user_id=user_id).order_by(CaptureJobRecord.created_at.desc()).all()
+            stored = [StoredCaptureJob(record) for record in records]
+        with self._lock:
+            return [self._jobs.get(job.id, job) for job in stored]
+
+    def cancel(self, job_id, user_id):
+        """
+        Cancel a queued or running job; running jobs keep what they captured so far
+
+        Jobs of other processes are flagged in the capture_jobs table and
+        cancelled by their process on its next sync.
+        """
+        job = self.get(job_id, user_id)
+        if job is None:
+            return None
+        if isinstance(job, StoredCaptureJob):
+            if job.status in ACTIVE_STATES:
+                with self.app.app_context():
+                    CaptureJobRecord.query.filter_by(id=job.id).update({'cancel_requested': True})
+                    db.session.commit()
+            return job
+        self._cancel_local(job)
+        return job
+
+    def stop(self, timeout=2.0):
+        """Cancel every queued and running job, waiting briefly for running jobs to store their packets"""
+        self.running = False
+        with self._lock:
+            running = [job for job in self._jobs.values() if job.status == JOB_RUNNING]
+            queued = list(self._queue)
+        for job in running + queued:
+            self._cancel_local(job)
+        deadline = time.time() + timeout
+        for job in running:
+            job.wait(max(0.0, deadline - time.time()))
+        if self.thread:
+            self.thread.join(timeout=self.sync_interval + 1)
+            self.thread = None
+            print("Capture job manager stopped")
+
+    def stats(self):
+        with self._lock, self.app.app_context():
+            active = self._active_jobs()
+            return {
+                'running': active.filter(CaptureJobRecord.status == JOB_RUNNING).count(),
+                'queued': active.filter(CaptureJobRecord.status == JOB_QUEUED).count(),
+                'max_concurrent': self.max_concurrent,
+                'max_per_user': self.max_per_user,
+                'sources': [
+                    {'source': s.name, 'filter': s.filter, 'jobs': len(s.jobs), 'packets': s.packets}
+                    for s in self._sources
+                ],
+                'sources_started': self.sources_started
+            }
+
+    def _cancel_local(self, job):
+        with self._lock:
+            if job.status == JOB_QUEUED:
+                self._queue.remove(job)
+                job.status = JOB_CANCELLED
+                job.finished = time.time()
+            elif job.status == JOB_RUNNING:
+                # The source finishes it on its next poll (within half a second)
+                job.cancel_requested = True
+                return
+            else:
+                return
+        self._finished(job)
+
+    def _schedule(self):
+        """Start queued jobs while slots are free in the whole deployment (caller holds the lock)"""
+        if not self._queue:
+            return
+        with self.app.app_context():
+            # A busy slots lease leaves the queue to the next sync
+            if self._take_slots():
+                try:
+                    self._start_queued(self._active_jobs().filter(CaptureJobRecord.status == JOB_RUNNING).count())
+                    db.session.commit()
+                finally:
+                    release_lease(SLOTS_LEASE, self.owner)
+
+    def _start_queued(self, running):
+        from services.background_tasks import get_capture_service
+        while self._queue and running < self.max_concurrent:
+            job = self._queue.popleft()
+            if isinstance(job, PipelineJob):
+                # The pipeline's workers open their own capture
+                job.status = JOB_RUNNING
+                job.source = 'pipeline'
+                job.started = time.time()
+                self._store(job)
+                running += 1
+                threading.Thread(target=self._run_pipeline, args=(job,), daemon=True).start()
+                continue
+
+            service = get_capture_service()
+            if service is not None and not service.is_available():
+                service = None
+
+            source = next((s for s in self._sources if s.covers(job) and (s.service is not None) == (service is not None)), None)
+            started = source is None
+            if started:
+                source = SharedCapture(self, None if service is not None else job.filter, service)
+                self._sources.append(source)
+                self.sources_started += 1
+
+            job.status = JOB_RUNNING
+            job.source = source.name
+            job.started = time.time()
+            source.jobs.append(job)
+            self._store(job)
+            running += 1
+            if started:
+                source.start()
+
+    def _run_pipeline(self, job):
+        """Run a pipeline job's capture and store its flows (job thread)"""
+        config = self.config
+        try:
+            result = job.pipeline.run(
+                iface=getattr(config, 'CAPTURE_INTERFACE', None) or None,
+                filter_str=job.filter,
+                timeout=job.timeout,
+                stop=lambda: job.cancel_requested
+            )
+            with self.app.app_context():
+                save_flows(result.rows())
+                db.session.commit()
+            job.result = {'stats': result.summary(), 'pipeline': result.stats()}
+        except Exception as e:
+            permission_denied = isinstance(e, PermissionError) or getattr(e, 'errno', None) == 1
+            logging.error(f"Pipeline capture error: {e}")
+            self._finish(job, JOB_FAILED, str(e), permission_denied)
+        else:
+            self._finish(job, JOB_CANCELLED if job.cancel_requested else JOB_COMPLETED)
+
+    def _finish(self, job, status, error=None, permission_denied=False):
+        """Detach a running job, store its packets and free its slot"""
+        with self._lock:
+            if job.status != JOB_RUNNING:
+                return
+            for source in self._sources:
+                if job in source.jobs:
+                    source.jobs.remove(job)
+            job.status = status
+            job.error = error
+            job.permission_denied = permission_denied
+            job.finished = time.time()
+
+        if job.packets and status != JOB_FAILED:
+            try:
+                with self.app.app_context():
+                    save_packets(job.packets, job.user_id)
+                    db.session.commit()
+            except Exception as e:
+                logging.error(f"Error storing packets of capture job {job.id}: {e}")
+        self._finished(job)
+
+        with self._lock:
+            self._schedule()
+
+    def _finished(self, job):
+        """Write a finished job with its packets and forget it locally"""
+        try:
+            with self.app.app_context():
+                self._store(job, with_packets=True)
+                db.session.commit()
+        except Exception as e:
+            logging.error(f"Error storing capture job {job.id}: {e}")
+        else:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+        job._done.set()
+
+    def _release_if_idle(self, source):
+        """Mark a source without jobs as stopping; returns True if it should stop"""
+        with self._lock:
+            if not source.jobs:
+                source.stopping = True
+            return source.stopping
+
+    def _source_failed(self, source, error, permission_denied):
+        for job in list(source.jobs):
+            self._finish(job, JOB_FAILED, error, permission_denied)
+
+    def _source_stopped(self, source):
+        with self._lock:
+            source.stopping = True
+            if source in self._sources:
+                self._sources.remove(source)
+            orphans = list(source.jobs)
+        # Jobs that attached while the source was shutting down are finished too
+        for job in orphans:
+            self._finish(job, JOB_FAILED, "Capture source stopped unexpectedly")
+
+    def _store(self, job, with_packets=False):
+        """Write a job of this process to its capture_jobs row (the caller commits)"""
+        record = db.session.get(CaptureJobRecord, job.id)
+        if record is None:
+            record = CaptureJobRecord(id=job.id, user_id=job.user_id, owner=self.owner)
+            db.session.add(record)
+        record.status = job.status
+        record.state = json.dumps(job.to_dict())
+        if job.status in FINISHED_STATES:
+            record.finished_at = datetime.utcnow()
+        if with_packets:
+            record.packets = zlib.compress(json.dumps(job.packets).encode())
+        job.stored_captured = len(job.packets)
+
+    def _take_slots(self, wait=2.0):
+        """Take the slots lease, waiting briefly while another process checks its limits"""
+        deadline = time.time() + wait
+        while not acquire_lease(SLOTS_LEASE, self.owner, 5):
+            if time.time() >= deadline:
+                return False
+            time.sleep(0.02)
+        return True
+
+    def _active_jobs(self):
+        """Query for the queued and running jobs of processes that hold their jobs lease"""
+        owners = other_holders(JOBS_LEASE, self.owner, datetime.utcnow()) + [self.owner]
+        return CaptureJobRecord.query.filter(
+            CaptureJobRecord.status.in_(ACTIVE_STATES), CaptureJobRecord.owner.in_(owners)
+        )
+
+    def _renew_lease(self):
+        now = time.time()
+        if now >= self._lease_renew_at:
+            acquire_lease(JOBS_LEASE + self.owner, self.owner, self.lease_seconds)
+            self._lease_renew_at = now + self.lease_seconds / 3
+            return True
+        return False
+
+    def _sync_loop(self):
+        while self.running:
+            try:
+                with self.app.app_context():
+                    self._sync()
+            except Exception as e:
+                logging.error(f"Capture job sync error: {e}")
+            time.sleep(self.sync_interval)
+
+    def _sync(self):
+        """Apply cancellations from other processes, write progress and start queued jobs"""
+        if self._renew_lease():
+            self._expire_jobs()
+
+        with self._lock:
+            jobs = list(self._jobs.values())
+        if jobs:
+            cancelled = {row.id for row in db.session.query(CaptureJobRecord.id).filter(
+                CaptureJobRecord.id.in_([job.id for job in jobs]), CaptureJobRecord.cancel_requested.is_(True)
+            )}
+            for job in jobs:
+                if job.id in cancelled:
+                    self._cancel_local(job)
+            # Committed under the lock, so a job finishing meanwhile is not written back as running
+            with self._lock:
+                for job in jobs:
+                    if job.status == JOB_RUNNING and job.stored_captured != len(job.packets):
+                        self._store(job)
+                db.session.commit()
+
+        with self._lock:
+            self._schedule()
+
+    def _expire_jobs(self):
+        """Fail jobs of processes whose lease lapsed and delete finished jobs beyond the retention limit"""
+        owners = other_holders(JOBS_LEASE, self.owner, datetime.utcnow()) + [self.owner]
+        orphans = CaptureJobRecord.query.filter(
+            CaptureJobRecord.status.in_(ACTIVE_STATES), CaptureJobRecord.owner.notin_(owners)
+        )
+        for record in orphans:
+            state = json.loads(record.state) if record.state else {'job_id': record.id}
+            state.update(status=JOB_FAILED, error="The process running the capture job stopped",
+                         finished_at=time.time())
+            record.status = JOB_FAILED
+            record.state = json.dumps(state)
+            record.finished_at = datetime.utcnow()
+
+        expired = [row.id for row in db.session.query(CaptureJobRecord.id).filter(
+            CaptureJobRecord.status.in_(FINISHED_STATES)
+        ).order_by(CaptureJobRecord.finished_at.desc()).offset(self.retained)]
+        if expired:
+            CaptureJobRecord.query.filter(CaptureJobRecord.id.in_(expired)).delete(synchronize_session=False)
+        db.session.commit()
@@ -0,0 +1,406 @@
+"""
+Multi-process capture pipeline
+
+Decoding and flow aggregation are spread over N worker processes so capture
+throughput scales with cores instead of being bound to one interpreter's GIL.
+Frames are partitioned by flow hash, so a flow is normally handled by a
+single worker and the workers' flow tables barely overlap:
+
+- 'fanout': every worker opens its own AF_PACKET ring joined to one
+  PACKET_FANOUT group and the kernel hashes frames to workers (Linux only)
+- 'reader': the parent reads frames with the configured backend, hashes
+  them itself and ships them to the workers in batches
+
+When the capture ends each worker returns its flow rows and counters, which
+the parent merges into one PipelineResult. Flows that still reached several
+workers (e.g. locally generated traffic, which the kernel hashes by socket)
+are summed during the merge.
+"""
+import multiprocessing
+import os
+import queue
+import struct
+import time
+import zlib
+from datetime import datetime
+from itertools import count as counter
+from types import SimpleNamespace
+from scapy.layers.l2 import Ether
+from services.capture_backends import AfPacketBackend, capture_frames
+from services.decoder import decode_frame, decode_with_fallback, UNSUPPORTED, VLAN_ETHERTYPES, ETH_P_IP, ETH_P_IPV6
+from services.flows import FlowTable, FLOW_COLUMNS
+
+PIPELINE_MODES = ('auto', 'fanout', 'reader')
+
+# Workers are spawned rather than forked: the Flask process runs background
+# threads and forking it could copy locks held by them
+_mp = multiprocessing.get_context('spawn')
+_fanout_groups = counter()
+_ethertype = struct.Struct('!H')
+
+# Config values handed to the workers (the Config class itself is not sent)
+_WORKER_SETTINGS = (
+    'AFPACKET_BLOCK_SIZE', 'AFPACKET_BLOCK_COUNT', 'AFPACKET_BLOCK_TIMEOUT_MS', 'FLOW_TABLE_MAX_FLOWS'
+)
+
+
+def flow_hash(frame):
+    """
+    Direction-independent hash of a frame's addresses, protocol and ports
+
+    Returns:
+        int hash; 0 for frames that are not IPv4/IPv6
+    """
+    view = memoryview(frame)
+    length = len(view)
+    if length < 14:
+        return 0
+    offset = 12
+    ethertype = _ethertype.unpack_from(view, offset)[0]
+    offset += 2
+    while ethertype in VLAN_ETHERTYPES and length >= offset + 4:
+        ethertype = _ethertype.unpack_from(view, offset + 2)[0]
+        offset += 4
+
+    if ethertype == ETH_P_IP and length >= offset + 20:
+        proto = view[offset + 9]
+        a = bytes(view[offset + 12:offset + 16])
+        b = bytes(view[offset + 16:offset + 20])
+        transport = offset + (view[offset] & 0x0F) * 4
+    elif ethertype == ETH_P_IPV6 and length >= offset + 40:
+        proto = view[offset + 6]
+        a = bytes(view[offset + 8:offset + 24])
+        b = bytes(view[offset + 24:offset + 40])
+        transport = offset + 40
+    else:
+        return 0
+
+    if proto in (6, 17) and length >= transport + 4:
+        a += bytes(view[transport:transport + 2])
+        b += bytes(view[transport + 2:transport + 4])
+    return zlib.crc32(a + b if a <= b else b + a, proto)
+
+
+class _PipelineWorker:
+    """Decodes frames and aggregates them into a private flow table"""
+
+    def __init__(self, user_id, max_flows):
+        # Flows only leave the table at the end of the capture (or when it is full)
+        self.table = FlowTable(active_timeout=1 << 30, idle_timeout=1 << 30, max_flows=max_flows)
+        self.user_id = user_id
+        self.frames = 0
+        self.non_ip = 0
+        self.fallback = 0
+
+    def on_frame(self, frame, timestamp, link_layer=None):
+        self.frames += 1
+        decoded = decode_frame(frame, timestamp) if link_layer is None or link_layer is Ether else UNSUPPORTED
+        if decoded is None:
+            self.non_ip += 1
+        elif decoded is UNSUPPORTED:
+            self.fallback += 1
+            packet_data = decode_with_fallback(frame, timestamp, link_layer)
+            if packet_data is None:
+                self.non_ip += 1
+            else:
+                self.table.add_packet(packet_data, self.user_id)
+        else:
+            self.table.update(
+                self.user_id, decoded.protocol, decoded.src_ip, decoded.dst_ip,
+                decoded.src_port, decoded.dst_port, decoded.length,
+                datetime.utcfromtimestamp(timestamp), decoded.tcp_flags
+            )
+
+    def result(self, index):
+        return {
+            'worker': index,
+            'pid': os.getpid(),
+            'frames': self.frames,
+            'packets': self.table.packets_seen,
+            'non_ip': self.non_ip,
+            'fallback_decodes': self.fallback,
+            'rows': self.table.flush_all()
+        }
+
+
+def _worker_main(index, mode, settings, frames, results, stop_event):
+    """Worker process entry point; reports ('open'|'result'|'error', index, payload)"""
+    worker = _PipelineWorker(settings['user_id'], settings['FLOW_TABLE_MAX_FLOWS'])
+    try:
+        if mode == 'fanout':
+            backend = AfPacketBackend(SimpleNamespace(**settings), fanout_group=settings['fanout_group'])
+            backend.run(
+                worker.on_frame,
+                iface=settings['iface'],
+                filter_str=settings['filter_str'],
+                stop=stop_event.is_set,
+                on_open=lambda: results.put(('open', index, None))
+            )
+        else:
+            results.put(('open', index, None))
+            while True:
+                batch = frames.get()
+                if batch is None:
+                    break
+                for frame, timestamp, link_layer in batch:
+                    worker.on_frame(frame, timestamp, link_layer)
+        results.put(('result', index, worker.result(index)))
+    except Exception as e:
+        results.put(('error', index, (type(e).__name__, getattr(e, 'errno', None), str(e))))
+
+
+class PipelineResult:
+    """Merged flow rows and counters of all workers"""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.flows = {}
+        self.workers = []
+        self.frames = 0
+        self.packets = 0
+        self.non_ip = 0
+        self.elapsed = 0.0
+
+    def merge(self, partial):
+        """Fold one worker's partial result in; a flow seen by several workers is summed"""
+        rows = partial.pop('rows')
+        self.workers.append(dict(partial, flows=len(rows)))
+        self.frames += partial['frames']
+        self.packets += partial['packets']
+        self.non_ip += partial['non_ip']
+        for row in rows:
+            key = row[0:5] + row[8:9] + row[11:12]
+            existing = self.flows.get(key)
+            if existing is None:
+                self.flows[key] = list(row)
+            else:
+                existing[5] += row[5]
+                existing[6] += row[6]
+                existing[7] |= row[7]
+                existing[9] = min(existing[9], row[9])
+                existing[10] = max(existing[10], row[10])
+
+    def rows(self):
+        """Flow rows in FLOW_COLUMNS order"""
+        return [tuple(row) for row in self.flows.values()]
+
+    def summary(self, top=10):
+        """Protocol breakdown and top talkers in the /analysis/stats format"""
+        from services.capture import COMMON_PORTS
+        protocols, src_ips, dst_ips, dst_ports = {}, {}, {}, {}
+        for row in self.flows.values():
+            flow = dict(zip(FLOW_COLUMNS, row))
+            packets, size = flow['packets'], flow['bytes']
+            for totals, key in ((protocols, flow['protocol']), (src_ips, flow['src_ip']), (dst_ips, flow['dst_ip'])):
+                entry = totals.setdefault(key, [0, 0])
+                entry[0] += packets
+                entry[1] += size
+            if flow['dst_port'] is not None:
+                dst_ports[flow['dst_port']] = dst_ports.get(flow['dst_port'], 0) + packets
+
+        def ranked(totals):
+            return sorted(totals.items(), key=lambda item: item[1][0], reverse=True)[:top]
+
+        return {
+            'protocols': [
+                {'protocol': proto, 'count': count, 'bytes': size}
+                for proto, (count, size) in sorted(protocols.items())
+            ],
+            'total_packets': sum(count for count, _ in protocols.values()),
+            'total_bytes': sum(size for _, size in protocols.values()),
+            'top_source_ips': [
+                {'ip': ip, 'packet_count': count, 'total_bytes': size} for ip, (count, size) in ranked(src_ips)
+            ],
+            'top_destination_ips': [
+                {'ip': ip, 'packet_count': count, 'total_bytes': size} for ip, (count, size) in ranked(dst_ips)
+            ],
+            'top_destination_ports': [
+                {'port': port, 'service': COMMON_PORTS.get(port, 'Unknown'), 'packet_count': count}
+                for port, count in sorted(dst_ports.items(), key=lambda item: item[1], reverse=True)[:top]
+            ]
+        }
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'workers': self.workers,
+            'frames': self.frames,
+            'packets': self.packets,
+            'non_ip': self.non_ip,
+            'flows': len(self.flows),
+            'elapsed': round(self.elapsed, 3),
+            'frames_per_second': round(self.frames / self.elapsed) if self.elapsed else 0
+        }
+
+
+class ParallelCapture:
+    """Runs one capture across N decoding/aggregating worker processes"""
+
+    def __init__(self, config, workers=None, mode=None, user_id=None):
+        # Requested worker counts are capped at the configured number
+        limit = getattr(config, 'CAPTURE_PIPELINE_WORKERS', None) or os.cpu_count() or 1
+        workers = min(int(workers or limit), limit)
+        if workers < 1:
+            raise ValueError("The pipeline needs at least one worker")
+        mode = (mode or getattr(config, 'CAPTURE_PIPELINE_MODE', None) or 'auto').lower()
+        if mode not in PIPELINE_MODES:
+            raise ValueError(f"Unknown pipeline mode: {mode}")
+
+        self.config = config
+        self.workers = int(workers)
+        self.mode = mode
+        self.user_id = user_id
+        self.batch_size = getattr(config, 'CAPTURE_PIPELINE_BATCH_SIZE', 256)
+        self.start_timeout = 60  # seconds for spawned workers to come up
+        self._processes = []
+        self._queues = []
+        self._batches = []
+        self._results = None
+        self._stop = None
+        self._started = None
+        self.active_mode = None
+        self.dispatched = 0
+
+    def start(self, mode='reader', iface=None, filter_str=None):
+        """Spawn the workers and wait until all of them are ready"""
+        settings = {name: getattr(self.config, name) for name in _WORKER_SETTINGS if hasattr(self.config, name)}
+        settings.setdefault('FLOW_TABLE_MAX_FLOWS', 100000)
+        settings.update(
+            user_id=self.user_id,
+            iface=iface,
+            filter_str=filter_str,
+            fanout_group=(os.getpid() + next(_fanout_groups)) & 0xFFFF
+        )
+        self.active_mode = mode
+        self._results = _mp.Queue()
+        self._stop = _mp.Event()
+        for index in range(self.workers):
+            frames = _mp.Queue(maxsize=64) if mode == 'reader' else None
+            process = _mp.Process(
+                target=_worker_main,
+                args=(index, mode, settings, frames, self._results, self._stop),
+                name=f'capture-worker-{index}',
+                daemon=True
+            )
+            process.start()
+            self._processes.append(process)
+            self._queues.append(frames)
+            self._batches.append([])
+
+        ready = 0
+        deadline = time.time() + self.start_timeout
+        while ready < self.workers:
+            kind, index, payload = self._next_message(deadline)
+            if kind == 'error':
+                self._abort()
+                self._raise(payload)
+            ready += 1
+        self._started = time.time()
+
+    def dispatch(self, frame, timestamp, link_layer=None):
+        """Queue one frame for the worker that owns its flow (reader mode)"""
+        index = flow_hash(frame) % self.workers
+        batch = self._batches[index]
+        batch.append((bytes(frame), timestamp, None if link_layer is Ether else link_layer))
+        self.dispatched += 1
+        if len(batch) >= self.batch_size:
+            # Blocks when the worker falls behind, pushing back on the reader
+            self._queues[index].put(batch)
+            self._batches[index] = []
+
+    def finish(self):
+        """Stop the workers, collect their partial results and merge them"""
+        result = PipelineResult(self.active_mode)
+        if self.active_mode == 'reader':
+            for frames, batch in zip(self._queues, self._batches):
+                if batch:
+                    frames.put(batch)
+                frames.put(None)
+        self._stop.set()
+
+        error = None
+        deadline = time.time() + self.start_timeout
+        for _ in range(self.workers):
+            kind, index, payload = self._next_message(deadline)
+            if kind == 'result':
+                result.merge(payload)
+            elif kind == 'error' and error is None:
+                error = payload
+        for process in self._processes:
+            process.join(timeout=5)
+        result.elapsed = time.time() - self._started
+        self._reset()
+        if error:
+            self._raise(error)
+        return result
+
+    def run(self, iface=None, filter_str=None, timeout=10, stop=None):
+        """
+        Capture for timeout seconds (or until stop() returns True) across all workers
+
+        Returns:
+            PipelineResult
+
+        Raises:
+            PermissionError: If the process doesn't have sufficient permissions
+            OSError: If the capture could not be started
+        """
+        mode = self.mode
+        if mode == 'auto':
+            backend = (getattr(self.config, 'CAPTURE_BACKEND', None) or 'auto').lower()
+            mode = 'fanout' if AfPacketBackend.is_supported() and backend != 'scapy' else 'reader'
+
+        if mode == 'fanout':
+            try:
+                self.start('fanout', iface, filter_str)
+            except PermissionError:
+                raise
+            except OSError:
+                if self.mode != 'auto':
+                    raise
+                mode = 'reader'
+            else:
+                deadline = time.time() + timeout
+                while (time.time() < deadline and all(p.is_alive() for p in self._processes)
+                       and not (stop and stop())):
+                    time.sleep(0.1)
+                return self.finish()
+
+        self.start('reader', iface, filter_str)
+        try:
+            capture_frames(self.dispatch, self.config, iface=iface, filter_str=filter_str, timeout=timeout, stop=stop)
+        except Exception:
+            self._abort()
+            raise
+        return self.finish()
+
+    def _next_message(self, deadline):
+        while True:
+            try:
+                return self._results.get(timeout=0.5)
+            except queue.Empty:
+                if time.time() > deadline or not any(p.is_alive() for p in self._processes):
+                    self._abort()
+                    raise RuntimeError("Capture workers stopped without reporting a result")
+
+    @staticmethod
+    def _raise(payload):
+        name, errno, message = payload
+        if name == 'PermissionError' or errno == 1:
+            raise PermissionError(message)
+        if errno is not None or name == 'OSError':
+            raise OSError(errno, message)
+        raise RuntimeError(message)
+
+    def _abort(self):
+        if self._stop is not None:
+            self._stop.set()
+        for process in self._processes:
+            process.terminate()
+            process.join(timeout=5)
+        self._reset()
+
+    def _reset(self):
+        self._processes = []
+        self._queues = []
+        self._batches = []
@@ -0,0 +1,303 @@
+"""
+Continuous packet capture service
+
+A single long-lived sniffer runs on a background thread and pushes parsed
+packets into a bounded ring buffer. HTTP requests only read from the ring
+(or subscribe to new packets) so no request thread ever blocks in sniff.
+"""
+import threading
+import time
+import logging
+from collections import deque
+from itertools import islice
+from services.capture import matches_protocol
+from services.capture_backends import capture_frames
+from services.decoder import decode_with_fallback
+from services.sampling import PacketSampler
+
+
+class Subscription:
+    """Bounded per-consumer queue of new packets"""
+
+    def __init__(self, ring, maxsize, protocol='all', packet_filter=None):
+        self.ring = ring
+        self.protocol = protocol
+        self.packet_filter = packet_filter
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._queue = deque(maxlen=maxsize)
+        self._cond = threading.Condition()
+
+    def _push(self, seq, packet_data):
+        if not matches_protocol(packet_data, self.protocol):
+            return
+        if self.packet_filter is not None and not self.packet_filter(packet_data):
+            return
+        with self._cond:
+            if len(self._queue) == self._queue.maxlen:
+                # Slow consumer: the oldest queued packet is overwritten
+                self.dropped += 1
+            self._queue.append((seq, packet_data))
+            self._cond.notify()
+
+    def get(self, timeout=None, max_items=100):
+        """Wait for new packets and return up to max_items (seq, packet) pairs"""
+        with self._cond:
+            if not self._queue:
+                self._cond.wait(timeout)
+            items = []
+            while self._queue and len(items) < max_items:
+                items.append(self._queue.popleft())
+            return items
+
+    def close(self):
+        """Stop receiving packets"""
+        self.ring.unsubscribe(self)
+
+
+class PacketRing:
+    """Fixed-capacity ring buffer of parsed packets with drop counters"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.received = 0
+        self.dropped = 0
+        self._buffer = deque(maxlen=capacity)
+        self._next_seq = 1
+        self._lock = threading.Lock()
+        self._subscribers = []
+
+    def append(self, packet_data):
+        """Add a packet, evicting (and counting) the oldest one when full"""
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            if len(self._buffer) == self.capacity:
+                self.dropped += 1
+            self._buffer.append((seq, packet_data))
+            self.received += 1
+            subscribers = list(self._subscribers)
+
+        for subscriber in subscribers:
+            subscriber._push(seq, packet_data)
+
+        return seq
+
+    def read(self, since=0, protocol='all', limit=100):
+        """
+        Return the newest packets after sequence number `since`
+
+        Returns:
+            tuple of (list of packet dicts, cursor to pass as `since` next time)
+        """
+        with self._lock:
+            entries = list(self._buffer)
+            cursor = self._next_seq - 1
+
+        packets = [
+            packet_data for seq, packet_data in entries
+            if seq > since and matches_protocol(packet_data, protocol)
+        ]
+        return packets[-limit:] if limit else packets, cursor
+
+    def entries(self, since=0):
+        """
+        Buffered (seq, packet) pairs after sequence number `since`, oldest first
+
+        Returns:
+            tuple of (list of pairs, last sequence number appended)
+        """
+        with self._lock:
+            last = self._next_seq - 1
+            # Sequence numbers in the buffer are consecutive
+            first = self._buffer[0][0] if self._buffer else last + 1
+            entries = list(islice(self._buffer, max(0, since + 1 - first), None))
+        return entries, last
+
+    def subscribe(self, maxsize, protocol='all', packet_filter=None):
+        """
+        Register a consumer that receives every packet appended from now on
+
+        packet_filter is an optional callable; packets it rejects are never queued.
+        """
+        subscription = Subscription(self, maxsize, protocol, packet_filter)
+        with self._lock:
+            self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'capacity': self.capacity,
+                'buffered': len(self._buffer),
+                'received': self.received,
+                'dropped': self.dropped,
+                'subscribers': len(self._subscribers),
+                'subscriber_drops': sum(s.dropped for s in self._subscribers),
+                'last_seq': self._next_seq - 1
+            }
+
+
+class CaptureService:
+    """Long-lived sniffer feeding a PacketRing"""
+
+    def __init__(self, config):
+        self.config = config
+        self.interface = getattr(config, 'CAPTURE_INTERFACE', None) or None
+        self.filter = getattr(config, 'CAPTURE_DAEMON_FILTER', None) or None
+        self.retry_interval = getattr(config, 'CAPTURE_RETRY_INTERVAL', 30)
+        self.subscriber_queue_size = getattr(config, 'CAPTURE_SUBSCRIBER_QUEUE_SIZE', 1000)
+        self.ring = PacketRing(getattr(config, 'CAPTURE_RING_SIZE', 10000))
+        self.sampler = PacketSampler(
+            every=getattr(config, 'CAPTURE_DAEMON_SAMPLE_EVERY', 1),
+            probability=getattr(config, 'CAPTURE_DAEMON_SAMPLE_PROBABILITY', None)
+        )
+        self.running = False
+        self.capturing = False
+        self.last_error = None
+        self.parse_errors = 0
+        self.thread = None
+        self.backend = None
+        self._user_cursors = {}  # user id -> last sequence number returned to the user
+        self._cursor_lock = threading.Lock()
+
+    def start(self):
+        """Start the capture thread"""
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._capture_loop, daemon=True)
+            self.thread.start()
+            print("Capture service started")
+
+    def stop(self):
+        """Stop the capture thread"""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=5)
+            print("Capture service stopped")
+
+    def is_available(self):
+        """True while the sniffer is actually delivering packets"""
+        return self.running and self.capturing
+
+    def _capture_loop(self):
+        """Read raw frames until stopped, restarting the socket after errors"""
+        while self.running:
+            try:
+                self.backend, _ = capture_frames(
+                    self._on_frame,
+                    self.config,
+                    iface=self.interface,
+                    filter_str=self.filter,
+                    stop=lambda: not self.running,
+                    on_open=self._on_open,
+                    on_backend=self._on_backend
+                )
+            except Exception as e:
+                self.capturing = False
+                self.last_error = str(e)
+                logging.error(f"Capture service error: {e}")
+                self._sleep(self.retry_interval)
+
+        self.capturing = False
+
+    def _on_backend(self, backend):
+        # Set before the socket opens so status() shows the backend while capturing
+        self.backend = backend
+
+    def _on_open(self):
+        self.capturing = True
+        self.last_error = None
+
+    def _sleep(self, seconds):
+        deadline = time.time() + seconds
+        while self.running and time.time() < deadline:
+            time.sleep(0.5)
+
+    def _on_frame(self, frame, timestamp, link_layer=None):
+        if not self.sampler.accept():
+            return
+        try:
+            packet_data = decode_with_fallback(frame, timestamp, link_layer)
+        except Exception as e:
+            self.parse_errors += 1
+            logging.debug(f"Error parsing packet: {e}")
+            return
+        if packet_data is not None:
+            packet_data['sample_rate'] = self.sampler.rate
+            self.ring.append(packet_data)
+
+    def read(self, since=0, protocol='all', limit=100):
+        """Read buffered packets without blocking (see PacketRing.read)"""
+        return self.ring.read(since=since, protocol=protocol, limit=limit)
+
+    def collect(self, user_id, protocol='all', count=100, since=None, packet_filter=None):
+        """
+        Up to count buffered packets to store for a user, without waiting
+
+        Each user has a cursor on the ring, so a packet is returned to a user
+        (and saved) at most once, even across concurrent requests. A user
+        with a cursor (or passing `since`) gets the oldest packets after it;
+        a user without one gets the newest packets in the ring. packet_filter
+        is called once per packet matching protocol.
+
+        Returns:
+            tuple of (list of packet dicts, oldest first; cursor)
+        """
+        last = self.ring.stats()['last_seq']
+        with self._cursor_lock:
+            cursor = self._user_cursors.get(user_id)
+        if since is not None and since <= last:
+            cursor = since if cursor is None else max(cursor, since)
+        elif cursor is not None and cursor > last:
+            cursor = None  # from before a restart
+
+        def accept(packet_data):
+            return matches_protocol(packet_data, protocol) and (packet_filter is None or packet_filter(packet_data))
+
+        collected = []
+        if cursor is None:
+            # Newest first, then back to oldest first
+            entries, cursor = self.ring.entries(0)
+            for seq, packet_data in reversed(entries):
+                if len(collected) == count:
+                    break
+                if accept(packet_data):
+                    collected.append((seq, packet_data))
+            collected.reverse()
+        else:
+            entries, last = self.ring.entries(cursor)
+            for seq, packet_data in entries:
+                if len(collected) == count:
+                    break
+                cursor = seq
+                if accept(packet_data):
+                    collected.append((seq, packet_data))
+
+        with self._cursor_lock:
+            # Drop what a concurrent request of the same user has already returned
+            claimed = self._user_cursors.get(user_id, 0)
+            self._user_cursors[user_id] = max(claimed, cursor)
+        return [packet_data for seq, packet_data in collected if seq > claimed], max(claimed, cursor)
+
+    def subscribe(self, protocol='all', packet_filter=None):
+        """Subscribe to packets captured from now on"""
+        return self.ring.subscribe(self.subscriber_queue_size, protocol, packet_filter)
+
+    def status(self):
+        status = self.ring.stats()
+        status.update({
+            'running': self.running,
+            'capturing': self.capturing,
+            'interface': self.interface,
+            'backend': self.backend.stats() if self.backend else None,
+            'sampling': self.sampler.stats(),
+            'parse_errors': self.parse_errors,
+            'last_error': self.last_error
+        })
+        return status
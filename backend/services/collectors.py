@@ -0,0 +1,237 @@
+"""
+Metric collectors: psutil or direct /proc reads
+
+The system sampler and the rate engine read CPU, memory, network and disk
+counters every second. psutil re-opens and re-parses its source files on
+every call and builds named tuples for every interface and disk. On Linux,
+ProcCollector reads /proc/stat, /proc/meminfo, /proc/net/dev and
+/proc/diskstats instead. It keeps each file open and preads it into a
+reusable buffer. The column offsets of /proc/net/dev and the line numbers
+of /proc/meminfo are worked out once, and only the values needed are parsed.
+Both collectors return the same values. METRICS_BACKEND selects one
+('psutil', 'proc' or 'auto': /proc when available).
+
+Collectors keep state (buffers, the previous CPU times), so each consumer
+thread creates its own.
+"""
+import logging
+import os
+import sys
+
+import psutil
+
+TOTAL = 'all'  # counters summed over all interfaces
+
+# /proc/diskstats counts 512-byte sectors whatever the device's sector size
+SECTOR_SIZE = 512
+
+
+def _memory(total, available, free, buffers, cached):
+    """Memory dict as computed by psutil.virtual_memory()"""
+    used = total - free - cached - buffers
+    if used < 0:
+        used = total - free
+    if available > total:
+        available = free
+    return {
+        'total': total,
+        'available': available,
+        'used': used,
+        'percent': round((total - available) / total * 100, 1) if total else 0.0
+    }
+
+
+class PsutilCollector:
+    """Metrics through psutil (any platform)"""
+
+    name = 'psutil'
+
+    def cpu_percent(self):
+        """CPU usage since the previous call, without waiting"""
+        return psutil.cpu_percent(interval=None)
+
+    def memory(self):
+        memory = psutil.virtual_memory()
+        return {'total': memory.total, 'available': memory.available, 'used': memory.used, 'percent': memory.percent}
+
+    def net_counters(self, interfaces=None):
+        """
+        {series: (bytes_sent, bytes_recv, packets_sent, packets_recv, errin, errout, dropin, dropout)}
+
+        The TOTAL series sums all interfaces; the others are per interface,
+        limited to interfaces if given.
+        """
+        counters = {TOTAL: tuple(psutil.net_io_counters())[:8]}
+        for name, values in psutil.net_io_counters(pernic=True).items():
+            if name != TOTAL and (not interfaces or name in interfaces):
+                counters[name] = tuple(values)[:8]
+        return counters
+
+    def disk_io(self):
+        """Disk I/O counters summed over the block devices, or None"""
+        counters = psutil.disk_io_counters()
+        if counters is None:
+            return None
+        return {'read_count': counters.read_count, 'write_count': counters.write_count,
+                'read_bytes': counters.read_bytes, 'write_bytes': counters.write_bytes}
+
+    def close(self):
+        pass
+
+
+class ProcFile:
+    """A /proc file kept open and re-read into the same buffer"""
+
+    def __init__(self, path, size=8192):
+        self.path = path
+        self.fd = None
+        self.buffer = bytearray(size)
+
+    def read(self):
+        """The current content, as a bytes copy of the filled part of the buffer"""
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_RDONLY)
+        # seq files (/proc/net/*, /proc/diskstats...) return about a page per
+        # read, so a short read is not the end: read on until one returns 0
+        length = 0
+        while True:
+            if length == len(self.buffer):
+                # The file outgrew the buffer; the larger buffer is kept for later reads
+                self.buffer = self.buffer + bytearray(len(self.buffer))
+            read = os.preadv(self.fd, [memoryview(self.buffer)[length:]], length)
+            if not read:
+                return bytes(memoryview(self.buffer)[:length])
+            length += read
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class ProcCollector:
+    """Metrics read directly from /proc (Linux)"""
+
+    name = 'proc'
+
+    # /proc/meminfo keys used, in the order of _memory()'s arguments after total
+    MEMINFO_KEYS = (b'MemTotal:', b'MemAvailable:', b'MemFree:', b'Buffers:', b'Cached:', b'SReclaimable:')
+
+    def __init__(self, root='/proc', sys_block='/sys/block'):
+        self._stat = ProcFile(os.path.join(root, 'stat'))
+        self._meminfo = ProcFile(os.path.join(root, 'meminfo'))
+        self._net_dev = ProcFile(os.path.join(root, 'net', 'dev'))
+        self._diskstats = ProcFile(os.path.join(root, 'diskstats'))
+        self.sys_block = sys_block
+        self._previous_cpu = None
+        self._meminfo_lines = None  # line number of each MEMINFO_KEYS entry
+        self._net_columns = None  # field indexes of the counters, in net_counters() order
+        self._disks = {}  # device name -> whether it is a whole disk (not a partition)
+
+    def cpu_percent(self):
+        """CPU usage since the previous call, without waiting (0.0 on the first call)"""
+        data = self._stat.read()
+        # First line: cpu user nice system idle iowait irq softirq steal guest guest_nice;
+        # guest time is already counted in user and nice
+        times = [int(value) for value in data[:data.index(b'\n')].split()[1:9]]
+        total = sum(times)
+        idle = times[3] + times[4]
+        previous, self._previous_cpu = self._previous_cpu, (total, idle)
+        if previous is None or total <= previous[0]:
+            return 0.0
+        busy = (total - previous[0]) - (idle - previous[1])
+        return round(max(0.0, min(100.0, busy / (total - previous[0]) * 100)), 1)
+
+    def memory(self):
+        lines = self._meminfo.read().split(b'\n')
+        offsets = self._meminfo_lines
+        if offsets is None or any(line >= len(lines) or not lines[line].startswith(key)
+                                  for key, line in zip(self.MEMINFO_KEYS, offsets) if line is not None):
+            offsets = self._meminfo_lines = self._index_meminfo(lines)
+        total, available, free, buffers, cached, reclaimable = (
+            int(lines[line].split()[1]) * 1024 if line is not None else 0 for line in offsets
+        )
+        return _memory(total, available, free, buffers, cached + reclaimable)
+
+    def _index_meminfo(self, lines):
+        positions = {line.split(b' ', 1)[0]: number for number, line in enumerate(lines)}
+        return [positions.get(key) for key in self.MEMINFO_KEYS]
+
+    def net_counters(self, interfaces=None):
+        """Same as PsutilCollector.net_counters()"""
+        lines = self._net_dev.read().split(b'\n')
+        columns = self._net_columns
+        if columns is None:
+            columns = self._net_columns = self._index_net_dev(lines[1])
+        total = [0] * 8
+        counters = {}
+        for line in lines[2:]:
+            name, _, fields = line.partition(b':')
+            if not fields:
+                continue
+            fields = fields.split()
+            values = tuple(int(fields[column]) for column in columns)
+            for i in range(8):
+                total[i] += values[i]
+            name = name.strip().decode()
+            if not interfaces or name in interfaces:
+                counters[name] = values
+        counters[TOTAL] = tuple(total)
+        return counters
+
+    @staticmethod
+    def _index_net_dev(header):
+        """
+        Field indexes of the counters from the column header
+
+        The header is '<face> |<receive columns>|<transmit columns>'; the
+        fields after 'name:' are the receive columns, then the transmit ones.
+        """
+        _, receive, transmit = header.decode().split('|')
+        receive, transmit = receive.split(), transmit.split()
+        rx = {column: i for i, column in enumerate(receive)}
+        tx = {column: len(receive) + i for i, column in enumerate(transmit)}
+        return (tx['bytes'], rx['bytes'], tx['packets'], rx['packets'],
+                rx['errs'], tx['errs'], rx['drop'], tx['drop'])
+
+    def _is_disk(self, name):
+        is_disk = self._disks.get(name)
+        if is_disk is None:
+            # Whole disks are listed in /sys/block, partitions are not (as psutil counts them)
+            is_disk = self._disks[name] = os.path.exists(os.path.join(self.sys_block, name.replace('/', '!')))
+        return is_disk
+
+    def disk_io(self):
+        """Disk I/O counters summed over the whole disks"""
+        read_count = write_count = read_sectors = write_sectors = 0
+        for line in self._diskstats.read().split(b'\n'):
+            # major minor name reads merged sectors ms writes merged sectors ms ...
+            fields = line.split()
+            if len(fields) < 10 or not self._is_disk(fields[2].decode()):
+                continue
+            read_count += int(fields[3])
+            read_sectors += int(fields[5])
+            write_count += int(fields[7])
+            write_sectors += int(fields[9])
+        return {'read_count': read_count, 'write_count': write_count,
+                'read_bytes': read_sectors * SECTOR_SIZE, 'write_bytes': write_sectors * SECTOR_SIZE}
+
+    def close(self):
+        for proc_file in (self._stat, self._meminfo, self._net_dev, self._diskstats):
+            proc_file.close()
+
+
+def proc_available(root='/proc'):
+    return sys.platform.startswith('linux') and all(
+        os.access(os.path.join(root, name), os.R_OK) for name in ('stat', 'meminfo', 'net/dev', 'diskstats')
+    )
+
+
+def create_collector(config):
+    """A new collector for the METRICS_BACKEND setting ('psutil', 'proc' or 'auto')"""
+    backend = (getattr(config, 'METRICS_BACKEND', 'psutil') or 'psutil').lower()
+    if backend in ('proc', 'auto') and proc_available():
+        return ProcCollector()
+    if backend == 'proc':
+        logging.warning("METRICS_BACKEND=proc needs a readable Linux /proc; using psutil")
+    return PsutilCollector()
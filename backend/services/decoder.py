@@ -0,0 +1,219 @@
+"""
+Fast-path packet header decoder
+
+Parses Ethernet (with 802.1Q/802.1ad tags), IPv4, IPv6, TCP, UDP and ICMP
+headers straight from the raw frame bytes with struct, producing a compact
+DecodedPacket. Only frames the fast path does not understand are handed to
+scapy for a full dissection.
+"""
+import socket
+import struct
+from datetime import datetime
+from scapy.layers.l2 import Ether
+
+ETH_P_IP = 0x0800
+ETH_P_ARP = 0x0806
+ETH_P_IPV6 = 0x86DD
+VLAN_ETHERTYPES = (0x8100, 0x88A8, 0x9100)
+
+IPPROTO_ICMP = 1
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+IPPROTO_ICMPV6 = 58
+# IPv6 extension headers that are skipped to reach the transport header
+IPV6_EXTENSION_HEADERS = (0, 43, 60)
+IPV6_FRAGMENT_HEADER = 44
+
+# Ethertypes that are known not to carry IP; these are ignored without a scapy fallback
+NON_IP_ETHERTYPES = frozenset((ETH_P_ARP, 0x88CC, 0x8035, 0x888E, 0x8809))
+
+_ethertype = struct.Struct('!H')
+_ipv4_header = struct.Struct('!BxHHHBBH4s4s')
+_ipv6_header = struct.Struct('!4xHBB16s16s')
+_ports = struct.Struct('!HH')
+_tcp_flags = struct.Struct('!H')
+
+# Same letters and order scapy uses when printing TCP flags
+_TCP_FLAG_LETTERS = 'FSRPAUECN'
+TCP_FLAG_STRINGS = tuple(
+    ''.join(letter for bit, letter in enumerate(_TCP_FLAG_LETTERS) if value & (1 << bit))
+    for value in range(1 << len(_TCP_FLAG_LETTERS))
+)
+
+# Returned by decode_frame() when the frame needs a full scapy dissection
+UNSUPPORTED = object()
+
+
+class DecodedPacket:
+    """Header fields of one captured packet"""
+    __slots__ = (
+        'timestamp', 'protocol', 'ip_version', 'src_ip', 'dst_ip',
+        'src_port', 'dst_port', 'length', 'tcp_flags', 'icmp_type'
+    )
+
+    def __init__(self, timestamp, protocol, ip_version, src_ip, dst_ip,
+                 src_port=None, dst_port=None, length=0, tcp_flags=None, icmp_type=None):
+        self.timestamp = timestamp
+        self.protocol = protocol
+        self.ip_version = ip_version
+        self.src_ip = src_ip
+        self.dst_ip = dst_ip
+        self.src_port = src_port
+        self.dst_port = dst_port
+        self.length = length
+        self.tcp_flags = tcp_flags
+        self.icmp_type = icmp_type
+
+    @property
+    def info(self):
+        if self.tcp_flags is not None:
+            return f"Flags: {TCP_FLAG_STRINGS[self.tcp_flags]}"
+        if self.icmp_type is not None:
+            return f"Type: {self.icmp_type}"
+        return ""
+
+    def to_dict(self):
+        """Same shape as services.capture.parse_packet()"""
+        return {
+            'timestamp': datetime.utcfromtimestamp(self.timestamp).isoformat(),
+            'protocol': self.protocol,
+            'src_ip': self.src_ip,
+            'dst_ip': self.dst_ip,
+            'src_port': self.src_port,
+            'dst_port': self.dst_port,
+            'length': self.length,
+            'info': self.info,
+            'tcp_flags': self.tcp_flags,
+            'icmp_type': self.icmp_type
+        }
+
+
+def decode_frame(frame, timestamp):
+    """
+    Decode an Ethernet frame
+
+    Args:
+        frame: raw frame as bytes, bytearray or memoryview
+        timestamp: capture time (seconds since the epoch)
+
+    Returns:
+        DecodedPacket, None for frames that do not carry IP,
+        or UNSUPPORTED when the frame needs the scapy fallback
+    """
+    view = memoryview(frame)
+    length = len(view)
+    if length < 14:
+        return UNSUPPORTED
+
+    offset = 12
+    ethertype = _ethertype.unpack_from(view, offset)[0]
+    offset += 2
+    while ethertype in VLAN_ETHERTYPES:
+        if length < offset + 4:
+            return UNSUPPORTED
+        ethertype = _ethertype.unpack_from(view, offset + 2)[0]
+        offset += 4
+
+    if ethertype == ETH_P_IP:
+        return _decode_ipv4(view, offset, length, timestamp)
+    if ethertype == ETH_P_IPV6:
+        return _decode_ipv6(view, offset, length, timestamp)
+    if ethertype in NON_IP_ETHERTYPES or ethertype < 0x0600:
+        # ARP, LLDP, 802.3 length field frames, ...
+        return None
+    return UNSUPPORTED
+
+
+def _decode_ipv4(view, offset, length, timestamp):
+    if length < offset + 20:
+        return UNSUPPORTED
+    version_ihl, _total, _ident, frag, _ttl, proto, _csum, src, dst = _ipv4_header.unpack_from(view, offset)
+    if version_ihl >> 4 != 4:
+        return UNSUPPORTED
+    ihl = (version_ihl & 0x0F) * 4
+    if ihl < 20:
+        return UNSUPPORTED
+
+    packet = DecodedPacket(
+        timestamp, 'IP', 4,
+        socket.inet_ntop(socket.AF_INET, src),
+        socket.inet_ntop(socket.AF_INET, dst),
+        length=length
+    )
+    if frag & 0x1FFF:
+        # Non-first fragment: no transport header
+        return packet
+    return _decode_transport(packet, view, offset + ihl, length, proto)
+
+
+def _decode_ipv6(view, offset, length, timestamp):
+    if length < offset + 40:
+        return UNSUPPORTED
+    if view[offset] >> 4 != 6:
+        return UNSUPPORTED
+    _payload_len, next_header, _hop_limit, src, dst = _ipv6_header.unpack_from(view, offset)
+
+    packet = DecodedPacket(
+        timestamp, 'IP', 6,
+        socket.inet_ntop(socket.AF_INET6, src),
+        socket.inet_ntop(socket.AF_INET6, dst),
+        length=length
+    )
+    offset += 40
+    while next_header in IPV6_EXTENSION_HEADERS or next_header == IPV6_FRAGMENT_HEADER:
+        if length < offset + 8:
+            return packet
+        if next_header == IPV6_FRAGMENT_HEADER:
+            if _tcp_flags.unpack_from(view, offset + 2)[0] & 0xFFF8:
+                # Non-first fragment: no transport header
+                return packet
+            next_header = view[offset]
+            offset += 8
+        else:
+            ext_len = (view[offset + 1] + 1) * 8
+            next_header = view[offset]
+            offset += ext_len
+    return _decode_transport(packet, view, offset, length, next_header)
+
+
+def _decode_transport(packet, view, offset, length, proto):
+    if proto == IPPROTO_TCP:
+        if length >= offset + 14:
+            packet.protocol = 'TCP'
+            packet.src_port, packet.dst_port = _ports.unpack_from(view, offset)
+            packet.tcp_flags = _tcp_flags.unpack_from(view, offset + 12)[0] & 0x01FF
+    elif proto == IPPROTO_UDP:
+        if length >= offset + 4:
+            packet.protocol = 'UDP'
+            packet.src_port, packet.dst_port = _ports.unpack_from(view, offset)
+    elif proto == IPPROTO_ICMP or proto == IPPROTO_ICMPV6:
+        if length > offset:
+            packet.protocol = 'ICMP' if proto == IPPROTO_ICMP else 'ICMPv6'
+            packet.icmp_type = view[offset]
+    return packet
+
+
+def decode_with_fallback(frame, timestamp, link_layer=None):
+    """
+    Decode a raw frame to a packet dict, using scapy only when the fast path can't
+
+    Args:
+        frame: raw frame bytes
+        timestamp: capture time (seconds since the epoch)
+        link_layer: scapy class of the link layer if it is not Ethernet
+
+    Returns:
+        dict in the parse_packet() format, or None for non-IP frames
+    """
+    if link_layer is None or link_layer is Ether:
+        decoded = decode_frame(frame, timestamp)
+        if decoded is None:
+            return None
+        if decoded is not UNSUPPORTED:
+            return decoded.to_dict()
+        link_layer = Ether
+
+    from services.capture import parse_packet
+    packet = link_layer(bytes(frame))
+    packet.time = timestamp
+    return parse_packet(packet)
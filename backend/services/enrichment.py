@@ -0,0 +1,380 @@
+"""
+Device and subnet enrichment of captured traffic
+
+Registered devices (Device.ip_address, a host address or a CIDR network)
+and the subnets configured in ENRICHMENT_SUBNETS are kept in binary prefix
+tries, one per user and address family for devices and one per family for
+subnets. Each captured packet and exported flow is tagged with the device
+and subnet of its local end (the source if it matches, else the
+destination) by a longest-prefix match costing one step per address bit.
+The device routes update the local index as devices change and bump the
+'devices' row of data_versions; the indexes of the other app processes
+notice the new version (checked at most once a second, before tagging) and
+reload the devices. Per-device traffic is also counted in memory and logged
+to traffic_logs by the background monitor.
+"""
+import ipaddress
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from column_types import pack_ip
+
+_VALUE = 2  # node slot holding the entry stored at that prefix
+# data_versions row bumped whenever a device is added, removed or readdressed
+DEVICES_VERSION = 'devices'
+
+
+class PrefixTrie:
+    """Binary trie over address bits answering longest-prefix matches"""
+
+    def __init__(self, bits):
+        self.bits = bits
+        # Nodes are [zero child, one child, value]
+        self._root = [None, None, None]
+        self.size = 0
+
+    def _path(self, address, prefix_len):
+        number = int.from_bytes(address, 'big')
+        return [(number >> (self.bits - 1 - i)) & 1 for i in range(prefix_len)]
+
+    def insert(self, address, prefix_len, value):
+        """Store value at address/prefix_len (replacing what was there)"""
+        node = self._root
+        for bit in self._path(address, prefix_len):
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        if node[_VALUE] is None:
+            self.size += 1
+        node[_VALUE] = value
+
+    def get(self, address, prefix_len):
+        """The value stored at exactly address/prefix_len, or None"""
+        node = self._root
+        for bit in self._path(address, prefix_len):
+            node = node[bit]
+            if node is None:
+                return None
+        return node[_VALUE]
+
+    def remove(self, address, prefix_len):
+        """Remove the value at address/prefix_len and prune emptied nodes"""
+        trail = [self._root]
+        path = self._path(address, prefix_len)
+        for bit in path:
+            node = trail[-1][bit]
+            if node is None:
+                return
+            trail.append(node)
+        if trail[-1][_VALUE] is None:
+            return
+        trail[-1][_VALUE] = None
+        self.size -= 1
+        for depth in range(len(path), 0, -1):
+            node = trail[depth]
+            if node[0] is not None or node[1] is not None or node[_VALUE] is not None:
+                break
+            trail[depth - 1][path[depth - 1]] = None
+
+    def lookup(self, address):
+        """Value of the longest stored prefix containing address, or None"""
+        number = int.from_bytes(address, 'big')
+        node = self._root
+        best = node[_VALUE]
+        shift = self.bits - 1
+        while shift >= 0:
+            node = node[(number >> shift) & 1]
+            if node is None:
+                break
+            if node[_VALUE] is not None:
+                best = node[_VALUE]
+            shift -= 1
+        return best
+
+
+def parse_network(text):
+    """(packed network address, prefix length) of an address or CIDR string, or None"""
+    try:
+        network = ipaddress.ip_network((text or '').strip(), strict=False)
+    except ValueError:
+        return None
+    return network.network_address.packed, network.prefixlen
+
+
+def parse_subnets(text):
+    """
+    Subnets from 'name=cidr,name=cidr' (a bare cidr is its own name)
+
+    Returns:
+        list of (name, cidr) with invalid entries skipped
+    """
+    subnets = []
+    for entry in (text or '').split(','):
+        name, _, cidr = entry.strip().rpartition('=')
+        cidr = cidr.strip()
+        if not cidr:
+            continue
+        if parse_network(cidr) is None:
+            logging.warning(f"Ignoring invalid subnet {entry.strip()!r}")
+            continue
+        subnets.append(((name or cidr).strip()[:32], cidr))
+    return subnets
+
+
+def touch_devices():
+    """Bump the devices version so every process reloads its index; the caller commits"""
+    from models import db, DataVersion
+    updated = DataVersion.query.filter_by(name=DEVICES_VERSION).update(
+        {'version': DataVersion.version + 1, 'updated_at': datetime.utcnow()}, synchronize_session=False
+    )
+    if not updated:
+        db.session.add(DataVersion(name=DEVICES_VERSION, version=1, updated_at=datetime.utcnow()))
+
+
+class DeviceIndex:
+    """Longest-prefix match index of devices and subnets, with per-device traffic counters"""
+
+    def __init__(self, app, config):
+        self.app = app
+        self.subnets = parse_subnets(getattr(config, 'ENRICHMENT_SUBNETS', ''))
+        # (user_id, address length) -> trie of {device_id: None} (several devices may share a prefix)
+        self._devices = {}
+        # address length -> trie of subnet names
+        self._subnets = {}
+        # device_id -> (user_id, packed network, prefix length)
+        self._entries = {}
+        self._lock = threading.Lock()
+        # device_id -> [bytes_sent, bytes_recv, packets_sent, packets_recv] since the last drain
+        self._traffic = defaultdict(lambda: [0, 0, 0, 0])
+        self._traffic_lock = threading.Lock()
+        self.version = None  # devices version the index was loaded at
+        self.check_interval = 1.0  # seconds between checks for other processes' device changes
+        self._checked = 0.0
+        self.reloads = 0
+        self.lookups = 0
+        self.matches = 0
+
+        for name, cidr in self.subnets:
+            address, prefix_len = parse_network(cidr)
+            self._trie(self._subnets, len(address), len(address)).insert(address, prefix_len, name)
+
+    @staticmethod
+    def _trie(tries, key, length):
+        trie = tries.get(key)
+        if trie is None:
+            trie = tries[key] = PrefixTrie(length * 8)
+        return trie
+
+    def load(self):
+        """Index every registered device"""
+        from models import db, DataVersion
+        with self.app.app_context():
+            # Created up front so device changes only ever update the row
+            if db.session.get(DataVersion, DEVICES_VERSION) is None:
+                db.session.add(DataVersion(name=DEVICES_VERSION, version=0, updated_at=datetime.utcnow()))
+                try:
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()  # another process created it first
+        self._reload()
+        print(f"Device index loaded ({len(self._entries)} devices, {len(self.subnets)} subnets)")
+
+    def _reload(self):
+        """Rebuild the device tries from the devices table and swap them in"""
+        from models import db, Device, DataVersion
+        with self.app.app_context():
+            # Read first: a change committed meanwhile leaves a newer version for the next check
+            version = db.session.query(DataVersion.version).filter_by(name=DEVICES_VERSION).scalar() or 0
+            devices = Device.query.with_entities(Device.id, Device.user_id, Device.ip_address).all()
+        tries, entries = {}, {}
+        for device_id, user_id, ip_address in devices:
+            self._insert(tries, entries, device_id, user_id, ip_address)
+        with self._lock:
+            self._devices, self._entries = tries, entries
+            self.version = version
+        with self._traffic_lock:
+            for device_id in [device_id for device_id in self._traffic if device_id not in entries]:
+                del self._traffic[device_id]
+
+    def refresh(self):
+        """
+        Reload the devices if another process changed them (checked at most every check_interval)
+
+        Returns:
+            True if the index was reloaded
+        """
+        now = time.monotonic()
+        if now - self._checked < self.check_interval:
+            return False
+        self._checked = now
+        from models import db, DataVersion
+        try:
+            with self.app.app_context():
+                version = db.session.query(DataVersion.version).filter_by(name=DEVICES_VERSION).scalar() or 0
+            if version == self.version:
+                return False
+            self._reload()
+        except Exception as e:
+            logging.error(f"Error reloading the device index: {e}")
+            return False
+        self.reloads += 1
+        return True
+
+    def _insert(self, tries, entries, device_id, user_id, ip_address):
+        network = parse_network(ip_address)
+        if network is None:
+            return
+        address, prefix_len = network
+        trie = self._trie(tries, (user_id, len(address)), len(address))
+        # Copied rather than changed in place: lookups do not take the lock
+        devices = dict(trie.get(address, prefix_len) or {})
+        devices[device_id] = None
+        trie.insert(address, prefix_len, devices)
+        entries[device_id] = (user_id, address, prefix_len)
+
+    def _add(self, device_id, user_id, ip_address):
+        with self._lock:
+            self._insert(self._devices, self._entries, device_id, user_id, ip_address)
+
+    def add_device(self, device):
+        """Index a new device"""
+        self._add(device.id, device.user_id, device.ip_address)
+
+    def remove_device(self, device_id):
+        """Drop a device from the index (its traffic counters too)"""
+        with self._lock:
+            entry = self._entries.pop(device_id, None)
+            if entry is not None:
+                user_id, address, prefix_len = entry
+                trie = self._devices[user_id, len(address)]
+                devices = dict(trie.get(address, prefix_len) or {})
+                devices.pop(device_id, None)
+                if devices:
+                    trie.insert(address, prefix_len, devices)
+                else:
+                    trie.remove(address, prefix_len)
+        with self._traffic_lock:
+            self._traffic.pop(device_id, None)
+
+    def update_device(self, device):
+        """Re-index a device whose address may have changed"""
+        entry = self._entries.get(device.id)
+        if entry is not None and entry[1:] == parse_network(device.ip_address):
+            return
+        with self._traffic_lock:
+            counters = self._traffic.pop(device.id, None)
+        self.remove_device(device.id)
+        self.add_device(device)
+        if counters is not None:
+            with self._traffic_lock:
+                self._traffic[device.id] = counters
+
+    def device_for(self, user_id, address):
+        """Id of the user's device owning an address (bytes or string), or None"""
+        if address is None:
+            return None
+        if isinstance(address, str):
+            try:
+                address = pack_ip(address)
+            except (OSError, ValueError):
+                return None
+        trie = self._devices.get((user_id, len(address)))
+        devices = trie.lookup(address) if trie is not None else None
+        # Lowest id wins when several devices share the longest prefix
+        return min(devices) if devices else None
+
+    def subnet_for(self, address):
+        """Name of the configured subnet containing an address (bytes), or None"""
+        trie = self._subnets.get(len(address))
+        return trie.lookup(address) if trie is not None else None
+
+    def tag(self, user_id, src_ip, dst_ip):
+        """
+        Device and subnet of the local end of a packet or flow
+
+        The source is the local end if it is a device or in a subnet;
+        otherwise the destination.
+
+        Returns:
+            (device_id, subnet), None for what did not match
+        """
+        self.lookups += 1
+        for address in (src_ip, dst_ip):
+            if address is None:
+                continue
+            try:
+                packed = pack_ip(address)
+            except (OSError, ValueError):
+                continue
+            device_id = self.device_for(user_id, packed)
+            subnet = self.subnet_for(packed)
+            if device_id is not None or subnet is not None:
+                self.matches += 1
+                return device_id, subnet
+        return None, None
+
+    def count(self, user_id, src_ip, dst_ip, packets, nbytes):
+        """Account traffic to the devices on both ends (a device talking to another counts for both)"""
+        src = self.device_for(user_id, src_ip)
+        dst = self.device_for(user_id, dst_ip)
+        if src is None and dst is None:
+            return
+        with self._traffic_lock:
+            if src is not None:
+                counters = self._traffic[src]
+                counters[0] += nbytes
+                counters[2] += packets
+            if dst is not None:
+                counters = self._traffic[dst]
+                counters[1] += nbytes
+                counters[3] += packets
+
+    def tag_packet_rows(self, rows, count=True):
+        """
+        Packet rows (PACKET_COLUMNS order without the tags) with the tags appended
+
+        count also accounts them to the devices' traffic counters.
+        """
+        self.refresh()
+        tagged = []
+        for row in rows:
+            user_id, src_ip, dst_ip = row[9], row[2], row[3]
+            device_id, subnet = self.tag(user_id, src_ip, dst_ip)
+            if count and device_id is not None:
+                rate = row[8] or 1.0
+                self.count(user_id, src_ip, dst_ip, rate, (row[6] or 0) * rate)
+            tagged.append(tuple(row[:11]) + (device_id, subnet))
+        return tagged
+
+    def tag_flow_rows(self, rows, count=False):
+        """Flow rows (FLOW_COLUMNS order without the tags) with the tags appended"""
+        self.refresh()
+        tagged = []
+        for row in rows:
+            user_id, src_ip, dst_ip = row[11], row[1], row[2]
+            device_id, subnet = self.tag(user_id, src_ip, dst_ip)
+            if count and device_id is not None:
+                rate = row[8] or 1.0
+                self.count(user_id, src_ip, dst_ip, row[5] * rate, row[6] * rate)
+            tagged.append(tuple(row[:12]) + (device_id, subnet))
+        return tagged
+
+    def drain_traffic(self):
+        """{device_id: (bytes_sent, bytes_recv, packets_sent, packets_recv)} counted since the previous drain"""
+        with self._traffic_lock:
+            traffic, self._traffic = self._traffic, defaultdict(lambda: [0, 0, 0, 0])
+        return {device_id: tuple(int(value) for value in counters)
+                for device_id, counters in traffic.items() if any(counters)}
+
+    def stats(self):
+        return {
+            'devices': len(self._entries),
+            'subnets': [{'name': name, 'network': cidr} for name, cidr in self.subnets],
+            'version': self.version,
+            'reloads': self.reloads,
+            'lookups': self.lookups,
+            'matches': self.matches
+        }
@@ -0,0 +1,283 @@
+"""
+NetFlow-style 5-tuple flow aggregation
+
+Captured packets are folded into an in-memory flow table keyed on
+(user, protocol, src_ip, dst_ip, src_port, dst_port, sample rate). Flows
+are exported as one row each to the flows table when they go idle, exceed
+the active timeout, see a TCP FIN/RST, or are evicted because the table
+is full. Timeouts run on the packet clock (the newest packet timestamp
+seen per user), so a capture file ingested with old timestamps is cut into
+flows the same way as live traffic.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from models import Flow
+from services.packet_writer import PacketWriter
+
+# Column order of the rows produced by FlowTable (without the trailing device
+# and subnet tags, added on export) and written by the flow writer
+FLOW_COLUMNS = (
+    'protocol', 'src_ip', 'dst_ip', 'src_port', 'dst_port', 'packets',
+    'bytes', 'tcp_flags', 'sample_rate', 'first_seen', 'last_seen', 'user_id',
+    'device_id', 'subnet'
+)
+
+TCP_FIN = 0x01
+TCP_RST = 0x04
+
+
+class FlowRecord:
+    """Counters of one active flow"""
+    __slots__ = ('packets', 'bytes', 'tcp_flags', 'first_seen', 'last_seen', 'finished', 'touched')
+
+    def __init__(self, timestamp):
+        self.packets = 0
+        self.bytes = 0
+        self.tcp_flags = 0
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.finished = False
+        self.touched = time.monotonic()  # wall clock of the last update
+
+
+class FlowTable:
+    """Active flows with idle/active timeout based export"""
+
+    def __init__(self, active_timeout=300, idle_timeout=30, max_flows=100000):
+        self.active_timeout = timedelta(seconds=active_timeout)
+        self.idle_timeout = timedelta(seconds=idle_timeout)
+        self.max_flows = max_flows
+        # Least recently updated flow first, so idle flows are found at the front
+        self._flows = OrderedDict()
+        # user_id -> newest packet timestamp, the clock the timeouts run on
+        self._clocks = {}
+        self._lock = threading.Lock()
+        self._evicted = []
+
+        self.packets_seen = 0
+        self.flows_created = 0
+        self.flows_exported = 0
+        self.flows_evicted = 0
+
+    def __len__(self):
+        return len(self._flows)
+
+    def update(self, user_id, protocol, src_ip, dst_ip, src_port, dst_port, length, timestamp,
+               tcp_flags=None, sample_rate=1.0):
+        """Account one (possibly sampled) packet to its flow"""
+        key = (user_id, protocol, src_ip, dst_ip, src_port, dst_port, sample_rate)
+        with self._lock:
+            clock = self._clocks.get(user_id)
+            if clock is None or timestamp > clock:
+                self._clocks[user_id] = timestamp
+            flow = self._flows.get(key)
+            if flow is None:
+                if len(self._flows) >= self.max_flows:
+                    # Table full: export the least recently updated flow early
+                    old_key, old_flow = self._flows.popitem(last=False)
+                    self._evicted.append(self._to_row(old_key, old_flow))
+                    self.flows_evicted += 1
+                flow = FlowRecord(timestamp)
+                self._flows[key] = flow
+                self.flows_created += 1
+            else:
+                self._flows.move_to_end(key)
+                flow.touched = time.monotonic()
+                if timestamp > flow.last_seen:
+                    flow.last_seen = timestamp
+
+            flow.packets += 1
+            flow.bytes += length or 0
+            if tcp_flags:
+                flow.tcp_flags |= tcp_flags
+                if tcp_flags & (TCP_FIN | TCP_RST):
+                    flow.finished = True
+            self.packets_seen += 1
+
+    def add_packet(self, packet_data, user_id):
+        """Account a parsed packet dict (parse_packet() format)"""
+        timestamp = packet_data.get('timestamp')
+        self.update(
+            user_id,
+            packet_data['protocol'],
+            packet_data['src_ip'],
+            packet_data['dst_ip'],
+            packet_data['src_port'],
+            packet_data['dst_port'],
+            packet_data['length'],
+            datetime.fromisoformat(timestamp) if timestamp else datetime.utcnow(),
+            packet_data.get('tcp_flags'),
+            packet_data.get('sample_rate', 1.0)
+        )
+
+    def expire(self, now=None):
+        """
+        Remove and return rows for flows that are due for export
+
+        Flows are idle or past the active timeout by the packet clock of their
+        user. A flow that got no packets for the idle timeout in wall-clock
+        time is exported too, since the packet clock stops once a capture file
+        has been read (or a user's capture stops).
+
+        Args:
+            now: Packet clock to use for every user instead of the newest timestamps seen
+
+        Returns:
+            list of row tuples in FLOW_COLUMNS order
+        """
+        untouched_before = time.monotonic() - self.idle_timeout.total_seconds()
+        with self._lock:
+            rows = self._evicted
+            self._evicted = []
+
+            # Flows without recent packets sit at the front of the LRU order
+            while self._flows:
+                key, flow = next(iter(self._flows.items()))
+                if flow.touched > untouched_before:
+                    break
+                del self._flows[key]
+                rows.append(self._to_row(key, flow))
+
+            due = []
+            for key, flow in self._flows.items():
+                clock = now or self._clocks[key[0]]
+                if (flow.finished or flow.last_seen <= clock - self.idle_timeout
+                        or flow.first_seen <= clock - self.active_timeout):
+                    due.append(key)
+            for key in due:
+                rows.append(self._to_row(key, self._flows.pop(key)))
+
+            self.flows_exported += len(rows)
+        return rows
+
+    def discard(self, user_id):
+        """Drop a user's active and evicted flows without exporting them; returns how many"""
+        with self._lock:
+            keys = [key for key in self._flows if key[0] == user_id]
+            for key in keys:
+                del self._flows[key]
+            evicted = len(self._evicted)
+            self._evicted = [row for row in self._evicted if row[11] != user_id]
+        return len(keys) + evicted - len(self._evicted)
+
+    def flush_all(self):
+        """Remove and return rows for every flow (used on shutdown)"""
+        with self._lock:
+            rows = self._evicted + [self._to_row(key, flow) for key, flow in self._flows.items()]
+            self._evicted = []
+            self._flows.clear()
+            self.flows_exported += len(rows)
+        return rows
+
+    @staticmethod
+    def _to_row(key, flow):
+        user_id, protocol, src_ip, dst_ip, src_port, dst_port, sample_rate = key
+        return (
+            protocol, src_ip, dst_ip, src_port, dst_port, flow.packets, flow.bytes,
+            flow.tcp_flags, sample_rate, flow.first_seen, flow.last_seen, user_id
+        )
+
+    def stats(self):
+        with self._lock:
+            active = len(self._flows)
+        return {
+            'active_flows': active,
+            'max_flows': self.max_flows,
+            'packets_seen': self.packets_seen,
+            'flows_created': self.flows_created,
+            'flows_exported': self.flows_exported,
+            'flows_evicted': self.flows_evicted
+        }
+
+
+class FlowExporter:
+    """Periodically expires the flow table into the flows table"""
+
+    def __init__(self, app, config):
+        self.table = FlowTable(
+            active_timeout=getattr(config, 'FLOW_ACTIVE_TIMEOUT', 300),
+            idle_timeout=getattr(config, 'FLOW_IDLE_TIMEOUT', 30),
+            max_flows=getattr(config, 'FLOW_TABLE_MAX_FLOWS', 100000)
+        )
+        self.writer = PacketWriter(
+            app,
+            batch_size=getattr(config, 'PACKET_WRITER_BATCH_SIZE', 500),
+            flush_interval=getattr(config, 'PACKET_WRITER_FLUSH_INTERVAL', 1.0),
+            table=Flow.__table__,
+            columns=FLOW_COLUMNS,
+            name='Flow writer',
+            retries=getattr(config, 'PACKET_WRITER_RETRIES', 3),
+            retry_backoff=getattr(config, 'PACKET_WRITER_RETRY_BACKOFF', 0.5),
+            dead_letter_dir=getattr(config, 'PACKET_WRITER_DEAD_LETTER_DIR', None)
+        )
+        self.export_interval = 1
+        self.running = False
+        self.thread = None
+        # Held from expiring flows until they are queued, so discard() sees every flow
+        self._export_lock = threading.Lock()
+
+    def start(self):
+        """Start the export thread"""
+        if not self.running:
+            self.running = True
+            self.writer.start()
+            self.thread = threading.Thread(target=self._export_loop, daemon=True)
+            self.thread.start()
+            print("Flow exporter started")
+
+    def stop(self):
+        """Export every remaining flow and stop"""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=5)
+        self.export(self.table.flush_all())
+        self.writer.stop()
+        print("Flow exporter stopped")
+
+    def _export_loop(self):
+        while self.running:
+            try:
+                with self._export_lock:
+                    rows = self.table.expire()
+                    if rows:
+                        self.export(rows)
+            except Exception as e:
+                print(f"Error exporting flows: {e}")
+            time.sleep(self.export_interval)
+
+    def export(self, rows, count=False):
+        """
+        Tag flow rows with device and subnet and queue them for writing
+
+        count accounts them to the device traffic counters; flows built from
+        packets that went through save_packets() were counted there already.
+        """
+        from services.background_tasks import get_device_index
+        index = get_device_index()
+        if index is not None:
+            rows = index.tag_flow_rows(rows, count=count)
+        self.writer.submit_many(rows)
+
+    def discard(self, user_id):
+        """
+        Drop a user's unexported flows and write the flows already queued
+
+        Used when the user's flows are cleared: afterwards every flow of
+        packets seen so far is either gone or stored below the new maximum id.
+        """
+        with self._export_lock:
+            discarded = self.table.discard(user_id)
+            self.writer.flush()
+        return discarded
+
+    def add_packets(self, packets, user_id):
+        """Fold parsed packet dicts into the flow table"""
+        for packet_data in packets:
+            self.table.add_packet(packet_data, user_id)
+
+    def stats(self):
+        stats = self.table.stats()
+        stats['writer'] = self.writer.metrics()
+        return stats
@@ -0,0 +1,75 @@
+"""
+Leases in the job_leases table
+
+Every app process (one per gunicorn worker) starts the same background
+services. Lease rows let them coordinate through the database: a job that
+must run once per deployment takes a named lease, and state kept in one
+process's memory can check whether other processes hold leases too.
+A lease lapses when its holder stops renewing it, e.g. after a crash.
+"""
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from models import db, JobLease
+
+
+def process_owner():
+    """A lease owner name unique to this process and caller"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def acquire_lease(name, owner, seconds, now=None):
+    """
+    Take or renew the named lease for owner until now + seconds
+
+    The update only matches a lease the owner already holds or one that has
+    expired, and the database applies concurrent updates of the row one at a
+    time, so at most one owner gets it. Commits the session.
+
+    Returns:
+        True if owner holds the lease
+    """
+    now = now or datetime.utcnow()
+    expires_at = now + timedelta(seconds=seconds)
+    taken = JobLease.query.filter(
+        JobLease.name == name, or_(JobLease.owner == owner, JobLease.expires_at < now)
+    ).update({'owner': owner, 'expires_at': expires_at}, synchronize_session=False)
+    if not taken:
+        if db.session.get(JobLease, name) is not None:
+            db.session.rollback()
+            return False
+        db.session.add(JobLease(name=name, owner=owner, expires_at=expires_at))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another process created the lease first
+        db.session.rollback()
+        return False
+    return True
+
+
+def other_holders(prefix, owner, since):
+    """Owners other than owner of leases named prefix* that were held at some point after since"""
+    rows = db.session.query(JobLease.owner).filter(
+        JobLease.name.like(prefix + '%'), JobLease.owner != owner, JobLease.expires_at > since
+    )
+    return [row.owner for row in rows]
+
+
+def delete_expired(prefix, before):
+    """Delete leases named prefix* that expired before `before`; commits the session"""
+    deleted = JobLease.query.filter(
+        JobLease.name.like(prefix + '%'), JobLease.expires_at < before
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def release_lease(name, owner):
+    """Give up the named lease if owner holds it; commits the session"""
+    JobLease.query.filter_by(name=name, owner=owner).delete(synchronize_session=False)
+    db.session.commit()
@@ -1,16 +1,20 @@
-import psutil
-import time
+import ipaddress
+import os
 import socket
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import psutil
 import speedtest
+from services.system_sampler import read_interfaces
+from services.rates import interface_capacities
+from services.collectors import ProcFile
 
-# Store previous network stats for load calculation
-_previous_net_io = None
-_previous_timestamp = None
 
-def get_network_traffic():
-    """Get current network traffic statistics"""
-    net_io = psutil.net_io_counters()
-    
+def _counters(net_io):
     return {
         'bytes_sent': net_io.bytes_sent,
         'bytes_recv': net_io.bytes_recv,
@@ -23,89 +27,161 @@ def get_network_traffic():
     }
 
 
-def get_network_load():
+def get_network_traffic(pernic=False):
+    """
+    Get current network traffic statistics
+
+    pernic adds the counters of each interface under 'interfaces'.
+    """
+    traffic = _counters(psutil.net_io_counters())
+    if pernic:
+        traffic['interfaces'] = {name: _counters(net_io)
+                                 for name, net_io in psutil.net_io_counters(pernic=True).items()}
+    return traffic
+
+
+def _load(rates, capacity_bytes_per_sec):
+    """Load metrics of one set of per-second rates"""
+    bytes_sent_per_sec = rates['bytes_sent']
+    bytes_recv_per_sec = rates['bytes_recv']
+    
+    upload_utilization = min(100, (bytes_sent_per_sec / capacity_bytes_per_sec) * 100)
+    download_utilization = min(100, (bytes_recv_per_sec / capacity_bytes_per_sec) * 100)
+    total_utilization = min(100, ((bytes_sent_per_sec + bytes_recv_per_sec) / (2 * capacity_bytes_per_sec)) * 100)
+    
+    return {
+        'bytes_sent_per_sec': round(bytes_sent_per_sec, 2),
+        'bytes_recv_per_sec': round(bytes_recv_per_sec, 2),
+        'packets_sent_per_sec': round(rates['packets_sent'], 2),
+        'packets_recv_per_sec': round(rates['packets_recv'], 2),
+        'upload_utilization_percent': round(upload_utilization, 2),
+        'download_utilization_percent': round(download_utilization, 2),
+        'total_utilization_percent': round(total_utilization, 2)
+    }
+
+
+def get_network_load(window=60):
     """
     Calculate current network load based on recent traffic
     Returns load metrics including bytes/second and utilization percentage
+
+    Rates come from the shared rate engine (services.rates), which samples
+    the counters on a timer, so concurrent callers all see the same rates.
+    The top-level metrics are the latest interval's; 'smoothed' holds the
+    EWMA-smoothed ones and 'average' the average over the last window
+    seconds.
     """
     from config import Config
-    global _previous_net_io, _previous_timestamp
+    from services.background_tasks import get_rate_engine, init_rate_engine
     
-    current_net_io = psutil.net_io_counters()
-    current_timestamp = time.time()
-    
-    # If this is the first call, initialize and return zeros
-    if _previous_net_io is None or _previous_timestamp is None:
-        _previous_net_io = current_net_io
-        _previous_timestamp = current_timestamp
-        return {
-            'bytes_sent_per_sec': 0.0,
-            'bytes_recv_per_sec': 0.0,
-            'packets_sent_per_sec': 0.0,
-            'packets_recv_per_sec': 0.0,
-            'upload_utilization_percent': 0.0,
-            'download_utilization_percent': 0.0,
-            'total_utilization_percent': 0.0,
-            'timestamp': current_timestamp
-        }
-    
-    # Calculate time delta
-    time_delta = current_timestamp - _previous_timestamp
-    
-    if time_delta == 0:
-        time_delta = 1  # Avoid division by zero
-    
-    # Calculate bytes per second
-    bytes_sent_per_sec = (current_net_io.bytes_sent - _previous_net_io.bytes_sent) / time_delta
-    bytes_recv_per_sec = (current_net_io.bytes_recv - _previous_net_io.bytes_recv) / time_delta
-    
-    # Calculate packets per second
-    packets_sent_per_sec = (current_net_io.packets_sent - _previous_net_io.packets_sent) / time_delta
-    packets_recv_per_sec = (current_net_io.packets_recv - _previous_net_io.packets_recv) / time_delta
+    engine = get_rate_engine() or init_rate_engine(Config)
+    rates = engine.rates(window=window)
     
     # Get network capacity from config (in Mbps, convert to bytes/sec)
     capacity_mbps = getattr(Config, 'NETWORK_CAPACITY_MBPS', 100)
     typical_capacity_bytes_per_sec = capacity_mbps * 1000 * 1000 / 8
     
-    upload_utilization = min(100, (bytes_sent_per_sec / typical_capacity_bytes_per_sec) * 100)
-    download_utilization = min(100, (bytes_recv_per_sec / typical_capacity_bytes_per_sec) * 100)
-    total_utilization = min(100, ((bytes_sent_per_sec + bytes_recv_per_sec) / (2 * typical_capacity_bytes_per_sec)) * 100)
+    load = _load(rates['current'], typical_capacity_bytes_per_sec)
+    load['timestamp'] = rates['timestamp']
+    load['age_seconds'] = rates['age_seconds']
+    load['smoothed'] = _load(rates['ewma'], typical_capacity_bytes_per_sec)
+    load['average'] = _load(rates['average'], typical_capacity_bytes_per_sec)
+    load['average']['window_seconds'] = rates['window_seconds']
+    return load
+
+
+def _error_rates(rates):
+    """Error and drop rates of one set of per-second rates"""
+    return {f'{field}_per_sec': round(rates[field], 2) for field in ('errin', 'errout', 'dropin', 'dropout')}
+
+
+def get_interface_load(interfaces=None, window=60):
+    """
+    Load of each network interface against its own capacity
+
+    Capacities come from INTERFACE_CAPACITY_MBPS, else the link speed,
+    else NETWORK_CAPACITY_MBPS (services.rates.interface_capacities).
+
+    Args:
+        interfaces: names to include (default: all tracked interfaces)
+        window: seconds of the 'average' rates
+
+    Returns:
+        list of per-interface load dicts, busiest first
+    """
+    from config import Config
+    from services.background_tasks import get_rate_engine, init_rate_engine
     
-    # Update previous values
-    _previous_net_io = current_net_io
-    _previous_timestamp = current_timestamp
+    engine = get_rate_engine() or init_rate_engine(Config)
+    capacities = interface_capacities(Config)
+    default_capacity = {'capacity_mbps': getattr(Config, 'NETWORK_CAPACITY_MBPS', 100),
+                        'capacity_source': 'default', 'is_up': None}
     
-    return {
-        'bytes_sent_per_sec': round(bytes_sent_per_sec, 2),
-        'bytes_recv_per_sec': round(bytes_recv_per_sec, 2),
-        'packets_sent_per_sec': round(packets_sent_per_sec, 2),
-        'packets_recv_per_sec': round(packets_recv_per_sec, 2),
-        'upload_utilization_percent': round(upload_utilization, 2),
-        'download_utilization_percent': round(download_utilization, 2),
-        'total_utilization_percent': round(total_utilization, 2),
-        'timestamp': current_timestamp
-    }
+    loads = []
+    for name in engine.series():
+        if interfaces and name not in interfaces:
+            continue
+        rates = engine.rates(key=name, window=window)
+        if rates is None:
+            continue
+        capacity = capacities.get(name, default_capacity)
+        capacity_bytes_per_sec = capacity['capacity_mbps'] * 1000 * 1000 / 8
+        load = {'name': name, **capacity}
+        load.update(_load(rates['current'], capacity_bytes_per_sec))
+        load.update(_error_rates(rates['current']))
+        load['smoothed'] = _load(rates['ewma'], capacity_bytes_per_sec)
+        load['average'] = _load(rates['average'], capacity_bytes_per_sec)
+        load['average'].update(_error_rates(rates['average']))
+        load['average']['window_seconds'] = rates['window_seconds']
+        load['timestamp'] = rates['timestamp']
+        loads.append(load)
+    
+    loads.sort(key=lambda load: max(load['upload_utilization_percent'], load['download_utilization_percent']),
+               reverse=True)
+    return loads
+
+
+def get_interface_rate_history(interfaces=None, seconds=300):
+    """
+    Per-second rates of each interface over the last seconds, from the rate engine's memory
+
+    Returns:
+        {interface: [{'timestamp', 'bytes_sent_per_sec', ...}]}, oldest first
+    """
+    from config import Config
+    from services.background_tasks import get_rate_engine, init_rate_engine
+    
+    engine = get_rate_engine() or init_rate_engine(Config)
+    history = {}
+    for name in engine.series():
+        if interfaces and name not in interfaces:
+            continue
+        history[name] = [
+            dict({f'{field}_per_sec': round(value, 2) for field, value in rates.items()}, timestamp=timestamp)
+            for timestamp, rates in engine.history(key=name, seconds=seconds)
+        ]
+    return history
 
 
 def get_system_stats():
-    """Get system statistics"""
+    """
+    Get system statistics
+
+    Served from the background system sampler's latest snapshot (with its
+    age) when it is running; otherwise sampled here, which blocks for a
+    second to measure CPU usage.
+    """
+    from services.background_tasks import get_system_sampler
+    sampler = get_system_sampler()
+    if sampler is not None:
+        stats = sampler.system_stats()
+        if stats is not None:
+            return stats
+
     cpu_percent = psutil.cpu_percent(interval=1)
     memory = psutil.virtual_memory()
     disk = psutil.disk_usage('/')
     
-    # Network interfaces
-    net_if_addrs = psutil.net_if_addrs()
-    interfaces = []
-    
-    for interface_name, addrs in net_if_addrs.items():
-        for addr in addrs:
-            if addr.family == socket.AF_INET:
-                interfaces.append({
-                    'name': interface_name,
-                    'address': addr.address,
-                    'netmask': addr.netmask
-                })
-    
     return {
         'cpu': {
             'percent': cpu_percent,
@@ -123,10 +199,153 @@ def get_system_stats():
             'free': disk.free,
             'percent': disk.percent
         },
-        'network_interfaces': interfaces
+        'network_interfaces': read_interfaces()
     }
 
 
+# TCP states as numbered in /proc/net/tcp (include/net/tcp_states.h); request
+# sockets of half-open connections (NEW_SYN_RECV) are counted as SYN_RECV
+TCP_STATES = {
+    b'01': 'ESTABLISHED', b'02': 'SYN_SENT', b'03': 'SYN_RECV', b'04': 'FIN_WAIT1', b'05': 'FIN_WAIT2',
+    b'06': 'TIME_WAIT', b'07': 'CLOSE', b'08': 'CLOSE_WAIT', b'09': 'LAST_ACK', b'0A': 'LISTEN',
+    b'0B': 'CLOSING', b'0C': 'SYN_RECV'
+}
+
+# State counts with alert thresholds: (state, config setting, alert type)
+CONNECTION_THRESHOLDS = (
+    ('ESTABLISHED', 'TCP_ESTABLISHED_THRESHOLD', 'tcp_established'),
+    ('TIME_WAIT', 'TCP_TIME_WAIT_THRESHOLD', 'tcp_time_wait'),
+    ('SYN_RECV', 'TCP_SYN_RECV_THRESHOLD', 'tcp_syn_recv'),
+)
+
+_UNSPECIFIED = {b'00000000', b'0' * 32}
+
+
+def _decode_proc_address(hex_address):
+    """Address string of a /proc/net/tcp{,6} hex address (32-bit words in host byte order)"""
+    raw = bytes.fromhex(hex_address.decode())
+    if sys.byteorder == 'little':
+        raw = b''.join(raw[i:i + 4][::-1] for i in range(0, len(raw), 4))
+    if len(raw) == 4:
+        return socket.inet_ntop(socket.AF_INET, raw)
+    address = ipaddress.IPv6Address(raw)
+    # IPv4 clients of dual-stack listeners are counted with the same addresses over IPv4
+    return str(address.ipv4_mapped or address)
+
+
+class TcpConnectionCollector:
+    """
+    Counts of TCP sockets by state and remote address
+
+    Reads /proc/net/tcp and /proc/net/tcp6 into reusable buffers and only
+    splits off the first four fields of each line; addresses are counted
+    as hex and only the distinct ones are decoded. psutil.net_connections()
+    builds an object per socket and looks up owning processes, so it is
+    used only where /proc is not available.
+    """
+
+    def __init__(self, root='/proc', top=10):
+        self.files = [ProcFile(os.path.join(root, 'net', name), size=65536) for name in ('tcp', 'tcp6')]
+        self.use_proc = os.access(self.files[0].path, os.R_OK)
+        self.top = top
+
+    def _count_proc(self):
+        states = Counter()
+        remotes = Counter()
+        for proc_file in self.files:
+            try:
+                lines = proc_file.read().split(b'\n')
+            except FileNotFoundError:
+                continue  # no tcp6 without IPv6
+            # sl local_address rem_address st ...; the first line is the header
+            rows = [line.split(None, 4) for line in lines[1:] if line]
+            states.update(row[3] for row in rows)
+            # Remote addresses are 'address:port' with a 4-digit port; listeners have none
+            remotes.update(row[2][:-5] for row in rows if row[3] != b'0A')
+        named_states = Counter()
+        for code, count in states.items():
+            named_states[TCP_STATES.get(code, 'UNKNOWN')] += count
+        named_remotes = Counter()
+        for address, count in remotes.items():
+            if address not in _UNSPECIFIED:
+                named_remotes[_decode_proc_address(address)] += count
+        return named_states, named_remotes
+
+    @staticmethod
+    def _count_psutil():
+        states = Counter()
+        remotes = Counter()
+        for connection in psutil.net_connections('tcp'):
+            states[connection.status] += 1
+            if connection.raddr and connection.status != psutil.CONN_LISTEN:
+                remotes[connection.raddr.ip] += 1
+        return states, remotes
+
+    def collect(self):
+        """
+        Current TCP connection counts
+
+        Returns:
+            {'total', 'states': {state: count}, 'top_remote_addresses':
+            [{'address', 'connections'}], 'collected_at', 'collect_ms', 'source'}
+        """
+        started = time.perf_counter()
+        if self.use_proc:
+            states, remotes = self._count_proc()
+        else:
+            states, remotes = self._count_psutil()
+        counts = dict.fromkeys(TCP_STATES.values(), 0)
+        counts.update(states)
+        return {
+            'total': sum(states.values()),
+            'states': counts,
+            'top_remote_addresses': [{'address': address, 'connections': count}
+                                     for address, count in remotes.most_common(self.top)],
+            'collected_at': datetime.utcnow().isoformat(),
+            'collect_ms': round((time.perf_counter() - started) * 1000, 3),
+            'source': 'proc' if self.use_proc else 'psutil'
+        }
+
+
+_connection_collector = None
+_connection_stats = None  # (monotonic time, result) of the latest collection
+_connection_lock = threading.Lock()
+
+
+def get_connection_stats(max_age=None):
+    """
+    TCP connection counts by state and top remote addresses
+
+    Results are reused for max_age seconds (default CONNECTION_SAMPLE_INTERVAL),
+    so frequent callers (dashboards, the background monitor) share one read
+    of the connection table; one caller collects while the others wait.
+    """
+    from config import Config
+    global _connection_collector, _connection_stats
+    
+    if max_age is None:
+        max_age = getattr(Config, 'CONNECTION_SAMPLE_INTERVAL', 5)
+    with _connection_lock:
+        if _connection_stats is not None and time.monotonic() - _connection_stats[0] < max_age:
+            return _connection_stats[1]
+        if _connection_collector is None:
+            _connection_collector = TcpConnectionCollector(top=getattr(Config, 'CONNECTION_TOP_REMOTES', 10))
+        stats = _connection_collector.collect()
+        _connection_stats = (time.monotonic(), stats)
+        return stats
+
+
+def connection_alerts(stats, config):
+    """[(alert type, message)] of the connection state counts above their thresholds"""
+    alerts = []
+    for state, setting, alert_type in CONNECTION_THRESHOLDS:
+        threshold = getattr(config, setting, None)
+        count = stats['states'].get(state, 0)
+        if threshold and count > threshold:
+            alerts.append((alert_type, f"{count} TCP connections in {state} (threshold {threshold})"))
+    return alerts
+
+
 def run_speed_test():
     """
     Run network speed test using speedtest-cli package
@@ -204,4 +423,11 @@ def check_thresholds(config):
             'severity': 'warning'
         })
     
+    for alert_type, message in connection_alerts(get_connection_stats(), config):
+        alerts.append({
+            'type': alert_type,
+            'message': message,
+            'severity': 'warning'
+        })
+    
     return alerts
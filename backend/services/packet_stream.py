@@ -0,0 +1,151 @@
+"""
+Live packet streaming over Server-Sent Events
+
+A stream subscribes to the capture service's ring buffer with a server-side
+filter, coalesces the packets that arrive within each interval into one
+event and caps the packets sent per second with a token bucket. Packets
+beyond the cap are counted, not buffered, and the subscription queue is
+bounded, so a stream uses the same memory whether it runs for a second or
+a day.
+"""
+import ipaddress
+import json
+import time
+
+
+class PacketFilter:
+    """Server-side packet filter on protocol, addresses and ports"""
+
+    def __init__(self, protocol='all', ip=None, src_ip=None, dst_ip=None, port=None):
+        self.protocol = (protocol or 'all').lower()
+        self.ip = self._address(ip)
+        self.src_ip = self._address(src_ip)
+        self.dst_ip = self._address(dst_ip)
+        self.port = int(port) if port not in (None, '') else None
+        if self.port is not None and not 0 <= self.port <= 65535:
+            raise ValueError("Port must be between 0 and 65535")
+
+    @staticmethod
+    def _address(value):
+        """Exact address string, or an ip_network for CIDR filters"""
+        if not value:
+            return None
+        if '/' in value:
+            return ipaddress.ip_network(value, strict=False)
+        return str(ipaddress.ip_address(value))
+
+    @staticmethod
+    def _match_address(wanted, address):
+        if isinstance(wanted, str):
+            return address == wanted
+        try:
+            return address is not None and ipaddress.ip_address(address) in wanted
+        except ValueError:
+            return False
+
+    @classmethod
+    def from_args(cls, args):
+        """
+        Build a filter from request query parameters
+
+        Raises:
+            ValueError: for malformed addresses or ports
+        """
+        return cls(
+            protocol=args.get('protocol', 'all'),
+            ip=args.get('ip'),
+            src_ip=args.get('src_ip'),
+            dst_ip=args.get('dst_ip'),
+            port=args.get('port')
+        )
+
+    def __call__(self, packet_data):
+        if self.protocol not in ('all', 'ip') and (packet_data.get('protocol') or '').lower() != self.protocol:
+            return False
+        if self.port is not None and self.port not in (packet_data.get('src_port'), packet_data.get('dst_port')):
+            return False
+        if self.src_ip is not None and not self._match_address(self.src_ip, packet_data.get('src_ip')):
+            return False
+        if self.dst_ip is not None and not self._match_address(self.dst_ip, packet_data.get('dst_ip')):
+            return False
+        if self.ip is not None and not (self._match_address(self.ip, packet_data.get('src_ip')) or
+                                        self._match_address(self.ip, packet_data.get('dst_ip'))):
+            return False
+        return True
+
+
+def format_event(event, data, event_id=None):
+    """Encode one Server-Sent Event"""
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data, separators=(",", ":"))}')
+    return '\n'.join(lines) + '\n\n'
+
+
+class PacketStream:
+    """Turns a ring buffer subscription into coalesced, rate limited SSE events"""
+
+    def __init__(self, subscription, interval=0.5, max_rate=200, duration=None, heartbeat=15):
+        self.subscription = subscription
+        self.interval = interval
+        self.max_rate = max_rate
+        self.duration = duration
+        self.heartbeat = heartbeat
+        # Token bucket: refills at max_rate per second, holds at most one second of packets
+        self._tokens = float(max_rate)
+        self._refilled = time.monotonic()
+        self.sent = 0
+        self.suppressed = 0
+
+    def _take_tokens(self, wanted):
+        now = time.monotonic()
+        self._tokens = min(float(self.max_rate), self._tokens + (now - self._refilled) * self.max_rate)
+        self._refilled = now
+        granted = min(wanted, int(self._tokens))
+        self._tokens -= granted
+        return granted
+
+    def _stats(self):
+        return {'sent': self.sent, 'suppressed': self.suppressed, 'dropped': self.subscription.dropped}
+
+    def events(self):
+        """
+        Yield SSE-encoded events until the duration ends or the client disconnects
+
+        Events: 'packets' (batch of the newest packets within the rate limit),
+        'end' (duration reached), plus comment heartbeats while idle.
+        """
+        deadline = time.monotonic() + self.duration if self.duration else None
+        drain_size = self.subscription.maxsize
+        try:
+            while True:
+                wait = self.heartbeat
+                if deadline is not None:
+                    wait = min(wait, deadline - time.monotonic())
+                    if wait <= 0:
+                        yield format_event('end', self._stats())
+                        return
+
+                items = self.subscription.get(timeout=wait, max_items=drain_size)
+                if not items:
+                    if deadline is None or time.monotonic() < deadline:
+                        yield ': keepalive\n\n'
+                    continue
+
+                # Coalesce whatever else arrives within the interval into one event
+                time.sleep(self.interval)
+                items += self.subscription.get(timeout=0, max_items=drain_size)
+
+                granted = self._take_tokens(len(items))
+                self.suppressed += len(items) - granted
+                # A live view wants the newest packets when it cannot have all of them
+                batch = items[len(items) - granted:] if granted else []
+                self.sent += len(batch)
+                yield format_event(
+                    'packets',
+                    dict(self._stats(), packets=[packet_data for _, packet_data in batch]),
+                    event_id=items[-1][0]
+                )
+        finally:
+            self.subscription.close()
@@ -0,0 +1,257 @@
+"""
+Write-behind storage for captured packets
+
+Capture code hands the writer plain row tuples; a background thread flushes
+them with a single Core executemany INSERT per batch, bounded by size and
+time. This skips ORM object hydration and unit-of-work bookkeeping, which
+dominate CPU and memory at a few thousand packets per second.
+
+A batch failing on a database or connection error is retried with
+exponential backoff (bounded in attempts and delay). A batch that still
+fails is bisected to isolate the rows the database rejects, so one bad row does not cost the whole batch; rows that
+cannot be written (rejected rows, or every row while the database stays
+unavailable) are appended to a dead-letter file as JSON lines.
+"""
+import json
+import os
+import threading
+import time
+import logging
+from collections import deque
+from datetime import datetime, date
+from sqlalchemy.exc import OperationalError, InterfaceError
+from models import db, PacketCapture
+
+# Column order of the tuples accepted by a default PacketWriter.submit()
+PACKET_COLUMNS = (
+    'timestamp', 'protocol', 'src_ip', 'dst_ip', 'src_port',
+    'dst_port', 'length', 'tcp_flags', 'sample_rate', 'user_id', 'icmp_type',
+    'device_id', 'subnet'
+)
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    return str(value)
+
+
+def _is_transient(error):
+    """True for errors of the database or connection rather than of the rows"""
+    return isinstance(error, (OperationalError, InterfaceError)) or getattr(error, 'connection_invalidated', False)
+
+
+class PacketWriter:
+    """
+    Accumulates rows and bulk inserts them in batches
+
+    Writes packet_captures rows by default; pass table and columns to reuse
+    the same batching for another table (e.g. exported flow records).
+    """
+
+    def __init__(self, app, batch_size=500, flush_interval=1.0, max_backlog=100000,
+                 table=None, columns=PACKET_COLUMNS, name='Packet writer',
+                 retries=3, retry_backoff=0.5, dead_letter_dir=None):
+        self.app = app
+        self.name = name
+        self.columns = columns
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backlog = max_backlog
+        self.retries = retries  # attempts after the first one failed
+        self.retry_backoff = retry_backoff  # seconds before the first retry, doubled for each further one
+        self.max_retry_delay = 5.0
+        # Rows that could not be written are appended here (None only counts them)
+        self.dead_letter_path = os.path.join(
+            dead_letter_dir, name.lower().replace(' ', '_') + '.jsonl'
+        ) if dead_letter_dir else None
+        self.running = False
+        self.thread = None
+        self._backlog = deque()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._insert = (table if table is not None else PacketCapture.__table__).insert()
+
+        # Metrics
+        self.rows_submitted = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.rows_failed = 0  # not written: rejected by the database or given up on
+        self.rows_dead_lettered = 0  # failed rows saved to the dead-letter file
+        self.batch_retries = 0  # insert attempts repeated after a failure
+        self.batches = 0
+        self.last_batch_size = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def start(self):
+        """Start the background flush thread"""
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._writer_loop, daemon=True)
+            self.thread.start()
+            print(f"{self.name} started")
+
+    def stop(self):
+        """Stop the flush thread after writing whatever is still queued"""
+        self.running = False
+        with self._cond:
+            self._cond.notify()
+        if self.thread:
+            self.thread.join(timeout=10)
+            print(f"{self.name} stopped")
+        self.flush()
+
+    def submit(self, row):
+        """Queue one row (a tuple in column order)"""
+        self.submit_many((row,))
+
+    def submit_many(self, rows):
+        """Queue several rows; rows beyond max_backlog are dropped and counted"""
+        with self._cond:
+            for row in rows:
+                if len(self._backlog) >= self.max_backlog:
+                    self.rows_dropped += 1
+                    continue
+                self._backlog.append(row)
+                self.rows_submitted += 1
+            if len(self._backlog) >= self.batch_size:
+                self._cond.notify()
+
+    def wait_for_backlog(self, limit, timeout=None):
+        """
+        Block until at most limit rows are queued
+
+        Bulk producers (e.g. offline pcap ingestion) call this between batches
+        so they are slowed down instead of overflowing the backlog.
+
+        Returns:
+            True if the backlog drained below limit, False on timeout
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._cond:
+            while len(self._backlog) > limit:
+                if deadline is not None and time.time() >= deadline:
+                    return False
+                if not self.running:
+                    break
+                self._cond.notify()
+                self._cond.wait(0.05)
+        if not self.running:
+            self.flush()
+        return True
+
+    def _writer_loop(self):
+        """Flush when a full batch is queued or flush_interval has passed"""
+        while self.running:
+            with self._cond:
+                if len(self._backlog) < self.batch_size and self.running:
+                    self._cond.wait(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error in {self.name.lower()}: {e}")
+                time.sleep(1)
+
+    def flush(self):
+        """Synchronously write everything currently queued"""
+        with self._flush_lock:
+            while True:
+                with self._cond:
+                    if not self._backlog:
+                        return
+                    size = min(self.batch_size, len(self._backlog))
+                    batch = [self._backlog.popleft() for _ in range(size)]
+                self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        error = self._insert_rows(batch)
+        for attempt in range(self.retries):
+            # Rows the database rejects are rejected again; only outages are waited out
+            if error is None or not _is_transient(error):
+                break
+            delay = min(self.retry_backoff * 2 ** attempt, self.max_retry_delay)
+            logging.warning(f"{self.name} batch insert failed ({len(batch)} rows), retrying in {delay:.1f}s: {error}")
+            time.sleep(delay)
+            self.batch_retries += 1
+            error = self._insert_rows(batch)
+        if error is not None:
+            self._salvage(batch, error)
+
+    def _salvage(self, batch, error):
+        """Write what the database accepts of a failed batch by bisecting it; dead-letter the rest"""
+        if len(batch) == 1 or _is_transient(error):
+            # A rejected row, or the database is still unavailable
+            self._dead_letter(batch, error)
+            return
+        middle = len(batch) // 2
+        for half in (batch[:middle], batch[middle:]):
+            error = self._insert_rows(half)
+            if error is not None:
+                self._salvage(half, error)
+
+    def _insert_rows(self, batch):
+        """One INSERT of a batch; returns the error, or None once it is committed"""
+        started = time.perf_counter()
+        rows = [dict(zip(self.columns, row)) for row in batch]
+        try:
+            with self.app.app_context():
+                db.session.execute(self._insert, rows)
+                db.session.commit()
+        except Exception as e:
+            try:
+                with self.app.app_context():
+                    db.session.rollback()
+            except Exception:
+                pass
+            return e
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.batches += 1
+        self.rows_written += len(batch)
+        self.last_batch_size = len(batch)
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.total_flush_ms += elapsed_ms
+        return None
+
+    def _dead_letter(self, batch, error):
+        self.rows_failed += len(batch)
+        logging.error(f"{self.name} could not write {len(batch)} rows: {error}")
+        if self.dead_letter_path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.dead_letter_path), exist_ok=True)
+            with open(self.dead_letter_path, 'a') as f:
+                for row in batch:
+                    f.write(json.dumps({'error': str(error).split('\n', 1)[0], 'row': dict(zip(self.columns, row))},
+                                       default=_json_default) + '\n')
+            self.rows_dead_lettered += len(batch)
+        except OSError as e:
+            logging.error(f"{self.name} could not write to {self.dead_letter_path}: {e}")
+
+    def metrics(self):
+        """Batch size, flush latency and backlog metrics"""
+        with self._cond:
+            backlog = len(self._backlog)
+        return {
+            'running': self.running,
+            'backlog': backlog,
+            'max_backlog': self.max_backlog,
+            'rows_submitted': self.rows_submitted,
+            'rows_written': self.rows_written,
+            'rows_dropped': self.rows_dropped,
+            'rows_failed': self.rows_failed,
+            'rows_dead_lettered': self.rows_dead_lettered,
+            'batch_retries': self.batch_retries,
+            'dead_letter_file': self.dead_letter_path,
+            'batches': self.batches,
+            'last_batch_size': self.last_batch_size,
+            'avg_batch_size': round(self.rows_written / self.batches, 2) if self.batches else 0.0,
+            'last_flush_ms': round(self.last_flush_ms, 3),
+            'avg_flush_ms': round(self.total_flush_ms / self.batches, 3) if self.batches else 0.0,
+            'max_flush_ms': round(self.max_flush_ms, 3)
+        }
@@ -0,0 +1,226 @@
+"""
+Daily range partitions for the time-series tables (MySQL)
+
+packet_captures, traffic_logs and system_resource_logs are partitioned by
+RANGE COLUMNS on their timestamp, one partition per UTC day plus a
+MAXVALUE catch-all for rows beyond the last day. Queries on a time window
+only read the partitions it overlaps, and retention drops whole partitions,
+a metadata operation instead of a long DELETE.
+
+MySQL requires the partitioning column in every unique key and does not
+support foreign keys on partitioned tables, so converting a table changes
+its primary key to (id, timestamp) and drops its foreign keys.
+
+Every app process starts a PartitionManager; a maintenance run first takes
+the 'partitions' lease in job_leases, so only one process at a time runs the
+partition DDL.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, date, timedelta
+from sqlalchemy import text
+
+from models import db
+from services.leases import acquire_lease, process_owner
+
+# Partitioned table -> (time column, config attribute with its retention in days)
+PARTITIONED_TABLES = {
+    'packet_captures': ('timestamp', 'PACKET_RETENTION_DAYS'),
+    'traffic_logs': ('timestamp', 'TRAFFIC_LOG_RETENTION_DAYS'),
+    'system_resource_logs': ('timestamp', 'RESOURCE_LOG_RETENTION_DAYS'),
+}
+
+# Catch-all partition for rows past the last daily partition
+FUTURE_PARTITION = 'pfuture'
+
+
+def partition_name(day):
+    """Name of the partition holding the rows of one day"""
+    return 'p' + day.strftime('%Y%m%d')
+
+
+def partition_definition(day):
+    return f"PARTITION {partition_name(day)} VALUES LESS THAN ('{(day + timedelta(days=1)).isoformat()}')"
+
+
+def plan_partitions(partitions, today, retention_days, precreate_days):
+    """
+    Daily partitions to add and expired partitions to drop
+
+    Args:
+        partitions: [(name, exclusive upper bound date, or None for MAXVALUE)] in order
+        today: current UTC date
+        retention_days: days of data to keep, 0 to keep everything
+        precreate_days: days ahead of today that must have a partition
+
+    Returns:
+        tuple of (days to create partitions for, names of partitions to drop)
+    """
+    bounds = [(name, bound) for name, bound in partitions if bound is not None]
+    cutoff = today - timedelta(days=retention_days) if retention_days else None
+
+    day = bounds[-1][1] if bounds else today
+    if cutoff is not None and day < cutoff - timedelta(days=1):
+        # Maintenance was not run for a while: one partition spans the gap
+        # up to the cutoff instead of one per expired day
+        day = cutoff - timedelta(days=1)
+    create = []
+    while day <= today + timedelta(days=precreate_days):
+        create.append(day)
+        day += timedelta(days=1)
+
+    drop = []
+    if cutoff is not None:
+        # Every row of a partition bounded at or before the cutoff has expired
+        drop = [name for name, bound in bounds if bound <= cutoff]
+        drop += [partition_name(day) for day in create if day + timedelta(days=1) <= cutoff]
+    return create, drop
+
+
+def conversion_statements(table, column, foreign_keys, today, retention_days, precreate_days):
+    """
+    DDL converting an unpartitioned table to daily partitions
+
+    The first partition takes every row before the retention window (or
+    before today when everything is kept), so it is the first one dropped.
+    """
+    first_day = today - timedelta(days=retention_days)
+    definitions = [
+        f"PARTITION {partition_name(first_day - timedelta(days=1))} VALUES LESS THAN ('{first_day.isoformat()}')"
+    ]
+    day = first_day
+    while day <= today + timedelta(days=precreate_days):
+        definitions.append(partition_definition(day))
+        day += timedelta(days=1)
+    definitions.append(f"PARTITION {FUTURE_PARTITION} VALUES LESS THAN (MAXVALUE)")
+
+    changes = [f"DROP FOREIGN KEY {name}" for name in foreign_keys]
+    changes += [f"MODIFY {column} DATETIME NOT NULL", f"DROP PRIMARY KEY, ADD PRIMARY KEY (id, {column})"]
+    return [
+        f"UPDATE {table} SET {column} = '1970-01-01' WHERE {column} IS NULL",
+        f"ALTER TABLE {table} " + ', '.join(changes),
+        f"ALTER TABLE {table} PARTITION BY RANGE COLUMNS({column}) (" + ', '.join(definitions) + ")",
+    ]
+
+
+def list_partitions(connection, table):
+    """[(name, upper bound date or None)] of a table, empty if it is not partitioned"""
+    rows = connection.execute(text(
+        "SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION"
+    ), {'table': table}).fetchall()
+    # Bounds are reported as quoted literals, e.g. '2026-10-19 00:00:00'
+    return [(name, None if description == 'MAXVALUE' else date.fromisoformat(description.strip("'")[:10]))
+            for name, description in rows]
+
+
+def partition_tables(connection, inspector, config, today=None):
+    """
+    Convert the time-series tables that are not partitioned yet
+
+    Returns:
+        list of converted table names
+    """
+    today = today or datetime.utcnow().date()
+    existing = set(inspector.get_table_names())
+    converted = []
+    for table, (column, retention_attr) in PARTITIONED_TABLES.items():
+        if table not in existing or list_partitions(connection, table):
+            continue
+        foreign_keys = [fk['name'] for fk in inspector.get_foreign_keys(table) if fk.get('name')]
+        for statement in conversion_statements(table, column, foreign_keys, today,
+                                               getattr(config, retention_attr, 0),
+                                               getattr(config, 'PARTITION_PRECREATE_DAYS', 7)):
+            connection.execute(text(statement))
+        converted.append(table)
+    return converted
+
+
+class PartitionManager:
+    """Keeps future daily partitions created and drops expired ones"""
+
+    def __init__(self, app, config):
+        self.app = app
+        self.precreate_days = getattr(config, 'PARTITION_PRECREATE_DAYS', 7)
+        self.interval = getattr(config, 'PARTITION_MAINTENANCE_INTERVAL', 3600)
+        self.retention_days = {table: getattr(config, attr, 0) for table, (_, attr) in PARTITIONED_TABLES.items()}
+        self.owner = process_owner()
+        # Renewed every run; lapses if the holder misses a run, so another process takes over
+        self.lease_seconds = 2 * self.interval
+        self.running = False
+        self.thread = None
+        self.last_run = None
+        self.last_report = {}
+        self.skipped = 0
+        self.errors = 0
+
+    def start(self):
+        """Start periodic partition maintenance"""
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._maintenance_loop, daemon=True)
+            self.thread.start()
+            print("Partition maintenance started")
+
+    def stop(self):
+        """Stop partition maintenance"""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=5)
+            print("Partition maintenance stopped")
+
+    def _maintenance_loop(self):
+        deadline = 0.0
+        while self.running:
+            if time.time() >= deadline:
+                self.maintain()
+                deadline = time.time() + self.interval
+            time.sleep(0.5)
+
+    def maintain(self, today=None):
+        """
+        Add the partitions of the coming days and drop expired ones
+
+        Returns:
+            {table: {'created': [partition names], 'dropped': [partition names]}}
+            for the partitioned tables; empty on databases without partitioning,
+            None when another process holds the partitions lease
+        """
+        today = today or datetime.utcnow().date()
+        report = {}
+        try:
+            with self.app.app_context():
+                if db.engine.dialect.name != 'mysql':
+                    return report
+                if not acquire_lease('partitions', self.owner, self.lease_seconds):
+                    # Another process maintains the partitions
+                    self.skipped += 1
+                    return None
+                with db.engine.begin() as connection:
+                    for table in PARTITIONED_TABLES:
+                        partitions = list_partitions(connection, table)
+                        if not partitions:
+                            logging.warning(f"{table} is not partitioned; run 'python init_db.py migrate'")
+                            continue
+                        create, drop = plan_partitions(partitions, today, self.retention_days[table], self.precreate_days)
+                        if create:
+                            definitions = ', '.join(partition_definition(day) for day in create)
+                            if partitions[-1][1] is None:
+                                # The catch-all is split; it is normally empty so this is cheap
+                                connection.execute(text(
+                                    f"ALTER TABLE {table} REORGANIZE PARTITION {partitions[-1][0]} INTO "
+                                    f"({definitions}, PARTITION {partitions[-1][0]} VALUES LESS THAN (MAXVALUE))"
+                                ))
+                            else:
+                                connection.execute(text(f"ALTER TABLE {table} ADD PARTITION ({definitions})"))
+                        if drop:
+                            connection.execute(text(f"ALTER TABLE {table} DROP PARTITION {', '.join(drop)}"))
+                        report[table] = {'created': [partition_name(day) for day in create], 'dropped': drop}
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"Error maintaining partitions: {e}")
+        self.last_run = datetime.utcnow()
+        self.last_report = report
+        return report
@@ -0,0 +1,271 @@
+"""
+Offline capture ingestion
+
+Streams .pcap/.pcapng files through the raw record reader and the same
+decode -> sample -> save_packets path as live capture, so imported traffic
+lands in the same packet/flow storage and statistics. Progress and
+throughput are tracked while the file is read; uploads are ingested in a
+background thread and polled through their job id. Job progress is written
+to the ingest_jobs table, so any app process (gunicorn worker) can answer
+the poll, not only the one that accepted the upload.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from scapy.all import conf
+from models import db, IngestJobRecord
+from services.capture import save_packets, matches_protocol
+from services.decoder import decode_with_fallback
+from services.pcap_reader import PcapReader, LINKTYPE_ETHERNET
+from services.sampling import PacketSampler
+
+
+class IngestProgress:
+    """Counters of one ingestion run"""
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.status = 'pending'
+        self.error = None
+        self.format = None
+        self.bytes_total = None
+        self.bytes_read = 0
+        self.records = 0
+        self.packets = 0
+        self.skipped = 0
+        self.errors = 0
+        self.started = None
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def to_dict(self):
+        elapsed = self.elapsed
+        return {
+            'filename': self.filename,
+            'status': self.status,
+            'error': self.error,
+            'format': self.format,
+            'bytes_total': self.bytes_total,
+            'bytes_read': self.bytes_read,
+            'percent': round(100.0 * self.bytes_read / self.bytes_total, 1) if self.bytes_total else None,
+            'records': self.records,
+            'packets': self.packets,
+            'skipped': self.skipped,
+            'errors': self.errors,
+            'elapsed': round(elapsed, 3),
+            'records_per_second': round(self.records / elapsed) if elapsed else 0,
+            'mb_per_second': round(self.bytes_read / elapsed / 1e6, 2) if elapsed else 0.0
+        }
+
+
+# scapy link layer classes by pcap link type
+_link_layers = {}
+
+
+def _link_layer(linktype):
+    """scapy class for a pcap link type; None for Ethernet (fast path)"""
+    if linktype == LINKTYPE_ETHERNET:
+        return None
+    if linktype not in _link_layers:
+        _link_layers[linktype] = conf.l2types.get(linktype)
+    return _link_layers[linktype]
+
+
+def ingest_capture(source, user_id, protocol='all', sampler=None, progress=None,
+                   on_progress=None, batch_size=1000, progress_interval=1.0):
+    """
+    Read a capture file and store its packets for a user
+
+    Args:
+        source: path or binary file object of a .pcap/.pcapng (optionally gzipped) file
+        user_id: User the packets are stored for
+        protocol: Protocol filter (tcp, udp, ip, icmp, or all)
+        sampler: Optional PacketSampler; rejected records are skipped before decoding
+        progress: Optional IngestProgress to update (e.g. one polled by a job)
+        on_progress: Optional callable invoked with the progress every progress_interval seconds
+        batch_size: Packets handed to save_packets at a time
+
+    Returns:
+        IngestProgress
+
+    Raises:
+        PcapFormatError: If the file is not a readable capture
+    """
+    from services.background_tasks import get_packet_writer
+    progress = progress or IngestProgress()
+    sampler = sampler or PacketSampler()
+    writer = get_packet_writer()
+    progress.status = 'running'
+    progress.started = time.time()
+    next_report = progress.started + progress_interval
+    batch = []
+
+    def store(packets):
+        if writer is not None:
+            # Slow down instead of overflowing the write-behind backlog
+            writer.wait_for_backlog(writer.max_backlog // 2)
+        save_packets(packets, user_id)
+        db.session.commit()
+
+    with PcapReader(source) as reader:
+        progress.format = reader.format
+        progress.bytes_total = reader.size
+        for frame, timestamp, linktype in reader:
+            progress.records += 1
+            if not sampler.accept():
+                progress.skipped += 1
+                continue
+
+            link_layer = _link_layer(linktype)
+            if link_layer is None and linktype != LINKTYPE_ETHERNET:
+                progress.skipped += 1
+                continue
+            try:
+                packet_data = decode_with_fallback(frame, timestamp, link_layer)
+            except Exception:
+                progress.errors += 1
+                continue
+            if packet_data is None or not matches_protocol(packet_data, protocol):
+                progress.skipped += 1
+                continue
+
+            packet_data['sample_rate'] = sampler.rate
+            batch.append(packet_data)
+            if len(batch) >= batch_size:
+                store(batch)
+                progress.packets += len(batch)
+                batch = []
+
+            if progress.records & 0x3FF == 0:
+                progress.bytes_read = reader.bytes_read or 0
+                if on_progress and time.time() >= next_report:
+                    on_progress(progress)
+                    next_report = time.time() + progress_interval
+
+        if batch:
+            store(batch)
+            progress.packets += len(batch)
+        progress.bytes_read = reader.bytes_read or progress.bytes_total or 0
+
+    progress.finished = time.time()
+    progress.status = 'completed'
+    if on_progress:
+        on_progress(progress)
+    return progress
+
+
+class IngestJob:
+    """An uploaded capture file being ingested in a background thread"""
+
+    def __init__(self, app, path, user_id, filename, protocol='all', sampler=None):
+        self.id = uuid.uuid4().hex
+        self.app = app
+        self.path = path
+        self.user_id = user_id
+        self.protocol = protocol
+        self.sampler = sampler
+        self.progress = IngestProgress(filename)
+        self.thread = None
+
+    def start(self):
+        with self.app.app_context():
+            self._store()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        with self.app.app_context():
+            try:
+                ingest_capture(self.path, self.user_id, self.protocol, self.sampler, self.progress,
+                               on_progress=lambda progress: self._store())
+            except Exception as e:
+                db.session.rollback()
+                self.progress.status = 'failed'
+                self.progress.error = str(e)
+                self.progress.finished = time.time()
+                print(f"Error ingesting {self.progress.filename}: {e}")
+            finally:
+                try:
+                    os.remove(self.path)
+                except OSError:
+                    pass
+                try:
+                    self._store()
+                except Exception as e:
+                    print(f"Error storing the status of ingestion job {self.id}: {e}")
+                with _jobs_lock:
+                    _jobs.pop(self.id, None)
+
+    def _store(self):
+        """Write the progress to the job's ingest_jobs row; commits the session"""
+        record = db.session.get(IngestJobRecord, self.id)
+        if record is None:
+            record = IngestJobRecord(id=self.id, user_id=self.user_id)
+            db.session.add(record)
+        record.status = self.progress.status
+        record.progress = json.dumps(self.to_dict())
+        record.updated_at = datetime.utcnow()
+        db.session.commit()
+
+    def to_dict(self):
+        return dict(self.progress.to_dict(), job_id=self.id)
+
+
+class StoredIngestJob:
+    """An ingestion job as last written to the ingest_jobs table, e.g. by another process"""
+
+    def __init__(self, record):
+        self.id = record.id
+        self.user_id = record.user_id
+        self.status = record.status
+        self._progress = json.loads(record.progress) if record.progress else {'job_id': record.id}
+        if self.status in ('pending', 'running') and record.updated_at < datetime.utcnow() - STALE_AFTER:
+            # Progress is written every second, so the process ingesting the file has stopped
+            self.status = 'failed'
+            self._progress.update(status=self.status, error="The process ingesting the file stopped")
+
+    def to_dict(self):
+        return dict(self._progress, status=self.status)
+
+
+# Ingestion jobs running in this process by id; every job is also in the ingest_jobs table
+_jobs = {}
+_jobs_lock = threading.Lock()
+MAX_TRACKED_JOBS = 100
+STALE_AFTER = timedelta(minutes=2)
+
+
+def start_ingest_job(app, path, user_id, filename, protocol='all', sampler=None):
+    """Start ingesting a saved upload in the background and return its job"""
+    job = IngestJob(app, path, user_id, filename, protocol, sampler)
+    with _jobs_lock:
+        _jobs[job.id] = job
+    job.start()
+    with app.app_context():
+        # Forget the oldest jobs beyond the tracking limit
+        expired = [row.id for row in db.session.query(IngestJobRecord.id).order_by(
+            IngestJobRecord.created_at.desc()).offset(MAX_TRACKED_JOBS)]
+        if expired:
+            IngestJobRecord.query.filter(IngestJobRecord.id.in_(expired)).delete(synchronize_session=False)
+            db.session.commit()
+    return job
+
+
+def get_ingest_job(job_id, user_id):
+    """Return a user's ingestion job, or None; jobs of other processes are read from the ingest_jobs table"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None:
+        record = db.session.get(IngestJobRecord, job_id)
+        job = StoredIngestJob(record) if record is not None else None
+    if job is None or job.user_id != user_id:
+        return None
+    return job
@@ -0,0 +1,197 @@
+"""
+Streaming reader for offline .pcap / .pcapng files
+
+Records are read straight from the file with struct and yielded as raw
+frame bytes, so multi-GB captures are processed in constant memory and no
+scapy packet objects are built. Gzip-compressed files are read transparently.
+
+Supported:
+- classic pcap, both byte orders, microsecond and nanosecond timestamps
+- pcapng sections in either byte order with Enhanced, Simple and (obsolete)
+  Packet blocks, per-interface link types and if_tsresol timestamp resolution
+"""
+import gzip
+import os
+import struct
+import time
+
+PCAP_MAGIC_US = 0xA1B2C3D4
+PCAP_MAGIC_NS = 0xA1B23C4D
+PCAPNG_SECTION_HEADER = 0x0A0D0D0A
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_INTERFACE_DESCRIPTION = 0x00000001
+PCAPNG_PACKET = 0x00000002
+PCAPNG_SIMPLE_PACKET = 0x00000003
+PCAPNG_ENHANCED_PACKET = 0x00000006
+PCAPNG_OPTION_TSRESOL = 9
+GZIP_MAGIC = b'\x1f\x8b'
+
+LINKTYPE_ETHERNET = 1
+
+
+class PcapFormatError(ValueError):
+    """The file is not a readable pcap/pcapng capture"""
+
+
+class PcapReader:
+    """
+    Iterates (frame, timestamp, linktype) over the records of a capture file
+
+    Args:
+        source: path or binary file object
+    """
+
+    def __init__(self, source):
+        if isinstance(source, (str, os.PathLike)):
+            self._raw = open(source, 'rb', buffering=1 << 20)
+            self._owns_file = True
+        else:
+            self._raw = source
+            self._owns_file = False
+
+        try:
+            self.size = os.fstat(self._raw.fileno()).st_size
+        except (AttributeError, OSError, ValueError):
+            self.size = None
+
+        head = self._raw.read(2)
+        self._raw.seek(0)
+        self.compressed = head == GZIP_MAGIC
+        self._file = gzip.GzipFile(fileobj=self._raw) if self.compressed else self._raw
+
+        magic = self._file.read(4)
+        if len(magic) < 4:
+            raise PcapFormatError("File is too short to be a capture")
+        if struct.unpack('<I', magic)[0] == PCAPNG_SECTION_HEADER:
+            self.format = 'pcapng'
+            self._records = self._pcapng_records(magic)
+        elif struct.unpack('<I', magic)[0] in (PCAP_MAGIC_US, PCAP_MAGIC_NS) or \
+                struct.unpack('>I', magic)[0] in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+            self.format = 'pcap'
+            self._records = self._pcap_records(magic)
+        else:
+            raise PcapFormatError("Unknown capture file format (expected pcap or pcapng)")
+        self.records = 0
+
+    @property
+    def bytes_read(self):
+        """Position in the (possibly compressed) file, for progress reporting"""
+        try:
+            return self._raw.tell()
+        except (OSError, ValueError):
+            return None
+
+    def __iter__(self):
+        for record in self._records:
+            self.records += 1
+            yield record
+
+    def close(self):
+        if self.compressed:
+            self._file.close()
+        if self._owns_file:
+            self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _read_exact(self, size):
+        data = self._file.read(size)
+        if len(data) < size:
+            raise PcapFormatError("Capture file is truncated")
+        return data
+
+    def _pcap_records(self, magic):
+        endian = '<' if struct.unpack('<I', magic)[0] in (PCAP_MAGIC_US, PCAP_MAGIC_NS) else '>'
+        divisor = 1e9 if struct.unpack(endian + 'I', magic)[0] == PCAP_MAGIC_NS else 1e6
+        _version_major, _version_minor, _zone, _sigfigs, _snaplen, linktype = struct.unpack(
+            endian + 'HHiIII', self._read_exact(20)
+        )
+        linktype &= 0xFFFF
+        record_header = struct.Struct(endian + 'IIII')
+        read = self._file.read
+
+        while True:
+            header = read(16)
+            if len(header) < 16:
+                if header:
+                    raise PcapFormatError("Capture file is truncated")
+                return
+            sec, frac, caplen, _orig_len = record_header.unpack(header)
+            frame = read(caplen)
+            if len(frame) < caplen:
+                raise PcapFormatError("Capture file is truncated")
+            yield frame, sec + frac / divisor, linktype
+
+    def _pcapng_records(self, magic):
+        endian = '<'
+        interfaces = []
+        pending = magic
+        while True:
+            head = pending + self._file.read(8 - len(pending)) if pending else self._file.read(8)
+            pending = None
+            if not head:
+                return
+            if len(head) < 8:
+                raise PcapFormatError("Capture file is truncated")
+
+            block_type = struct.unpack('<I', head[:4])[0]
+            if block_type == PCAPNG_SECTION_HEADER:
+                # The byte-order magic decides how this section is read
+                order = self._read_exact(4)
+                if struct.unpack('<I', order)[0] == PCAPNG_BYTE_ORDER_MAGIC:
+                    endian = '<'
+                elif struct.unpack('>I', order)[0] == PCAPNG_BYTE_ORDER_MAGIC:
+                    endian = '>'
+                else:
+                    raise PcapFormatError("Bad pcapng byte-order magic")
+                total_length = struct.unpack(endian + 'I', head[4:8])[0]
+                self._read_exact(total_length - 12)
+                interfaces = []
+                continue
+
+            block_type, total_length = struct.unpack(endian + 'II', head)
+            if total_length < 12:
+                raise PcapFormatError("Bad pcapng block length")
+            body = memoryview(self._read_exact(total_length - 8))
+
+            if block_type == PCAPNG_ENHANCED_PACKET:
+                interface_id, ts_high, ts_low, caplen, _orig_len = struct.unpack_from(endian + 'IIIII', body)
+                linktype, resolution = self._interface(interfaces, interface_id)
+                yield body[20:20 + caplen], ((ts_high << 32) | ts_low) * resolution, linktype
+            elif block_type == PCAPNG_SIMPLE_PACKET:
+                linktype, _resolution = self._interface(interfaces, 0)
+                caplen = min(struct.unpack_from(endian + 'I', body)[0], len(body) - 8)
+                # Simple packet blocks carry no timestamp
+                yield body[4:4 + caplen], time.time(), linktype
+            elif block_type == PCAPNG_PACKET:
+                interface_id, _drops, ts_high, ts_low, caplen, _orig_len = struct.unpack_from(endian + 'HHIIII', body)
+                linktype, resolution = self._interface(interfaces, interface_id)
+                yield body[20:20 + caplen], ((ts_high << 32) | ts_low) * resolution, linktype
+            elif block_type == PCAPNG_INTERFACE_DESCRIPTION:
+                linktype = struct.unpack_from(endian + 'H', body)[0]
+                interfaces.append((linktype, self._timestamp_resolution(body, endian)))
+
+    @staticmethod
+    def _interface(interfaces, interface_id):
+        if interface_id >= len(interfaces):
+            raise PcapFormatError(f"Packet references undefined interface {interface_id}")
+        return interfaces[interface_id]
+
+    @staticmethod
+    def _timestamp_resolution(body, endian):
+        """Seconds per timestamp unit from an interface block's if_tsresol option"""
+        offset = 8
+        end = len(body) - 4  # trailing block length
+        while offset + 4 <= end:
+            code, length = struct.unpack_from(endian + 'HH', body, offset)
+            if code == 0:
+                break
+            if code == PCAPNG_OPTION_TSRESOL and length >= 1:
+                value = body[offset + 4]
+                return 2.0 ** -(value & 0x7F) if value & 0x80 else 10.0 ** -value
+            offset += 4 + (length + 3) // 4 * 4
+        return 1e-6
@@ -0,0 +1,213 @@
+"""
+Background purge of a user's captured packets and flows
+
+Clearing used to be one DELETE per table over every row of the user,
+holding row locks on millions of rows in one transaction and stalling the
+packet writer. A purge now records the newest packet and flow ids at the
+time of the request and returns at once. From then on the statistics and
+listing queries hide the user's rows up to those ids (visible_rows()), and
+a worker deletes them in short id-ordered chunks. Purges are stored in the
+packet_purges table and resumed after a restart.
+
+Every app process (one per gunicorn worker) reads the hidden ids from the
+table, so a clear handled by one worker hides the rows in all of them, and
+only the process holding the 'packet-purge' lease deletes. A failed purge
+keeps its rows hidden and is retried.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func, and_, or_
+
+from models import db, PacketCapture, Flow, PacketPurge
+from services.leases import acquire_lease, process_owner
+
+PURGE_PENDING = 'pending'
+PURGE_RUNNING = 'running'
+PURGE_COMPLETED = 'completed'
+PURGE_FAILED = 'failed'
+# Purges whose rows are hidden: not deleted yet, or failed and waiting for a retry
+HIDING_STATES = (PURGE_PENDING, PURGE_RUNNING, PURGE_FAILED)
+PURGE_LEASE = 'packet-purge'
+
+
+def visible_rows(model, user_id):
+    """
+    Filter for a user's packet or flow rows that have not been cleared
+
+    Use instead of model.user_id == user_id wherever rows are read.
+    """
+    from services.background_tasks import get_packet_purger
+    purger = get_packet_purger()
+    floor = purger.floor(model, user_id) if purger is not None else None
+    if floor is None:
+        return model.user_id == user_id
+    return and_(model.user_id == user_id, model.id > floor)
+
+
+class PacketPurger:
+    """Runs purges one at a time on a worker thread"""
+
+    def __init__(self, app, config):
+        self.app = app
+        self.chunk_size = getattr(config, 'PURGE_CHUNK_SIZE', 5000)
+        self.chunk_pause = getattr(config, 'PURGE_CHUNK_PAUSE', 0.02)
+        self.retry_interval = getattr(config, 'PURGE_RETRY_INTERVAL', 60)  # seconds before a failed purge runs again
+        self.floor_ttl = 1.0  # seconds a user's floors read from packet_purges are reused
+        self.owner = process_owner()
+        self.lease_seconds = 60
+        self.lease_held = False
+        self._lease_renew_at = 0.0
+        # user_id -> (monotonic read time, (packets_up_to, flows_up_to) or None); rows at
+        # or below the ids are hidden until deleted
+        self._floors = {}
+        self._wake = threading.Event()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """Start the worker; unfinished purges of any process are picked up from the table"""
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._purge_loop, daemon=True)
+            self.thread.start()
+            self._wake.set()
+            print("Packet purger started")
+
+    def stop(self):
+        """Stop the worker; an unfinished purge continues after the next start"""
+        self.running = False
+        self._wake.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+            print("Packet purger stopped")
+
+    def floor(self, model, user_id):
+        """Highest hidden id of a user's rows in the model's table, or None"""
+        now = time.monotonic()
+        cached = self._floors.get(user_id)
+        if cached is None or now - cached[0] >= self.floor_ttl:
+            # Read in its own session so the caller's transaction is not touched
+            with self.app.app_context():
+                packets, flows = db.session.query(
+                    func.max(PacketPurge.packets_up_to), func.max(PacketPurge.flows_up_to)
+                ).filter(PacketPurge.user_id == user_id, PacketPurge.status.in_(HIDING_STATES)).one()
+            cached = self._floors[user_id] = (now, None if packets is None else (packets, flows or 0))
+        floors = cached[1]
+        if floors is None:
+            return None
+        return floors[0] if model is PacketCapture else floors[1]
+
+    def submit(self, user_id):
+        """
+        Hide a user's packets and flows at once and queue their deletion
+
+        Must be called within an application context. Rows stored after this
+        call have higher ids and are kept.
+
+        Returns:
+            PacketPurge
+        """
+        from services.background_tasks import get_packet_writer, get_flow_exporter
+        # Rows still queued in the write-behind writers, and flows still being
+        # aggregated, hold packets captured before the clear; they are written or
+        # dropped first so they cannot get ids above the floor and reappear
+        writer = get_packet_writer()
+        if writer is not None:
+            writer.flush()
+        exporter = get_flow_exporter()
+        if exporter is not None:
+            exporter.discard(user_id)
+
+        # The table-wide maximum is an index lookup; rows of other users below it are not touched
+        purge = PacketPurge(
+            user_id=user_id,
+            packets_up_to=db.session.query(func.max(PacketCapture.id)).scalar() or 0,
+            flows_up_to=db.session.query(func.max(Flow.id)).scalar() or 0,
+            status=PURGE_PENDING
+        )
+        db.session.add(purge)
+        db.session.commit()
+        # Other processes read the new floor within floor_ttl
+        self._floors.pop(user_id, None)
+        self._wake.set()
+        return purge
+
+    def get(self, purge_id, user_id):
+        """A user's purge, or None (within an application context)"""
+        return PacketPurge.query.filter_by(id=purge_id, user_id=user_id).first()
+
+    def _purge_loop(self):
+        while self.running:
+            self._wake.wait(timeout=5)
+            self._wake.clear()
+            while self.running and self._run_next():
+                pass
+
+    def _hold_lease(self):
+        """Take or renew the purge lease; only its holder deletes rows (commits the session)"""
+        now = time.time()
+        if not self.lease_held or now >= self._lease_renew_at:
+            self.lease_held = acquire_lease(PURGE_LEASE, self.owner, self.lease_seconds)
+            self._lease_renew_at = now + self.lease_seconds / 3
+        return self.lease_held
+
+    def _run_next(self):
+        """Run the oldest unfinished purge, or a failed one due for a retry; returns False when there is none"""
+        with self.app.app_context():
+            if not self._hold_lease():
+                # Another process runs the purges
+                return False
+            purge = PacketPurge.query.filter(or_(
+                PacketPurge.status.in_([PURGE_PENDING, PURGE_RUNNING]),
+                and_(PacketPurge.status == PURGE_FAILED,
+                     PacketPurge.finished_at <= datetime.utcnow() - timedelta(seconds=self.retry_interval))
+            )).order_by(PacketPurge.id).first()
+            if purge is None:
+                return False
+            try:
+                purge.status = PURGE_RUNNING
+                db.session.commit()
+                for model, up_to, counter in ((PacketCapture, purge.packets_up_to, 'packets_deleted'),
+                                              (Flow, purge.flows_up_to, 'flows_deleted')):
+                    if not self._delete_chunks(purge, model, up_to, counter):
+                        # Stopped, or the lease went to another process, which continues the purge
+                        return False
+                purge.status = PURGE_COMPLETED
+                purge.error = None
+                purge.finished_at = datetime.utcnow()
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logging.error(f"Error purging packets for user {purge.user_id}: {e}")
+                # The rows stay hidden; the purge runs again after retry_interval
+                purge.status = PURGE_FAILED
+                purge.error = str(e)[:255]
+                purge.finished_at = datetime.utcnow()
+                db.session.commit()
+            self._floors.pop(purge.user_id, None)
+            return True
+
+    def _delete_chunks(self, purge, model, up_to, counter):
+        """
+        Delete the user's rows with ids up to up_to, one chunk per transaction, while holding the lease
+
+        Returns:
+            True once every row is deleted
+        """
+        last_id = 0
+        while self.running and self._hold_lease():
+            ids = [row[0] for row in db.session.query(model.id).filter(
+                model.user_id == purge.user_id, model.id > last_id, model.id <= up_to
+            ).order_by(model.id).limit(self.chunk_size)]
+            if not ids:
+                return True
+            deleted = model.query.filter(model.id.in_(ids)).delete(synchronize_session=False)
+            # Progress is committed with the rows it counts
+            setattr(purge, counter, (getattr(purge, counter) or 0) + deleted)
+            db.session.commit()
+            last_id = ids[-1]
+            if self.chunk_pause:
+                time.sleep(self.chunk_pause)
+        return False
@@ -0,0 +1,318 @@
+"""
+Network rate engine
+
+Rates used to be computed from the difference to the previous call of
+get_network_load(), kept in module globals, so concurrent callers stole
+each other's deltas. The counters are now read once per interval by one
+thread, and each interval's per-second rates are written to a fixed-size
+ring buffer (flat arrays, one slot per sample). Any number of
+readers get the instantaneous rate (the latest slot), an EWMA-smoothed rate
+and the average over a window, under a short lock. Counters that go
+backwards are treated as a 32-bit wrap when that explains the step, and
+otherwise as a reset (the rate counts from zero).
+
+Each network interface has its own series next to the total, so a
+saturated uplink is not hidden behind idle interfaces. Rates are kept as
+32-bit floats to keep a long history per interface small. The counts since
+the last drain() are also accumulated per series for the background monitor
+to store as interface traffic logs.
+"""
+import logging
+import math
+import threading
+import time
+from array import array
+
+import psutil
+
+from services.collectors import TOTAL, create_collector
+
+# Counter fields, in the order of psutil.net_io_counters()
+FIELDS = ('bytes_sent', 'bytes_recv', 'packets_sent', 'packets_recv', 'errin', 'errout', 'dropin', 'dropout')
+
+_WRAP = 2 ** 32
+
+
+def parse_capacities(text):
+    """{interface: Mbps} from 'name=mbps,name=mbps', invalid entries skipped"""
+    capacities = {}
+    for entry in (text or '').split(','):
+        name, _, mbps = entry.strip().partition('=')
+        try:
+            capacities[name.strip()] = int(mbps)
+        except ValueError:
+            if entry.strip():
+                logging.warning(f"Ignoring invalid interface capacity {entry.strip()!r}")
+    return capacities
+
+
+def interface_capacities(config):
+    """
+    Capacity of each network interface
+
+    Configured in INTERFACE_CAPACITY_MBPS, else the link speed the driver
+    reports, else NETWORK_CAPACITY_MBPS.
+
+    Returns:
+        {interface: {'capacity_mbps', 'capacity_source' ('config', 'link' or 'default'), 'is_up'}}
+    """
+    configured = parse_capacities(getattr(config, 'INTERFACE_CAPACITY_MBPS', ''))
+    default = getattr(config, 'NETWORK_CAPACITY_MBPS', 100)
+    capacities = {}
+    for name, stats in psutil.net_if_stats().items():
+        if name in configured:
+            capacity, source = configured[name], 'config'
+        elif stats.speed > 0:
+            capacity, source = stats.speed, 'link'
+        else:
+            capacity, source = default, 'default'
+        capacities[name] = {'capacity_mbps': capacity, 'capacity_source': source, 'is_up': stats.isup}
+    return capacities
+
+
+class RateSeries:
+    """Ring buffer of per-second rates of one set of counters"""
+
+    def __init__(self, size, ewma_seconds, width=len(FIELDS)):
+        self.size = size
+        self.width = width
+        self.ewma_seconds = ewma_seconds
+        # Slot i holds rates[i * width:(i + 1) * width], its wall-clock time and its duration
+        self._rates = array('f', bytes(4 * size * width))
+        self._times = array('d', bytes(8 * size))
+        self._durations = array('f', bytes(4 * size))
+        self._next = 0
+        self.count = 0
+        self._previous = None
+        self._ewma = None
+        # Counts and seconds since the last drain()
+        self._counts = [0] * width
+        self._seconds = 0.0
+        self.wraps = 0
+        self.resets = 0
+
+    def _delta(self, previous, current):
+        delta = current - previous
+        if delta >= 0:
+            return delta
+        wrapped = current + _WRAP - previous
+        if previous < _WRAP and wrapped < _WRAP // 2:
+            self.wraps += 1
+            return wrapped
+        self.resets += 1
+        return current
+
+    def add(self, counters, now, elapsed):
+        """
+        Account a new counter reading
+
+        now: wall-clock time of the reading
+        elapsed: seconds since the previous reading
+        """
+        previous, self._previous = self._previous, counters
+        if previous is None or elapsed <= 0:
+            return
+        deltas = [self._delta(old, new) for old, new in zip(previous, counters)]
+        rates = [delta / elapsed for delta in deltas]
+        self._counts = [count + delta for count, delta in zip(self._counts, deltas)]
+        self._seconds += elapsed
+        slot = self._next
+        self._rates[slot * self.width:(slot + 1) * self.width] = array('f', rates)
+        self._times[slot] = now
+        self._durations[slot] = elapsed
+        self._next = (slot + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+        if self._ewma is None:
+            self._ewma = rates
+        else:
+            alpha = 1 - math.exp(-elapsed / self.ewma_seconds)
+            self._ewma = [smoothed + alpha * (rate - smoothed) for smoothed, rate in zip(self._ewma, rates)]
+
+    def drain(self):
+        """(seconds, counts in FIELDS order) since the previous drain"""
+        drained = self._seconds, self._counts
+        self._counts = [0] * self.width
+        self._seconds = 0.0
+        return drained
+
+    def _slots(self):
+        """Slot indexes from the newest to the oldest"""
+        return ((self._next - 1 - i) % self.size for i in range(self.count))
+
+    def latest(self):
+        """(time, rates) of the newest slot, or None"""
+        if not self.count:
+            return None
+        slot = (self._next - 1) % self.size
+        return self._times[slot], self._rates[slot * self.width:(slot + 1) * self.width].tolist()
+
+    def ewma(self):
+        return list(self._ewma) if self._ewma is not None else [0.0] * self.width
+
+    def average(self, seconds):
+        """(seconds covered, time-weighted average rates) over the newest slots spanning seconds"""
+        totals = [0.0] * self.width
+        covered = 0.0
+        for slot in self._slots():
+            if covered >= seconds:
+                break
+            duration = self._durations[slot]
+            offset = slot * self.width
+            for i in range(self.width):
+                totals[i] += self._rates[offset + i] * duration
+            covered += duration
+        if not covered:
+            return 0.0, totals
+        return covered, [total / covered for total in totals]
+
+    def history(self, since):
+        """[(time, rates)] of the slots newer than since, oldest first"""
+        points = []
+        for slot in self._slots():
+            if self._times[slot] <= since:
+                break
+            points.append((self._times[slot], self._rates[slot * self.width:(slot + 1) * self.width].tolist()))
+        points.reverse()
+        return points
+
+
+class RateEngine:
+    """Samples network counters on a timer and serves their rates to any number of readers"""
+
+    def __init__(self, config, read_counters=None, clock=time.monotonic):
+        # Interfaces tracked besides the total (empty: all of them)
+        self.interfaces = {name.strip() for name in (getattr(config, 'RATE_INTERFACES', '') or '').split(',')
+                           if name.strip()}
+        # Counters come from the METRICS_BACKEND collector (services.collectors)
+        self.collector = None
+        if read_counters is None:
+            self.collector = create_collector(config)
+            read_counters = lambda: self.collector.net_counters(self.interfaces)
+        self.read_counters = read_counters
+        self.clock = clock
+        self.interval = getattr(config, 'RATE_SAMPLE_INTERVAL', 1.0)
+        self.history_seconds = getattr(config, 'RATE_HISTORY_SECONDS', 3600)
+        self.ewma_seconds = getattr(config, 'RATE_EWMA_SECONDS', 10)
+        self.size = max(2, int(math.ceil(self.history_seconds / self.interval)))
+        self._series = {}
+        self._lock = threading.Lock()
+        self._last_sample = None
+        self.running = False
+        self.thread = None
+
+        # Metrics
+        self.samples = 0
+        self.errors = 0
+
+    def start(self):
+        """Take the first reading and start sampling"""
+        if not self.running:
+            self.sample()
+            self.running = True
+            self.thread = threading.Thread(target=self._sample_loop, daemon=True)
+            self.thread.start()
+            print("Rate engine started")
+
+    def stop(self):
+        """Stop sampling"""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=5)
+            print("Rate engine stopped")
+        if self.collector is not None:
+            self.collector.close()
+
+    def _sample_loop(self):
+        deadline = self.clock()
+        while self.running:
+            deadline += self.interval
+            delay = deadline - self.clock()
+            if delay < 0:
+                deadline = self.clock()
+            else:
+                time.sleep(delay)
+            self.sample()
+
+    def sample(self):
+        """Read the counters once and add the rates since the previous reading"""
+        try:
+            counters = self.read_counters()
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"Error reading network counters: {e}")
+            return
+        now = time.time()
+        tick = self.clock()
+        with self._lock:
+            elapsed = tick - self._last_sample if self._last_sample is not None else 0.0
+            self._last_sample = tick
+            for key, values in counters.items():
+                series = self._series.get(key)
+                if series is None:
+                    series = self._series[key] = RateSeries(self.size, self.ewma_seconds)
+                series.add(values, now, elapsed)
+            # Interfaces that went away (e.g. container veths) take their history with them
+            for key in [key for key in self._series if key not in counters]:
+                del self._series[key]
+            self.samples += 1
+
+    def rates(self, key=TOTAL, window=60):
+        """
+        Rates of a series, or None if it is unknown
+
+        Returns:
+            dict with 'current', 'ewma' and 'average' ({field: per second}),
+            'window_seconds' (seconds the average covers), 'timestamp' (wall
+            time of the newest sample) and 'age_seconds'
+        """
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                return None
+            latest = series.latest()
+            ewma = series.ewma()
+            covered, average = series.average(window)
+            age = self.clock() - self._last_sample
+        timestamp, current = latest if latest is not None else (time.time(), [0.0] * len(FIELDS))
+        return {
+            'current': dict(zip(FIELDS, current)),
+            'ewma': dict(zip(FIELDS, ewma)),
+            'average': dict(zip(FIELDS, average)),
+            'window_seconds': round(covered, 3),
+            'timestamp': timestamp,
+            'age_seconds': round(age, 3)
+        }
+
+    def history(self, key=TOTAL, seconds=300):
+        """[(wall time, {field: per second})] of a series over the last seconds, oldest first"""
+        since = time.time() - seconds
+        with self._lock:
+            series = self._series.get(key)
+            points = series.history(since) if series is not None else []
+        return [(timestamp, dict(zip(FIELDS, rates))) for timestamp, rates in points]
+
+    def series(self):
+        """Names of the per-interface series"""
+        with self._lock:
+            return sorted(key for key in self._series if key != TOTAL)
+
+    def drain(self):
+        """{series: (seconds, {field: count})} accumulated since the previous drain"""
+        with self._lock:
+            drained = {key: series.drain() for key, series in self._series.items()}
+        return {key: (seconds, dict(zip(FIELDS, counts))) for key, (seconds, counts) in drained.items()}
+
+    def stats(self):
+        with self._lock:
+            series = {key: {'samples': value.count, 'wraps': value.wraps, 'resets': value.resets}
+                      for key, value in self._series.items()}
+        return {
+            'running': self.running,
+            'backend': self.collector.name if self.collector is not None else None,
+            'interval': self.interval,
+            'slots': self.size,
+            'samples': self.samples,
+            'errors': self.errors,
+            'series': series
+        }
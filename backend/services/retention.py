@@ -0,0 +1,272 @@
+"""
+Retention and downsampling for the time-series tables
+
+Rows older than each table's retention are deleted in small chunks walked
+in (time, id) order on the table's time index, one short transaction per
+chunk, so a purge never holds locks on millions of rows or produces one
+huge replication event. Before traffic and resource logs expire they are
+rolled up into hourly tables; rollups advance from the last rolled-up hour
+and are independent of the purge, so a restart never counts an hour twice.
+Tables partitioned by day (services.partitions) expire by dropping
+partitions instead and are skipped here.
+
+Every app process (e.g. each gunicorn worker) starts a RetentionJob. A run
+first takes the 'retention' lease in job_leases, so only one process at a
+time purges and rolls up; the others skip their runs until the holder stops
+renewing it.
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import func, or_, and_
+
+from models import (
+    db, TrafficLog, SystemResourceLog, PacketCapture, Flow, Alert, TrafficLogRollup, SystemResourceRollup,
+    InterfaceTrafficLog, ConnectionStateLog
+)
+from services.leases import acquire_lease, process_owner
+
+
+def _hour(timestamp):
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+class RetentionJob:
+    """Periodic chunked purge of expired rows, with hourly rollups of the metric logs"""
+
+    # Hours rolled up per transaction
+    ROLLUP_BATCH_HOURS = 24
+
+    def __init__(self, app, config):
+        self.app = app
+        self.interval = getattr(config, 'RETENTION_INTERVAL', 3600)
+        self.chunk_size = getattr(config, 'RETENTION_CHUNK_SIZE', 1000)
+        self.chunk_pause = getattr(config, 'RETENTION_CHUNK_PAUSE', 0.05)
+        self.downsample = getattr(config, 'RETENTION_DOWNSAMPLE', True)
+        self.partitioning = getattr(config, 'PARTITIONING_ENABLED', False)
+        self.owner = process_owner()
+        # Renewed every run; lapses if the holder misses a run, so another process takes over
+        self.lease_seconds = 2 * self.interval
+        rollup_days = getattr(config, 'ROLLUP_RETENTION_DAYS', 365)
+        # Table -> (model, time column, extra condition, days kept; 0 keeps everything)
+        self.tables = {
+            'packet_captures': (PacketCapture, PacketCapture.timestamp, None,
+                                getattr(config, 'PACKET_RETENTION_DAYS', 0)),
+            'flows': (Flow, Flow.last_seen, None, getattr(config, 'FLOW_RETENTION_DAYS', 0)),
+            'traffic_logs': (TrafficLog, TrafficLog.timestamp, None, getattr(config, 'TRAFFIC_LOG_RETENTION_DAYS', 0)),
+            'interface_traffic_logs': (InterfaceTrafficLog, InterfaceTrafficLog.timestamp, None,
+                                       getattr(config, 'TRAFFIC_LOG_RETENTION_DAYS', 0)),
+            'system_resource_logs': (SystemResourceLog, SystemResourceLog.timestamp, None,
+                                     getattr(config, 'RESOURCE_LOG_RETENTION_DAYS', 0)),
+            'connection_state_logs': (ConnectionStateLog, ConnectionStateLog.timestamp, None,
+                                      getattr(config, 'RESOURCE_LOG_RETENTION_DAYS', 0)),
+            # Only resolved alerts expire, counted from when they were resolved; resolved_at
+            # is never before created_at, so the walk can use the created_at index
+            'alerts': (Alert, Alert.created_at, lambda cutoff: and_(
+                Alert.status == 'resolved', func.coalesce(Alert.resolved_at, Alert.created_at) < cutoff
+            ), getattr(config, 'ALERT_RETENTION_DAYS', 0)),
+            'traffic_log_rollups': (TrafficLogRollup, TrafficLogRollup.hour, None, rollup_days),
+            'system_resource_rollups': (SystemResourceRollup, SystemResourceRollup.hour, None, rollup_days),
+        }
+        self.running = False
+        self.thread = None
+        self.runs = 0
+        self.skipped = 0
+        self.errors = 0
+        self.last_report = None
+        self.totals = defaultdict(int)  # rows deleted per table since start
+
+    def start(self):
+        """Start running retention periodically"""
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._retention_loop, daemon=True)
+            self.thread.start()
+            print("Retention job started")
+
+    def stop(self):
+        """Stop the job; a purge in progress stops after its current chunk"""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=5)
+            print("Retention job stopped")
+
+    def _retention_loop(self):
+        deadline = 0.0
+        while self.running:
+            if time.time() >= deadline:
+                self.run()
+                deadline = time.time() + self.interval
+            time.sleep(0.5)
+
+    def _stopped(self):
+        # run() is also called directly, without the thread
+        return self.thread is not None and not self.running
+
+    def run(self, now=None):
+        """
+        Roll up complete hours, then purge expired rows of every table
+
+        Returns:
+            {'started', 'seconds', 'rows_deleted', 'tables': {table: {'deleted', 'seconds',
+            'rolled_up', 'rollup_seconds', 'partitioned'}}}, or None when another
+            process holds the retention lease
+        """
+        now = now or datetime.utcnow()
+        started = time.perf_counter()
+        tables = {}
+        try:
+            with self.app.app_context():
+                if not acquire_lease('retention', self.owner, self.lease_seconds):
+                    # Another process runs retention
+                    self.skipped += 1
+                    return None
+                partitioned = self._partitioned_tables()
+                if self.downsample:
+                    # Hours are complete a few minutes after they end
+                    end = _hour(now - timedelta(minutes=5))
+                    for table, rollup in (('traffic_log_rollups', self._rollup_traffic),
+                                          ('system_resource_rollups', self._rollup_resources)):
+                        table_started = time.perf_counter()
+                        tables[table] = {'rolled_up': rollup(end),
+                                         'rollup_seconds': round(time.perf_counter() - table_started, 3)}
+                for table, (model, time_column, condition, days) in self.tables.items():
+                    if not days or self._stopped():
+                        continue
+                    entry = tables.setdefault(table, {})
+                    if table in partitioned:
+                        entry['partitioned'] = True
+                        continue
+                    cutoff = now - timedelta(days=days)
+                    table_started = time.perf_counter()
+                    entry['deleted'] = self._purge(model, time_column, cutoff,
+                                                   condition(cutoff) if condition is not None else None)
+                    entry['seconds'] = round(time.perf_counter() - table_started, 3)
+                    self.totals[table] += entry['deleted']
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"Error applying retention: {e}")
+
+        self.runs += 1
+        self.last_report = {
+            'started': now.isoformat(),
+            'seconds': round(time.perf_counter() - started, 3),
+            'rows_deleted': sum(entry.get('deleted', 0) for entry in tables.values()),
+            'tables': tables
+        }
+        if self.last_report['rows_deleted']:
+            print(f"Retention removed {self.last_report['rows_deleted']} rows in {self.last_report['seconds']}s")
+        return self.last_report
+
+    def _partitioned_tables(self):
+        """Tables whose retention is left to partition maintenance"""
+        if not self.partitioning or db.engine.dialect.name != 'mysql':
+            return set()
+        from services.partitions import PARTITIONED_TABLES, list_partitions
+        with db.engine.connect() as connection:
+            return {table for table in PARTITIONED_TABLES if list_partitions(connection, table)}
+
+    def _purge(self, model, time_column, cutoff, condition=None):
+        """
+        Delete rows with time_column < cutoff (and condition) chunk by chunk
+
+        Each chunk is found by continuing the (time, id) walk on the time index
+        from where the last one ended, rather than re-scanning from the start
+        past rows the database has not finished cleaning up.
+        """
+        deleted = 0
+        last = None
+        while not self._stopped():
+            query = db.session.query(model.id, time_column).filter(time_column < cutoff)
+            if last is not None:
+                query = query.filter(or_(time_column > last[1], and_(time_column == last[1], model.id > last[0])))
+            if condition is not None:
+                query = query.filter(condition)
+            chunk = query.order_by(time_column, model.id).limit(self.chunk_size).all()
+            if not chunk:
+                break
+            deleted += model.query.filter(model.id.in_([row[0] for row in chunk])).delete(synchronize_session=False)
+            db.session.commit()
+            last = chunk[-1]
+            if len(chunk) < self.chunk_size:
+                break
+            if self.chunk_pause:
+                time.sleep(self.chunk_pause)
+        return deleted
+
+    def _rollup_range(self, rollup_model, source_time, end):
+        """First hour to roll up: after the last rollup, or the oldest raw row"""
+        last = db.session.query(func.max(rollup_model.hour)).scalar()
+        if last is not None:
+            return last + timedelta(hours=1)
+        oldest = db.session.query(func.min(source_time)).scalar()
+        return _hour(oldest) if oldest is not None and oldest < end else None
+
+    def _rollup_traffic(self, end):
+        """Hourly traffic rollups up to end; returns rollup rows written"""
+        start = self._rollup_range(TrafficLogRollup, TrafficLog.timestamp, end)
+        written = 0
+        while start is not None and start < end and not self._stopped():
+            batch_end = min(start + timedelta(hours=self.ROLLUP_BATCH_HOURS), end)
+            hours = {}
+            rows = db.session.query(
+                TrafficLog.timestamp, TrafficLog.device_id, TrafficLog.bytes_sent, TrafficLog.bytes_recv,
+                TrafficLog.packets_sent, TrafficLog.packets_recv
+            ).filter(TrafficLog.timestamp >= start, TrafficLog.timestamp < batch_end)
+            for timestamp, device_id, *counters in rows.yield_per(10000):
+                key = (_hour(timestamp), device_id)
+                values = hours.get(key)
+                if values is None:
+                    hours[key] = [counter or 0 for counter in counters] + [1]
+                elif device_id is None:
+                    # Host counters are cumulative: the hour keeps its last (largest) values
+                    for i, counter in enumerate(counters):
+                        values[i] = max(values[i], counter or 0)
+                    values[4] += 1
+                else:
+                    # Device rows count their interval: the hour is their sum
+                    for i, counter in enumerate(counters):
+                        values[i] += counter or 0
+                    values[4] += 1
+            db.session.add_all(TrafficLogRollup(
+                hour=hour, device_id=device_id, bytes_sent=values[0], bytes_recv=values[1],
+                packets_sent=values[2], packets_recv=values[3], samples=values[4]
+            ) for (hour, device_id), values in hours.items())
+            db.session.commit()
+            written += len(hours)
+            start = batch_end
+        return written
+
+    def _rollup_resources(self, end):
+        """Hourly resource averages and peaks up to end; returns rollup rows written"""
+        start = self._rollup_range(SystemResourceRollup, SystemResourceLog.timestamp, end)
+        written = 0
+        while start is not None and start < end and not self._stopped():
+            batch_end = min(start + timedelta(hours=self.ROLLUP_BATCH_HOURS), end)
+            hours = {}
+            rows = db.session.query(
+                SystemResourceLog.timestamp, SystemResourceLog.cpu_percent, SystemResourceLog.memory_percent,
+                SystemResourceLog.disk_percent
+            ).filter(SystemResourceLog.timestamp >= start, SystemResourceLog.timestamp < batch_end)
+            for timestamp, *values in rows.yield_per(10000):
+                values = [value or 0.0 for value in values]
+                totals = hours.get(_hour(timestamp))
+                if totals is None:
+                    hours[_hour(timestamp)] = values + values + [1]
+                else:
+                    for i, value in enumerate(values):
+                        totals[i] += value
+                        totals[3 + i] = max(totals[3 + i], value)
+                    totals[6] += 1
+            db.session.add_all(SystemResourceRollup(
+                hour=hour, samples=totals[6],
+                cpu_percent=totals[0] / totals[6], memory_percent=totals[1] / totals[6],
+                disk_percent=totals[2] / totals[6], cpu_percent_max=totals[3],
+                memory_percent_max=totals[4], disk_percent_max=totals[5]
+            ) for hour, totals in hours.items())
+            db.session.commit()
+            written += len(hours)
+            start = batch_end
+        return written
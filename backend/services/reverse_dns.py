@@ -0,0 +1,161 @@
+"""
+Cached, non-blocking reverse DNS for the top talkers
+
+Resolving addresses while answering a statistics request would make it as
+slow as the slowest PTR lookup. Requests only read a bounded LRU cache;
+addresses not in it (or expired) are queued for a few worker threads and
+appear on a later request. Failed lookups are cached too, for a shorter
+time, so unresolvable addresses are not retried on every request. An
+expired name is still served while it is being refreshed.
+"""
+import logging
+import queue
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+
+def system_resolve(address):
+    """PTR name of an address via the system resolver, or None"""
+    try:
+        return socket.gethostbyaddr(address)[0]
+    except (socket.herror, socket.gaierror, OSError, UnicodeError):
+        return None
+
+
+class ReverseDNSResolver:
+    """Reverse lookups answered from a TTL cache and resolved in the background"""
+
+    def __init__(self, config, resolve=system_resolve, clock=time.monotonic):
+        self.resolve = resolve
+        self.clock = clock
+        self.max_entries = getattr(config, 'REVERSE_DNS_CACHE_SIZE', 4096)
+        self.ttl = getattr(config, 'REVERSE_DNS_TTL', 3600)
+        self.negative_ttl = getattr(config, 'REVERSE_DNS_NEGATIVE_TTL', 300)
+        self.worker_count = getattr(config, 'REVERSE_DNS_WORKERS', 4)
+        # address -> (hostname or None, expires at); least recently used first
+        self._cache = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=getattr(config, 'REVERSE_DNS_QUEUE_SIZE', 1024))
+        self.running = False
+        self.threads = []
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.resolved = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def start(self):
+        """Start the resolver threads"""
+        if not self.running:
+            self.running = True
+            self.threads = [threading.Thread(target=self._resolve_loop, daemon=True)
+                            for _ in range(self.worker_count)]
+            for thread in self.threads:
+                thread.start()
+            print("Reverse DNS resolver started")
+
+    def stop(self):
+        """Stop the resolver threads; a lookup in progress is abandoned"""
+        self.running = False
+        for thread in self.threads:
+            thread.join(timeout=1)
+        if self.threads:
+            print("Reverse DNS resolver stopped")
+        self.threads = []
+
+    def hostnames(self, addresses):
+        """
+        Cached names of addresses, without waiting for any lookup
+
+        Addresses missing from the cache or expired are queued for resolution.
+
+        Returns:
+            {address: hostname or None}
+        """
+        now = self.clock()
+        names = {}
+        due = []
+        with self._lock:
+            for address in addresses:
+                if not address or address in names:
+                    continue
+                entry = self._cache.get(address)
+                if entry is None:
+                    self.misses += 1
+                    names[address] = None
+                    due.append(address)
+                    continue
+                self.hits += 1
+                self._cache.move_to_end(address)
+                names[address] = entry[0]
+                if entry[1] <= now:
+                    due.append(address)
+            due = [address for address in due if address not in self._pending]
+            self._pending.update(due)
+        for address in due:
+            try:
+                self._queue.put_nowait(address)
+            except queue.Full:
+                self.dropped += 1
+                with self._lock:
+                    self._pending.discard(address)
+        return names
+
+    def annotate(self, analysis):
+        """Copy of a get_packet_analysis() result with 'hostname' added to the top IPs"""
+        if not analysis:
+            return analysis
+        keys = ('top_source_ips', 'top_destination_ips')
+        names = self.hostnames([entry['ip'] for key in keys for entry in analysis.get(key) or ()])
+        annotated = dict(analysis)
+        for key in keys:
+            if key in analysis:
+                annotated[key] = [dict(entry, hostname=names.get(entry['ip'])) for entry in analysis[key]]
+        return annotated
+
+    def _store(self, address, hostname):
+        ttl = self.ttl if hostname else self.negative_ttl
+        with self._lock:
+            self._cache[address] = (hostname, self.clock() + ttl)
+            self._cache.move_to_end(address)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+            self._pending.discard(address)
+
+    def _resolve_loop(self):
+        while self.running:
+            try:
+                address = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                hostname = self.resolve(address)
+            except Exception as e:
+                logging.error(f"Reverse DNS lookup of {address} failed: {e}")
+                hostname = None
+            if hostname:
+                hostname = hostname.rstrip('.')[:253]
+                self.resolved += 1
+            else:
+                self.failed += 1
+            self._store(address, hostname or None)
+
+    def stats(self):
+        with self._lock:
+            cached = len(self._cache)
+            pending = len(self._pending)
+        return {
+            'cached': cached,
+            'max_entries': self.max_entries,
+            'pending': pending,
+            'hits': self.hits,
+            'misses': self.misses,
+            'resolved': self.resolved,
+            'failed': self.failed,
+            'dropped': self.dropped
+        }
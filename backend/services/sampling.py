@@ -0,0 +1,71 @@
+"""
+Packet sampling for high-rate capture
+
+A sampler decides per frame, before any decoding, whether the frame is kept.
+Every kept packet records its sample_rate (how many packets it stands for)
+so statistics can scale counts and bytes back to estimates.
+"""
+import random
+
+
+class PacketSampler:
+    """Deterministic 1-in-N or random probability-p packet sampling"""
+
+    def __init__(self, every=1, probability=None):
+        if probability is not None:
+            probability = float(probability)
+            if not 0 < probability <= 1:
+                raise ValueError("Sampling probability must be in (0, 1]")
+            self.mode = 'random' if probability < 1 else 'none'
+            self.probability = probability
+            self.every = 1
+            self.rate = 1.0 / probability
+        else:
+            every = int(every) if every is not None else 1
+            if every < 1:
+                raise ValueError("Sampling interval must be at least 1")
+            self.mode = 'deterministic' if every > 1 else 'none'
+            self.probability = 1.0 / every
+            self.every = every
+            self.rate = float(every)
+        self.seen = 0
+        self.sampled = 0
+        self._random = random.random
+
+    def accept(self):
+        """Return True if the next packet should be kept"""
+        self.seen += 1
+        if self.mode == 'deterministic':
+            keep = self.seen % self.every == 1
+        elif self.mode == 'random':
+            keep = self._random() < self.probability
+        else:
+            keep = True
+        if keep:
+            self.sampled += 1
+        return keep
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'sample_rate': self.rate,
+            'seen': self.seen,
+            'sampled': self.sampled
+        }
+
+
+def sampler_from_request(data):
+    """
+    Build a sampler from capture request parameters
+
+    Args:
+        data: dict with optional 'sample_every' (1-in-N) or 'sample_probability' (p)
+
+    Raises:
+        ValueError: for invalid or conflicting sampling parameters
+    """
+    every = data.get('sample_every')
+    probability = data.get('sample_probability')
+    if every is not None and probability is not None:
+        raise ValueError("Use either sample_every or sample_probability, not both")
+    return PacketSampler(every=every if every is not None else 1, probability=probability)
@@ -0,0 +1,144 @@
+"""
+Streaming sketches for capture statistics
+
+Space-Saving keeps the heaviest keys of a stream in a fixed number of
+counters; every reported count over-estimates the true count by at most
+total / capacity. A Count-Min sketch (also an over-estimate, by at most
+e / width of the total with probability 1 - e^-depth) caps the counts of
+keys that inherited a large error when they replaced another key.
+HyperLogLog estimates distinct counts in a few KiB and merges losslessly.
+"""
+import hashlib
+import heapq
+import math
+from array import array
+
+# 2^-rank for every possible HyperLogLog register value
+_HLL_POWERS = [2.0 ** -r for r in range(65)]
+
+
+class CountMinSketch:
+    """Count-Min sketch over hashable keys with float weights"""
+
+    def __init__(self, width=512, depth=4):
+        self.width = width
+        self.depth = depth
+        self.total = 0.0
+        self._rows = [array('d', bytes(8 * width)) for _ in range(depth)]
+
+    def _indexes(self, key):
+        # Double hashing: depth indexes from one hash (Kirsch-Mitzenmacher)
+        # (multiplied through so small ints such as ports do not land in adjacent cells)
+        h = (hash(key) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        h1 = h & 0xFFFFFFFF
+        h2 = ((h >> 32) & 0xFFFFFFFF) | 1
+        width = self.width
+        return [(h1 + i * h2) % width for i in range(self.depth)]
+
+    def add(self, key, weight=1.0):
+        for row, index in zip(self._rows, self._indexes(key)):
+            row[index] += weight
+        self.total += weight
+
+    def estimate(self, key):
+        return min(row[index] for row, index in zip(self._rows, self._indexes(key)))
+
+    def error_bound(self):
+        """Over-estimate that holds for a key with probability 1 - e^-depth"""
+        return math.e / self.width * self.total
+
+
+class SpaceSaving:
+    """
+    Space-Saving heavy hitters with weights and an attached byte counter
+
+    Counters are [count, error, bytes]; error is the count inherited from the
+    key a new key replaced, so count - error is a lower bound.
+    """
+
+    def __init__(self, capacity=200):
+        self.capacity = capacity
+        self.counters = {}
+        self.total = 0.0
+        # Min-heap of (count, key); entries go stale when a count grows and
+        # are skipped lazily, so evicting costs O(log n) instead of a scan
+        self._heap = []
+
+    def add(self, key, weight=1.0, nbytes=0.0):
+        self.total += weight
+        counter = self.counters.get(key)
+        if counter is None:
+            if len(self.counters) < self.capacity:
+                counter = self.counters[key] = [0.0, 0.0, 0.0]
+            else:
+                count, victim = self._pop_min()
+                del self.counters[victim]
+                counter = self.counters[key] = [count, count, 0.0]
+        counter[0] += weight
+        counter[2] += nbytes
+        heapq.heappush(self._heap, (counter[0], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(c[0], k) for k, c in self.counters.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        while True:
+            count, key = heapq.heappop(self._heap)
+            counter = self.counters.get(key)
+            if counter is not None and counter[0] == count:
+                return count, key
+
+    def min_count(self):
+        """Upper bound on the count of any key that is not monitored"""
+        if len(self.counters) < self.capacity:
+            return 0.0
+        return min(counter[0] for counter in self.counters.values())
+
+    def error_bound(self):
+        """Largest possible over-estimate, 0 until a key has been evicted (never above total / capacity)"""
+        if not self.counters:
+            return 0.0
+        return max(self.min_count(), max(counter[1] for counter in self.counters.values()))
+
+
+class HyperLogLog:
+    """
+    HyperLogLog distinct counter with 2^precision one-byte registers
+
+    Keys are hashed with blake2b rather than hash() so registers stay
+    comparable across processes and can be persisted and merged later.
+    The relative standard error is 1.04 / sqrt(2^precision).
+    """
+
+    def __init__(self, precision=12, registers=None):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+
+    def add(self, key):
+        h = int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=8).digest(), 'big')
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Fold in another counter (or its registers) of the same precision"""
+        registers = other.registers if isinstance(other, HyperLogLog) else other
+        if len(registers) != self.m:
+            raise ValueError("Cannot merge HyperLogLog counters of different precision")
+        self.registers = bytearray(map(max, self.registers, registers))
+
+    def count(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(_HLL_POWERS[r] for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small range: linear counting is more accurate
+            estimate = m * math.log(m / zeros)
+        return estimate
+
+    def relative_error(self):
+        return 1.04 / math.sqrt(self.m)
@@ -0,0 +1,463 @@
+"""
+In-memory capture statistics served from sketches
+
+Every stored packet also updates a per-user, per-time-bucket set of
+sketches, so the top source IPs, destination IPs and destination ports of
+a window are answered by merging a few bucket summaries instead of three
+GROUP BY scans of packet_captures. Counts are over-estimates with a known
+bound (reported as `error_bound`), and windows are rounded down to whole
+buckets.
+
+The sketches only know packets stored by this process since it started,
+so a window that begins earlier is answered from the database instead, as
+is any window in which another process stored packets too (e.g. under
+several gunicorn workers). Each process that stores packets holds a
+'packet-writer:' lease (services.leases) while it does, renewed by the
+flusher thread; the other processes find it there. Clearing a user's
+packets in any process is seen through its packet_purges row: the sketches
+of every process forget the user before answering for them or flushing.
+
+Each bucket also keeps HyperLogLog counters of distinct source IPs,
+destination ports and flows. Those are flushed to the distinct_counts
+table periodically; merging is a register-wise max, so flushing the same
+bucket again (or after a restart) never double counts.
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from models import db, DistinctCount, PacketPurge
+from services.leases import acquire_lease, delete_expired, other_holders, process_owner
+from services.sketches import SpaceSaving, CountMinSketch, HyperLogLog
+
+EPOCH = datetime(1970, 1, 1)
+
+# Prefix of the leases held by processes storing packets
+WRITER_LEASE = 'packet-writer:'
+
+
+class HeavyHitters:
+    """Space-Saving candidates with Count-Min caps for one key (source IP, port, ...)"""
+
+    def __init__(self, capacity, width, depth, track_bytes=True):
+        self.summary = SpaceSaving(capacity)
+        self.packets = CountMinSketch(width, depth)
+        self.bytes = CountMinSketch(width, depth) if track_bytes else None
+
+    def add(self, key, count, nbytes):
+        self.summary.add(key, count, nbytes)
+        self.packets.add(key, count)
+        if self.bytes is not None:
+            self.bytes.add(key, nbytes)
+
+    def estimate(self, key, floor=None):
+        """
+        Upper bounds on (packets, bytes) of a key in this bucket
+
+        floor is summary.min_count(), passed in when estimating many keys.
+        """
+        counter = self.summary.counters.get(key)
+        if counter is not None and counter[1] == 0:
+            # Monitored since its first packet: exact
+            return counter[0], counter[2]
+        if counter is None:
+            floor = self.summary.min_count() if floor is None else floor
+            if not floor:
+                # Nothing was ever evicted, so an unmonitored key never occurred
+                return 0.0, 0.0
+            count = min(floor, self.packets.estimate(key))
+        else:
+            count = min(counter[0], self.packets.estimate(key))
+        return count, self.bytes.estimate(key) if self.bytes is not None else 0.0
+
+    def error_bound(self):
+        return min(self.summary.error_bound(), self.packets.error_bound())
+
+
+# Distinct-count metrics kept per bucket
+DISTINCT_METRICS = ('source_ips', 'destination_ports', 'flows')
+
+
+class BucketSketch:
+    """Sketches of one user's packets within one time bucket"""
+
+    def __init__(self, capacity, width, depth, precision):
+        self.src_ips = HeavyHitters(capacity, width, depth)
+        self.dst_ips = HeavyHitters(capacity, width, depth)
+        self.dst_ports = HeavyHitters(capacity, width, depth, track_bytes=False)
+        self.distinct = {metric: HyperLogLog(precision) for metric in DISTINCT_METRICS}
+        self.dirty = False  # distinct counters changed since the last flush
+
+
+class StatsSketches:
+    """Per-user, per-bucket heavy hitter sketches"""
+
+    def __init__(self, app, config):
+        self.app = app
+        self.bucket_seconds = getattr(config, 'STATS_SKETCH_BUCKET_SECONDS', 900)
+        self.retention = timedelta(hours=getattr(config, 'STATS_SKETCH_RETENTION_HOURS', 24))
+        self.capacity = getattr(config, 'STATS_SKETCH_CAPACITY', 100)
+        self.width = getattr(config, 'STATS_SKETCH_WIDTH', 256)
+        self.depth = getattr(config, 'STATS_SKETCH_DEPTH', 4)
+        self.precision = getattr(config, 'STATS_HLL_PRECISION', 12)
+        self.flush_interval = getattr(config, 'STATS_SKETCH_FLUSH_INTERVAL', 60)
+        # Database rows older than this were never seen by the sketches
+        self.started = datetime.utcnow()
+        self._buckets = defaultdict(dict)  # user_id -> {bucket index: BucketSketch}
+        self._lock = threading.Lock()
+        # Clears of a user's packets, possibly by another process: the newest one applied,
+        # when the sketches last forgot the user, and when packet_purges was last checked
+        self.clear_check_interval = 1.0
+        self._clears = {}
+        self._user_started = {}
+        self._clears_checked = {}
+        self.owner = process_owner()
+        # The writer lease outlives the last stored packet: it is renewed at most once per
+        # flush interval, for two intervals
+        self.lease_seconds = 2 * self.flush_interval
+        self._stored = False  # packets stored since the last lease renewal
+        self._lease_renew_at = 0.0
+        self.running = False
+        self.thread = None
+        self.flushes = 0
+        self.flush_errors = 0
+
+    def start(self):
+        """Start flushing distinct counters in the background"""
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._flush_loop, daemon=True)
+            self.thread.start()
+            print("Stats sketch flusher started")
+
+    def stop(self):
+        """Stop the flusher and persist what is left"""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=5)
+            print("Stats sketch flusher stopped")
+        self.flush()
+
+    def _flush_loop(self):
+        deadline = 0.0
+        while self.running:
+            self.renew_writer_lease()
+            if time.time() >= deadline:
+                self.flush()
+                deadline = time.time() + self.flush_interval
+            time.sleep(0.5)
+
+    def renew_writer_lease(self):
+        """Hold this process's writer lease while it stores packets (renewed off the request path)"""
+        now = time.time()
+        if not self._stored or now < self._lease_renew_at or self.app is None:
+            return
+        try:
+            with self.app.app_context():
+                acquire_lease(WRITER_LEASE + self.owner, self.owner, self.lease_seconds)
+                delete_expired(WRITER_LEASE, datetime.utcnow() - self.retention)
+        except Exception as e:
+            logging.error(f"Error renewing the packet writer lease: {e}")
+            return
+        self._stored = False
+        self._lease_renew_at = now + self.flush_interval
+
+    def _bucket(self, timestamp):
+        return int((timestamp - EPOCH).total_seconds()) // self.bucket_seconds
+
+    def _add(self, batch):
+        """Fold aggregated (user, bucket, 5-tuple) -> [packets, bytes] into the sketches"""
+        oldest = self._bucket(datetime.utcnow() - self.retention)
+        src, dst, ports = defaultdict(lambda: [0.0, 0.0]), defaultdict(lambda: [0.0, 0.0]), defaultdict(float)
+        distinct = defaultdict(set)
+        for (user_id, bucket, protocol, src_ip, dst_ip, src_port, dst_port), (count, nbytes) in batch.items():
+            # Distinct counts are persisted, so they also take packets older than the retention
+            keys = distinct[user_id, bucket]
+            keys.add(('flows', f'{protocol}|{src_ip}|{src_port}|{dst_ip}|{dst_port}'))
+            if src_ip is not None:
+                keys.add(('source_ips', src_ip))
+            if dst_port is not None:
+                keys.add(('destination_ports', dst_port))
+            if bucket < oldest:
+                continue
+            if src_ip is not None:
+                totals = src[user_id, bucket, src_ip]
+                totals[0] += count
+                totals[1] += nbytes
+            if dst_ip is not None:
+                totals = dst[user_id, bucket, dst_ip]
+                totals[0] += count
+                totals[1] += nbytes
+            if dst_port is not None:
+                ports[user_id, bucket, dst_port] += count
+
+        self._stored = True
+        with self._lock:
+            for (user_id, bucket, key), (count, nbytes) in src.items():
+                self._sketch(user_id, bucket).src_ips.add(key, count, nbytes)
+            for (user_id, bucket, key), (count, nbytes) in dst.items():
+                self._sketch(user_id, bucket).dst_ips.add(key, count, nbytes)
+            for (user_id, bucket, key), count in ports.items():
+                self._sketch(user_id, bucket).dst_ports.add(key, count, 0.0)
+            for (user_id, bucket), keys in distinct.items():
+                sketch = self._sketch(user_id, bucket)
+                for metric, key in keys:
+                    sketch.distinct[metric].add(key)
+                sketch.dirty = True
+            for buckets in self._buckets.values():
+                # Expired buckets are kept until their distinct counters are flushed
+                for bucket in [b for b, sketch in buckets.items() if b < oldest and not sketch.dirty]:
+                    del buckets[bucket]
+
+    def _sketch(self, user_id, bucket):
+        buckets = self._buckets[user_id]
+        sketch = buckets.get(bucket)
+        if sketch is None:
+            sketch = buckets[bucket] = BucketSketch(self.capacity, self.width, self.depth, self.precision)
+        return sketch
+
+    def add_rows(self, rows):
+        """
+        Record stored packet rows (PACKET_COLUMNS order)
+
+        Rows are aggregated per key first so a batch costs one sketch update
+        per distinct key rather than per packet.
+        """
+        batch = defaultdict(lambda: [0.0, 0.0])
+        bucket_seconds = self.bucket_seconds
+        for timestamp, protocol, src_ip, dst_ip, src_port, dst_port, length, _, sample_rate, user_id, *_ in rows:
+            rate = sample_rate or 1.0
+            bucket = int((timestamp - EPOCH).total_seconds()) // bucket_seconds
+            totals = batch[user_id, bucket, protocol, src_ip, dst_ip, src_port, dst_port]
+            totals[0] += rate
+            totals[1] += (length or 0) * rate
+        self._add(batch)
+
+    def add_flow_rows(self, rows):
+        """Record stored flow rows (FLOW_COLUMNS order), bucketed by last_seen like the flow statistics"""
+        batch = defaultdict(lambda: [0.0, 0.0])
+        for protocol, src_ip, dst_ip, src_port, dst_port, packets, nbytes, _, sample_rate, _, last_seen, user_id, *_ in rows:
+            rate = sample_rate or 1.0
+            totals = batch[user_id, self._bucket(last_seen), protocol, src_ip, dst_ip, src_port, dst_port]
+            totals[0] += packets * rate
+            totals[1] += nbytes * rate
+        self._add(batch)
+
+    def reset(self, user_id, cleared_at=None):
+        """
+        Forget a user's statistics after their packets were deleted (the caller deletes stored counters)
+
+        cleared_at is the created_at of the packet_purges row recording the
+        clear, so other processes' sketches apply it and this one does not again.
+        """
+        with self._lock:
+            self._buckets.pop(user_id, None)
+            if cleared_at is not None:
+                self._clears[user_id] = max(cleared_at, self._clears.get(user_id, cleared_at))
+
+    def _apply_clears(self, user_ids):
+        """Reset users whose packets another process cleared; must be called inside an application context"""
+        now = time.monotonic()
+        due = [user_id for user_id in user_ids
+               if now - self._clears_checked.get(user_id, float('-inf')) >= self.clear_check_interval]
+        if not due:
+            return
+        for user_id in due:
+            self._clears_checked[user_id] = now
+        rows = db.session.query(PacketPurge.user_id, func.max(PacketPurge.created_at)).filter(
+            PacketPurge.user_id.in_(due)
+        ).group_by(PacketPurge.user_id)
+        for user_id, cleared_at in rows:
+            # Clears from before the sketches started removed nothing they saw
+            if cleared_at > self._clears.get(user_id, self.started):
+                self.reset(user_id, cleared_at)
+                # Packets this process stored since the clear were forgotten with it
+                self._user_started[user_id] = datetime.utcnow()
+
+    def flush(self):
+        """
+        Merge changed distinct counters into the distinct_counts table
+
+        Returns:
+            Number of buckets written
+        """
+        if self.app is not None:
+            # A cleared user's counters must not be written back after the clear deleted them
+            try:
+                with self.app.app_context():
+                    self._apply_clears(list(self._buckets))
+            except Exception as e:
+                logging.error(f"Error checking cleared statistics: {e}")
+        with self._lock:
+            dirty = []
+            for user_id, buckets in self._buckets.items():
+                for bucket, sketch in buckets.items():
+                    if sketch.dirty:
+                        sketch.dirty = False
+                        dirty.append((user_id, bucket, sketch,
+                                      {metric: bytes(hll.registers) for metric, hll in sketch.distinct.items()}))
+        if not dirty or self.app is None:
+            return 0
+
+        try:
+            with self.app.app_context():
+                for user_id, bucket, _, registers in dirty:
+                    bucket_start = self._bucket_start(bucket)
+                    stored = {
+                        row.metric: row
+                        for row in DistinctCount.query.filter_by(user_id=user_id, bucket_start=bucket_start)
+                    }
+                    for metric, value in registers.items():
+                        row = stored.get(metric)
+                        if row is None:
+                            db.session.add(DistinctCount(user_id=user_id, metric=metric,
+                                                         bucket_start=bucket_start, registers=value))
+                        elif len(row.registers) == len(value):
+                            merged = HyperLogLog(self.precision, row.registers)
+                            merged.merge(value)
+                            row.registers = bytes(merged.registers)
+                        else:
+                            # Written with another precision: this process's counters replace it
+                            row.registers = value
+                db.session.commit()
+        except Exception as e:
+            logging.error(f"Error flushing distinct counters: {e}")
+            self.flush_errors += 1
+            with self._lock:
+                for _, _, sketch, _ in dirty:
+                    sketch.dirty = True
+            return 0
+
+        self.flushes += 1
+        return len(dirty)
+
+    def _bucket_start(self, bucket):
+        return datetime.utcfromtimestamp(bucket * self.bucket_seconds)
+
+    def window_start(self, start_time):
+        """Start of the bucket holding start_time: the sketches answer for whole buckets from there"""
+        return self._bucket_start(self._bucket(start_time))
+
+    def get_distinct_counts(self, user_id, start_time):
+        """
+        Estimated distinct source IPs, destination ports and flows since start_time
+
+        Buckets the sketches saw completely come from memory; older ones (before
+        the process started or past the retention) come from the distinct_counts
+        table. Must be called inside an application context.
+        """
+        self._apply_clears([user_id])
+        first = self._bucket(start_time)
+        stored_until = max(self._bucket(self.started), self._bucket(datetime.utcnow() - self.retention))
+        if self._other_writers(start_time):
+            # Other processes' counters only reach this one through the table, including
+            # buckets after the current one (packet timestamps ahead of this clock);
+            # merging is a max, so buckets also held in memory are not counted twice
+            stored_until = None
+        merged = {metric: HyperLogLog(self.precision) for metric in DISTINCT_METRICS}
+
+        with self._lock:
+            for bucket, sketch in self._buckets.get(user_id, {}).items():
+                if bucket >= first:
+                    for metric, hll in sketch.distinct.items():
+                        merged[metric].merge(hll)
+
+        if stored_until is None or first <= stored_until:
+            rows = db.session.query(DistinctCount.metric, DistinctCount.registers).filter(
+                DistinctCount.user_id == user_id, DistinctCount.bucket_start >= self._bucket_start(first)
+            )
+            if stored_until is not None:
+                rows = rows.filter(DistinctCount.bucket_start <= self._bucket_start(stored_until))
+            for metric, registers in rows:
+                if metric in merged and len(registers) == merged[metric].m:
+                    merged[metric].merge(registers)
+
+        counts = {metric: int(round(hll.count())) for metric, hll in merged.items()}
+        counts['relative_error'] = round(merged['flows'].relative_error(), 4)
+        counts['window_start'] = self._bucket_start(first).isoformat()
+        return counts
+
+    def covers(self, start_time, user_id=None):
+        """
+        True if every stored packet since start_time (of user_id, if given) went through the sketches and is still kept
+
+        Must be called inside an application context.
+        """
+        if user_id is not None:
+            self._apply_clears([user_id])
+        # After a clear applied late, the user's packets stored in between were forgotten too
+        started = self._user_started.get(user_id, self.started)
+        return (start_time >= self.started and start_time >= started
+                and start_time >= datetime.utcnow() - self.retention and not self._other_writers(start_time))
+
+    def _other_writers(self, start_time):
+        """True if another process stored packets since start_time"""
+        return bool(other_holders(WRITER_LEASE, self.owner, start_time))
+
+    def _merge(self, sketches, attribute, limit):
+        """Top keys over several buckets: sum of per-bucket upper bounds"""
+        hitters = [getattr(sketch, attribute) for sketch in sketches]
+        floors = [hitter.summary.min_count() for hitter in hitters]
+
+        # Cheap bounds from the counters alone: a key whose upper bound is below
+        # the limit-th best lower bound cannot make the top list
+        total_floor = sum(floors)
+        upper, lower = defaultdict(float), defaultdict(float)
+        for hitter, floor in zip(hitters, floors):
+            for key, (count, error, _) in hitter.summary.counters.items():
+                upper[key] += count - floor
+                lower[key] += count - error
+        threshold = sorted(lower.values(), reverse=True)[limit - 1] if len(lower) >= limit else 0.0
+        candidates = [key for key, bound in upper.items() if bound + total_floor >= threshold]
+
+        totals = []
+        for key in candidates:
+            count = nbytes = 0.0
+            for hitter, floor in zip(hitters, floors):
+                c, b = hitter.estimate(key, floor)
+                count += c
+                nbytes += b
+            totals.append((count, nbytes, key))
+        totals.sort(key=lambda item: item[0], reverse=True)
+        return totals[:limit], sum(hitter.error_bound() for hitter in hitters)
+
+    def get_packet_analysis(self, user_id, start_time, limit=10):
+        """
+        Top talkers of a window in get_packet_analysis() format
+
+        Returns:
+            dict, or None if the window starts before the sketches were started
+        """
+        if not self.covers(start_time, user_id):
+            return None
+        first = self._bucket(start_time)
+        with self._lock:
+            sketches = [sketch for bucket, sketch in self._buckets.get(user_id, {}).items() if bucket >= first]
+            src, src_error = self._merge(sketches, 'src_ips', limit)
+            dst, dst_error = self._merge(sketches, 'dst_ips', limit)
+            ports, port_error = self._merge(sketches, 'dst_ports', limit)
+
+        from services.capture import COMMON_PORTS
+        return {
+            'top_source_ips': [
+                {'ip': ip, 'packet_count': int(round(count)), 'total_bytes': int(round(nbytes))}
+                for count, nbytes, ip in src
+            ],
+            'top_destination_ips': [
+                {'ip': ip, 'packet_count': int(round(count)), 'total_bytes': int(round(nbytes))}
+                for count, nbytes, ip in dst
+            ],
+            'top_destination_ports': [
+                {'port': port, 'service': COMMON_PORTS.get(port, 'Unknown'), 'packet_count': int(round(count))}
+                for count, _, port in ports
+            ],
+            'source': 'sketch',
+            'window_start': self._bucket_start(first).isoformat(),
+            'error_bound': {
+                'source_ips': int(round(src_error)),
+                'destination_ips': int(round(dst_error)),
+                'destination_ports': int(round(port_error))
+            }
+        }
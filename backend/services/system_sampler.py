@@ -0,0 +1,183 @@
+"""
+Shared background sampler of system metrics
+
+psutil.cpu_percent(interval=1) sleeps for a second, and every /system
+request and both background monitor checks used to pay for it. One sampler
+thread now takes CPU, memory, disk and interface snapshots on a fixed
+cadence (CPU is measured over the time since the previous
+sample, without sleeping). Each snapshot is a new dict published by a
+single reference assignment, so readers take no lock and get the latest
+complete snapshot in microseconds, together with its age. Other components
+can register listeners called with each new snapshot on the sampler thread.
+CPU, memory and disk I/O come from the METRICS_BACKEND collector
+(services.collectors); disk usage and interface addresses from psutil.
+"""
+import logging
+import socket
+import threading
+import time
+from datetime import datetime
+
+import psutil
+
+from services.collectors import create_collector
+
+
+def read_interfaces():
+    """IPv4 addresses of the network interfaces"""
+    interfaces = []
+    for interface_name, addrs in psutil.net_if_addrs().items():
+        for addr in addrs:
+            if addr.family == socket.AF_INET:
+                interfaces.append({
+                    'name': interface_name,
+                    'address': addr.address,
+                    'netmask': addr.netmask
+                })
+    return interfaces
+
+
+class SystemSampler:
+    """Samples system metrics on a timer into a latest-value cache"""
+
+    def __init__(self, config):
+        self.interval = getattr(config, 'SYSTEM_SAMPLE_INTERVAL', 1.0)
+        # Interfaces and disk usage change slowly; refreshed every N samples
+        self.slow_every = getattr(config, 'SYSTEM_SAMPLE_SLOW_EVERY', 10)
+        self.collector = create_collector(config)
+        self.cpu_count = psutil.cpu_count()
+        self._snapshot = None
+        self._listeners = []
+        self._ready = threading.Event()
+        self.running = False
+        self.thread = None
+
+        # Metrics
+        self.samples = 0
+        self.errors = 0
+        self.last_sample_ms = 0.0
+        self.max_sample_ms = 0.0
+
+    def start(self):
+        """Take the first snapshot and start sampling"""
+        if not self.running:
+            # Starts the CPU measurement; the first snapshot covers the time to the next sample
+            self.collector.cpu_percent()
+            self.running = True
+            self.thread = threading.Thread(target=self._sample_loop, daemon=True)
+            self.thread.start()
+            print("System sampler started")
+
+    def stop(self):
+        """Stop sampling"""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=5)
+            print("System sampler stopped")
+        self.collector.close()
+
+    def add_listener(self, callback):
+        """Call callback(snapshot) on the sampler thread after each sample"""
+        self._listeners.append(callback)
+
+    def _sample_loop(self):
+        deadline = time.monotonic()
+        while self.running:
+            self.sample()
+            # Fixed cadence: the next sample is due one interval after the previous one was due
+            deadline += self.interval
+            delay = deadline - time.monotonic()
+            if delay < 0:
+                deadline = time.monotonic()
+            else:
+                time.sleep(delay)
+
+    def sample(self):
+        """Take and publish one snapshot (called by the sampler thread)"""
+        started = time.perf_counter()
+        try:
+            previous = self._snapshot
+            slow = previous is None or self.samples % self.slow_every == 0
+            collector = self.collector
+            if slow:
+                disk = psutil.disk_usage('/')
+                disk = {'total': disk.total, 'used': disk.used, 'free': disk.free, 'percent': disk.percent}
+                interfaces = read_interfaces()
+            else:
+                disk, interfaces = previous['disk'], previous['network_interfaces']
+            snapshot = {
+                'monotonic': time.monotonic(),
+                'sampled_at': datetime.utcnow(),
+                'cpu': {'percent': collector.cpu_percent(), 'count': self.cpu_count},
+                'memory': collector.memory(),
+                'disk': disk,
+                'disk_io': collector.disk_io(),
+                'network_interfaces': interfaces
+            }
+            # Published whole: readers see the previous or the new snapshot, never a mix
+            self._snapshot = snapshot
+            self.samples += 1
+            self._ready.set()
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"Error sampling system metrics: {e}")
+            return None
+        finally:
+            self.last_sample_ms = (time.perf_counter() - started) * 1000
+            self.max_sample_ms = max(self.max_sample_ms, self.last_sample_ms)
+
+        for callback in self._listeners:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                logging.error(f"Error in system sample listener: {e}")
+        return snapshot
+
+    def latest(self, wait=None):
+        """
+        The latest snapshot, or None if there is none yet
+
+        wait: seconds to wait for the first snapshot after start
+        """
+        snapshot = self._snapshot
+        if snapshot is None and wait:
+            self._ready.wait(wait)
+            snapshot = self._snapshot
+        return snapshot
+
+    def system_stats(self):
+        """
+        get_system_stats() result from the latest snapshot, or None if there is none yet
+
+        Adds when the snapshot was taken and its age in seconds.
+        """
+        snapshot = self.latest(wait=self.interval if self.running else None)
+        if snapshot is None:
+            return None
+        return {
+            'cpu': snapshot['cpu'],
+            'memory': snapshot['memory'],
+            'disk': snapshot['disk'],
+            'disk_io': snapshot['disk_io'],
+            'network_interfaces': snapshot['network_interfaces'],
+            'sampled_at': snapshot['sampled_at'].isoformat(),
+            'age_seconds': self.age(snapshot)
+        }
+
+    @staticmethod
+    def age(snapshot):
+        """Seconds since a snapshot was taken"""
+        return round(time.monotonic() - snapshot['monotonic'], 3)
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            'running': self.running,
+            'backend': self.collector.name,
+            'interval': self.interval,
+            'samples': self.samples,
+            'errors': self.errors,
+            'age_seconds': self.age(snapshot) if snapshot is not None else None,
+            'last_sample_ms': round(self.last_sample_ms, 3),
+            'max_sample_ms': round(self.max_sample_ms, 3)
+        }
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Loopback-driven test of the raw capture backends"""
+
+import sys
+import os
+import socket
+import threading
+import time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from services.capture_backends import ScapyBackend, AfPacketBackend, get_capture_backend
+from services.decoder import decode_with_fallback
+
+
+def run_loopback_capture(backend, packets=50):
+    """Capture UDP datagrams sent to 127.0.0.1 and return the decoded ones"""
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    port = receiver.getsockname()[1]
+
+    decoded = []
+    opened = threading.Event()
+    done = threading.Event()
+    errors = []
+
+    def on_frame(frame, timestamp, link_layer):
+        packet = decode_with_fallback(frame, timestamp, link_layer)
+        if packet and packet['protocol'] == 'UDP' and packet['dst_port'] == port:
+            decoded.append(packet)
+
+    def capture():
+        try:
+            backend.run(on_frame, iface='lo', timeout=10, stop=lambda: done.is_set(), on_open=opened.set)
+        except Exception as e:
+            errors.append(e)
+            opened.set()
+
+    thread = threading.Thread(target=capture, daemon=True)
+    thread.start()
+    opened.wait(5)
+    if errors:
+        receiver.close()
+        raise errors[0]
+
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for i in range(packets):
+        sender.sendto(b'loopback-test-%d' % i, ('127.0.0.1', port))
+    sender.close()
+
+    deadline = time.time() + 5
+    while len(decoded) < packets and time.time() < deadline:
+        time.sleep(0.05)
+    done.set()
+    thread.join(timeout=5)
+    receiver.close()
+    return decoded
+
+
+def can_capture():
+    try:
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(3))
+        sock.close()
+        return True
+    except (AttributeError, OSError):
+        return False
+
+
+def test_afpacket_loopback():
+    """TPACKET_V3 ring delivers loopback traffic"""
+    print("\n=== Testing AF_PACKET TPACKET_V3 Backend ===")
+    if not AfPacketBackend.is_supported() or not can_capture():
+        print("- Skipped: requires Linux and CAP_NET_RAW")
+        return True
+
+    backend = AfPacketBackend(Config)
+    packets = run_loopback_capture(backend)
+    assert len(packets) >= 50, f"Expected 50 packets, captured {len(packets)}"
+    assert packets[0]['src_ip'] == '127.0.0.1'
+    stats = backend.stats()
+    assert stats['blocks'] > 0
+    print(f"✓ Captured {len(packets)} loopback packets in {stats['blocks']} block(s), kernel drops: {stats['kernel_drops']}")
+    return True
+
+
+def test_scapy_loopback():
+    """scapy raw socket backend delivers loopback traffic"""
+    print("\n=== Testing scapy Backend ===")
+    if not can_capture():
+        print("- Skipped: requires CAP_NET_RAW")
+        return True
+
+    packets = run_loopback_capture(ScapyBackend(Config))
+    assert len(packets) >= 50, f"Expected 50 packets, captured {len(packets)}"
+    print(f"✓ Captured {len(packets)} loopback packets")
+    return True
+
+
+def test_backend_selection():
+    """CAPTURE_BACKEND picks the backend"""
+    print("\n=== Testing Backend Selection ===")
+
+    class TestConfig:
+        CAPTURE_BACKEND = 'scapy'
+
+    assert isinstance(get_capture_backend(TestConfig), ScapyBackend)
+    TestConfig.CAPTURE_BACKEND = 'afpacket'
+    assert isinstance(get_capture_backend(TestConfig), AfPacketBackend)
+    TestConfig.CAPTURE_BACKEND = 'auto'
+    expected = AfPacketBackend if AfPacketBackend.is_supported() else ScapyBackend
+    assert isinstance(get_capture_backend(TestConfig), expected)
+    print("✓ Backend selection works")
+    return True
+
+
+def main():
+    """Run all tests"""
+    results = [
+        ("AF_PACKET Loopback", test_afpacket_loopback()),
+        ("scapy Loopback", test_scapy_loopback()),
+        ("Backend Selection", test_backend_selection())
+    ]
+
+    passed = sum(1 for _, result in results if result)
+    print(f"\nTotal: {passed}/{len(results)} tests passed")
+    return 0 if passed == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""Test the asynchronous capture job manager: limits, queueing and shared sources"""
+
+import sys
+import os
+import tempfile
+import time
+from datetime import datetime
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from models import db, PacketCapture, Flow, CaptureJobRecord, JobLease
+from services import background_tasks
+from services.capture_service import CaptureService
+from services.capture_jobs import CaptureJobManager, CaptureLimitError, StoredCaptureJob, _covers
+from services.capture_pipeline import PipelineResult
+from services.sampling import PacketSampler
+
+
+class JobConfig:
+    CAPTURE_JOBS_MAX_CONCURRENT = 2
+    CAPTURE_JOBS_MAX_PER_USER = 2
+    CAPTURE_JOBS_MAX_QUEUED = 1
+    CAPTURE_JOBS_RETAINED = 50
+    MAX_PACKETS = 1000
+    CAPTURE_TIMEOUT = 60
+    CAPTURE_INTERFACE = None
+    CAPTURE_RING_SIZE = 1000
+
+
+def make_packet(i, protocol='TCP'):
+    return {'timestamp': datetime.utcnow().isoformat(), 'protocol': protocol, 'src_ip': '10.0.0.1', 'dst_ip': '10.0.0.2',
+            'src_port': 40000, 'dst_port': 443 if protocol == 'TCP' else 53, 'length': 60, 'info': f'#{i}'}
+
+
+class FakePipeline:
+    """Stands in for ParallelCapture: 'captures' one flow until stopped or timed out"""
+    workers = 2
+    mode = 'reader'
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.calls = []
+
+    def run(self, iface=None, filter_str=None, timeout=10, stop=None):
+        self.calls.append(filter_str)
+        deadline = time.time() + timeout
+        while time.time() < deadline and not (stop and stop()):
+            time.sleep(0.01)
+        now = datetime.utcnow()
+        result = PipelineResult(self.mode)
+        result.merge({'worker': 0, 'frames': 3, 'packets': 3, 'non_ip': 0,
+                      'rows': [('UDP', '10.0.0.1', '8.8.8.8', 5000, 53, 3, 240, 0, 1.0, now, now, self.user_id)]})
+        return result
+
+
+def make_environment():
+    """A Flask app on a temporary database and a capture service fed by the test"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'jobs.db')}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+
+    # The ring buffer is filled directly instead of by a sniffer
+    service = CaptureService(JobConfig)
+    service.running = service.capturing = True
+    return app, service
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_filter_compatibility():
+    """A sniffer serves jobs whose packets its filter includes"""
+    print("\n=== Testing Filter Compatibility ===")
+    assert _covers(None, 'tcp') and _covers('tcp', 'tcp') and _covers('ip', 'udp')
+    assert not _covers('tcp', 'udp') and not _covers('tcp', None) and not _covers('ip', None)
+    print("✓ Unfiltered and 'ip' sniffers are shared with narrower jobs")
+    return True
+
+
+def test_limits_and_queue():
+    """Global slots, the queue bound and the per-user limit"""
+    print("\n=== Testing Limits and Queue ===")
+    app, service = make_environment()
+    saved = background_tasks.capture_service, background_tasks.packet_writer, background_tasks.flow_exporter
+    background_tasks.capture_service, background_tasks.packet_writer, background_tasks.flow_exporter = service, None, None
+    manager = CaptureJobManager(app, JobConfig)
+    try:
+        first = manager.submit(1, count=10, timeout=30)
+        second = manager.submit(2, count=10, timeout=30)
+        queued = manager.submit(3, count=10, timeout=30)
+        assert (first.status, second.status, queued.status) == ('running', 'running', 'queued')
+
+        for user_id in (4, 1):
+            try:
+                manager.submit(user_id, count=10, timeout=30)
+            except CaptureLimitError:
+                pass
+            else:
+                raise AssertionError("Queue is full")
+        for bad in ({'count': 0}, {'count': 5000}, {'timeout': 600}):
+            try:
+                manager.submit(5, **bad)
+            except ValueError:
+                continue
+            raise AssertionError(f"{bad} should be rejected")
+
+        # Cancelling a running job frees its slot for the queued one
+        manager.cancel(first.id, 1)
+        assert first.wait(2) and first.status == 'cancelled'
+        assert wait_for(lambda: queued.status == 'running')
+        assert manager.get(first.id, 2) is None, "Jobs are private to their user"
+
+        # Per-user limit: user 2 has one running job, a second one is accepted, a third is not
+        manager.cancel(queued.id, 3)
+        extra = manager.submit(2, count=10, timeout=30)
+        try:
+            manager.submit(2, count=10, timeout=30)
+        except CaptureLimitError:
+            pass
+        else:
+            raise AssertionError("Per-user limit not enforced")
+        assert manager.stats()['sources_started'] == 1, "All jobs read the one ring subscription"
+    finally:
+        manager.stop()
+        background_tasks.capture_service, background_tasks.packet_writer, background_tasks.flow_exporter = saved
+
+    assert all(job.status == 'cancelled' for job in (second, queued, extra))
+    print("✓ 2 running, 1 queued, excess rejected; cancel hands the slot to the queue")
+    return True
+
+
+def test_shared_capture():
+    """Concurrent jobs share one source, each with its own filter, count and sampler"""
+    print("\n=== Testing Shared Capture ===")
+    app, service = make_environment()
+    saved = background_tasks.capture_service, background_tasks.packet_writer, background_tasks.flow_exporter
+    background_tasks.capture_service, background_tasks.packet_writer, background_tasks.flow_exporter = service, None, None
+    manager = CaptureJobManager(app, JobConfig)
+    try:
+        tcp_job = manager.submit(1, protocol='tcp', count=20, timeout=10)
+        sampled_job = manager.submit(2, count=30, timeout=10, sampler=PacketSampler(every=2))
+        assert wait_for(lambda: service.ring.stats()['subscribers'] == 1)
+
+        for i in range(100):
+            service.ring.append(make_packet(i, 'TCP' if i % 2 else 'UDP'))
+        assert tcp_job.wait(5) and sampled_job.wait(5)
+        assert wait_for(lambda: service.ring.stats()['subscribers'] == 0), "Idle source unsubscribes"
+    finally:
+        manager.stop()
+        background_tasks.capture_service, background_tasks.packet_writer, background_tasks.flow_exporter = saved
+
+    assert tcp_job.status == 'completed' and len(tcp_job.packets) == 20
+    assert all(packet['protocol'] == 'TCP' for packet in tcp_job.packets)
+    assert sampled_job.status == 'completed' and len(sampled_job.packets) == 30
+    assert all(packet['sample_rate'] == 2.0 for packet in sampled_job.packets)
+    assert tcp_job.to_dict()['progress']['percent'] == 100.0
+    assert manager.stats()['sources_started'] == 1
+    with app.app_context():
+        assert PacketCapture.query.filter_by(user_id=1).count() == 20
+        assert PacketCapture.query.filter_by(user_id=2).count() == 30
+    print("✓ 2 jobs on 1 subscription: 20 TCP packets and 30 sampled packets stored")
+    return True
+
+
+def test_shared_job_state():
+    """Two processes' managers on one database share limits, status, results and cancellation"""
+    print("\n=== Testing Shared Job State ===")
+    app, service = make_environment()
+    saved = background_tasks.capture_service, background_tasks.packet_writer, background_tasks.flow_exporter
+    background_tasks.capture_service, background_tasks.packet_writer, background_tasks.flow_exporter = service, None, None
+    first, second = CaptureJobManager(app, JobConfig), CaptureJobManager(app, JobConfig)
+    for manager in (first, second):
+        manager.sync_interval = 0.05
+        manager.start()
+    try:
+        a = first.submit(1, count=10, timeout=30)
+        b = first.submit(1, count=10, timeout=30)
+        queued = None
+        for user_id in (1, 3):
+            # User 1 is at its limit on the other process; user 3 finds the slots and the queue taken
+            if user_id == 3:
+                queued = second.submit(2, count=10, timeout=30)
+            try:
+                second.submit(user_id, count=10, timeout=30)
+            except CaptureLimitError:
+                continue
+            raise AssertionError(f"Limit for user {user_id} not enforced across processes")
+        assert queued.status == 'queued' and second.stats()['running'] == 2
+
+        # Status, list and cancel of the first process's jobs from the second
+        remote = second.get(a.id, 1)
+        assert isinstance(remote, StoredCaptureJob) and remote.to_dict()['status'] == 'running'
+        assert [job.id for job in second.list(1)] == [b.id, a.id] and second.get(a.id, 2) is None
+        for i in range(4):
+            service.ring.append(make_packet(i))
+        assert wait_for(lambda: len(a.packets) == 4 and len(b.packets) == 4)
+        assert wait_for(lambda: second.get(a.id, 1).to_dict()['progress']['captured'] == 4)
+        second.cancel(a.id, 1)
+        assert a.wait(2) and a.status == 'cancelled'
+        assert wait_for(lambda: queued.status == 'running'), "The freed slot goes to the other process's queue"
+        result = second.get(a.id, 1).to_dict(include_packets=True)
+        assert result['status'] == 'cancelled' and len(result['packets']) == 4
+
+        # Jobs of a process that stopped renewing its lease are failed and stop counting
+        first.running = False
+        first.thread.join()
+        with app.app_context():
+            JobLease.query.filter_by(owner=first.owner).delete()
+            db.session.commit()
+        second._lease_renew_at = 0
+        assert wait_for(lambda: second.get(b.id, 1).status == 'failed')
+        assert second.stats()['running'] == 1
+        with app.app_context():
+            assert CaptureJobRecord.query.count() == 3
+    finally:
+        first.stop()
+        second.stop()
+        background_tasks.capture_service, background_tasks.packet_writer, background_tasks.flow_exporter = saved
+
+    print("✓ Limits, status, results and cancellation work across 2 managers; a dead process's jobs fail")
+    return True
+
+
+def test_pipeline_jobs():
+    """Pipeline captures take job slots like any capture and store their flows when they finish"""
+    print("\n=== Testing Pipeline Jobs ===")
+    app, service = make_environment()
+    saved = (background_tasks.capture_service, background_tasks.packet_writer, background_tasks.flow_exporter,
+             background_tasks.device_index, background_tasks.stats_sketches)
+    (background_tasks.capture_service, background_tasks.packet_writer, background_tasks.flow_exporter,
+     background_tasks.device_index, background_tasks.stats_sketches) = service, None, None, None, None
+    manager = CaptureJobManager(app, JobConfig)
+    try:
+        for bad in ('soon', 0, 600):
+            try:
+                manager.submit_pipeline(1, FakePipeline(1), timeout=bad)
+            except ValueError:
+                continue
+            raise AssertionError(f"timeout {bad!r} should be rejected")
+
+        short, long = FakePipeline(1), FakePipeline(1)
+        done = manager.submit_pipeline(1, short, protocol='udp', timeout=0.2)
+        cancelled = manager.submit_pipeline(1, long, timeout=30)
+        try:
+            manager.submit(1, count=10, timeout=30)
+        except CaptureLimitError:
+            pass
+        else:
+            raise AssertionError("Pipeline jobs count against the per-user limit")
+
+        assert done.wait(5) and done.status == 'completed' and short.calls == ['udp']
+        manager.cancel(cancelled.id, 1)
+        assert cancelled.wait(5) and cancelled.status == 'cancelled'
+        data = manager.get(done.id, 1).to_dict()
+        assert data['kind'] == 'pipeline' and data['source'] == 'pipeline'
+        assert data['stats']['total_packets'] == 3 and data['pipeline']['flows'] == 1
+        assert data['progress']['captured'] == 3
+    finally:
+        manager.stop()
+        (background_tasks.capture_service, background_tasks.packet_writer, background_tasks.flow_exporter,
+         background_tasks.device_index, background_tasks.stats_sketches) = saved
+
+    with app.app_context():
+        assert Flow.query.filter_by(user_id=1).count() == 2, "Cancelled runs keep what they captured"
+        stored = StoredCaptureJob(db.session.get(CaptureJobRecord, done.id)).to_dict()
+        assert stored['status'] == 'completed' and stored['stats']['total_bytes'] == 240
+    print("✓ 2 pipeline jobs took user 1's slots; flows of the completed and the cancelled run stored")
+    return True
+
+
+def main():
+    """Run all tests"""
+    results = [
+        ("Filter Compatibility", test_filter_compatibility()),
+        ("Limits and Queue", test_limits_and_queue()),
+        ("Shared Capture", test_shared_capture()),
+        ("Shared Job State", test_shared_job_state()),
+        ("Pipeline Jobs", test_pipeline_jobs())
+    ]
+
+    passed = sum(1 for _, result in results if result)
+    print(f"\nTotal: {passed}/{len(results)} tests passed")
+    return 0 if passed == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""Test the multi-process capture pipeline"""
+
+import sys
+import os
+import time
+from datetime import datetime
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from scapy.all import Ether, IP, TCP, UDP, ARP
+from config import Config
+from services.capture_pipeline import ParallelCapture, PipelineResult, flow_hash
+
+
+def test_flow_hash():
+    """Both directions of a flow hash alike; different flows spread out"""
+    print("\n=== Testing Flow Hash ===")
+    forward = bytes(Ether() / IP(src='10.0.0.1', dst='10.0.0.2') / TCP(sport=40000, dport=443))
+    reverse = bytes(Ether() / IP(src='10.0.0.2', dst='10.0.0.1') / TCP(sport=443, dport=40000))
+    assert flow_hash(forward) == flow_hash(reverse)
+    assert flow_hash(bytes(Ether() / ARP())) == 0
+
+    buckets = [0] * 4
+    for port in range(1000):
+        frame = bytes(Ether() / IP(src='10.0.0.1', dst='10.0.0.2') / UDP(sport=port, dport=53))
+        buckets[flow_hash(frame) % 4] += 1
+    assert min(buckets) > 150, buckets
+    print(f"✓ Symmetric hash, 1000 flows over 4 workers: {buckets}")
+    return True
+
+
+def test_merge():
+    """Partial results are merged; a flow reported by two workers is summed"""
+    print("\n=== Testing Partial Result Merge ===")
+    t0, t1, t2 = datetime(2024, 1, 1, 0, 0, 0), datetime(2024, 1, 1, 0, 0, 5), datetime(2024, 1, 1, 0, 0, 9)
+    flow = ('TCP', '10.0.0.1', '10.0.0.2', 40000, 443)
+    result = PipelineResult('reader')
+    result.merge({'worker': 0, 'frames': 10, 'packets': 10, 'non_ip': 0,
+                  'rows': [flow + (10, 1000, 0x02, 1.0, t0, t1, 1)]})
+    result.merge({'worker': 1, 'frames': 6, 'packets': 5, 'non_ip': 1,
+                  'rows': [flow + (4, 400, 0x10, 1.0, t1, t2, 1),
+                           ('UDP', '10.0.0.1', '8.8.8.8', 5000, 53, 1, 80, 0, 1.0, t0, t0, 1)]})
+
+    assert (result.frames, result.packets, result.non_ip) == (16, 15, 1)
+    tcp = next(row for row in result.rows() if row[0] == 'TCP')
+    assert tcp[5:8] == (14, 1400, 0x12) and tcp[9:11] == (t0, t2)
+    summary = result.summary()
+    assert summary['total_packets'] == 15 and summary['total_bytes'] == 1480
+    assert summary['top_destination_ports'][0] == {'port': 443, 'service': 'HTTPS', 'packet_count': 14}
+    print("✓ Worker results merged into 2 flows")
+    return True
+
+
+def test_reader_pipeline():
+    """Frames dispatched by the reader are decoded and aggregated by the workers"""
+    print("\n=== Testing Reader Pipeline ===")
+    frames = [
+        bytes(Ether() / IP(src='10.0.0.1', dst=f'10.0.1.{i % 20}') / UDP(sport=5000, dport=53) / (b'x' * 50))
+        for i in range(2000)
+    ] + [bytes(Ether() / ARP())] * 10
+
+    class TwoWorkers(Config):
+        CAPTURE_PIPELINE_WORKERS = 2  # worker counts are capped at this (the CPU count by default)
+
+    pipeline = ParallelCapture(TwoWorkers, workers=2, mode='reader', user_id=3)
+    pipeline.start('reader')
+    started = time.time()
+    for frame in frames:
+        pipeline.dispatch(frame, started)
+    result = pipeline.finish()
+
+    assert result.frames == 2010 and result.packets == 2000 and result.non_ip == 10
+    assert len(result.flows) == 20
+    assert len(result.workers) == 2 and all(worker['frames'] > 0 for worker in result.workers)
+    assert {row[-1] for row in result.rows()} == {3}, "Flows carry the capturing user"
+    assert result.summary()['total_bytes'] == 2000 * len(frames[0])
+    print(f"✓ 2010 frames through 2 workers: {[w['frames'] for w in result.workers]}")
+    return True
+
+
+def test_worker_limit():
+    """Requested worker counts are capped at CAPTURE_PIPELINE_WORKERS; nothing is spawned up front"""
+    print("\n=== Testing Worker Limit ===")
+
+    class LimitConfig(Config):
+        CAPTURE_PIPELINE_WORKERS = 3
+
+    assert ParallelCapture(LimitConfig, workers=5000, mode='reader').workers == 3
+    assert ParallelCapture(LimitConfig, workers=2, mode='reader').workers == 2
+    assert ParallelCapture(LimitConfig, mode='reader').workers == 3
+    for bad in ({'workers': -1}, {'workers': 'many'}, {'mode': 'turbo'}):
+        try:
+            ParallelCapture(LimitConfig, **bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"{bad} should be rejected")
+    assert not ParallelCapture(LimitConfig, workers=2)._processes
+    print("✓ 5000 workers capped at 3; invalid counts and modes rejected")
+    return True
+
+
+def test_worker_main_import():
+    """Spawned workers re-import the main script; app.py must start nothing then"""
+    print("\n=== Testing Worker Import of app.py ===")
+    import runpy
+    from services import background_tasks
+    names = ('background_monitor', 'capture_service', 'packet_writer', 'flow_exporter', 'capture_jobs',
+             'retention_job', 'packet_purger', 'system_sampler', 'rate_engine')
+    before = {name: getattr(background_tasks, name) for name in names}
+    # What multiprocessing's spawn does in each worker when started from `python app.py`
+    namespace = runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py'),
+                               run_name='__mp_main__')
+    assert 'create_app' in namespace and 'app' not in namespace
+    assert {name: getattr(background_tasks, name) for name in names} == before, "No services started"
+    print("✓ app.py imported as __mp_main__ without creating the app")
+    return True
+
+
+def main():
+    """Run all tests"""
+    results = [
+        ("Flow Hash", test_flow_hash()),
+        ("Partial Result Merge", test_merge()),
+        ("Reader Pipeline", test_reader_pipeline()),
+        ("Worker Limit", test_worker_limit()),
+        ("Worker Import of app.py", test_worker_main_import())
+    ]
+
+    passed = sum(1 for _, result in results if result)
+    print(f"\nTotal: {passed}/{len(results)} tests passed")
+    return 0 if passed == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
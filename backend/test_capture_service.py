@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""Test the continuous capture service ring buffer"""
+
+import sys
+import os
+import threading
+import time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from scapy.all import Ether, IP, TCP, UDP
+from config import Config
+from services.capture_service import PacketRing, CaptureService
+
+
+def test_ring_buffer():
+    """Test ring eviction, drop counters and cursor reads"""
+    print("\n=== Testing Packet Ring Buffer ===")
+    ring = PacketRing(capacity=3)
+
+    for i in range(5):
+        ring.append({'protocol': 'TCP' if i % 2 == 0 else 'UDP', 'length': i})
+
+    stats = ring.stats()
+    assert stats['buffered'] == 3, "Ring should hold at most its capacity"
+    assert stats['received'] == 5, "All appended packets should be counted"
+    assert stats['dropped'] == 2, "Evicted packets should be counted as dropped"
+    print("✓ Ring evicts oldest packets and counts drops")
+
+    packets, cursor = ring.read(since=0)
+    assert [p['length'] for p in packets] == [2, 3, 4]
+    assert cursor == 5
+    print("✓ Ring read returns buffered packets and a cursor")
+
+    packets, _ = ring.read(since=0, protocol='tcp')
+    assert [p['length'] for p in packets] == [2, 4]
+    packets, _ = ring.read(since=cursor)
+    assert packets == []
+    print("✓ Protocol filter and cursor work")
+    return True
+
+
+def test_subscription():
+    """Test bounded subscriber queues"""
+    print("\n=== Testing Subscriptions ===")
+    ring = PacketRing(capacity=100)
+    subscription = ring.subscribe(maxsize=2, protocol='udp')
+
+    for i in range(4):
+        ring.append({'protocol': 'UDP', 'length': i})
+    ring.append({'protocol': 'TCP', 'length': 99})
+
+    items = subscription.get(timeout=0.1)
+    assert [p['length'] for _, p in items] == [2, 3], "Slow subscriber should keep the newest packets"
+    assert subscription.dropped == 2
+    print("✓ Subscriber queue is bounded and filtered")
+
+    subscription.close()
+    assert ring.stats()['subscribers'] == 0
+    assert subscription.get(timeout=0.05) == []
+    print("✓ Unsubscribe works")
+    return True
+
+
+def test_service_packet_handler():
+    """Test that the service decodes raw frames into the ring"""
+    print("\n=== Testing Capture Service Packet Handler ===")
+    service = CaptureService(Config)
+    now = time.time()
+    service._on_frame(bytes(Ether() / IP(src='10.0.0.1', dst='10.0.0.2') / TCP(sport=1234, dport=80)), now)
+    service._on_frame(bytes(Ether() / IP(src='10.0.0.3', dst='10.0.0.4') / UDP(sport=5353, dport=53)), now)
+    service._on_frame(bytes(Ether(type=0x0806) / b'not ip'), now)
+
+    packets, cursor = service.read()
+    assert cursor == 2, "Non-IP frames should not be buffered"
+    assert packets[0]['protocol'] == 'TCP' and packets[0]['dst_port'] == 80
+    assert packets[1]['protocol'] == 'UDP' and packets[1]['src_ip'] == '10.0.0.3'
+    assert not service.is_available(), "Service is not available until the sniffer runs"
+    print("✓ Packets are parsed into the ring buffer")
+    return True
+
+
+def test_collect_per_user():
+    """Collection returns at once and never returns a packet twice to a user"""
+    print("\n=== Testing Per-User Collection ===")
+    service = CaptureService(Config)
+    for i in range(5):
+        service.ring.append({'protocol': 'TCP', 'length': i})
+
+    # Without a cursor a user gets the newest buffered packets
+    started = time.time()
+    packets, cursor = service.collect(1, count=3)
+    assert time.time() - started < 0.5, "Does not wait for packets"
+    assert [p['length'] for p in packets] == [2, 3, 4] and cursor == 5
+
+    for i in range(5, 10):
+        service.ring.append({'protocol': 'TCP' if i % 2 else 'UDP', 'length': i})
+    packets, cursor = service.collect(1, protocol='tcp', count=2)
+    assert [p['length'] for p in packets] == [5, 7] and cursor == 8, "Oldest first after the cursor"
+
+    # The next call picks up after the last packet returned, even with an old or no cursor
+    packets, cursor = service.collect(1, count=10, since=0)
+    assert [p['length'] for p in packets] == [8, 9] and cursor == 10
+    assert service.collect(1, count=10)[0] == []
+    assert [p['length'] for p in service.collect(2, count=10, since=8)[0]] == [8, 9], "Cursors are per user"
+    print("✓ Each packet returned to a user once; new users get the newest packets")
+    return True
+
+
+def test_backend_status():
+    """The backend shows in the status while it captures, not only after it stopped"""
+    print("\n=== Testing Backend Status ===")
+    from services.capture_backends import ScapyBackend
+
+    class ScapyConfig(Config):
+        CAPTURE_BACKEND = 'scapy'
+
+    service = CaptureService(ScapyConfig)
+    seen = []
+    original = ScapyBackend.run
+
+    def run(backend, on_frame, stop=None, on_open=None, **kwargs):
+        on_open()
+        seen.append(service.status()['backend'])
+        while not stop():
+            time.sleep(0.01)
+        return 0
+
+    ScapyBackend.run = run
+    try:
+        service.start()
+        deadline = time.time() + 5
+        while not seen and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        service.stop()
+        ScapyBackend.run = original
+    assert seen == [{'backend': 'scapy', 'received': 0}], seen
+    print(f"✓ Status during capture: {seen[0]}")
+    return True
+
+
+def main():
+    """Run all tests"""
+    results = [
+        ("Ring Buffer", test_ring_buffer()),
+        ("Subscriptions", test_subscription()),
+        ("Service Packet Handler", test_service_packet_handler()),
+        ("Per-User Collection", test_collect_per_user()),
+        ("Backend Status", test_backend_status())
+    ]
+
+    passed = sum(1 for _, result in results if result)
+    print(f"\nTotal: {passed}/{len(results)} tests passed")
+    return 0 if passed == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
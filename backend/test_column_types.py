@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Test compact packet storage: binary addresses, protocol numbers and the legacy table migration"""
+
+import sys
+import os
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from sqlalchemy import inspect, text
+from models import db, PacketCapture, Flow
+from migrations import upgrade, compact_packet_columns
+from services import background_tasks
+from services.capture import save_packets
+
+
+def make_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'compact.db')}"
+    db.init_app(app)
+    return app
+
+
+def test_compact_storage():
+    """Rows are stored as packed bytes and numbers but read back as before"""
+    print("\n=== Testing Compact Storage ===")
+    app = make_app()
+    saved = (background_tasks.stats_sketches, background_tasks.packet_writer, background_tasks.flow_exporter,
+             background_tasks.packet_purger)
+    background_tasks.stats_sketches = background_tasks.packet_writer = None
+    background_tasks.flow_exporter = background_tasks.packet_purger = None
+    try:
+        with app.app_context():
+            db.create_all()
+            save_packets([
+                {'timestamp': '2026-03-10T12:00:00', 'protocol': 'TCP', 'src_ip': '192.168.1.10',
+                 'dst_ip': '10.0.0.1', 'src_port': 40000, 'dst_port': 443, 'length': 60, 'info': 'Flags: SA',
+                 'tcp_flags': 0x12},
+                {'timestamp': '2026-03-10T12:00:01', 'protocol': 'ICMPv6', 'src_ip': '2001:db8::1',
+                 'dst_ip': 'ff02::1', 'src_port': None, 'dst_port': None, 'length': 90, 'info': 'Type: 135'},
+            ], 1)
+            db.session.commit()
+            raw = db.session.execute(text(
+                "SELECT protocol, length(src_ip), length(dst_ip), typeof(src_ip), tcp_flags, icmp_type "
+                "FROM packet_captures ORDER BY id"
+            )).all()
+            tcp = PacketCapture.query.filter(PacketCapture.protocol == 'tcp',
+                                             PacketCapture.src_ip == '192.168.1.10').one().to_dict()
+            icmp = PacketCapture.query.filter_by(dst_ip='ff02::1').one().to_dict()
+            unknown = PacketCapture.query.filter_by(protocol='SCTP').count()
+    finally:
+        (background_tasks.stats_sketches, background_tasks.packet_writer, background_tasks.flow_exporter,
+         background_tasks.packet_purger) = saved
+
+    assert raw == [(6, 4, 4, 'blob', 0x12, None), (58, 16, 16, 'blob', None, 135)]
+    assert (tcp['protocol'], tcp['src_ip'], tcp['info'], tcp['tcp_flags']) == ('TCP', '192.168.1.10', 'Flags: SA', 0x12)
+    assert (icmp['protocol'], icmp['src_ip'], icmp['info']) == ('ICMPv6', '2001:db8::1', 'Type: 135')
+    assert unknown == 0, "Unknown protocols match nothing"
+    print("✓ IPv4 in 4 bytes, IPv6 in 16, protocols as numbers; the API sees the same strings")
+    return True
+
+
+def test_legacy_migration():
+    """Text tables are rebuilt in chunks with their ids, once"""
+    print("\n=== Testing Legacy Table Migration ===")
+    app = make_app()
+    with app.app_context():
+        db.create_all()
+        for table in (PacketCapture.__table__, Flow.__table__):
+            table.drop(bind=db.engine)
+        db.session.execute(text(
+            "CREATE TABLE packet_captures (id INTEGER PRIMARY KEY, timestamp DATETIME, protocol VARCHAR(10), "
+            "src_ip VARCHAR(45), dst_ip VARCHAR(45), src_port INTEGER, dst_port INTEGER, length INTEGER, "
+            "info TEXT, sample_rate FLOAT, user_id INTEGER NOT NULL)"
+        ))
+        db.session.execute(text("CREATE INDEX ix_packet_captures_timestamp ON packet_captures (timestamp)"))
+        db.session.execute(text(
+            "CREATE TABLE flows (id INTEGER PRIMARY KEY, protocol VARCHAR(10), src_ip VARCHAR(45), "
+            "dst_ip VARCHAR(45), src_port INTEGER, dst_port INTEGER, packets BIGINT, bytes BIGINT, "
+            "tcp_flags INTEGER, sample_rate FLOAT, first_seen DATETIME, last_seen DATETIME, user_id INTEGER NOT NULL)"
+        ))
+        infos = ['Flags: PA', 'Type: 8', '', 'free text']
+        for i in range(25):
+            db.session.execute(text(
+                "INSERT INTO packet_captures VALUES (:id, '2026-03-10 12:00:00', :protocol, :src, '10.0.0.2', "
+                "1000, 80, 60, :info, 1.0, 1)"
+            ), {'id': 10 + 3 * i, 'protocol': ['TCP', 'ICMP', 'UDP', 'IP'][i % 4],
+                'src': 'not an address' if i == 24 else f'10.0.1.{i}', 'info': infos[i % 4]})
+        db.session.execute(text(
+            "INSERT INTO flows VALUES (7, 'UDP', 'fe80::1', '10.0.0.2', 53, 53, 4, 400, 0, 1.0, "
+            "'2026-03-10 12:00:00', '2026-03-10 12:00:00', 1)"
+        ))
+        db.session.commit()
+        db.session.remove()
+
+        converted = compact_packet_columns(db.engine, chunk_size=10)
+        results = dict(upgrade(db.engine))
+        tables = set(inspect(db.engine).get_table_names())
+        indexes = {index['name'] for index in inspect(db.engine).get_indexes('packet_captures')}
+        packets = {packet.id: packet.to_dict() for packet in PacketCapture.query.all()}
+        flow = Flow.query.one().to_dict()
+
+    assert converted == ['packet_captures: 25 rows', 'flows: 1 rows']
+    assert results['compact_packet_columns'] == [], "Already converted tables are left alone"
+    assert 'packet_captures_legacy' not in tables and 'ix_packet_captures_user_time' in indexes
+    assert sorted(packets) == [10 + 3 * i for i in range(25)], "Ids are kept"
+    assert (packets[10]['protocol'], packets[10]['src_ip'], packets[10]['info']) == ('TCP', '10.0.1.0', 'Flags: PA')
+    assert (packets[13]['protocol'], packets[13]['info']) == ('ICMP', 'Type: 8')
+    assert packets[19]['protocol'] == 'IP' and packets[19]['info'] == '', "Other text is dropped"
+    assert packets[82]['src_ip'] is None and packets[82]['dst_ip'] == '10.0.0.2'
+    assert (flow['src_ip'], flow['protocol'], flow['bytes']) == ('fe80::1', 'UDP', 400)
+    print(f"✓ {len(packets)} packets and 1 flow converted in chunks of 10; a second run changes nothing")
+    return True
+
+
+def main():
+    """Run all tests"""
+    results = [
+        ("Compact Storage", test_compact_storage()),
+        ("Legacy Table Migration", test_legacy_migration())
+    ]
+
+    passed = sum(1 for _, result in results if result)
+    print(f"\nTotal: {passed}/{len(results)} tests passed")
+    return 0 if passed == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""Test the TCP connection-state collector, its shared cache, logging and alert thresholds"""
+
+import sys
+import os
+import socket
+import tempfile
+from collections import Counter
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import psutil
+from flask import Flask
+from models import db, ConnectionStateLog
+from services import background_tasks, monitor
+from services.monitor import TcpConnectionCollector, get_connection_stats, connection_alerts
+
+HEADER = "  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode\n"
+
+
+def proc_address(address, port):
+    """An address as /proc/net/tcp{,6} prints it: 32-bit words in host byte order, in hex"""
+    family = socket.AF_INET6 if ':' in address else socket.AF_INET
+    raw = socket.inet_pton(family, address)
+    if sys.byteorder == 'little':
+        raw = b''.join(raw[i:i + 4][::-1] for i in range(0, len(raw), 4))
+    return f"{raw.hex().upper()}:{port:04X}"
+
+
+def table(rows):
+    """/proc/net/tcp content of (local, remote, state code) rows"""
+    lines = [HEADER]
+    for number, (local, remote, state) in enumerate(rows):
+        lines.append(f"{number:4}: {proc_address(*local)} {proc_address(*remote)} {state} "
+                     f"00000000:00000000 00:00000000 00000000     0        0 {1000 + number} 1 0000000000000000 20 4 0 10 -1\n")
+    return ''.join(lines)
+
+
+def fixture_root():
+    root = tempfile.mkdtemp()
+    os.makedirs(os.path.join(root, 'net'))
+    server, client, other = ('10.0.0.5', 443), ('93.184.216.34', 51000), ('198.51.100.7', 40000)
+    v4 = [(('0.0.0.0', 443), ('0.0.0.0', 0), '0A')]
+    v4 += [(server, client, '01')] * 3 + [(server, other, '06')] * 2 + [(server, other, '03')]
+    v4 += [(('10.0.0.5', 50000), ('10.0.0.1', 53), '08')]
+    v6 = [(('::', 22), ('::', 0), '0A'), (('::', 22), ('::', 0), '07'),
+          (('::ffff:10.0.0.5', 443), ('::ffff:93.184.216.34', 51001), '01'),
+          (('2001:db8::5', 443), ('2001:db8::99', 40001), '0C')]
+    with open(os.path.join(root, 'net', 'tcp'), 'w') as f:
+        f.write(table(v4))
+    with open(os.path.join(root, 'net', 'tcp6'), 'w') as f:
+        f.write(table(v6))
+    return root
+
+
+class ConnectionConfig:
+    TCP_ESTABLISHED_THRESHOLD = 3
+    TCP_TIME_WAIT_THRESHOLD = 100
+    TCP_SYN_RECV_THRESHOLD = 1
+
+
+def test_collector():
+    """Sockets are counted by state and remote address across IPv4 and IPv6"""
+    print("\n=== Testing TCP Connection Collector ===")
+    collector = TcpConnectionCollector(root=fixture_root(), top=2)
+    stats = collector.collect()
+    states = stats['states']
+    assert stats['source'] == 'proc' and stats['total'] == 12
+    assert (states['ESTABLISHED'], states['TIME_WAIT'], states['SYN_RECV'], states['LISTEN']) == (4, 2, 2, 2)
+    assert (states['CLOSE_WAIT'], states['CLOSE'], states['FIN_WAIT1']) == (1, 1, 0)
+    assert stats['top_remote_addresses'] == [
+        {'address': '93.184.216.34', 'connections': 4},   # IPv4-mapped IPv6 merged with IPv4
+        {'address': '198.51.100.7', 'connections': 3},
+    ], "Listeners and unconnected sockets have no remote address"
+
+    alerts = connection_alerts(stats, ConnectionConfig)
+    assert [alert_type for alert_type, _ in alerts] == ['tcp_established', 'tcp_syn_recv']
+    print(f"✓ {stats['total']} sockets in {stats['collect_ms']} ms; alerts: {[message for _, message in alerts]}")
+    return True
+
+
+def test_matches_psutil():
+    """With hundreds of live sockets, /proc counts match psutil's"""
+    print("\n=== Testing TCP Connection Collector Against psutil ===")
+    collector = TcpConnectionCollector()
+    if not collector.use_proc:
+        print("✓ Skipped: no readable /proc/net/tcp")
+        return True
+    # 200 loopback connections: 200 listeners, 400 ESTABLISHED ends, /proc/net/tcp well past one page
+    sockets = []
+    try:
+        for _ in range(200):
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.bind(('127.0.0.1', 0))
+            listener.listen(1)
+            client = socket.create_connection(listener.getsockname())
+            server, _ = listener.accept()
+            sockets += [listener, client, server]
+        stats = collector.collect()
+        reference = Counter(connection.status for connection in psutil.net_connections('tcp'))
+    finally:
+        for sock in sockets:
+            sock.close()
+
+    assert stats['source'] == 'proc'
+    assert stats['states']['LISTEN'] >= 200 and stats['states']['ESTABLISHED'] >= 400, stats['states']
+    # Only sockets opened or closed between the two reads can differ
+    assert abs(stats['total'] - sum(reference.values())) <= 10, (stats['total'], sum(reference.values()))
+    for state in ('LISTEN', 'ESTABLISHED'):
+        assert abs(stats['states'][state] - reference[state]) <= 10, (state, stats['states'][state], reference[state])
+    top = stats['top_remote_addresses'][0]
+    assert top['address'] == '127.0.0.1' and top['connections'] >= 400, top
+    print(f"✓ {stats['total']} sockets from /proc vs {sum(reference.values())} from psutil in {stats['collect_ms']} ms")
+    return True
+
+
+def test_shared_and_logged():
+    """Callers within the sample interval share one reading; the monitor logs it"""
+    print("\n=== Testing Shared Connection Stats and Logging ===")
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'connections.db')}"
+    db.init_app(app)
+    saved = (monitor._connection_collector, monitor._connection_stats, background_tasks.system_sampler,
+             background_tasks.rate_engine, background_tasks.device_index)
+    monitor._connection_collector = TcpConnectionCollector(root=fixture_root())
+    monitor._connection_stats = None
+    sampler = background_tasks.SystemSampler(ConnectionConfig)
+    sampler.sample()
+    background_tasks.system_sampler = sampler
+    background_tasks.rate_engine = background_tasks.device_index = None
+    try:
+        first = get_connection_stats(max_age=60)
+        assert get_connection_stats(max_age=60) is first, "Reused within max_age"
+        assert get_connection_stats(max_age=0) is not first, "Read again when older"
+        with app.app_context():
+            db.create_all()
+        background_tasks.BackgroundMonitor(app, ConnectionConfig)._log_traffic_data()
+        with app.app_context():
+            log = ConnectionStateLog.query.one().to_dict()
+    finally:
+        (monitor._connection_collector, monitor._connection_stats, background_tasks.system_sampler,
+         background_tasks.rate_engine, background_tasks.device_index) = saved
+
+    assert (log['total'], log['established'], log['time_wait'], log['syn_recv'], log['listen']) == (12, 4, 2, 2, 2)
+    assert (log['close_wait'], log['fin_wait'], log['other']) == (1, 0, 1)
+    print(f"✓ One reading shared, logged as {log}")
+    return True
+
+
+def main():
+    """Run all tests"""
+    results = [
+        ("TCP Connection Collector", test_collector()),
+        ("TCP Connection Collector Against psutil", test_matches_psutil()),
+        ("Shared Connection Stats and Logging", test_shared_and_logged())
+    ]
+
+    passed = sum(1 for _, result in results if result)
+    print(f"\nTotal: {passed}/{len(results)} tests passed")
+    return 0 if passed == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Test the struct-based fast-path header decoder against scapy"""
+
+import sys
+import os
+import time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from scapy.all import Ether, Dot1Q, ARP, IP, IPv6, TCP, UDP, ICMP, Raw
+from scapy.layers.inet6 import ICMPv6EchoRequest, IPv6ExtHdrHopByHop, IPv6ExtHdrFragment
+from services.capture import parse_packet
+from services.decoder import decode_frame, decode_with_fallback, UNSUPPORTED, TCP_FLAG_STRINGS
+
+
+def test_matches_scapy_ipv4():
+    """The fast path produces the same fields as the scapy callback for IPv4"""
+    print("\n=== Testing IPv4 Decoding ===")
+    frames = [
+        Ether() / IP(src='192.168.1.10', dst='8.8.8.8') / TCP(sport=40000, dport=443, flags='PA') / Raw(b'x' * 100),
+        Ether() / IP(src='10.0.0.1', dst='10.0.0.2', options=b'\x01\x01\x01\x00') / TCP(flags='S'),
+        Ether() / IP(src='10.0.0.1', dst='224.0.0.251') / UDP(sport=5353, dport=5353),
+        Ether() / IP(src='10.0.0.1', dst='10.0.0.2') / ICMP(type=8),
+        Ether() / IP(src='10.0.0.1', dst='10.0.0.2', proto=47) / Raw(b'gre'),
+        Ether() / Dot1Q(vlan=10) / IP(src='172.16.0.1', dst='172.16.0.2') / UDP(sport=1, dport=2),
+    ]
+    now = time.time()
+    for frame in frames:
+        raw = bytes(frame)
+        expected = parse_packet(Ether(raw))
+        decoded = decode_frame(raw, now).to_dict()
+        for key in ('protocol', 'src_ip', 'dst_ip', 'src_port', 'dst_port', 'length', 'info'):
+            assert decoded[key] == expected[key], f"{key}: {decoded[key]!r} != {expected[key]!r}"
+    print(f"✓ {len(frames)} IPv4 frames decode identically to scapy")
+    return True
+
+
+def test_ipv6():
+    """IPv6 transport headers are found behind extension headers"""
+    print("\n=== Testing IPv6 Decoding ===")
+    now = time.time()
+    decoded = decode_frame(bytes(Ether() / IPv6(src='2001:db8::1', dst='2001:db8::2') / TCP(sport=1, dport=22, flags='SA')), now)
+    assert (decoded.protocol, decoded.src_ip, decoded.dst_port, decoded.info) == ('TCP', '2001:db8::1', 22, 'Flags: SA')
+
+    decoded = decode_frame(bytes(Ether() / IPv6() / IPv6ExtHdrHopByHop() / UDP(sport=546, dport=547)), now)
+    assert (decoded.protocol, decoded.dst_port) == ('UDP', 547)
+
+    decoded = decode_frame(bytes(Ether() / IPv6() / IPv6ExtHdrFragment(offset=10) / Raw(b'x' * 16)), now)
+    assert decoded.protocol == 'IP' and decoded.dst_port is None, "Non-first fragments have no ports"
+
+    decoded = decode_frame(bytes(Ether() / IPv6() / ICMPv6EchoRequest()), now)
+    assert (decoded.protocol, decoded.icmp_type) == ('ICMPv6', 128)
+    print("✓ IPv6 with extension headers and ICMPv6 decoded")
+    return True
+
+
+def test_non_ip_and_fallback():
+    """Non-IP frames are skipped; exotic or truncated frames fall back to scapy"""
+    print("\n=== Testing Non-IP Frames and Fallback ===")
+    now = time.time()
+    assert decode_frame(bytes(Ether() / ARP()), now) is None
+    assert decode_frame(b'\x00' * 10, now) is UNSUPPORTED
+
+    # MPLS is not handled by the fast path
+    mpls = bytes(Ether(type=0x8847) / Raw(b'\x00\x01\x01\x40')) + bytes(IP(src='1.1.1.1', dst='2.2.2.2') / UDP())
+    assert decode_frame(mpls, now) is UNSUPPORTED
+    decode_with_fallback(mpls, now)  # must not raise
+
+    packet = decode_with_fallback(bytes(Ether() / IP(src='1.2.3.4', dst='5.6.7.8') / UDP(sport=9, dport=10)), now)
+    assert packet['src_ip'] == '1.2.3.4' and packet['protocol'] == 'UDP'
+    print("✓ Non-IP frames ignored, exotic frames handed to scapy")
+    return True
+
+
+def test_tcp_flag_strings():
+    """Flag strings match scapy's formatting"""
+    print("\n=== Testing TCP Flag Strings ===")
+    for flags in (0x02, 0x12, 0x18, 0x11, 0x04, 0x1FF, 0):
+        assert TCP_FLAG_STRINGS[flags] == str(TCP(flags=flags).flags)
+    print("✓ TCP flag strings match scapy")
+    return True
+
+
+def main():
+    """Run all tests"""
+    results = [
+        ("IPv4 Decoding", test_matches_scapy_ipv4()),
+        ("IPv6 Decoding", test_ipv6()),
+        ("Non-IP and Fallback", test_non_ip_and_fallback()),
+        ("TCP Flag Strings", test_tcp_flag_strings())
+    ]
+
+    passed = sum(1 for _, result in results if result)
+    print(f"\nTotal: {passed}/{len(results)} tests passed")
+    return 0 if passed == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
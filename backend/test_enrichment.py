@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""Test device and subnet enrichment: longest-prefix matching, incremental updates and tagging"""
+
+import sys
+import os
+import tempfile
+from datetime import datetime
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from models import db, User, Device, PacketCapture, Flow
+from column_types import pack_ip
+from services import background_tasks
+from services.capture import save_packets, get_protocol_stats
+from services.enrichment import PrefixTrie, DeviceIndex, parse_network, parse_subnets, touch_devices
+from services.flows import FlowExporter
+
+
+class EnrichmentConfig:
+    ENRICHMENT_SUBNETS = 'lan=192.168.0.0/16, servers=192.168.10.0/24,bad=300.1.1.0/24,2001:db8::/32'
+    FLOW_ACTIVE_TIMEOUT = 300
+    FLOW_IDLE_TIMEOUT = 30
+    PACKET_WRITER_BATCH_SIZE = 100
+    PACKET_WRITER_FLUSH_INTERVAL = 60
+
+
+def packet(src_ip, dst_ip, length=100, protocol='TCP'):
+    return {'timestamp': datetime.utcnow().isoformat(), 'protocol': protocol, 'src_ip': src_ip, 'dst_ip': dst_ip,
+            'src_port': 40000, 'dst_port': 443, 'length': length, 'tcp_flags': 0x10}
+
+
+def test_prefix_trie():
+    """The longest stored prefix wins, and removal prunes back to the shorter one"""
+    print("\n=== Testing Prefix Trie ===")
+    trie = PrefixTrie(32)
+    for cidr, value in (('10.0.0.0/8', 'a'), ('10.1.0.0/16', 'b'), ('10.1.2.3/32', 'c'), ('0.0.0.0/0', 'default')):
+        trie.insert(*parse_network(cidr), value)
+    found = [trie.lookup(pack_ip(address)) for address in ('10.1.2.3', '10.1.2.4', '10.9.9.9', '8.8.8.8')]
+    assert found == ['c', 'b', 'a', 'default'], found
+
+    trie.remove(*parse_network('10.1.2.3/32'))
+    trie.remove(*parse_network('10.1.0.0/16'))
+    trie.remove(*parse_network('10.1.0.0/16'))
+    assert trie.lookup(pack_ip('10.1.2.3')) == 'a' and trie.size == 2
+    node = trie._root
+    for bit in trie._path(*parse_network('10.0.0.0/8')):
+        node = node[bit]
+    assert node[0] is None and node[1] is None, "Emptied branches below 10.0.0.0/8 are pruned"
+
+    six = PrefixTrie(128)
+    six.insert(*parse_network('2001:db8::/32'), 'doc')
+    assert six.lookup(pack_ip('2001:db8::1')) == 'doc' and six.lookup(pack_ip('2001:db9::1')) is None
+    assert parse_subnets(EnrichmentConfig.ENRICHMENT_SUBNETS) == [
+        ('lan', '192.168.0.0/16'), ('servers', '192.168.10.0/24'), ('2001:db8::/32', '2001:db8::/32')
+    ], "Invalid subnets are skipped, bare ones are named after themselves"
+    print("✓ /32 beats /16 beats /8 beats /0; removals fall back to the covering prefix")
+    return True
+
+
+def test_tagging():
+    """Packets and flows are tagged by device and subnet; device changes apply at once"""
+    print("\n=== Testing Packet and Flow Tagging ===")
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'enrichment.db')}"
+    db.init_app(app)
+    saved = (background_tasks.device_index, background_tasks.stats_sketches, background_tasks.packet_writer,
+             background_tasks.flow_exporter, background_tasks.packet_purger)
+    background_tasks.stats_sketches = background_tasks.packet_writer = None
+    background_tasks.flow_exporter = background_tasks.packet_purger = None
+    try:
+        with app.app_context():
+            db.create_all()
+            db.session.add_all([User(id=user_id, username=f'u{user_id}', email=f'u{user_id}@example.com',
+                                     password_hash='x') for user_id in (1, 2)])
+            db.session.add_all([
+                Device(id=1, name='laptop', ip_address='192.168.10.5', user_id=1),
+                Device(id=2, name='office', ip_address='192.168.20.0/24', user_id=1),
+                Device(id=3, name='other user', ip_address='192.168.10.5', user_id=2),
+                Device(id=4, name='broken', ip_address='not an address', user_id=1),
+            ])
+            db.session.commit()
+
+        index = DeviceIndex(app, EnrichmentConfig)
+        index.load()
+        background_tasks.device_index = index
+        with app.app_context():
+            save_packets([
+                packet('192.168.10.5', '93.184.216.34', 1000),   # laptop, outbound
+                packet('93.184.216.34', '192.168.20.7', 500),    # office network, inbound
+                packet('192.168.10.5', '192.168.20.7', 200),     # laptop to office: source wins
+                packet('192.168.30.1', '8.8.8.8', 50),           # no device, lan subnet
+                packet('8.8.4.4', '8.8.8.8', 50),                # nothing
+            ], 1)
+            db.session.commit()
+            tags = [(row.device_id, row.subnet) for row in PacketCapture.query.order_by(PacketCapture.id)]
+            laptop = get_protocol_stats(1, datetime(2000, 1, 1), device_id=1)
+
+            # Incremental updates: the laptop moves, a device is added, the office is removed
+            moved = db.session.get(Device, 1)
+            moved.ip_address = '10.0.0.5'
+            db.session.commit()
+            index.update_device(moved)
+            added = Device(id=5, name='phone', ip_address='192.168.10.5', user_id=1)
+            db.session.add(added)
+            db.session.commit()
+            index.add_device(added)
+            index.remove_device(2)
+            after = [index.device_for(1, address) for address in ('10.0.0.5', '192.168.10.5', '192.168.20.7')]
+            other_user = index.device_for(2, '192.168.10.5')
+
+            exporter = FlowExporter(app, EnrichmentConfig)
+            exporter.add_packets([packet('10.0.0.5', '1.1.1.1', 300)], 1)
+            exporter.export(exporter.table.flush_all())
+            exporter.writer.flush()
+            flow = Flow.query.one()
+        counters = index.drain_traffic()
+        drained = index.drain_traffic()
+    finally:
+        (background_tasks.device_index, background_tasks.stats_sketches, background_tasks.packet_writer,
+         background_tasks.flow_exporter, background_tasks.packet_purger) = saved
+
+    assert tags == [(1, 'servers'), (2, 'lan'), (1, 'servers'), (None, 'lan'), (None, None)], tags
+    assert laptop['total_packets'] == 2 and laptop['total_bytes'] == 1200
+    assert counters == {1: (1200, 0, 2, 0)}, "Counted when stored, kept across a move, dropped with the device"
+    assert drained == {}, "A drain returns the traffic since the previous one"
+    assert after == [1, 5, None] and other_user == 3
+    assert (flow.device_id, flow.subnet) == (1, None), "Flows are tagged on export"
+    assert index.stats()['devices'] == 3, "The removed and the unparsable device are not indexed"
+    print(f"✓ Tags {tags}; device moves, additions and removals apply without a reload")
+    return True
+
+
+def test_other_process_changes():
+    """Device changes made through another process's index reach this one through the devices version"""
+    print("\n=== Testing Device Changes From Another Process ===")
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'enrichment.db')}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(id=1, username='u1', email='u1@example.com', password_hash='x'))
+        db.session.add_all([Device(id=1, name='laptop', ip_address='192.168.10.5', user_id=1),
+                            Device(id=2, name='nas', ip_address='192.168.10.9', user_id=1)])
+        db.session.commit()
+
+    here, there = DeviceIndex(app, EnrichmentConfig), DeviceIndex(app, EnrichmentConfig)
+    here.load()
+    there.load()
+    here.check_interval = 0
+    rows = [('TCP', '192.168.10.5', '1.1.1.1', 40000, 443, 2, 200, 0, 1.0, datetime.utcnow(), datetime.utcnow(), 1),
+            ('TCP', '192.168.10.9', '1.1.1.1', 40000, 443, 1, 50, 0, 1.0, datetime.utcnow(), datetime.utcnow(), 1)]
+    assert [row[-2] for row in here.tag_flow_rows(rows, count=True)] == [1, 2]
+    assert not here.refresh(), "Nothing changed"
+
+    # What the device routes do in the other process: change, bump the version, commit, update its index
+    with app.app_context():
+        laptop = db.session.get(Device, 1)
+        laptop.ip_address = '10.0.0.5'
+        db.session.delete(db.session.get(Device, 2))
+        db.session.add(Device(id=3, name='phone', ip_address='192.168.10.9', user_id=1))
+        touch_devices()
+        db.session.commit()
+        there.update_device(laptop)
+    there.remove_device(2)
+
+    tags = [row[-2] for row in here.tag_flow_rows(rows + [rows[0][:1] + ('10.0.0.5',) + rows[0][2:]])]
+    assert tags == [None, 3, 1], tags
+    assert here.reloads == 1 and here.version == 1
+    assert here.drain_traffic() == {1: (200, 0, 2, 0)}, "Counters of the removed device are dropped"
+    print(f"✓ Readdressed, removed and added devices seen after one reload: {tags}")
+    return True
+
+
+def main():
+    """Run all tests"""
+    results = [
+        ("Prefix Trie", test_prefix_trie()),
+        ("Packet and Flow Tagging", test_tagging()),
+        ("Device Changes From Another Process", test_other_process_changes())
+    ]
+
+    passed = sum(1 for _, result in results if result)
+    print(f"\nTotal: {passed}/{len(results)} tests passed")
+    return 0 if passed == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Test 5-tuple flow aggregation and export"""
+
+import sys
+import os
+import tempfile
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from config import Config
+from models import db, Flow
+from services.flows import FlowTable, FlowExporter, FLOW_COLUMNS
+
+
+def create_test_app():
+    """Minimal app bound to a throwaway SQLite database"""
+    app = Flask(__name__)
+    db_file = os.path.join(tempfile.mkdtemp(), 'flows.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_file}'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def test_aggregation():
+    """Packets of the same 5-tuple are folded into one flow"""
+    print("\n=== Testing Flow Aggregation ===")
+    table = FlowTable()
+    start = datetime(2024, 1, 1)
+    for i in range(100):
+        table.update(1, 'TCP', '10.0.0.1', '10.0.0.2', 40000, 443, 100, start + timedelta(seconds=i), 0x10)
+    table.update(1, 'TCP', '10.0.0.1', '10.0.0.2', 40000, 443, 60, start + timedelta(seconds=100), 0x02)
+    table.update(1, 'UDP', '10.0.0.1', '8.8.8.8', 5000, 53, 80, start)
+    assert len(table) == 2
+
+    rows = [dict(zip(FLOW_COLUMNS, row)) for row in table.flush_all()]
+    tcp = next(row for row in rows if row['protocol'] == 'TCP')
+    assert tcp['packets'] == 101 and tcp['bytes'] == 10060
+    assert tcp['tcp_flags'] == 0x12, "TCP flags should be the union of all packets"
+    assert tcp['first_seen'] == start and tcp['last_seen'] == start + timedelta(seconds=100)
+    print("✓ 102 packets aggregated into 2 flows")
+    return True
+
+
+def test_expiry():
+    """Idle, active and FIN/RST flows are exported; busy flows stay"""
+    print("\n=== Testing Flow Expiry ===")
+    table = FlowTable(active_timeout=300, idle_timeout=30)
+    now = datetime(2024, 1, 1, 12, 0, 0)
+    table.update(1, 'UDP', '10.0.0.1', '10.0.0.2', 1, 2, 10, now - timedelta(seconds=60))     # idle
+    table.update(1, 'TCP', '10.0.0.1', '10.0.0.3', 3, 4, 10, now - timedelta(seconds=400))    # long-lived
+    table.update(1, 'TCP', '10.0.0.1', '10.0.0.3', 3, 4, 10, now - timedelta(seconds=1))
+    table.update(1, 'TCP', '10.0.0.1', '10.0.0.4', 5, 6, 10, now, 0x01)                       # FIN
+    table.update(1, 'TCP', '10.0.0.1', '10.0.0.5', 7, 8, 10, now - timedelta(seconds=5))     # busy
+
+    exported = {row[2] for row in table.expire(now)}
+    assert exported == {'10.0.0.2', '10.0.0.3', '10.0.0.4'}, exported
+    assert len(table) == 1
+    print("✓ Idle, active-timeout and finished flows exported")
+
+    small = FlowTable(max_flows=2)
+    for port in range(3):
+        small.update(1, 'UDP', '10.0.0.1', '10.0.0.2', port, 53, 10, now)
+    assert len(small) == 2 and small.stats()['flows_evicted'] == 1
+    assert len(small.expire(now)) == 1, "Evicted flow is exported with the next expiry"
+    print("✓ Full table evicts and exports the least recently used flow")
+    return True
+
+
+def test_packet_clock():
+    """Flows of old (ingested) packets expire on their own timestamps, not on the wall clock"""
+    print("\n=== Testing Packet Clock ===")
+    table = FlowTable(active_timeout=300, idle_timeout=30)
+    start = datetime(2023, 11, 14, 22, 13, 20)
+    for i in range(100):
+        table.update(1, 'TCP', '10.0.0.1', '10.0.0.2', 40000, 443, 100, start + timedelta(seconds=i))
+        assert table.expire() == [], "A flow busy in packet time is not exported while it is read"
+    assert len(table) == 1 and table.stats()['flows_created'] == 1
+
+    # The traffic pauses for a minute in packet time: the first flow is idle, the new one is not
+    table.update(1, 'UDP', '10.0.0.1', '10.0.0.3', 5000, 53, 80, start + timedelta(seconds=160))
+    exported = table.expire()
+    assert [row[2] for row in exported] == ['10.0.0.2'] and exported[0][5] == 100
+
+    # Once the file has been read the packet clock stops; the wall-clock idle timeout exports the rest
+    assert table.expire() == []
+    for flow in table._flows.values():
+        flow.touched -= 31
+    assert [row[2] for row in table.expire()] == ['10.0.0.3'] and len(table) == 0
+    print("✓ 100 s of 2023 packets form one flow, split at the pause and exported once read")
+    return True
+
+
+def test_export_to_database():
+    """Exported flows are written to the flows table and feed the statistics"""
+    print("\n=== Testing Flow Export and Statistics ===")
+    from services.capture import get_protocol_stats, get_packet_analysis
+
+    app = create_test_app()
+    exporter = FlowExporter(app, Config)
+    now = datetime.utcnow()
+    packets = [
+        {'timestamp': now.isoformat(), 'protocol': 'TCP', 'src_ip': '10.0.0.1', 'dst_ip': '10.0.0.2',
+         'src_port': 40000 + (i % 3), 'dst_port': 443, 'length': 100, 'info': '', 'tcp_flags': 0x10}
+        for i in range(1000)
+    ]
+    exporter.add_packets(packets, user_id=7)
+    exporter.writer.submit_many(exporter.table.flush_all())
+    exporter.writer.flush()
+
+    original_storage = Config.CAPTURE_STORAGE
+    Config.CAPTURE_STORAGE = 'flows'
+    try:
+        with app.app_context():
+            assert Flow.query.count() == 3, "1000 packets should become 3 flow rows"
+            stats = get_protocol_stats(7, now - timedelta(hours=1))
+            analysis = get_packet_analysis(7, now - timedelta(hours=1))
+    finally:
+        Config.CAPTURE_STORAGE = original_storage
+
+    assert stats['total_packets'] == 1000 and stats['total_bytes'] == 100000
+    assert analysis['top_destination_ports'][0] == {'port': 443, 'service': 'HTTPS', 'packet_count': 1000}
+    print("✓ 1000 packets stored as 3 rows; stats computed from flows")
+    return True
+
+
+def main():
+    """Run all tests"""
+    results = [
+        ("Flow Aggregation", test_aggregation()),
+        ("Flow Expiry", test_expiry()),
+        ("Packet Clock", test_packet_clock()),
+        ("Flow Export and Statistics", test_export_to_database())
+    ]
+
+    passed = sum(1 for _, result in results if result)
+    print(f"\nTotal: {passed}/{len(results)} tests passed")
+    return 0 if passed == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
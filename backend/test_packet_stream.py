@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Test live packet streaming: filtering, coalescing and rate limiting"""
+
+import sys
+import os
+import json
+import threading
+import time
+import tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.capture_service import PacketRing
+from services.packet_stream import PacketFilter, PacketStream
+
+
+def make_packet(i, protocol='TCP', src_ip='10.0.0.1', dst_ip='10.0.0.2', dst_port=443):
+    return {'protocol': protocol, 'src_ip': src_ip, 'dst_ip': dst_ip,
+            'src_port': 40000, 'dst_port': dst_port, 'length': 60, 'info': '', 'seq': i}
+
+
+def parse_events(chunks):
+    """Split SSE chunks into (event, data) pairs, skipping heartbeats"""
+    events = []
+    for chunk in chunks:
+        if chunk.startswith(':'):
+            continue
+        fields = dict(line.split(': ', 1) for line in chunk.strip().split('\n'))
+        events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def test_filter():
+    """Protocol, address (exact or CIDR) and port filters"""
+    print("\n=== Testing Stream Filter ===")
+    assert PacketFilter(protocol='udp')(make_packet(0, protocol='UDP'))
+    assert not PacketFilter(protocol='udp')(make_packet(0))
+    assert PacketFilter(ip='10.0.0.2')(make_packet(0))
+    assert PacketFilter(src_ip='10.0.0.0/24')(make_packet(0))
+    assert not PacketFilter(dst_ip='192.168.0.0/16')(make_packet(0))
+    assert PacketFilter(port='443')(make_packet(0)) and not PacketFilter(port=80)(make_packet(0))
+    for bad in ({'ip': 'not-an-ip'}, {'port': '70000'}):
+        try:
+            PacketFilter.from_args(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"{bad} should be rejected")
+    print("✓ Filters match protocol, addresses, networks and ports")
+    return True
+
+
+def test_coalescing_and_rate_limit():
+    """Packets within an interval become one event; excess packets are counted"""
+    print("\n=== Testing Coalescing and Rate Limit ===")
+    ring = PacketRing(capacity=100)
+    subscription = ring.subscribe(maxsize=1000, packet_filter=PacketFilter(protocol='tcp'))
+    stream = PacketStream(subscription, interval=0.2, max_rate=50, duration=1.0)
+
+    def produce():
+        time.sleep(0.1)
+        for i in range(300):
+            ring.append(make_packet(i, protocol='TCP' if i % 3 else 'UDP'))
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    events = parse_events(stream.events())
+    producer.join()
+
+    batches = [data for event, data in events if event == 'packets']
+    assert events[-1][0] == 'end'
+    assert len(batches) == 1, "A burst is coalesced into one event"
+    assert len(batches[0]['packets']) == 50, "At most max_rate packets per second"
+    assert batches[0]['suppressed'] == 150, "200 TCP packets minus 50 sent"
+    assert batches[0]['packets'][-1]['seq'] == 299, "The newest packets are sent"
+    assert ring.stats()['subscribers'] == 0, "Finished streams unsubscribe"
+    print("✓ 300 packets (200 matching) -> 1 event with 50 packets, 150 suppressed")
+    return True
+
+
+def test_flat_memory():
+    """Memory stays bounded while a slow stream falls far behind"""
+    print("\n=== Testing Stream Memory ===")
+    ring = PacketRing(capacity=1000)
+    subscription = ring.subscribe(maxsize=1000)
+    stream = PacketStream(subscription, interval=0.01, max_rate=10, heartbeat=0.05)
+    events = stream.events()
+
+    tracemalloc.start()
+    for round_ in range(20):
+        for i in range(5000):
+            ring.append(make_packet(i))
+        next(events)
+        if round_ == 1:
+            baseline = tracemalloc.get_traced_memory()[0]
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    events.close()
+
+    assert subscription.dropped > 0, "Overflowing packets are dropped, not queued"
+    assert current - baseline < 2 * 1024 * 1024, f"Memory grew by {current - baseline} bytes"
+    assert ring.stats()['subscribers'] == 0
+    print(f"✓ 100000 packets streamed, memory growth {max(current - baseline, 0) // 1024} KiB")
+    return True
+
+
+def main():
+    """Run all tests"""
+    results = [
+        ("Stream Filter", test_filter()),
+        ("Coalescing and Rate Limit", test_coalescing_and_rate_limit()),
+        ("Stream Memory", test_flat_memory())
+    ]
+
+    passed = sum(1 for _, result in results if result)
+    print(f"\nTotal: {passed}/{len(results)} tests passed")
+    return 0 if passed == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""Test the write-behind packet writer"""
+
+import sys
+import os
+import json
+import tempfile
+import time
+from datetime import datetime
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from sqlalchemy.exc import OperationalError
+from models import db, PacketCapture
+from services.packet_writer import PacketWriter
+
+
+def create_test_app():
+    """Minimal app bound to a throwaway SQLite database"""
+    app = Flask(__name__)
+    db_file = os.path.join(tempfile.mkdtemp(), 'writer.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_file}'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def make_row(i, user_id=1):
+    return (datetime.utcnow(), 'TCP', '10.0.0.1', '10.0.0.2', 1000 + i, 80, 60, None, 1.0, user_id)
+
+
+def test_size_bounded_batches():
+    """Rows are written in batches of at most batch_size"""
+    print("\n=== Testing Size-Bounded Batches ===")
+    app = create_test_app()
+    writer = PacketWriter(app, batch_size=100, flush_interval=60)
+    writer.submit_many([make_row(i) for i in range(250)])
+    writer.flush()
+
+    with app.app_context():
+        assert PacketCapture.query.count() == 250, "All rows should be written"
+    metrics = writer.metrics()
+    assert metrics['batches'] == 3
+    assert metrics['last_batch_size'] == 50
+    assert metrics['backlog'] == 0
+    print(f"✓ 250 rows written in {metrics['batches']} batches ({metrics['avg_flush_ms']} ms avg)")
+    return True
+
+
+def test_time_bounded_flush():
+    """The background thread flushes partial batches after flush_interval"""
+    print("\n=== Testing Time-Bounded Flush ===")
+    app = create_test_app()
+    writer = PacketWriter(app, batch_size=1000, flush_interval=0.1)
+    writer.start()
+    try:
+        writer.submit(make_row(0))
+        deadline = time.time() + 5
+        while writer.metrics()['rows_written'] < 1 and time.time() < deadline:
+            time.sleep(0.05)
+        assert writer.metrics()['rows_written'] == 1, "Partial batch should be flushed by timer"
+    finally:
+        writer.stop()
+    print("✓ Partial batch flushed by timer")
+    return True
+
+
+def test_backlog_limit():
+    """Rows beyond max_backlog are dropped and counted"""
+    print("\n=== Testing Backlog Limit ===")
+    app = create_test_app()
+    writer = PacketWriter(app, batch_size=10, flush_interval=60, max_backlog=5)
+    writer.submit_many([make_row(i) for i in range(8)])
+    metrics = writer.metrics()
+    assert metrics['backlog'] == 5
+    assert metrics['rows_dropped'] == 3
+    print("✓ Backlog is bounded and drops are counted")
+    return True
+
+
+def test_failed_batches():
+    """Outages are retried; failed batches are bisected so only the rejected rows are lost and dead-lettered"""
+    print("\n=== Testing Failed Batches ===")
+    app = create_test_app()
+    dead_letters = tempfile.mkdtemp()
+    writer = PacketWriter(app, batch_size=100, flush_interval=60, retries=2, retry_backoff=0.01,
+                          dead_letter_dir=dead_letters)
+    insert = writer._insert_rows
+    outage = {'attempts': 1}
+
+    def flaky_insert(batch):
+        # The database is briefly unavailable
+        if outage['attempts'] > 0:
+            outage['attempts'] -= 1
+            return OperationalError('INSERT', {}, Exception('server has gone away'))
+        return insert(batch)
+
+    writer._insert_rows = flaky_insert
+    writer.submit_many([make_row(i) for i in range(40)])
+    writer.flush()
+    metrics = writer.metrics()
+    assert (metrics['rows_written'], metrics['batch_retries'], metrics['rows_failed']) == (40, 1, 0)
+
+    # Two rows the database rejects (NULL user_id) in a batch of 64
+    rows = [make_row(i, user_id=None if i in (5, 50) else 1) for i in range(64)]
+    writer.submit_many(rows)
+    writer.flush()
+    metrics = writer.metrics()
+    assert metrics['rows_written'] == 40 + 62 and metrics['rows_failed'] == 2
+    assert metrics['batch_retries'] == 1, "Rejected rows are not retried"
+    assert metrics['rows_dead_lettered'] == 2
+    with open(metrics['dead_letter_file']) as f:
+        spilled = [json.loads(line) for line in f]
+    assert [entry['row']['src_port'] for entry in spilled] == [1005, 1050] and 'NOT NULL' in spilled[0]['error']
+
+    # An outage outlasting the retries spills the whole batch without bisecting it
+    outage['attempts'] = 100
+    writer.submit_many([make_row(i) for i in range(10)])
+    writer.flush()
+    metrics = writer.metrics()
+    assert metrics['rows_failed'] == 12 and metrics['rows_dead_lettered'] == 12 and outage['attempts'] == 97
+    with app.app_context():
+        assert PacketCapture.query.count() == 102
+    print(f"✓ {metrics['batch_retries']} retries; 2 rejected rows isolated from 64; "
+          f"{metrics['rows_dead_lettered']} rows dead-lettered")
+    return True
+
+
+def main():
+    """Run all tests"""
+    results = [
+        ("Size-Bounded Batches", test_size_bounded_batches()),
+        ("Time-Bounded Flush", test_time_bounded_flush()),
+        ("Backlog Limit", test_backlog_limit()),
+        ("Failed Batches", test_failed_batches())
+    ]
+
+    passed = sum(1 for _, result in results if result)
+    print(f"\nTotal: {passed}/{len(results)} tests passed")
+    return 0 if passed == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
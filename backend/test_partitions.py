@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""Test daily partition planning and the partitioning DDL"""
+
+import sys
+import os
+import tempfile
+from datetime import datetime, date, timedelta
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from models import db, JobLease
+from migrations import upgrade
+from services import partitions
+from services.partitions import (
+    PartitionManager, plan_partitions, conversion_statements, list_partitions, partition_name, FUTURE_PARTITION
+)
+
+TODAY = date(2026, 3, 10)
+
+
+class PartitionConfig:
+    PARTITION_PRECREATE_DAYS = 3
+    PACKET_RETENTION_DAYS = 7
+    TRAFFIC_LOG_RETENTION_DAYS = 0
+    RESOURCE_LOG_RETENTION_DAYS = 30
+
+
+def daily(first, last):
+    """Partitions for the days first..last and the catch-all"""
+    days = [first + timedelta(days=i) for i in range((last - first).days + 1)]
+    return [(partition_name(day), day + timedelta(days=1)) for day in days] + [(FUTURE_PARTITION, None)]
+
+
+def test_plan_partitions():
+    """Steady state adds one day and drops one; gaps collapse into one partition"""
+    print("\n=== Testing Partition Planning ===")
+    # Maintained yesterday: tomorrow + 2 exist, the window is 7 days
+    partitions = daily(TODAY - timedelta(days=8), TODAY + timedelta(days=2))
+    create, drop = plan_partitions(partitions, TODAY, 7, 3)
+    assert create == [TODAY + timedelta(days=3)]
+    assert drop == ['p20260302'], "Only the day whose rows are all older than 7 days goes"
+
+    assert plan_partitions(partitions, TODAY, 7, 2) == ([], ['p20260302'])
+    assert plan_partitions(partitions, TODAY, 0, 3)[1] == [], "Retention 0 keeps everything"
+
+    # Not maintained for a month: one partition covers the gap up to the cutoff
+    stale = daily(TODAY - timedelta(days=40), TODAY - timedelta(days=35))
+    create, drop = plan_partitions(stale, TODAY, 7, 3)
+    assert create[0] == TODAY - timedelta(days=8) and create[-1] == TODAY + timedelta(days=3)
+    assert len(create) == 12
+    assert drop == [name for name, _ in stale[:-1]] + ['p20260302']
+    print(f"✓ Steady state +1/-1 partition, a 30 day gap becomes {len(create)} partitions")
+    return True
+
+
+def test_conversion_statements():
+    """Conversion DDL: keys fixed up, history in one partition, a MAXVALUE catch-all"""
+    print("\n=== Testing Conversion Statements ===")
+    update, alter, partition = conversion_statements('packet_captures', 'timestamp', ['packet_captures_ibfk_1'],
+                                                     TODAY, 7, 3)
+    assert update.startswith('UPDATE packet_captures SET timestamp')
+    assert 'DROP FOREIGN KEY packet_captures_ibfk_1' in alter
+    assert 'DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp)' in alter
+    assert partition.startswith('ALTER TABLE packet_captures PARTITION BY RANGE COLUMNS(timestamp)')
+    assert "PARTITION p20260302 VALUES LESS THAN ('2026-03-03')" in partition, "History before the window"
+    assert "PARTITION p20260313 VALUES LESS THAN ('2026-03-14')" in partition
+    assert partition.endswith(f"PARTITION {FUTURE_PARTITION} VALUES LESS THAN (MAXVALUE))")
+    assert partition.count('PARTITION p2') == 1 + 7 + 4
+    # Right after conversion the history partition is the only one due
+    assert plan_partitions(daily(TODAY - timedelta(days=8), TODAY + timedelta(days=3)), TODAY, 7, 3) == \
+        ([], ['p20260302'])
+    print(f"✓ {partition.count('PARTITION p2')} daily partitions plus {FUTURE_PARTITION}")
+    return True
+
+
+class FakeConnection:
+    """Answers the information_schema query with fixed rows"""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, statement, params=None):
+        rows = self.rows
+
+        class Result:
+            def fetchall(self):
+                return rows
+        return Result()
+
+
+def test_list_partitions_and_sqlite():
+    """MySQL partition bounds are parsed; on sqlite migration and maintenance do nothing"""
+    print("\n=== Testing Partition Listing and Other Databases ===")
+    connection = FakeConnection([('p20260309', "'2026-03-10 00:00:00'"), (FUTURE_PARTITION, 'MAXVALUE')])
+    assert list_partitions(connection, 'packet_captures') == \
+        [('p20260309', date(2026, 3, 10)), (FUTURE_PARTITION, None)]
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'partitions.db')}"
+    db.init_app(app)
+    with app.app_context():
+        results = dict(upgrade(db.engine))
+    assert results['daily_partitions'] == []
+    manager = PartitionManager(app, PartitionConfig)
+    assert manager.maintain(TODAY) == {} and manager.errors == 0
+    assert manager.retention_days == {'packet_captures': 7, 'traffic_logs': 0, 'system_resource_logs': 30}
+    print("✓ Bounds parsed; sqlite databases are left unpartitioned")
+    return True
+
+
+def test_maintenance_lease():
+    """Only the process holding the partitions lease runs the DDL"""
+    print("\n=== Testing Maintenance Lease ===")
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'partitions.db')}"
+    db.init_app(app)
+    listed = []
+    original = partitions.list_partitions
+    # As if on MySQL, with tables that are not partitioned yet (so no DDL is sent to sqlite)
+    partitions.list_partitions = lambda connection, table: listed.append(table) or []
+    try:
+        with app.app_context():
+            db.create_all()
+            db.engine.dialect.name = 'mysql'
+        first, second = PartitionManager(app, PartitionConfig), PartitionManager(app, PartitionConfig)
+        assert first.maintain(TODAY) == {} and len(listed) == 3
+        assert second.maintain(TODAY) is None and second.skipped == 1 and len(listed) == 3
+        assert first.maintain(TODAY) == {} and len(listed) == 6, "The holder renews its lease"
+
+        # The holder stopped renewing: the lease lapses and another process takes over
+        with app.app_context():
+            JobLease.query.filter_by(name='partitions').update({'expires_at': datetime(2000, 1, 1)})
+            db.session.commit()
+        assert second.maintain(TODAY) == {} and len(listed) == 9
+        assert first.maintain(TODAY) is None and first.skipped == 1
+    finally:
+        partitions.list_partitions = original
+        with app.app_context():
+            del db.engine.dialect.name
+    print("✓ One of 2 managers maintains at a time; a lapsed lease moves to the other")
+    return True
+
+
+def main():
+    """Run all tests"""
+    results = [
+        ("Partition Planning", test_plan_partitions()),
+        ("Conversion Statements", test_conversion_statements()),
+        ("Partition Listing and Other Databases", test_list_partitions_and_sqlite()),
+        ("Maintenance Lease", test_maintenance_lease())
+    ]
+
+    passed = sum(1 for _, result in results if result)
+    print(f"\nTotal: {passed}/{len(results)} tests passed")
+    return 0 if passed == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""Test the streaming pcap/pcapng reader and offline ingestion"""
+
+import sys
+import os
+import gzip
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from scapy.all import Ether, IP, TCP, UDP, ARP, wrpcap
+from scapy.layers.l2 import CookedLinux
+from scapy.utils import PcapNgWriter
+from models import db, PacketCapture, IngestJobRecord
+from services.pcap_reader import PcapReader, PcapFormatError
+from services import pcap_ingest
+from services.pcap_ingest import ingest_capture, start_ingest_job, get_ingest_job
+
+
+def build_packets():
+    """TCP and UDP frames plus one ARP frame, with increasing timestamps"""
+    packets = []
+    for i in range(200):
+        packet = Ether() / IP(src='10.0.0.1', dst='10.0.0.2') / (
+            TCP(sport=40000, dport=443, flags='PA') if i % 2 else UDP(sport=5000, dport=53)
+        ) / (b'x' * i)
+        packet.time = 1700000000 + i / 1000
+        packets.append(packet)
+    arp = Ether() / ARP()
+    arp.time = 1700000001
+    packets.append(arp)
+    return packets
+
+
+def test_pcap_formats():
+    """pcap (us/ns), pcapng and gzipped files yield the original frames"""
+    print("\n=== Testing Capture File Formats ===")
+    packets = build_packets()
+    workdir = tempfile.mkdtemp()
+    paths = {
+        'pcap': os.path.join(workdir, 'us.pcap'),
+        'pcap-ns': os.path.join(workdir, 'ns.pcap'),
+        'pcapng': os.path.join(workdir, 'cap.pcapng')
+    }
+    wrpcap(paths['pcap'], packets)
+    wrpcap(paths['pcap-ns'], packets, nano=True)
+    with PcapNgWriter(paths['pcapng']) as writer:
+        for packet in packets:
+            writer.write(packet)
+    paths['pcap.gz'] = paths['pcap'] + '.gz'
+    with open(paths['pcap'], 'rb') as src, gzip.open(paths['pcap.gz'], 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+
+    for name, path in paths.items():
+        with PcapReader(path) as reader:
+            records = [(bytes(frame), timestamp, linktype) for frame, timestamp, linktype in reader]
+        assert reader.format == name.split('-')[0].split('.')[0], (name, reader.format)
+        assert len(records) == len(packets), name
+        for (frame, timestamp, linktype), packet in zip(records, packets):
+            assert frame == bytes(packet), name
+            assert abs(timestamp - float(packet.time)) < 1e-5, name
+            assert linktype == 1
+        print(f"✓ {name}: {len(records)} records")
+
+    truncated = os.path.join(workdir, 'truncated.pcap')
+    with open(paths['pcap'], 'rb') as src, open(truncated, 'wb') as dst:
+        dst.write(src.read()[:-10])
+    for bad in (truncated, __file__):
+        try:
+            list(PcapReader(bad))
+        except PcapFormatError:
+            continue
+        raise AssertionError(f"{bad} should be rejected")
+    print("✓ Truncated and non-capture files rejected")
+    return True
+
+
+def test_ingestion():
+    """Ingested files feed the same storage and statistics as live capture"""
+    print("\n=== Testing Offline Ingestion ===")
+    from services.capture import get_protocol_stats
+    from services import background_tasks
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'ingest.db')}"
+    db.init_app(app)
+
+    path = os.path.join(tempfile.mkdtemp(), 'mixed.pcap')
+    packets = build_packets()
+    wrpcap(path, packets)
+    cooked = os.path.join(tempfile.mkdtemp(), 'cooked.pcap')
+    wrpcap(cooked, [CookedLinux() / IP(src='10.0.0.5', dst='10.0.0.6') / UDP(sport=1, dport=2)])
+
+    # Store through the session even if another test started the app's writers
+    writers = background_tasks.packet_writer, background_tasks.flow_exporter
+    background_tasks.packet_writer = background_tasks.flow_exporter = None
+    reports = []
+    with app.app_context():
+        db.create_all()
+        try:
+            progress = ingest_capture(path, user_id=5, batch_size=64, on_progress=reports.append)
+            cooked_progress = ingest_capture(cooked, user_id=6)
+        finally:
+            background_tasks.packet_writer, background_tasks.flow_exporter = writers
+        stats = get_protocol_stats(5, datetime(2023, 11, 14) - timedelta(days=1))
+        assert PacketCapture.query.filter_by(user_id=5).count() == 200
+        first = PacketCapture.query.filter_by(user_id=5).order_by(PacketCapture.timestamp).first()
+        assert first.timestamp == datetime.utcfromtimestamp(1700000000), "Capture timestamps are kept"
+        assert PacketCapture.query.filter_by(user_id=6).one().src_ip == '10.0.0.5'
+
+    status = progress.to_dict()
+    assert status['status'] == 'completed' and status['percent'] == 100.0
+    assert (status['records'], status['packets'], status['skipped']) == (201, 200, 1)
+    assert reports and reports[-1] is progress
+    assert cooked_progress.packets == 1, "Non-Ethernet link types use the scapy fallback"
+    assert stats['total_packets'] == 200
+    assert {p['protocol']: p['count'] for p in stats['protocols']} == {'TCP': 100, 'UDP': 100}
+    print(f"✓ 200 packets ingested ({status['records_per_second']} records/s)")
+    return True
+
+
+def test_ingest_job_status():
+    """Ingestion job status is served from the database, e.g. by another worker"""
+    print("\n=== Testing Ingestion Job Status ===")
+    from services import background_tasks
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'jobs.db')}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+
+    path = os.path.join(tempfile.mkdtemp(), 'upload.pcap')
+    wrpcap(path, build_packets())
+    writers = background_tasks.packet_writer, background_tasks.flow_exporter
+    background_tasks.packet_writer = background_tasks.flow_exporter = None
+    try:
+        job = start_ingest_job(app, path, 5, 'upload.pcap')
+        job.thread.join(10)
+    finally:
+        background_tasks.packet_writer, background_tasks.flow_exporter = writers
+    assert not pcap_ingest._jobs and not os.path.exists(path), "Finished jobs are only kept in the table"
+
+    with app.app_context():
+        status = get_ingest_job(job.id, 5).to_dict()
+        assert status['status'] == 'completed' and status['packets'] == 200 and status['job_id'] == job.id
+        assert get_ingest_job(job.id, 6) is None and get_ingest_job('missing', 5) is None
+
+        # A running job whose process stopped writing progress is reported as failed
+        record = db.session.get(IngestJobRecord, job.id)
+        record.status = 'running'
+        record.updated_at = datetime.utcnow() - timedelta(minutes=5)
+        db.session.commit()
+        stale = get_ingest_job(job.id, 5).to_dict()
+        assert stale['status'] == 'failed' and stale['error']
+    print("✓ Completed job read back from the table; stale running job reported as failed")
+    return True
+
+
+def main():
+    """Run all tests"""
+    results = [
+        ("Capture File Formats", test_pcap_formats()),
+        ("Offline Ingestion", test_ingestion()),
+        ("Ingestion Job Status", test_ingest_job_status())
+    ]
+
+    passed = sum(1 for _, result in results if result)
+    print(f"\nTotal: {passed}/{len(results)} tests passed")
+    return 0 if passed == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
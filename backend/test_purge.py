@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""Test background packet purges: immediate hiding, chunked deletion and resuming"""
+
+import sys
+import os
+import tempfile
+import time
+from datetime import datetime
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from models import db, PacketCapture, Flow, PacketPurge
+from services import background_tasks
+from services.capture import save_packets, get_protocol_stats
+from services.purge import PacketPurger, visible_rows
+from services.packet_writer import PacketWriter
+from services.flows import FlowExporter
+from services.stats_sketches import StatsSketches
+
+
+class PurgeConfig:
+    PURGE_CHUNK_SIZE = 7
+    PURGE_CHUNK_PAUSE = 0
+
+
+def make_packets(n, protocol='TCP'):
+    return [{'timestamp': datetime.utcnow().isoformat(), 'protocol': protocol, 'src_ip': '10.0.0.1',
+             'dst_ip': '10.0.0.2', 'src_port': 40000, 'dst_port': 443, 'length': 100, 'info': ''} for _ in range(n)]
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_purge():
+    """Cleared rows disappear at once, are deleted later, and newer rows stay"""
+    print("\n=== Testing Background Purge ===")
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'purge.db')}"
+    db.init_app(app)
+
+    saved = (background_tasks.packet_purger, background_tasks.stats_sketches,
+             background_tasks.packet_writer, background_tasks.flow_exporter)
+    background_tasks.stats_sketches = background_tasks.packet_writer = background_tasks.flow_exporter = None
+    # Not started: the purge is recorded but nothing deletes it yet
+    first = PacketPurger(app, PurgeConfig)
+    background_tasks.packet_purger = first
+    resumed = None
+    try:
+        with app.app_context():
+            db.create_all()
+            save_packets(make_packets(40), 1)
+            save_packets(make_packets(10, 'UDP'), 2)
+            db.session.add_all([Flow(protocol='TCP', packets=5, bytes=500, user_id=1) for _ in range(3)])
+            db.session.commit()
+
+            purge = first.submit(1)
+            purge_id = purge.id
+            hidden = get_protocol_stats(1, datetime(2000, 1, 1))['total_packets']
+            other_user = get_protocol_stats(2, datetime(2000, 1, 1))['total_packets']
+            save_packets(make_packets(5, 'UDP'), 1)
+            db.session.commit()
+            after_clear = get_protocol_stats(1, datetime(2000, 1, 1))
+            visible_flows = Flow.query.filter(visible_rows(Flow, 1)).count()
+            stored = PacketCapture.query.filter_by(user_id=1).count()
+
+        # A new worker (as after a restart) picks the unfinished purge up
+        resumed = PacketPurger(app, PurgeConfig)
+        background_tasks.packet_purger = resumed
+        resumed.start()
+        assert resumed.floor(PacketCapture, 1) is not None, "Hidden again before the worker runs"
+
+        def finished():
+            with app.app_context():
+                return db.session.get(PacketPurge, purge_id).status == 'completed'
+        assert wait_for(finished)
+
+        with app.app_context():
+            result = resumed.get(purge_id, 1).to_dict()
+            remaining = PacketCapture.query.filter_by(user_id=1).count()
+            untouched = PacketCapture.query.filter_by(user_id=2).count()
+            flows = Flow.query.filter_by(user_id=1).count()
+            assert resumed.get(purge_id, 2) is None, "Purges are private to their user"
+    finally:
+        if resumed is not None:
+            resumed.stop()
+        (background_tasks.packet_purger, background_tasks.stats_sketches,
+         background_tasks.packet_writer, background_tasks.flow_exporter) = saved
+
+    assert hidden == 0 and other_user == 10 and stored == 45
+    assert after_clear['total_packets'] == 5 and after_clear['protocols'][0]['protocol'] == 'UDP'
+    assert visible_flows == 0
+    assert result['packets_deleted'] == 40 and result['flows_deleted'] == 3 and result['finished_at']
+    assert remaining == 5 and untouched == 10 and flows == 0
+    assert resumed.floor(PacketCapture, 1) is None, "Nothing is hidden once the purge is done"
+    print(f"✓ 40 packets hidden at once, deleted in chunks of 7 after a restart; 5 newer packets kept")
+    return True
+
+
+def test_queued_rows():
+    """Packets and flows still queued for writing at clear time do not reappear"""
+    print("\n=== Testing Purge of Queued Rows ===")
+    from config import Config
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'queued.db')}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+
+    saved = (background_tasks.packet_purger, background_tasks.stats_sketches, background_tasks.packet_writer,
+             background_tasks.flow_exporter, background_tasks.device_index, Config.CAPTURE_STORAGE)
+    # Neither writer is started, so rows stay queued until flushed
+    writer = PacketWriter(app, flush_interval=60)
+    exporter = FlowExporter(app, Config)
+    purger = PacketPurger(app, PurgeConfig)
+    (background_tasks.packet_purger, background_tasks.stats_sketches, background_tasks.packet_writer,
+     background_tasks.flow_exporter, background_tasks.device_index) = purger, None, writer, exporter, None
+    Config.CAPTURE_STORAGE = 'both'
+    try:
+        with app.app_context():
+            save_packets(make_packets(20), 1)
+            save_packets(make_packets(4), 2)
+            purger.submit(1)
+            save_packets(make_packets(3, 'UDP'), 1)
+            writer.flush()
+            exporter.export(exporter.table.flush_all())
+            exporter.writer.flush()
+
+            packets = PacketCapture.query.filter(visible_rows(PacketCapture, 1)).count()
+            flows = Flow.query.filter(visible_rows(Flow, 1)).all()
+            other_user = Flow.query.filter(visible_rows(Flow, 2)).count()
+    finally:
+        (background_tasks.packet_purger, background_tasks.stats_sketches, background_tasks.packet_writer,
+         background_tasks.flow_exporter, background_tasks.device_index, Config.CAPTURE_STORAGE) = saved
+
+    assert packets == 3, "Packets queued before the clear are stored below the floor"
+    assert [flow.protocol for flow in flows] == ['UDP'] and flows[0].packets == 3, "Cleared flows are dropped"
+    assert other_user == 1, "Other users' flows are kept"
+    print("✓ 20 queued packets and their flow cleared; 3 newer packets and other users kept")
+    return True
+
+
+def test_shared_purges():
+    """Floors, the purge worker and sketch resets are shared by every process through the database"""
+    print("\n=== Testing Purges Across Processes ===")
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'shared.db')}"
+    db.init_app(app)
+
+    saved = (background_tasks.packet_purger, background_tasks.stats_sketches,
+             background_tasks.packet_writer, background_tasks.flow_exporter)
+    # Two worker processes: the first handles the clear, the second stores packets and serves statistics
+    first, second = PacketPurger(app, PurgeConfig), PacketPurger(app, PurgeConfig)
+    sketches = StatsSketches(app, PurgeConfig)
+    sketches.clear_check_interval = 0
+    background_tasks.packet_writer = background_tasks.flow_exporter = None
+    background_tasks.stats_sketches, background_tasks.packet_purger = sketches, second
+    try:
+        with app.app_context():
+            db.create_all()
+            save_packets(make_packets(30), 1)
+            db.session.commit()
+            assert sketches.get_packet_analysis(1, sketches.started)['top_source_ips']
+
+            purge = first.submit(1)
+            assert second.floor(PacketCapture, 1) == purge.packets_up_to, "Hidden in the other process too"
+            assert get_protocol_stats(1, datetime(2000, 1, 1))['total_packets'] == 0
+            assert sketches.get_packet_analysis(1, sketches.started) is None, "Sketches forget the cleared user"
+            assert 1 not in sketches._buckets
+
+        # A failing purge keeps its rows hidden and runs again after the retry interval
+        second.running = True
+        second.retry_interval = 0
+        delete_chunks, failures = second._delete_chunks, []
+
+        def fail_once(*args):
+            if not failures:
+                failures.append(True)
+                raise RuntimeError("lost connection")
+            return delete_chunks(*args)
+        second._delete_chunks = fail_once
+        assert second._run_next()
+        with app.app_context():
+            failed = db.session.get(PacketPurge, purge.id).to_dict()
+        assert failed['status'] == 'failed' and second.floor(PacketCapture, 1) is not None
+        # Only the lease holder deletes
+        first.running = True
+        assert not first._run_next() and second.lease_held and not first.lease_held
+        time.sleep(0.01)
+        assert second._run_next()
+        with app.app_context():
+            done = db.session.get(PacketPurge, purge.id).to_dict()
+            remaining = PacketCapture.query.filter_by(user_id=1).count()
+    finally:
+        first.running = second.running = False
+        (background_tasks.packet_purger, background_tasks.stats_sketches,
+         background_tasks.packet_writer, background_tasks.flow_exporter) = saved
+
+    assert done['status'] == 'completed' and done['error'] is None and done['packets_deleted'] == 30
+    assert remaining == 0 and second.floor(PacketCapture, 1) is None
+    print("✓ Clear hidden in both processes; failed purge retried by the lease holder; sketches reset")
+    return True
+
+
+def main():
+    """Run all tests"""
+    results = [
+        ("Background Purge", test_purge()),
+        ("Purge of Queued Rows", test_queued_rows()),
+        ("Purges Across Processes", test_shared_purges())
+    ]
+
+    passed = sum(1 for _, result in results if result)
+    print(f"\nTotal: {passed}/{len(results)} tests passed")
+    return 0 if passed == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""Test the network rate engine: ring buffer, wraps and resets, smoothing, readers and per-interface logs"""
+
+import sys
+import os
+import tempfile
+import threading
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from models import db, InterfaceTrafficLog
+from services import background_tasks
+from services.rates import RateEngine, FIELDS, TOTAL, parse_capacities
+from services.system_sampler import SystemSampler
+
+
+class RateConfig:
+    RATE_SAMPLE_INTERVAL = 1.0
+    RATE_HISTORY_SECONDS = 5
+    RATE_EWMA_SECONDS = 10
+
+
+class Counters:
+    """Counter readings from a list, advanced by hand together with the clock"""
+
+    def __init__(self):
+        self.values = [0] * len(FIELDS)
+        self.now = 100.0
+
+    def read(self):
+        return {TOTAL: tuple(self.values)}
+
+    def clock(self):
+        return self.now
+
+    def step(self, engine, seconds=1.0, **increments):
+        self.now += seconds
+        for name, increment in increments.items():
+            self.values[FIELDS.index(name)] += increment
+        engine.sample()
+
+
+def test_rates():
+    """Instantaneous, smoothed and windowed rates; the ring keeps the newest slots"""
+    print("\n=== Testing Rate Engine ===")
+    counters = Counters()
+    engine = RateEngine(RateConfig, read_counters=counters.read, clock=counters.clock)
+    engine.sample()
+    assert engine.rates()['current']['bytes_recv'] == 0.0, "No rate before the second reading"
+
+    for received in (1000, 2000, 3000, 4000, 5000, 6000, 7000):
+        counters.step(engine, bytes_recv=received, packets_recv=received // 100)
+    counters.step(engine, seconds=2.0, bytes_recv=16000)
+    rates = engine.rates(window=3)
+    assert rates['current']['bytes_recv'] == 8000.0 and rates['current']['packets_recv'] == 0.0
+    assert rates['window_seconds'] == 3.0 and rates['average']['bytes_recv'] == (16000 + 7000) / 3
+    assert 1000 < rates['ewma']['bytes_recv'] < 8000, "Smoothed towards the recent rates"
+    whole = engine.rates(window=3600)
+    assert whole['window_seconds'] == 6.0, "5 slots: the oldest samples were overwritten"
+    assert [point['bytes_recv'] for _, point in engine.history(seconds=3600)] == [4000, 5000, 6000, 7000, 8000]
+    assert engine.rates(key='eth9') is None
+    print(f"✓ Current {rates['current']['bytes_recv']:.0f} B/s, EWMA {rates['ewma']['bytes_recv']:.0f} B/s, "
+          f"3 s average {rates['average']['bytes_recv']:.0f} B/s")
+    return True
+
+
+def test_wrap_and_reset():
+    """A 32-bit wrap counts the bytes across it; a reset counts from zero"""
+    print("\n=== Testing Counter Wrap and Reset ===")
+    counters = Counters()
+    engine = RateEngine(RateConfig, read_counters=counters.read, clock=counters.clock)
+    counters.values[0] = 2 ** 32 - 500
+    counters.values[1] = 10 ** 12
+    engine.sample()
+    counters.values[0] = 1500      # wrapped: 2000 bytes
+    counters.values[1] = 300       # reset: 300 bytes since
+    counters.step(engine)
+    current = engine.rates()['current']
+    assert current['bytes_sent'] == 2000.0 and current['bytes_recv'] == 300.0, current
+    series = engine.stats()['series'][TOTAL]
+    assert series['wraps'] == 1 and series['resets'] == 1
+    print("✓ Wrap gives 2000 B/s, reset gives 300 B/s; no negative rates")
+    return True
+
+
+def test_concurrent_readers():
+    """Readers polling at the same time all get the same rates"""
+    print("\n=== Testing Concurrent Readers ===")
+    counters = Counters()
+    engine = RateEngine(RateConfig, read_counters=counters.read, clock=counters.clock)
+    engine.sample()
+    counters.step(engine, bytes_sent=5000)
+    results = []
+
+    def poll():
+        for _ in range(200):
+            results.append(engine.rates()['current']['bytes_sent'])
+
+    threads = [threading.Thread(target=poll) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 1600 and set(results) == {5000.0}, "Reading does not consume the delta"
+    print("✓ 8 readers x 200 polls all saw 5000 B/s")
+    return True
+
+
+class InterfaceCounters(Counters):
+    """Total and per-interface readings; interfaces can disappear"""
+
+    def __init__(self, names):
+        super().__init__()
+        self.interfaces = {name: [0] * len(FIELDS) for name in names}
+
+    def read(self):
+        counters = {name: tuple(values) for name, values in self.interfaces.items()}
+        counters[TOTAL] = tuple(sum(values) for values in zip(*self.interfaces.values()))
+        return counters
+
+    def step(self, engine, seconds=1.0, **increments):
+        self.now += seconds
+        for name, fields in increments.items():
+            for field, increment in fields.items():
+                self.interfaces[name][FIELDS.index(field)] += increment
+        engine.sample()
+
+
+def test_interfaces():
+    """Each interface has its own rates and errors; counts since the last drain are stored"""
+    print("\n=== Testing Per-Interface Rates and Logs ===")
+    counters = InterfaceCounters(['eth0', 'wlan0', 'veth1'])
+    engine = RateEngine(RateConfig, read_counters=counters.read, clock=counters.clock)
+    engine.sample()
+    for _ in range(3):
+        counters.step(engine, eth0={'bytes_sent': 12000000, 'packets_sent': 8000, 'dropout': 3},
+                      veth1={'bytes_recv': 10})
+    del counters.interfaces['veth1']
+    counters.step(engine, eth0={'bytes_sent': 12000000, 'errin': 1})
+
+    assert engine.series() == ['eth0', 'wlan0'], "Vanished interfaces are dropped"
+    eth0 = engine.rates(key='eth0')['current']
+    assert eth0['bytes_sent'] == 12000000.0 and eth0['errin'] == 1.0
+    assert engine.rates(key='wlan0')['current']['bytes_sent'] == 0.0
+    assert parse_capacities('eth0=1000, wwan0 = 50,bad,x=y') == {'eth0': 1000, 'wwan0': 50}
+
+    # The background monitor stores the drained counts of interfaces that had traffic
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'rates.db')}"
+    db.init_app(app)
+    sampler = SystemSampler(RateConfig)
+    sampler.sample()
+    saved = background_tasks.rate_engine, background_tasks.system_sampler, background_tasks.device_index
+    background_tasks.rate_engine, background_tasks.system_sampler = engine, sampler
+    background_tasks.device_index = None
+    try:
+        with app.app_context():
+            db.create_all()
+        monitor = background_tasks.BackgroundMonitor(app, RateConfig)
+        monitor._log_traffic_data()
+        monitor._log_traffic_data()
+        with app.app_context():
+            logs = [log.to_dict() for log in InterfaceTrafficLog.query.all()]
+    finally:
+        background_tasks.rate_engine, background_tasks.system_sampler, background_tasks.device_index = saved
+
+    assert len(logs) == 1, "Idle interfaces and the second, empty drain store nothing"
+    log = logs[0]
+    assert (log['interface'], log['seconds'], log['bytes_sent'], log['packets_sent']) == ('eth0', 4.0, 48000000, 24000)
+    assert (log['errin'], log['dropout'], log['bytes_sent_per_sec']) == (1, 9, 12000000.0)
+    print(f"✓ eth0 at {eth0['bytes_sent'] / 1e6:.0f} MB/s stored as one {log['seconds']} s row; "
+          f"idle wlan0 not stored")
+    return True
+
+
+def main():
+    """Run all tests"""
+    results = [
+        ("Rate Engine", test_rates()),
+        ("Counter Wrap and Reset", test_wrap_and_reset()),
+        ("Concurrent Readers", test_concurrent_readers()),
+        ("Per-Interface Rates and Logs", test_interfaces())
+    ]
+
+    passed = sum(1 for _, result in results if result)
+    print(f"\nTotal: {passed}/{len(results)} tests passed")
+    return 0 if passed == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""Test the retention job: chunked purges and hourly rollups"""
+
+import sys
+import os
+import tempfile
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from models import (
+    db, User, TrafficLog, SystemResourceLog, PacketCapture, Alert, TrafficLogRollup, SystemResourceRollup, JobLease
+)
+from services.retention import RetentionJob
+
+
+class RetentionConfig:
+    PACKET_RETENTION_DAYS = 1
+    FLOW_RETENTION_DAYS = 1
+    TRAFFIC_LOG_RETENTION_DAYS = 2
+    RESOURCE_LOG_RETENTION_DAYS = 2
+    ALERT_RETENTION_DAYS = 1
+    ROLLUP_RETENTION_DAYS = 365
+    RETENTION_CHUNK_SIZE = 7
+    RETENTION_CHUNK_PAUSE = 0
+
+
+def make_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'retention.db')}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(id=1, username='retention', email='retention@example.com', password_hash='x'))
+        db.session.commit()
+    return app
+
+
+def test_chunked_purge():
+    """Expired rows go in chunks, also across chunk borders with equal timestamps"""
+    print("\n=== Testing Chunked Purge ===")
+    app = make_app()
+    now = datetime(2026, 3, 10, 12, 0)
+    with app.app_context():
+        # 50 expired packets sharing 5 timestamps, so chunks of 7 split equal timestamps
+        for i in range(50):
+            db.session.add(PacketCapture(timestamp=now - timedelta(days=2, minutes=i % 5), protocol='TCP',
+                                         length=60, user_id=1))
+        for i in range(20):
+            db.session.add(PacketCapture(timestamp=now - timedelta(hours=i), protocol='UDP', length=60, user_id=1))
+        old = now - timedelta(days=3)
+        db.session.add_all([
+            Alert(alert_type='cpu', message='old', status='resolved', created_at=old, resolved_at=old, user_id=1),
+            Alert(alert_type='cpu', message='active', status='active', created_at=old, user_id=1),
+            Alert(alert_type='cpu', message='resolved late', status='resolved', created_at=old,
+                  resolved_at=now - timedelta(hours=1), user_id=1),
+        ])
+        db.session.commit()
+
+    job = RetentionJob(app, RetentionConfig)
+    report = job.run(now)
+    again = job.run(now)
+    with app.app_context():
+        packets = PacketCapture.query.count()
+        messages = sorted(alert.message for alert in Alert.query.all())
+
+    assert report['tables']['packet_captures']['deleted'] == 50 and packets == 20
+    assert report['tables']['alerts']['deleted'] == 1 and messages == ['active', 'resolved late']
+    assert report['rows_deleted'] == 51 and again['rows_deleted'] == 0 and job.errors == 0
+    assert job.totals['packet_captures'] == 50
+    print(f"✓ 50 expired packets in chunks of 7, {packets} kept; only the long-resolved alert removed")
+    return True
+
+
+def test_rollups():
+    """Complete hours are rolled up once before the raw logs expire"""
+    print("\n=== Testing Hourly Rollups ===")
+    app = make_app()
+    now = datetime(2026, 3, 10, 12, 2)
+    start = now - timedelta(days=3)
+    with app.app_context():
+        # One sample every 10 minutes for 3 days, counters growing by 100 per sample
+        for i in range(3 * 24 * 6 + 1):
+            timestamp = start + timedelta(minutes=10 * i)
+            db.session.add(TrafficLog(timestamp=timestamp, bytes_sent=100 * i, bytes_recv=200 * i,
+                                      packets_sent=i, packets_recv=2 * i))
+            db.session.add(SystemResourceLog(timestamp=timestamp, cpu_percent=float(i % 6 * 10),
+                                             memory_percent=50.0, disk_percent=70.0))
+        # A device's rows count their interval: 10 bytes each in the first hour
+        for i in range(6):
+            db.session.add(TrafficLog(timestamp=start + timedelta(minutes=10 * i), bytes_sent=10, bytes_recv=0,
+                                      packets_sent=1, packets_recv=0, device_id=7))
+        db.session.commit()
+
+    job = RetentionJob(app, RetentionConfig)
+    report = job.run(now)
+    rerun = job.run(now + timedelta(minutes=1))
+    with app.app_context():
+        hours = SystemResourceRollup.query.order_by(SystemResourceRollup.hour).all()
+        traffic = TrafficLogRollup.query.filter(TrafficLogRollup.device_id.is_(None)).order_by(TrafficLogRollup.hour).all()
+        device = TrafficLogRollup.query.filter_by(device_id=7).one()
+        remaining = TrafficLog.query.count()
+        first = hours[0].to_dict()
+
+    # 12:02 is 3 minutes short of closing the 11:00 hour: 10:00 is the last complete one
+    assert report['tables']['traffic_log_rollups']['rolled_up'] == 72 and len(traffic) == 71
+    assert len(hours) == 71 and rerun['tables']['system_resource_rollups']['rolled_up'] == 0
+    assert first['samples'] == 6 and first['cpu_percent'] == 25.0 and first['cpu_percent_max'] == 50.0
+    assert traffic[0].bytes_sent == 500 and traffic[1].bytes_sent == 1100, "Last counter value of the hour"
+    assert (device.bytes_sent, device.packets_sent, device.samples) == (60, 6, 6), "Device intervals are summed"
+    assert report['tables']['traffic_logs']['deleted'] == 6 * 24 + 6 and remaining == 2 * 24 * 6, \
+        "The rerun a minute later expires one more sample"
+    print(f"✓ {len(hours)} hourly rollups, {report['tables']['traffic_logs']['deleted']} raw rows expired")
+    return True
+
+
+def test_single_runner():
+    """Of the jobs started by several processes, only the lease holder runs"""
+    print("\n=== Testing Retention Lease ===")
+    app = make_app()
+    now = datetime(2026, 3, 10, 12, 0)
+    with app.app_context():
+        db.session.add_all([PacketCapture(timestamp=now - timedelta(days=5), protocol='TCP', length=60, user_id=1)
+                            for _ in range(10)])
+        db.session.commit()
+
+    first, second = RetentionJob(app, RetentionConfig), RetentionJob(app, RetentionConfig)
+    report = first.run(now)
+    skipped = second.run(now)
+    renewed = first.run(now)
+    with app.app_context():
+        # The holder stops renewing: the lease expires and the other process takes over
+        JobLease.query.update({'expires_at': datetime.utcnow() - timedelta(seconds=1)})
+        db.session.commit()
+    taken_over = second.run(now)
+    with app.app_context():
+        lease = db.session.get(JobLease, 'retention')
+        owner = lease.owner
+
+    assert report['tables']['packet_captures']['deleted'] == 10 and renewed is not None
+    assert skipped is None and second.skipped == 1 and second.runs == 1, "Only the run after the takeover"
+    assert taken_over is not None and owner == second.owner and second.errors == 0
+    print("✓ One process runs retention; another takes over when the lease lapses")
+    return True
+
+
+def main():
+    """Run all tests"""
+    results = [
+        ("Chunked Purge", test_chunked_purge()),
+        ("Hourly Rollups", test_rollups()),
+        ("Retention Lease", test_single_runner())
+    ]
+
+    passed = sum(1 for _, result in results if result)
+    print(f"\nTotal: {passed}/{len(results)} tests passed")
+    return 0 if passed == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Test the cached background reverse DNS resolver against a local stub resolver"""
+
+import sys
+import os
+import threading
+import time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.reverse_dns import ReverseDNSResolver
+
+
+class ResolverConfig:
+    REVERSE_DNS_CACHE_SIZE = 3
+    REVERSE_DNS_TTL = 100
+    REVERSE_DNS_NEGATIVE_TTL = 10
+    REVERSE_DNS_WORKERS = 2
+    REVERSE_DNS_QUEUE_SIZE = 16
+
+
+class StubResolver:
+    """PTR records from a dict; lookups block until released and are counted"""
+
+    def __init__(self, records):
+        self.records = records
+        self.calls = []
+        self.release = threading.Event()
+
+    def __call__(self, address):
+        self.release.wait(5)
+        self.calls.append(address)
+        return self.records.get(address)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_background_resolution():
+    """Requests never wait; names appear on later calls and failures are cached"""
+    print("\n=== Testing Background Reverse DNS ===")
+    stub = StubResolver({'10.0.0.1': 'nas.lan.', '10.0.0.2': 'printer.lan'})
+    clock = Clock()
+    resolver = ReverseDNSResolver(ResolverConfig, resolve=stub, clock=clock)
+    resolver.start()
+    try:
+        analysis = {'top_source_ips': [{'ip': '10.0.0.1', 'packet_count': 5}, {'ip': '10.0.0.9', 'packet_count': 1}],
+                    'top_destination_ips': [{'ip': '10.0.0.2', 'packet_count': 3}], 'top_destination_ports': []}
+        started = time.perf_counter()
+        first = resolver.annotate(analysis)
+        elapsed = time.perf_counter() - started
+        assert elapsed < 0.1, "The stub is still blocked, the request must not wait for it"
+        assert [entry['hostname'] for entry in first['top_source_ips']] == [None, None]
+        assert 'hostname' not in analysis['top_source_ips'][0], "The input is not modified"
+
+        resolver.annotate(analysis)
+        stub.release.set()
+        assert wait_for(lambda: resolver.stats()['pending'] == 0)
+        assert sorted(stub.calls) == ['10.0.0.1', '10.0.0.2', '10.0.0.9'], "Queued once despite two requests"
+
+        second = resolver.annotate(analysis)
+        assert [entry['hostname'] for entry in second['top_source_ips']] == ['nas.lan', None]
+        assert second['top_destination_ips'][0]['hostname'] == 'printer.lan'
+        assert len(stub.calls) == 3, "Cached names and cached failures are not looked up again"
+
+        # The failure expires after the negative TTL, the names after the TTL
+        clock.now += 11
+        resolver.hostnames(['10.0.0.9', '10.0.0.1'])
+        assert wait_for(lambda: len(stub.calls) == 4) and stub.calls[-1] == '10.0.0.9'
+        clock.now += 100
+        stub.records['10.0.0.1'] = 'nas2.lan'
+        assert resolver.hostnames(['10.0.0.1']) == {'10.0.0.1': 'nas.lan'}, "Stale name served while refreshing"
+        assert wait_for(lambda: resolver.hostnames(['10.0.0.1']) == {'10.0.0.1': 'nas2.lan'})
+
+        # Bounded: the least recently used address goes first
+        for address in ('10.0.1.1', '10.0.1.2'):
+            resolver.hostnames([address])
+        assert wait_for(lambda: resolver.stats()['pending'] == 0)
+        assert resolver.stats()['cached'] == 3
+        assert resolver._cache.keys() == {'10.0.0.1', '10.0.1.1', '10.0.1.2'}
+    finally:
+        stub.release.set()
+        resolver.stop()
+
+    stats = resolver.stats()
+    assert stats['resolved'] >= 3 and stats['failed'] >= 2 and stats['dropped'] == 0
+    print(f"✓ First request answered in {elapsed * 1000:.1f} ms without names; later requests served from cache "
+          f"({stats['hits']} hits, {stats['misses']} misses)")
+    return True
+
+
+def test_queue_full():
+    """Addresses beyond the queue are dropped and retried on a later request"""
+    print("\n=== Testing Full Resolver Queue ===")
+
+    class SmallQueue(ResolverConfig):
+        REVERSE_DNS_QUEUE_SIZE = 2
+
+    stub = StubResolver({})
+    # Not started: nothing drains the queue
+    resolver = ReverseDNSResolver(SmallQueue, resolve=stub)
+    names = resolver.hostnames([f'10.0.2.{i}' for i in range(5)])
+    assert names == {f'10.0.2.{i}': None for i in range(5)}
+    assert resolver.dropped == 3 and resolver.stats()['pending'] == 2, "Dropped addresses are not left pending"
+    print("✓ 2 queued, 3 dropped and not marked pending")
+    return True
+
+
+def main():
+    """Run all tests"""
+    results = [
+        ("Background Reverse DNS", test_background_resolution()),
+        ("Full Resolver Queue", test_queue_full())
+    ]
+
+    passed = sum(1 for _, result in results if result)
+    print(f"\nTotal: {passed}/{len(results)} tests passed")
+    return 0 if passed == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Test packet sampling and scaled statistics"""
+
+import sys
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from models import db, PacketCapture
+from services.sampling import PacketSampler, sampler_from_request
+
+
+def test_deterministic_sampling():
+    """1-in-N keeps exactly every Nth packet"""
+    print("\n=== Testing Deterministic Sampling ===")
+    sampler = PacketSampler(every=10)
+    kept = [i for i in range(1000) if sampler.accept()]
+    assert len(kept) == 100 and kept[:3] == [0, 10, 20]
+    assert sampler.rate == 10.0
+    assert sampler.stats() == {'mode': 'deterministic', 'sample_rate': 10.0, 'seen': 1000, 'sampled': 100}
+    print("✓ 1-in-10 sampling keeps 100 of 1000 packets")
+    return True
+
+
+def test_random_sampling():
+    """Probability p keeps roughly p of the packets"""
+    print("\n=== Testing Random Sampling ===")
+    random.seed(42)
+    sampler = PacketSampler(probability=0.05)
+    sampler._random = random.random
+    kept = sum(1 for _ in range(100000) if sampler.accept())
+    assert 4500 < kept < 5500, kept
+    assert sampler.rate == 20.0
+    print(f"✓ p=0.05 kept {kept} of 100000 packets")
+    return True
+
+
+def test_request_parameters():
+    """Invalid or conflicting parameters are rejected"""
+    print("\n=== Testing Sampling Request Parameters ===")
+    assert sampler_from_request({}).mode == 'none'
+    assert sampler_from_request({'sample_every': 4}).rate == 4.0
+    for bad in ({'sample_every': 0}, {'sample_probability': 1.5}, {'sample_every': 2, 'sample_probability': 0.5}):
+        try:
+            sampler_from_request(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"{bad} should be rejected")
+    print("✓ Sampling parameters validated")
+    return True
+
+
+def test_scaled_statistics():
+    """Statistics scale sampled rows back to estimates"""
+    print("\n=== Testing Scaled Statistics ===")
+    from services.capture import get_protocol_stats, get_packet_analysis
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'sampling.db')}"
+    db.init_app(app)
+    now = datetime.utcnow()
+    with app.app_context():
+        db.create_all()
+        for i in range(10):
+            db.session.add(PacketCapture(timestamp=now, protocol='TCP', src_ip='10.0.0.1', dst_ip='10.0.0.2',
+                                         src_port=1000, dst_port=443, length=100, info='', sample_rate=10.0, user_id=1))
+        db.session.add(PacketCapture(timestamp=now, protocol='UDP', src_ip='10.0.0.1', dst_ip='10.0.0.3',
+                                     src_port=1000, dst_port=53, length=80, info='', sample_rate=1.0, user_id=1))
+        db.session.commit()
+
+        stats = get_protocol_stats(1, now - timedelta(hours=1))
+        analysis = get_packet_analysis(1, now - timedelta(hours=1))
+
+    assert stats['total_packets'] == 101 and stats['total_bytes'] == 10080
+    assert analysis['top_source_ips'][0]['packet_count'] == 101
+    assert analysis['top_destination_ports'][0] == {'port': 443, 'service': 'HTTPS', 'packet_count': 100}
+    print("✓ Counts and bytes scaled by sample rate")
+    return True
+
+
+def main():
+    """Run all tests"""
+    results = [
+        ("Deterministic Sampling", test_deterministic_sampling()),
+        ("Random Sampling", test_random_sampling()),
+        ("Request Parameters", test_request_parameters()),
+        ("Scaled Statistics", test_scaled_statistics())
+    ]
+
+    passed = sum(1 for _, result in results if result)
+    print(f"\nTotal: {passed}/{len(results)} tests passed")
+    return 0 if passed == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""Test statistics sketches (heavy hitters, distinct counts) and the statistics queries"""
+
+import sys
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from models import db, DistinctCount, JobLease
+from services import background_tasks
+from services.sketches import SpaceSaving, CountMinSketch, HyperLogLog
+from services.stats_sketches import StatsSketches
+from services.capture import save_packets, get_packet_analysis, get_protocol_stats, get_capture_stats
+
+
+class SketchConfig:
+    STATS_SKETCH_BUCKET_SECONDS = 60
+    STATS_SKETCH_RETENTION_HOURS = 24
+    STATS_SKETCH_CAPACITY = 100
+    STATS_SKETCH_WIDTH = 256
+    STATS_SKETCH_DEPTH = 4
+
+
+def zipf_stream(n, keys, seed=1):
+    """Skewed key stream: key i is drawn with weight 1 / (i + 1)"""
+    rng = random.Random(seed)
+    population = [f'10.0.{i // 256}.{i % 256}' for i in range(keys)]
+    return rng.choices(population, weights=[1 / (i + 1) for i in range(keys)], k=n)
+
+
+def test_space_saving_bounds():
+    """Top keys are found and no count is off by more than total / capacity"""
+    print("\n=== Testing Space-Saving and Count-Min Bounds ===")
+    stream = zipf_stream(50000, 5000)
+    truth = Counter(stream)
+    summary = SpaceSaving(capacity=100)
+    cms = CountMinSketch(width=256, depth=4)
+    for key in stream:
+        summary.add(key, 1.0, 60.0)
+        cms.add(key)
+
+    bound = summary.error_bound()
+    assert 0 < bound <= summary.total / summary.capacity
+    for key, (count, error, _) in summary.counters.items():
+        assert truth[key] <= count <= truth[key] + bound, key
+        assert count - error <= truth[key]
+    top = sorted(summary.counters, key=lambda k: summary.counters[k][0], reverse=True)[:10]
+    assert set(top) == {key for key, _ in truth.most_common(10)}
+    assert all(truth[key] <= cms.estimate(key) for key in truth)
+    assert sum(cms.estimate(key) - truth[key] > cms.error_bound() for key in truth) < len(truth) * 0.05
+    print(f"✓ 50000 packets over 5000 keys: top 10 exact, error bound {bound:.0f}")
+    return True
+
+
+def make_packets(n, start, seed=2):
+    rng = random.Random(seed)
+    sources = zipf_stream(n, 60, seed)
+    return [{
+        'timestamp': (start + timedelta(seconds=i * 0.01)).isoformat(),
+        'protocol': 'TCP',
+        'src_ip': src,
+        'dst_ip': f'192.168.0.{rng.randint(1, 30)}',
+        'src_port': 40000,
+        'dst_port': rng.choice([80, 443, 443, 443, 53, 22, 8080]),
+        'length': rng.randint(60, 1500),
+        'info': ''
+    } for i, src in enumerate(sources)]
+
+
+def test_matches_database():
+    """With fewer distinct keys than counters the sketches agree with the SQL queries"""
+    print("\n=== Testing Sketch Top Talkers ===")
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'sketch.db')}"
+    db.init_app(app)
+
+    saved = background_tasks.stats_sketches, background_tasks.packet_writer, background_tasks.flow_exporter
+    sketches = StatsSketches(app, SketchConfig)
+    background_tasks.stats_sketches, background_tasks.packet_writer, background_tasks.flow_exporter = sketches, None, None
+    window_start = sketches.started
+    try:
+        with app.app_context():
+            db.create_all()
+            packets = make_packets(3000, sketches.started + timedelta(seconds=1))
+            save_packets(packets, 1)
+            save_packets(packets[:50], 2)
+            db.session.commit()
+
+            started = time.perf_counter()
+            from_sketch = get_packet_analysis(1, window_start)
+            elapsed = time.perf_counter() - started
+            background_tasks.stats_sketches = None
+            from_database = get_packet_analysis(1, window_start)
+            background_tasks.stats_sketches = sketches
+
+            assert get_packet_analysis(1, window_start - timedelta(hours=1))['source'] == 'database', \
+                "Windows older than the sketches use the database"
+            sketches.reset(1)
+            assert get_packet_analysis(1, window_start)['top_source_ips'] == []
+            assert get_packet_analysis(2, window_start)['top_source_ips'][0]['packet_count'] > 0
+    finally:
+        background_tasks.stats_sketches, background_tasks.packet_writer, background_tasks.flow_exporter = saved
+
+    assert from_sketch['source'] == 'sketch' and from_database['source'] == 'database'
+    assert from_sketch['error_bound']['source_ips'] == 0
+    for key, field in (('top_source_ips', 'ip'), ('top_destination_ips', 'ip'), ('top_destination_ports', 'port')):
+        # Keys tied at the cut-off may differ; their counts may not
+        assert [row['packet_count'] for row in from_sketch[key]] == [row['packet_count'] for row in from_database[key]], key
+        expected = {row[field]: row for row in from_database[key]}
+        assert all(row == expected[row[field]] for row in from_sketch[key] if row[field] in expected), key
+    print(f"✓ Sketch answers match the database in {elapsed * 1e6:.0f} µs")
+    return True
+
+
+def test_combined_scan():
+    """get_capture_stats() answers what the per-statistic queries answer"""
+    print("\n=== Testing Combined Statistics Scan ===")
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'combined.db')}"
+    db.init_app(app)
+
+    saved = background_tasks.stats_sketches, background_tasks.packet_writer, background_tasks.flow_exporter
+    background_tasks.stats_sketches = background_tasks.packet_writer = background_tasks.flow_exporter = None
+    start_time = datetime.utcnow() - timedelta(hours=1)
+    try:
+        with app.app_context():
+            db.create_all()
+            packets = make_packets(2000, start_time + timedelta(minutes=1))
+            for i, packet in enumerate(packets):
+                packet['protocol'] = ('TCP', 'UDP', 'ICMP')[i % 3]
+                packet['sample_rate'] = 2.0 if i % 5 == 0 else 1.0
+                if packet['protocol'] == 'ICMP':
+                    packet['dst_port'] = None
+            save_packets(packets, 1)
+            save_packets(packets[:100], 2)
+            db.session.commit()
+
+            stats, analysis = get_capture_stats(1, start_time)
+            expected_stats = get_protocol_stats(1, start_time)
+            expected_analysis = get_packet_analysis(1, start_time)
+    finally:
+        background_tasks.stats_sketches, background_tasks.packet_writer, background_tasks.flow_exporter = saved
+
+    assert stats['total_packets'] == expected_stats['total_packets'] == 2400, "Sampled packets count twice"
+    assert stats['total_bytes'] == expected_stats['total_bytes']
+    by_protocol = lambda rows: sorted((row['protocol'], row['count'], row['bytes']) for row in rows)
+    assert by_protocol(stats['protocols']) == by_protocol(expected_stats['protocols'])
+    for key in ('top_source_ips', 'top_destination_ips', 'top_destination_ports'):
+        assert [row['packet_count'] for row in analysis[key]] == \
+            [row['packet_count'] for row in expected_analysis[key]], key
+    print(f"✓ get_capture_stats reproduces {len(stats['protocols'])} protocols and the top lists")
+    return True
+
+
+def test_aligned_window():
+    """Protocol counts and sketch answers cover the same bucket-aligned window"""
+    print("\n=== Testing Bucket-Aligned Window ===")
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'aligned.db')}"
+    db.init_app(app)
+
+    saved = background_tasks.stats_sketches, background_tasks.packet_writer, background_tasks.flow_exporter
+    sketches = StatsSketches(app, SketchConfig)
+    background_tasks.stats_sketches, background_tasks.packet_writer, background_tasks.flow_exporter = sketches, None, None
+    bucket_start = sketches.window_start(datetime.utcnow() - timedelta(minutes=2))
+    sketches.started = bucket_start
+    requested = bucket_start + timedelta(seconds=15)
+    try:
+        with app.app_context():
+            db.create_all()
+            packets = make_packets(3000, bucket_start + timedelta(seconds=1))
+            save_packets(packets, 1)
+            db.session.commit()
+
+            window_start = sketches.window_start(requested)
+            stats, analysis = get_capture_stats(1, window_start)
+            distinct = sketches.get_distinct_counts(1, window_start)
+            background_tasks.stats_sketches = None
+            from_database = get_packet_analysis(1, window_start)
+    finally:
+        background_tasks.stats_sketches, background_tasks.packet_writer, background_tasks.flow_exporter = saved
+
+    before = sum(1 for packet in packets if datetime.fromisoformat(packet['timestamp']) < requested)
+    assert window_start == bucket_start and before > 0
+    assert analysis['source'] == 'sketch' and analysis['window_start'] == window_start.isoformat()
+    assert stats['total_packets'] == len(packets), "Packets before the requested start but in its bucket count"
+    assert [row['packet_count'] for row in analysis['top_source_ips']] == \
+        [row['packet_count'] for row in from_database['top_source_ips']]
+    assert distinct['source_ips'] == len({packet['src_ip'] for packet in packets})
+    print(f"✓ Window starts at {window_start.time()}: {before} packets before the requested start counted by every statistic")
+    return True
+
+
+def test_hyperloglog():
+    """Distinct counts within the expected error, lossless merge, stable registers"""
+    print("\n=== Testing HyperLogLog ===")
+    first, second = HyperLogLog(12), HyperLogLog(12)
+    for i in range(60000):
+        first.add(f'10.{i}')
+    for i in range(30000, 90000):
+        second.add(f'10.{i}')
+    assert abs(first.count() - 60000) / 60000 < 4 * first.relative_error()
+
+    union = HyperLogLog(12, first.registers)
+    union.merge(second)
+    assert abs(union.count() - 90000) / 90000 < 4 * union.relative_error()
+    union.merge(first)
+    assert union.count() == HyperLogLog(12, union.registers).count(), "Merging again changes nothing"
+
+    small = HyperLogLog(12)
+    for port in (22, 80, 443, 443, 53):
+        small.add(port)
+    assert round(small.count()) == 4
+    try:
+        small.merge(HyperLogLog(10))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Different precisions must not merge")
+    print(f"✓ 60000 -> {first.count():.0f}, union 90000 -> {union.count():.0f}")
+    return True
+
+
+def test_distinct_persistence():
+    """Distinct counters are flushed per bucket and survive a restart without double counting"""
+    print("\n=== Testing Distinct Count Persistence ===")
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'distinct.db')}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+
+    def packets(start, sources, ports):
+        return [(start + timedelta(seconds=i * 0.02), 'UDP', f'10.1.{i % sources // 256}.{i % sources % 256}', '10.0.0.1',
+                 5000, 1000 + i % ports, 100, None, 1.0, 7) for i in range(3000)]
+
+    now = datetime.utcnow()
+    sketches = StatsSketches(app, SketchConfig)
+    sketches.add_rows(packets(now - timedelta(minutes=2), 500, 40))
+    # Packets from a day ago (e.g. an imported capture) only reach the stored counters
+    sketches.add_rows(packets(now - timedelta(days=1, hours=1), 800, 10))
+    written = sketches.flush()
+    assert written > 0 and sketches.flush() == 0, "Clean buckets are not written again"
+
+    with app.app_context():
+        stored = DistinctCount.query.filter_by(user_id=7).count()
+        recent = sketches.get_distinct_counts(7, now - timedelta(minutes=3))
+        everything = sketches.get_distinct_counts(7, now - timedelta(days=2))
+
+        # A restarted process re-flushing the same bucket must not inflate it
+        restarted = StatsSketches(app, SketchConfig)
+        restarted.add_rows(packets(now - timedelta(minutes=2), 500, 40))
+        restarted.flush()
+        restarted._buckets.clear()
+        from_database = restarted.get_distinct_counts(7, now - timedelta(minutes=3))
+
+    assert stored == 3 * written
+    assert abs(recent['source_ips'] - 500) <= 15 and abs(recent['destination_ports'] - 40) <= 2
+    assert abs(recent['flows'] - 1000) <= 30, "lcm(500, 40) source and port combinations"
+    assert abs(everything['source_ips'] - 800) <= 25, "The old capture's 800 sources include the recent 500"
+    assert abs(from_database['source_ips'] - recent['source_ips']) <= 1
+    print(f"✓ {written} buckets flushed; {recent['source_ips']} / {everything['source_ips']} distinct sources")
+    return True
+
+
+def test_other_writers():
+    """When another process also stores packets, the statistics come from the database"""
+    print("\n=== Testing Several Writing Processes ===")
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'writers.db')}"
+    db.init_app(app)
+
+    saved = background_tasks.stats_sketches, background_tasks.packet_writer, background_tasks.flow_exporter
+    # Two worker processes, each with its own sketches
+    first, second = StatsSketches(app, SketchConfig), StatsSketches(app, SketchConfig)
+    background_tasks.packet_writer = background_tasks.flow_exporter = None
+    window_start = min(first.started, second.started)
+    try:
+        with app.app_context():
+            db.create_all()
+            packets = make_packets(3000, window_start + timedelta(seconds=1))
+            for packet in packets[1500:]:
+                # Sources only the second process sees, timestamped a bucket ahead of the current one
+                packet['src_ip'] = packet['src_ip'].replace('10.0.', '10.9.')
+                packet['timestamp'] = (datetime.fromisoformat(packet['timestamp']) + timedelta(seconds=60)).isoformat()
+            for sketches, half in ((first, packets[:1500]), (second, packets[1500:])):
+                background_tasks.stats_sketches = sketches
+                save_packets(half, 1)
+                db.session.commit()
+        first.renew_writer_lease()
+        second.renew_writer_lease()
+        first.flush()
+        second.flush()
+
+        with app.app_context():
+            background_tasks.stats_sketches = first
+            shared = get_packet_analysis(1, window_start)
+            distinct = first.get_distinct_counts(1, window_start)
+            in_memory = len({src for sketch in first._buckets[1].values() for src in sketch.src_ips.summary.counters})
+            background_tasks.stats_sketches = None
+            from_database = get_packet_analysis(1, window_start)
+
+            # The second process stopped storing packets before the window
+            JobLease.query.filter_by(owner=second.owner).update({'expires_at': window_start})
+            db.session.commit()
+            background_tasks.stats_sketches = first
+            alone = get_packet_analysis(1, window_start)
+    finally:
+        background_tasks.stats_sketches, background_tasks.packet_writer, background_tasks.flow_exporter = saved
+
+    sources = len({packet['src_ip'] for packet in packets})
+    assert shared['source'] == 'database' and shared == from_database
+    assert abs(distinct['source_ips'] - sources) <= 2 and in_memory < sources, "Both processes' counters merged"
+    assert alone['source'] == 'sketch'
+    print(f"✓ Two writers: database answers; {distinct['source_ips']} of {sources} sources counted across both")
+    return True
+
+
+def main():
+    """Run all tests"""
+    results = [
+        ("Space-Saving and Count-Min Bounds", test_space_saving_bounds()),
+        ("Sketch Top Talkers", test_matches_database()),
+        ("Combined Statistics Scan", test_combined_scan()),
+        ("Bucket-Aligned Window", test_aligned_window()),
+        ("HyperLogLog", test_hyperloglog()),
+        ("Distinct Count Persistence", test_distinct_persistence()),
+        ("Several Writing Processes", test_other_writers())
+    ]
+
+    passed = sum(1 for _, result in results if result)
+    print(f"\nTotal: {passed}/{len(results)} tests passed")
+    return 0 if passed == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
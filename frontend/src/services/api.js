@@ -69,7 +69,54 @@ export const analysisAPI = {
   getPackets: (params) => apiClient.get('/analysis/packets', { params }),
   getStats: (params) => apiClient.get('/analysis/stats', { params }),
   getProtocols: () => apiClient.get('/analysis/protocols'),
-  clearPackets: () => apiClient.delete('/analysis/clear-packets')
+  clearPackets: () => apiClient.delete('/analysis/clear-packets'),
+  getPurge: (id) => apiClient.get(`/analysis/purges/${id}`),
+  submitCaptureJob: (data) => apiClient.post('/analysis/jobs', data),
+  getCaptureJobs: () => apiClient.get('/analysis/jobs'),
+  getCaptureJob: (id) => apiClient.get(`/analysis/jobs/${id}`),
+  getCaptureJobResults: (id) => apiClient.get(`/analysis/jobs/${id}/results`),
+  cancelCaptureJob: (id) => apiClient.delete(`/analysis/jobs/${id}`),
+  streamPackets: (params, onEvent, signal) => streamEvents('/analysis/stream', params, onEvent, signal)
+}
+
+// Read a Server-Sent Events endpoint with fetch so the auth header can be sent
+// (EventSource cannot set headers). Resolves when the stream ends or is aborted.
+async function streamEvents(path, params, onEvent, signal) {
+  const token = localStorage.getItem('token')
+  const query = new URLSearchParams(params).toString()
+  const response = await fetch(`/api${path}?${query}`, {
+    headers: token ? { Authorization: `Bearer ${token}` } : {},
+    signal
+  })
+  if (!response.ok) {
+    const body = await response.json().catch(() => ({}))
+    throw new Error(body.error || `HTTP ${response.status}`)
+  }
+
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ''
+  try {
+    while (true) {
+      const { value, done } = await reader.read()
+      if (done) break
+      buffer += decoder.decode(value, { stream: true })
+      let boundary
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const chunk = buffer.slice(0, boundary)
+        buffer = buffer.slice(boundary + 2)
+        let event = 'message'
+        let data = ''
+        for (const line of chunk.split('\n')) {
+          if (line.startsWith('event: ')) event = line.slice(7)
+          else if (line.startsWith('data: ')) data += line.slice(6)
+        }
+        if (data) onEvent(event, JSON.parse(data))
+      }
+    }
+  } catch (error) {
+    if (error.name !== 'AbortError') throw error
+  }
 }
 
 export default apiClient